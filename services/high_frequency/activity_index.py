@@ -0,0 +1,217 @@
+"""
+Índices de atividade dos agentes
+================================
+Estruturas em memória alimentadas diretamente pela ingestão
+(add_tick_to_buffer), consultadas pelo detector TWAP em vez do ticks_raw:
+
+- AgentActivityIndex: último trade visto para cada (símbolo, agente), usado
+  pelo monitor de inatividade.
+- VolumeIndex: volume financeiro acumulado por minuto, por símbolo e por
+  (símbolo, agente), usado no volume % de mercado dos robôs.
+
+Os horários são epoch em segundos, o mesmo formato de Tick.timestamp.
+"""
+
+import time
+from array import array
+from typing import Dict, Optional, Tuple
+
+
+class AgentActivityIndex:
+    """Último trade por (símbolo, agente), atualizado a cada tick ingerido."""
+
+    def __init__(self):
+        self._last_trade: Dict[Tuple[str, int], float] = {}
+        self.ticks_recorded = 0
+        self.started_at = time.time()
+
+    def record(self, symbol: str, buy_agent: Optional[int], sell_agent: Optional[int], timestamp: float) -> None:
+        """Registra um trade para o comprador e o vendedor (ticks fora de ordem não regridem o índice)."""
+        self.ticks_recorded += 1
+        for agent_id in (buy_agent, sell_agent):
+            if not agent_id:
+                continue
+            key = (symbol, agent_id)
+            if timestamp > self._last_trade.get(key, 0.0):
+                self._last_trade[key] = timestamp
+
+    def record_tick(self, tick) -> None:
+        self.record(tick.symbol, tick.buy_agent, tick.sell_agent, tick.timestamp)
+
+    def last_trade(self, symbol: str, agent_id: int) -> Optional[float]:
+        return self._last_trade.get((symbol, agent_id))
+
+    def clear(self) -> None:
+        self._last_trade.clear()
+        self.ticks_recorded = 0
+        self.started_at = time.time()
+
+    def get_stats(self) -> Dict:
+        return {
+            'keys': len(self._last_trade),
+            'ticks_recorded': self.ticks_recorded,
+            'uptime_seconds': round(time.time() - self.started_at, 1),
+        }
+
+
+class MinuteVolumeSeries:
+    """Soma prefixada do volume financeiro por minuto.
+
+    cum[i] é o volume acumulado do minuto `base` até o minuto `base + i`,
+    então o volume de qualquer janela é a diferença de duas posições.
+    """
+
+    __slots__ = ("base", "cum")
+
+    def __init__(self, base: int):
+        self.base = base
+        self.cum = array('d')
+
+    def add(self, minute: int, value: float) -> None:
+        idx = minute - self.base
+        cum = self.cum
+        if idx < 0:
+            # Tick anterior ao primeiro minuto da série: estende o início com zeros
+            self.cum = cum = array('d', [0.0] * -idx) + cum
+            self.base = minute
+            idx = 0
+        size = len(cum)
+        if idx >= size:
+            last = cum[-1] if size else 0.0
+            cum.extend([last] * (idx + 1 - size))
+            size = idx + 1
+        # Quase sempre idx é o último minuto; tick atrasado propaga para frente
+        for j in range(idx, size):
+            cum[j] += value
+
+    def total_until(self, minute: int) -> float:
+        """Volume acumulado até o minuto (inclusive)."""
+        idx = minute - self.base
+        if idx < 0 or not self.cum:
+            return 0.0
+        if idx >= len(self.cum):
+            return self.cum[-1]
+        return self.cum[idx]
+
+    def sum_between(self, start_minute: int, end_minute: int) -> float:
+        """Volume dos minutos [start_minute, end_minute]."""
+        return self.total_until(end_minute) - self.total_until(start_minute - 1)
+
+    def replace_range(self, start_minute: int, end_minute: int, buckets: Dict[int, float]) -> None:
+        """Substitui os minutos [start_minute, end_minute) pelos valores do banco."""
+        values = {}
+        prev = 0.0
+        for i, total in enumerate(self.cum):
+            values[self.base + i] = total - prev
+            prev = total
+        for minute in range(start_minute, end_minute):
+            values.pop(minute, None)
+        values.update(buckets)
+        self.base = min([self.base, start_minute] + list(values))
+        last = max(values) if values else self.base
+        self.cum = array('d', [0.0] * (last - self.base + 1))
+        running = 0.0
+        for i in range(len(self.cum)):
+            running += values.get(self.base + i, 0.0)
+            self.cum[i] = running
+
+    def trim_before(self, minute: int) -> None:
+        """Descarta minutos antigos, rebaseando o acumulado no novo primeiro minuto."""
+        drop = minute - self.base
+        if drop <= 0:
+            return
+        cum = self.cum
+        drop = min(drop, len(cum))
+        if drop:
+            dropped = cum[drop - 1]
+            del cum[:drop]
+            for i in range(len(cum)):
+                cum[i] -= dropped
+        self.base = minute
+
+
+class VolumeIndex:
+    """Volume financeiro (price * volume) por minuto, por símbolo e por agente.
+
+    Cobre os ticks ingeridos desde `coverage_minute`; minutos anteriores
+    (ex.: logo após um restart) são preenchidos uma vez por símbolo a partir
+    do banco via `seed`.
+    """
+
+    def __init__(self, retention_minutes: int = 180):
+        self.retention_minutes = retention_minutes
+        self.market: Dict[str, MinuteVolumeSeries] = {}
+        self.agents: Dict[Tuple[str, int], MinuteVolumeSeries] = {}
+        self.seeded_from: Dict[str, int] = {}
+        self.started_at = time.time()
+        # Primeiro minuto integralmente visto pela ingestão
+        self.coverage_minute = int(self.started_at // 60) + 1
+        self._last_trim_minute = int(self.started_at // 60)
+
+    def _series(self, table: Dict, key, minute: int) -> MinuteVolumeSeries:
+        series = table.get(key)
+        if series is None:
+            series = table[key] = MinuteVolumeSeries(minute)
+        return series
+
+    def record(self, symbol: str, buy_agent: Optional[int], sell_agent: Optional[int],
+               price: float, volume: float, timestamp: float) -> None:
+        minute = int(timestamp // 60)
+        if minute < self._last_trim_minute - self.retention_minutes:
+            return
+        financial = price * volume
+        self._series(self.market, symbol, minute).add(minute, financial)
+        # Mesmo critério do SQL (buy_agent = X OR sell_agent = X): conta uma vez por agente
+        if buy_agent:
+            self._series(self.agents, (symbol, buy_agent), minute).add(minute, financial)
+        if sell_agent and sell_agent != buy_agent:
+            self._series(self.agents, (symbol, sell_agent), minute).add(minute, financial)
+        if minute - self._last_trim_minute > 30:
+            self.trim(minute)
+
+    def record_tick(self, tick) -> None:
+        self.record(tick.symbol, tick.buy_agent, tick.sell_agent, tick.price, tick.volume, tick.timestamp)
+
+    def needs_seed(self, symbol: str, start_minute: int) -> bool:
+        """True se a janela começa antes do que a ingestão (ou o seed) já cobre."""
+        if start_minute >= self.coverage_minute:
+            return False
+        seeded = self.seeded_from.get(symbol)
+        return seeded is None or start_minute < seeded
+
+    def seed(self, symbol: str, start_minute: int, market_buckets: Dict[int, float],
+             agent_buckets: Dict[int, Dict[int, float]]) -> None:
+        """Carrega os minutos [start_minute, coverage_minute) vindos do banco."""
+        end_minute = self.coverage_minute
+        self._series(self.market, symbol, start_minute).replace_range(start_minute, end_minute, market_buckets)
+        for agent_id, buckets in agent_buckets.items():
+            self._series(self.agents, (symbol, agent_id), start_minute).replace_range(start_minute, end_minute, buckets)
+        self.seeded_from[symbol] = start_minute
+
+    def market_volume(self, symbol: str, start_minute: int, end_minute: int) -> float:
+        series = self.market.get(symbol)
+        return series.sum_between(start_minute, end_minute) if series else 0.0
+
+    def agent_volume(self, symbol: str, agent_id: int, start_minute: int, end_minute: int) -> float:
+        series = self.agents.get((symbol, agent_id))
+        return series.sum_between(start_minute, end_minute) if series else 0.0
+
+    def trim(self, now_minute: int) -> None:
+        cutoff = now_minute - self.retention_minutes
+        for table in (self.market, self.agents):
+            for series in table.values():
+                series.trim_before(cutoff)
+        self._last_trim_minute = now_minute
+
+    def get_stats(self) -> Dict:
+        return {
+            'symbols': len(self.market),
+            'agent_series': len(self.agents),
+            'seeded_symbols': len(self.seeded_from),
+            'buckets': sum(len(s.cum) for s in self.agents.values()) + sum(len(s.cum) for s in self.market.values()),
+        }
+
+
+# Instâncias únicas do processo, compartilhadas entre buffer e detector
+agent_activity_index = AgentActivityIndex()
+volume_index = VolumeIndex()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Benchmark da detecção TWAP em processos por shard (TWAP_WORKERS)
+================================================================
+Carrega um pregão inteiro do ticks_raw em colunas por símbolo e o reproduz
+em --chunks ciclos incrementais: a cada ciclo todos os símbolos recebem a
+próxima fatia de ticks. Roda a mesma reprodução no event loop (0 workers) e
+com 1, 2, 4 e 8 processos, sem gravar nada (persistência nula), e mostra o
+tempo total, ticks/s e o speedup sobre o event loop. A coluna "padrões"
+confere que todos os modos chegam ao mesmo resultado.
+
+Uso:
+    python services/high_frequency/benchmark_detection_workers.py [--day 2025-06-02] [--symbols 40] [--chunks 60] [--workers 0,1,2,4,8]
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+from datetime import date, datetime, time as dtime, timedelta, timezone
+from pathlib import Path
+
+# Configuração do event loop para Windows
+if sys.platform == "win32":
+    asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
+# Adiciona o projeto ao path
+_PROJECT_ROOT = Path(__file__).resolve().parents[2]
+if str(_PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(_PROJECT_ROOT))
+
+from psycopg import AsyncConnection
+
+from services.high_frequency.config import DATABASE_URL
+from services.high_frequency.detection_workers import ShardedDetection
+from services.high_frequency.robot_detector import TWAPDetector
+from services.high_frequency.robot_models import TWAPDetectionConfig
+from services.high_frequency.tick_store import columns_from_rows, rows_from_columns
+
+TICKS_SQL = """
+    SELECT symbol, price, volume, timestamp, buy_agent, sell_agent, exchange, trade_type, trade_id
+      FROM ticks_raw
+     WHERE symbol = %s AND timestamp >= %s AND timestamp < %s
+     ORDER BY timestamp ASC
+"""
+
+
+class NullPersistence:
+    """Aceita as gravações da detecção sem tocar no banco"""
+
+    def __init__(self):
+        self._next_id = 1
+
+    async def save_pattern_and_trades(self, pattern, trades):
+        return await self.save_twap_pattern(pattern)
+
+    async def save_twap_pattern(self, pattern):
+        self._next_id += 1
+        return self._next_id
+
+    async def append_robot_trades(self, pattern_id, trades):
+        return len(trades)
+
+    async def get_existing_pattern(self, *args, **kwargs):
+        return None
+
+
+async def load_day(conn: AsyncConnection, day: date, limit: int):
+    """Colunas do pregão por símbolo, dos símbolos com mais ticks"""
+    start = datetime.combine(day, dtime.min, tzinfo=timezone.utc)
+    end = start + timedelta(days=1)
+    async with conn.cursor() as cur:
+        await cur.execute("""
+            SELECT symbol, count(*) FROM ticks_raw
+             WHERE timestamp >= %s AND timestamp < %s
+             GROUP BY symbol ORDER BY count(*) DESC LIMIT %s
+        """, (start, end, limit))
+        symbols = [row[0] for row in await cur.fetchall()]
+
+        columns = {}
+        for symbol in symbols:
+            await cur.execute(TICKS_SQL, (symbol, start, end))
+            rows = [
+                {
+                    'symbol': r[0], 'price': r[1], 'volume': r[2], 'timestamp': r[3], 'buy_agent': r[4],
+                    'sell_agent': r[5], 'exchange': r[6], 'trade_type': r[7], 'trade_id': r[8],
+                }
+                for r in await cur.fetchall()
+            ]
+            if rows:
+                columns[symbol] = columns_from_rows(rows)
+    return start, columns
+
+
+def slice_columns(batch, lower: float, upper: float):
+    cols, names = batch
+    timestamps = cols["timestamp"]
+    i, j = timestamps.searchsorted(lower, "left"), timestamps.searchsorted(upper, "left")
+    return {name: column[i:j] for name, column in cols.items()}, names
+
+
+async def analyze_in_loop(detector: TWAPDetector, symbol: str, start_of_day: datetime, batch, upper: datetime):
+    """Mesmo ciclo de _analyze_symbol_incremental, com a janela do pregão reproduzido"""
+    state = detector._incremental_state(symbol, start_of_day)
+    cols, names = batch
+    detector._consume_ticks(state, rows_from_columns(symbol, cols, names), upper)
+    return await detector._persist_deltas(
+        symbol, detector._incremental_deltas(symbol, state),
+        lambda delta: state.take_pending(delta.kind, delta.agent_id, delta.key),
+    )
+
+
+async def replay(workers: int, start_of_day: datetime, columns, chunks: int):
+    detector = TWAPDetector(config=TWAPDetectionConfig(), persistence=NullPersistence(), mode="incremental")
+    detector.market_twap_detector.persistence = detector.persistence
+    sharded = ShardedDetection(detector, workers) if workers else None
+    patterns = {}
+    try:
+        if sharded:
+            # Sobe os processos antes de medir (spawn + imports)
+            await asyncio.gather(*(
+                asyncio.get_running_loop().run_in_executor(executor, int) for executor in sharded.executors
+            ))
+
+        step = timedelta(days=1) / chunks
+        started = time.perf_counter()
+        for i in range(chunks):
+            lower, upper = start_of_day + step * i, start_of_day + step * (i + 1)
+            slices = {s: slice_columns(b, lower.timestamp(), upper.timestamp()) for s, b in columns.items()}
+            if sharded:
+                results = await asyncio.gather(*(
+                    sharded.analyze_batch(symbol, start_of_day.date(), batch, upper)
+                    for symbol, batch in slices.items()
+                ))
+            else:
+                results = [
+                    await analyze_in_loop(detector, symbol, start_of_day, batch, upper)
+                    for symbol, batch in slices.items()
+                ]
+            patterns.update(zip(slices, results))
+        elapsed = time.perf_counter() - started
+    finally:
+        if sharded:
+            sharded.close()
+    return elapsed, sum(len(p) for p in patterns.values())
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark da detecção TWAP em processos por shard")
+    parser.add_argument("--day", type=date.fromisoformat, help="Pregão (padrão: o mais recente do ticks_raw)")
+    parser.add_argument("--symbols", type=int, default=40, help="Símbolos com mais ticks no pregão")
+    parser.add_argument("--chunks", type=int, default=60, help="Ciclos de detecção no pregão")
+    parser.add_argument("--workers", default="0,1,2,4,8", help="Quantidades de processos (0 = event loop)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    async with await AsyncConnection.connect(os.getenv("DATABASE_URL", DATABASE_URL)) as conn:
+        day = args.day
+        if day is None:
+            async with conn.cursor() as cur:
+                await cur.execute("SELECT max(timestamp) FROM ticks_raw")
+                latest = (await cur.fetchone())[0]
+            if latest is None:
+                print("ticks_raw vazio")
+                return
+            day = latest.astimezone(timezone.utc).date()
+        start_of_day, columns = await load_day(conn, day, args.symbols)
+
+    total = sum(len(cols["timestamp"]) for cols, _ in columns.values())
+    print(f"Pregão {day}: {total} ticks em {len(columns)} símbolos, {args.chunks} ciclos "
+          f"({os.cpu_count()} CPUs)")
+    print(f"{'workers':>8} {'tempo s':>9} {'ticks/s':>10} {'speedup':>8} {'padrões':>8}")
+    baseline = None
+    for workers in (int(w) for w in args.workers.split(",")):
+        elapsed, patterns = await replay(workers, start_of_day, columns, args.chunks)
+        baseline = baseline or elapsed
+        print(f"{workers or 'loop':>8} {elapsed:>9.2f} {total / elapsed:>10.0f} "
+              f"{baseline / elapsed:>7.2f}x {patterns:>8}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
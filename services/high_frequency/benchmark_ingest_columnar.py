@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Benchmark da ingestão em lote: JSON x colunar
+=============================================
+Envia os mesmos lotes para /ingest/batch (JSON) e /ingest/columnar (formato
+binário de services/shared/tick_codec) de um backend rodando e compara
+ticks/segundo de ponta a ponta e no servidor (seção "ingest" do /metrics).
+
+Atenção: os ticks enviados entram no buffer e são gravados em ticks_raw;
+use símbolos de teste e um banco descartável.
+
+Uso:
+    python services/high_frequency/benchmark_ingest_columnar.py [--url http://127.0.0.1:8002] [--batch 1000] [--batches 50]
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+from pathlib import Path
+from urllib import request as urlreq
+
+# Adiciona o projeto ao path
+_PROJECT_ROOT = Path(__file__).resolve().parents[2]
+if str(_PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(_PROJECT_ROOT))
+
+from services.shared.tick_codec import CONTENT_TYPE, encode_ticks
+
+BENCH_SYMBOLS = ("BENCH1", "BENCH2", "BENCH3", "BENCH4")
+
+
+def make_batch(n: int, base_trade_id: int) -> list[dict]:
+    now = time.time()
+    return [
+        {
+            "symbol": random.choice(BENCH_SYMBOLS),
+            "exchange": "B",
+            "price": round(30 + random.random() * 5, 2),
+            "volume": random.choice((100, 200, 500, 1000)),
+            "timestamp": now + i * 0.001,
+            "trade_id": base_trade_id + i,
+            "buy_agent": random.randint(1, 200),
+            "sell_agent": random.randint(1, 200),
+            "trade_type": random.choice((2, 3)),
+        }
+        for i in range(n)
+    ]
+
+
+def post(url: str, data: bytes, content_type: str) -> dict:
+    req = urlreq.Request(url, data=data, headers={"Content-Type": content_type}, method="POST")
+    with urlreq.urlopen(req, timeout=30) as resp:
+        return json.loads(resp.read())
+
+
+def server_ingest_stats(base_url: str) -> dict:
+    with urlreq.urlopen(f"{base_url}/metrics", timeout=10) as resp:
+        return json.loads(resp.read()).get("ingest", {})
+
+
+def run(base_url: str, fmt: str, batches: list[list[dict]]) -> dict:
+    before = server_ingest_stats(base_url).get(fmt, {})
+    encode_s = 0.0
+    payload_bytes = 0
+    start = time.perf_counter()
+    for batch in batches:
+        t0 = time.perf_counter()
+        if fmt == "columnar":
+            data, content_type, path = encode_ticks(batch), CONTENT_TYPE, "/ingest/columnar"
+        else:
+            data, content_type, path = json.dumps({"ticks": batch}).encode("utf-8"), "application/json", "/ingest/batch"
+        encode_s += time.perf_counter() - t0
+        payload_bytes += len(data)
+        post(f"{base_url}{path}", data, content_type)
+    elapsed = time.perf_counter() - start
+    after = server_ingest_stats(base_url).get(fmt, {})
+
+    ticks = sum(len(b) for b in batches)
+    server_ms = after.get("busy_ms", 0.0) - before.get("busy_ms", 0.0)
+    return {
+        "ticks_per_sec": ticks / elapsed,
+        "server_ticks_per_sec": ticks / (server_ms / 1000) if server_ms > 0 else 0.0,
+        "encode_ms": encode_s * 1000,
+        "bytes_per_tick": payload_bytes / ticks,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark da ingestão em lote JSON x colunar")
+    parser.add_argument("--url", default="http://127.0.0.1:8002", help="URL base do backend de alta frequência")
+    parser.add_argument("--batch", type=int, default=1000, help="Ticks por lote")
+    parser.add_argument("--batches", type=int, default=50, help="Lotes por formato")
+    args = parser.parse_args()
+
+    batches = [make_batch(args.batch, 1_000_000_000 + i * args.batch) for i in range(args.batches)]
+
+    print(f"{'formato':>10} {'ticks/s':>10} {'servidor ticks/s':>17} {'encode ms':>10} {'bytes/tick':>11}")
+    for fmt in ("json", "columnar"):
+        result = run(args.url.rstrip("/"), fmt, batches)
+        print(f"{fmt:>10} {result['ticks_per_sec']:>10.0f} {result['server_ticks_per_sec']:>17.0f} "
+              f"{result['encode_ms']:>10.1f} {result['bytes_per_tick']:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Benchmark da latência de entrega: IPC x HTTP
+============================================
+Mede p50/p99 do tempo entre o feed entregar um lote e receber a confirmação
+do backend: ACK do transporte IPC (services/shared/ipc_transport) ou resposta
+do POST /ingest/columnar. Com lotes de 1 tick é a latência de ponta a ponta
+de cada tick até o buffer do backend.
+
+Contra um backend rodando (HF_IPC_LISTEN configurado lá):
+    python services/high_frequency/benchmark_ipc_transport.py --url http://127.0.0.1:8002 --ipc tcp://127.0.0.1:8010
+
+Sem backend (--local): sobe um IpcServer e um servidor HTTP da biblioteca
+padrão no próprio processo, ambos decodificando o lote colunar. Mede só o
+custo do transporte.
+
+Atenção: contra o backend os ticks entram no buffer e são gravados em
+ticks_raw; use um banco descartável.
+"""
+
+import argparse
+import asyncio
+import random
+import socket
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib import request as urlreq
+
+# Adiciona o projeto ao path
+_PROJECT_ROOT = Path(__file__).resolve().parents[2]
+if str(_PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(_PROJECT_ROOT))
+
+from services.high_frequency.ipc_server import IpcServer
+from services.shared.ipc_transport import KIND_TICKS, IpcClient
+from services.shared.tick_codec import CONTENT_TYPE, decode_ticks, encode_ticks
+
+BENCH_SYMBOLS = ("BENCH1", "BENCH2", "BENCH3", "BENCH4")
+
+
+def make_batch(n: int, base_trade_id: int) -> list[dict]:
+    now = time.time()
+    return [
+        {
+            "symbol": random.choice(BENCH_SYMBOLS),
+            "exchange": "B",
+            "price": round(30 + random.random() * 5, 2),
+            "volume": random.choice((100, 200, 500, 1000)),
+            "timestamp": now,
+            "trade_id": base_trade_id + i,
+            "buy_agent": random.randint(1, 200),
+            "sell_agent": random.randint(1, 200),
+            "trade_type": random.choice((2, 3)),
+        }
+        for i in range(n)
+    ]
+
+
+def percentile(values: list[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def measure(send, payloads: list[bytes], warmup: int) -> list[float]:
+    for payload in payloads[:warmup]:
+        send(payload)
+    latencies = []
+    for payload in payloads[warmup:]:
+        t0 = time.perf_counter()
+        if not send(payload):
+            raise RuntimeError("lote não confirmado")
+        latencies.append((time.perf_counter() - t0) * 1000)
+    return latencies
+
+
+def http_sender(url: str):
+    # Conexão nova por POST, como o urllib/requests sem sessão nos feeds
+    def send(payload: bytes) -> bool:
+        req = urlreq.Request(url, data=payload, headers={"Content-Type": CONTENT_TYPE}, method="POST")
+        with urlreq.urlopen(req, timeout=10) as resp:
+            resp.read()
+            return resp.status == 200
+    return send
+
+
+def ipc_sender(address: str):
+    client = IpcClient(address, "benchmark.ticks")
+    return lambda payload: client.send(KIND_TICKS, payload, wait=True)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_local_servers() -> tuple[str, str]:
+    """IpcServer e HTTP locais, ambos decodificando o lote como o backend"""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+
+    async def ingest(body: bytes):
+        decode_ticks(body)
+
+    ipc_address = f"tcp://127.0.0.1:{free_port()}"
+    server = IpcServer(ipc_address, {KIND_TICKS: ingest})
+    asyncio.run_coroutine_threadsafe(server.start(), loop).result(5)
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            decode_ticks(self.rfile.read(int(self.headers["Content-Length"])))
+            body = b'{"status":"ok"}'
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    http = ThreadingHTTPServer(("127.0.0.1", free_port()), Handler)
+    threading.Thread(target=http.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{http.server_port}", ipc_address
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de latência de entrega IPC x HTTP")
+    parser.add_argument("--url", default="http://127.0.0.1:8002", help="URL base do backend de alta frequência")
+    parser.add_argument("--ipc", default="tcp://127.0.0.1:8010", help="Endereço HF_IPC_LISTEN do backend")
+    parser.add_argument("--local", action="store_true", help="Usa servidores locais no próprio processo")
+    parser.add_argument("--batch", type=int, default=1, help="Ticks por lote")
+    parser.add_argument("--count", type=int, default=5000, help="Lotes medidos por transporte")
+    parser.add_argument("--warmup", type=int, default=200, help="Lotes de aquecimento")
+    args = parser.parse_args()
+
+    base_url, ipc_address = start_local_servers() if args.local else (args.url.rstrip("/"), args.ipc)
+    payloads = [encode_ticks(make_batch(args.batch, 2_000_000_000 + i * args.batch))
+                for i in range(args.warmup + args.count)]
+
+    print(f"{'transporte':>10} {'p50 ms':>8} {'p99 ms':>8} {'média ms':>9} {'lotes/s':>9}")
+    for name, send in (("http", http_sender(f"{base_url}/ingest/columnar")), ("ipc", ipc_sender(ipc_address))):
+        latencies = measure(send, payloads, args.warmup)
+        print(f"{name:>10} {statistics.median(latencies):>8.3f} {percentile(latencies, 99):>8.3f} "
+              f"{statistics.fmean(latencies):>9.3f} {1000 / statistics.fmean(latencies):>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Benchmark do motor de price book (services/shared/order_book)
+=============================================================
+Reproduz eventos gravados em order_book_events, por símbolo e na ordem de
+chegada, nas listas de dicts que dll.py/profit.py mantinham e no motor
+compartilhado, e mede eventos/s de:
+
+  - aplicar:  só a atualização do book;
+  - top-N:    atualização + top-N a cada evento (antes: sorted por preço);
+  - métricas: atualização + spread/microprice/desequilíbrio a cada evento.
+
+Eventos de book completo (ação 4) zeram o book, pois os arrays da DLL não
+são gravados. Sem banco, --synthetic N gera N eventos de um book vivo.
+
+Uso:
+    python services/high_frequency/benchmark_order_book.py [--symbol PETR4] [--limit 500000] [--top 10]
+    python services/high_frequency/benchmark_order_book.py --synthetic 500000
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+# Configuração do event loop para Windows
+if sys.platform == "win32":
+    asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
+# Adiciona o projeto ao path
+_PROJECT_ROOT = Path(__file__).resolve().parents[2]
+if str(_PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(_PROJECT_ROOT))
+
+from services.high_frequency.config import DATABASE_URL
+from services.high_frequency.test_order_book import make_events
+from services.shared.order_book import (
+    ACTION_ADD, ACTION_DELETE, ACTION_DELETE_FROM, ACTION_EDIT, ACTION_FULL_BOOK, SIDE_SELL, OrderBook,
+)
+
+
+async def load_events(symbol, limit: int):
+    from psycopg import AsyncConnection
+
+    where, params = ("WHERE symbol = %s", (symbol, limit)) if symbol else ("", (limit,))
+    async with await AsyncConnection.connect(os.getenv("DATABASE_URL", DATABASE_URL)) as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(f"""
+                SELECT symbol, action, side, position, price, quantity, offer_count
+                  FROM order_book_events {where}
+                 ORDER BY event_time, id
+                 LIMIT %s
+            """, params)
+            return [
+                (symbol, action, side, position if position is not None else -1, price or 0.0, quantity or 0,
+                 offer_count or 0)
+                for symbol, action, side, position, price, quantity, offer_count in await cur.fetchall()
+            ]
+
+
+class LegacyBooks:
+    """Listas de dicts por lado, índices a partir do fim (como antes do motor)"""
+
+    def __init__(self, top: int):
+        self.top_levels = top
+        self.books = {}
+
+    def apply(self, symbol, action, side, position, price, qty, count):
+        book = self.books.get(symbol)
+        if book is None:
+            book = self.books[symbol] = {"bids": [], "asks": []}
+        if action == ACTION_FULL_BOOK:
+            book["bids"], book["asks"] = [], []
+            return book
+        levels = book["asks"] if side == SIDE_SELL else book["bids"]
+        if action == ACTION_ADD:
+            idx = min(max(len(levels) - position, 0), len(levels))
+            levels.insert(idx, {"price": price, "quantity": qty, "offer_count": count})
+        elif action == ACTION_EDIT:
+            idx = len(levels) - position - 1
+            if 0 <= idx < len(levels):
+                level = levels[idx]
+                level["quantity"] = qty
+                level["offer_count"] = count
+                level["price"] = price or level["price"]
+        elif action == ACTION_DELETE:
+            idx = len(levels) - position - 1
+            if 0 <= idx < len(levels):
+                levels.pop(idx)
+        elif action == ACTION_DELETE_FROM:
+            idx = len(levels) - position - 1
+            if 0 <= idx < len(levels):
+                del levels[idx:]
+        return book
+
+    def top(self, book):
+        bids = sorted(book["bids"], key=lambda lvl: lvl["price"], reverse=True)[:self.top_levels]
+        asks = sorted(book["asks"], key=lambda lvl: lvl["price"])[:self.top_levels]
+        return bids, asks
+
+    def metrics(self, book):
+        bids, asks = self.top(book)
+        if not bids or not asks:
+            return None
+        bid, ask = bids[0], asks[0]
+        top_qty = bid["quantity"] + ask["quantity"]
+        bid_depth = sum(l["quantity"] for l in bids)
+        ask_depth = sum(l["quantity"] for l in asks)
+        return (
+            ask["price"] - bid["price"],
+            (bid["price"] * ask["quantity"] + ask["price"] * bid["quantity"]) / top_qty if top_qty else None,
+            (bid_depth - ask_depth) / (bid_depth + ask_depth) if bid_depth + ask_depth else None,
+        )
+
+
+class EngineBooks:
+    def __init__(self, top: int):
+        self.top_levels = top
+        self.books = {}
+
+    def apply(self, symbol, action, side, position, price, qty, count):
+        book = self.books.get(symbol)
+        if book is None:
+            book = self.books[symbol] = OrderBook(symbol, self.top_levels)
+        if action == ACTION_FULL_BOOK:
+            book.load((), ())
+        else:
+            book.apply(action, side, position, price, qty, count)
+        return book
+
+    def top(self, book):
+        return book.top()
+
+    def metrics(self, book):
+        return book.metrics()
+
+
+def run(impl, events, query: str) -> float:
+    start = time.perf_counter()
+    apply = impl.apply
+    if query == "top":
+        top = impl.top
+        for event in events:
+            top(apply(*event))
+    elif query == "metrics":
+        metrics = impl.metrics
+        for event in events:
+            metrics(apply(*event))
+    else:
+        for event in events:
+            apply(*event)
+    return len(events) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark do motor de price book")
+    parser.add_argument("--symbol", help="Só um símbolo (padrão: todos)")
+    parser.add_argument("--limit", type=int, default=500_000, help="Máximo de eventos lidos do banco")
+    parser.add_argument("--synthetic", type=int, default=0, help="Gera N eventos em vez de ler o banco")
+    parser.add_argument("--top", type=int, default=10, help="Níveis do top-N")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        events = [("SYNTH3", *event) for event in make_events(random.Random(1), args.synthetic)]
+        source = "sintéticos"
+    else:
+        events = asyncio.run(load_events(args.symbol, args.limit))
+        source = "order_book_events"
+    if not events:
+        print("Nenhum evento para reproduzir")
+        return
+
+    symbols = len({event[0] for event in events})
+    print(f"{len(events)} eventos {source} em {symbols} símbolos, top-{args.top}")
+    print(f"{'consulta':>9} {'listas eventos/s':>17} {'motor eventos/s':>16} {'speedup':>8}")
+    for query in ("aplicar", "top", "metrics"):
+        legacy = run(LegacyBooks(args.top), events, query)
+        engine = run(EngineBooks(args.top), events, query)
+        print(f"{query:>9} {legacy:>17,.0f} {engine:>16,.0f} {engine / legacy:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
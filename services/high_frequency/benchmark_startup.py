@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Benchmark da subida do backend HF: tempo até o primeiro tick aceito
+===================================================================
+Sobe o backend (uvicorn) em um processo novo e envia um tick em
+/ingest/batch a cada --interval-ms até a primeira resposta 200. Mede, a
+partir do spawn, quando a porta abre, quando o primeiro tick é aceito e (se
+disponível) os tempos de /metrics["startup"].
+
+Para comparar antes/depois, rode o mesmo comando em cada versão do código
+contra o mesmo banco (esquema já criado, como num restart em produção).
+
+Uso:
+    python services/high_frequency/benchmark_startup.py [--runs 5] [--port 8099]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+_PROJECT_ROOT = Path(__file__).resolve().parents[2]
+
+
+def post_tick(base_url: str) -> int:
+    body = json.dumps({"ticks": [{
+        "symbol": "BENCH3", "exchange": "B", "price": 10.0, "volume": 100, "timestamp": time.time(),
+    }]}).encode()
+    request = urllib.request.Request(f"{base_url}/ingest/batch", data=body,
+                                     headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request, timeout=2) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def get_startup_metrics(base_url: str):
+    try:
+        with urllib.request.urlopen(f"{base_url}/metrics", timeout=5) as response:
+            return json.loads(response.read()).get("startup")
+    except Exception:
+        return None
+
+
+def run_once(port: int, interval: float, timeout: float) -> dict:
+    base_url = f"http://127.0.0.1:{port}"
+    env = dict(os.environ, HF_DISABLE_SIM="1")
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "services.high_frequency.main:app", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=_PROJECT_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    result = {"port_open_ms": None, "first_accept_ms": None, "rejected": 0}
+    try:
+        while time.perf_counter() - started < timeout:
+            try:
+                status = post_tick(base_url)
+            except (urllib.error.URLError, ConnectionError, TimeoutError):
+                time.sleep(interval)
+                continue
+            elapsed = (time.perf_counter() - started) * 1000
+            if result["port_open_ms"] is None:
+                result["port_open_ms"] = elapsed
+            if status == 200:
+                result["first_accept_ms"] = elapsed
+                break
+            result["rejected"] += 1
+            time.sleep(interval)
+        # Dá tempo de o banco ficar pronto para ler os tempos internos
+        time.sleep(2.0)
+        result["startup"] = get_startup_metrics(base_url)
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tempo até o primeiro tick aceito na subida do backend HF")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--interval-ms", type=float, default=10.0)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    args = parser.parse_args()
+
+    print("🧪 BENCHMARK DE SUBIDA DO BACKEND HF")
+    print("=" * 72)
+    print(f"{'rodada':<8}{'porta (ms)':>12}{'1º tick (ms)':>14}{'503s':>8}{'banco (ms)':>12}{'antes do banco':>16}")
+    accepted = []
+    for run in range(1, args.runs + 1):
+        result = run_once(args.port, args.interval_ms / 1000.0, args.timeout)
+        startup = result["startup"] or {}
+        first = result["first_accept_ms"]
+        if first is not None:
+            accepted.append(first)
+        print(f"{run:<8}{result['port_open_ms'] or float('nan'):>12.0f}{first or float('nan'):>14.0f}"
+              f"{result['rejected']:>8}{startup.get('time_to_db_ready_ms') or float('nan'):>12.0f}"
+              f"{startup.get('ticks_before_db_ready', '-'):>16}")
+    if accepted:
+        print(f"\nTempo até o primeiro tick aceito: p50 {statistics.median(accepted):.0f} ms, "
+              f"melhor {min(accepted):.0f} ms, pior {max(accepted):.0f} ms")
+    print("\n✅ Benchmark concluído!")
+
+
+if __name__ == "__main__":
+    main()
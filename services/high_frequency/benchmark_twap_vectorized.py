@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Benchmark da detecção TWAP vetorizada
+=====================================
+Compara o tempo de clusterização + estatísticas por agente entre o caminho
+original (_cluster_trades/_analyze_agent_trades) e o caminho NumPy
+(vectorized_twap), sem banco e sem persistir. A coluna "colunas ms" é a parte
+do tempo NumPy gasta montando as colunas a partir dos TickData.
+
+Uso:
+    python services/high_frequency/benchmark_twap_vectorized.py [--sizes 1000,10000,50000] [--rounds 3]
+"""
+
+import argparse
+import asyncio
+import logging
+import random
+import sys
+import time
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+
+# Adiciona o projeto ao path
+_PROJECT_ROOT = Path(__file__).resolve().parents[2]
+if str(_PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(_PROJECT_ROOT))
+
+from services.high_frequency.robot_models import TWAPDetectionConfig, TickData, TradeType
+from services.high_frequency.robot_detector import TWAPDetector
+from services.high_frequency.vectorized_twap import AgentTradeArrays, cluster_indices
+
+
+def make_trades(n: int) -> list[TickData]:
+    """Trades de um agente ao longo de um pregão, poucas assinaturas de volume"""
+    start = datetime.now(timezone.utc) - timedelta(hours=7)
+    step = 7 * 3600 / n
+    return [
+        TickData(
+            symbol="PETR4",
+            price=round(30 + random.random() * 2, 2),
+            volume=random.choice((100, 200, 500, 1000)),
+            timestamp=start + timedelta(seconds=i * step + random.random()),
+            trade_type=random.choice((TradeType.BUY, TradeType.SELL)),
+            agent_id=7,
+            exchange="B",
+            trade_id=i,
+        )
+        for i in range(n)
+    ]
+
+
+async def run_legacy(detector: TWAPDetector, trades: list[TickData]) -> int:
+    clusters = detector._cluster_trades(trades)
+    await detector._analyze_agent_trades("PETR4", 7, trades, persist=False)
+    for (volume, direction, interval), cluster in clusters.items():
+        await detector._analyze_agent_trades("PETR4", 7, cluster, volume, direction, interval, persist=False)
+    return len(clusters)
+
+
+async def run_vectorized(detector: TWAPDetector, trades: list[TickData]) -> int:
+    arrays = AgentTradeArrays(trades)
+    clusters = cluster_indices(arrays, detector.config.min_trades)
+    await detector._analyze_agent_arrays(arrays, "PETR4", 7, arrays.sorted_index(), persist=False)
+    for (volume, direction, interval), index in clusters.items():
+        await detector._analyze_agent_arrays(arrays, "PETR4", 7, index, volume, direction, interval, persist=False)
+    return len(clusters)
+
+
+async def build_columns(detector: TWAPDetector, trades: list[TickData]) -> int:
+    return len(AgentTradeArrays(trades))
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark da detecção TWAP vetorizada")
+    parser.add_argument("--sizes", default="1000,10000,50000", help="Trades por agente, separados por vírgula")
+    parser.add_argument("--rounds", type=int, default=3, help="Rodadas por tamanho (usa a melhor)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    detector = TWAPDetector(config=TWAPDetectionConfig(), persistence=None, mode="full")
+
+    print(f"{'trades':>8} {'original ms':>12} {'numpy ms':>10} {'colunas ms':>11} {'speedup':>8}")
+    for size in (int(s) for s in args.sizes.split(",")):
+        trades = make_trades(size)
+        random.shuffle(trades)
+        timings = {}
+        for name, run in (("legacy", run_legacy), ("vectorized", run_vectorized), ("columns", build_columns)):
+            best = float("inf")
+            for _ in range(args.rounds):
+                start = time.perf_counter()
+                await run(detector, trades)
+                best = min(best, time.perf_counter() - start)
+            timings[name] = best * 1000
+        print(f"{size:>8} {timings['legacy']:>12.1f} {timings['vectorized']:>10.1f} {timings['columns']:>11.1f} "
+              f"{timings['legacy'] / timings['vectorized']:>7.1f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
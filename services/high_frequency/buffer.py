@@ -5,17 +5,35 @@ import asyncio
 import logging
 import time
 from collections import deque, defaultdict
-from typing import Dict, Deque
+from typing import Dict, Deque, Optional, Tuple
 from services.high_frequency.models import Tick, OrderBookEvent, OrderBookSnapshot, OrderBookOffer
 from services.high_frequency.persistence import persist_ticks
+from services.high_frequency.activity_index import agent_activity_index, volume_index
+from services.high_frequency.tick_store import tick_store
+from services.high_frequency.tick_journal import tick_journal
+from services.high_frequency.tick_latency import tick_latency
+from services.high_frequency import rollup_store
+from services.high_frequency.detection_scheduler import detection_scheduler
+from services.high_frequency.config import (
+    HF_BOOK_BATCH_MAX, HF_BOOK_BATCH_MS, HF_BOOK_QUEUE_HIGH_WATER, HF_BUFFER_MAX_TICKS,
+)
 
 logger = logging.getLogger(__name__)
 
-# Estado global do buffer
-buffer_queue: Dict[str, deque] = defaultdict(deque)
-order_book_event_queue: Deque[OrderBookEvent] = deque()
-order_book_snapshot_queue: Deque[OrderBookSnapshot] = deque()
-order_book_offer_queue: Deque[OrderBookOffer] = deque()
+# Estado global do buffer: por símbolo, (segmento do journal ou None, tick)
+buffer_queue: Dict[str, Deque[Tuple[Optional[int], Tick]]] = defaultdict(deque)
+# Total em buffer_queue; acima de HF_BUFFER_MAX_TICKS os ticks ficam só no journal ou, sem ele, são descartados
+buffered_ticks = 0
+buffer_stats: Dict[str, int] = {'failed_batches': 0, 'lost_ticks': 0, 'spilled_ticks': 0, 'dropped_ticks': 0}
+# Filas do livro de ofertas guardam (instante de enfileiramento, item) para medir o atraso
+order_book_event_queue: Deque[Tuple[float, OrderBookEvent]] = deque()
+order_book_snapshot_queue: Deque[Tuple[float, OrderBookSnapshot]] = deque()
+order_book_offer_queue: Deque[Tuple[float, OrderBookOffer]] = deque()
+order_book_stats: Dict[str, Dict[str, float]] = {
+    name: {'enqueued': 0, 'written': 0, 'failed': 0, 'shed': 0, 'batches': 0,
+           'last_batch_size': 0, 'last_write_ms': 0.0, 'lag_ms': 0.0}
+    for name in ('events', 'snapshots', 'offers')
+}
 subscriptions: Dict[str, dict] = {}
 tick_counters: Dict[str, int] = defaultdict(int)
 
@@ -25,6 +43,7 @@ BATCH_TIMEOUT_MS = 100
 
 async def start_buffer_processor(db_pool):
     """Inicia o processador de buffer principal."""
+    global buffered_ticks
     logger.info("Iniciando processador de buffer...")
     
     while True:
@@ -43,8 +62,16 @@ async def start_buffer_processor(db_pool):
                             ticks_to_process.append(tick_queue.popleft())
                     
                     if ticks_to_process:
+                        buffered_ticks -= len(ticks_to_process)
+                        segments = [segment for segment, _ in ticks_to_process]
                         # Persiste no banco
-                        await persist_ticks(ticks_to_process, db_pool)
+                        if await persist_ticks([tick for _, tick in ticks_to_process], db_pool):
+                            tick_journal.commit(segments)
+                        else:
+                            # Sem o banco o lote sai da memória; o que está no journal volta pelo replay
+                            buffer_stats['failed_batches'] += 1
+                            buffer_stats['lost_ticks'] += segments.count(None)
+                            tick_journal.mark_for_replay(segments)
                         tick_counters[symbol] += len(ticks_to_process)
                         
                         logger.debug(f"Processados {len(ticks_to_process)} ticks para {symbol}")
@@ -58,71 +85,150 @@ async def start_buffer_processor(db_pool):
 
 def add_tick_to_buffer(tick: Tick):
     """Adiciona um tick ao buffer."""
-    buffer_queue[tick.symbol].append(tick)
+    global buffered_ticks
+    if tick.ingested_at is None:
+        tick.ingested_at = time.time()
+    # Bolsa → backend e feed → backend (o COMMIT é medido em persist_ticks)
+    tick_latency.record_ingest(tick)
+    segment = tick_journal.append(tick)
+    if buffered_ticks >= HF_BUFFER_MAX_TICKS:
+        if segment is None:
+            # Memória cheia sem journal (ou journal acima da cota): o tick é descartado
+            buffer_stats['dropped_ticks'] += 1
+            return
+        # Memória cheia: o tick fica só no journal e chega ao banco pelo replay
+        tick_journal.mark_for_replay((segment,), spilled=True)
+        buffer_stats['spilled_ticks'] += 1
+    else:
+        buffer_queue[tick.symbol].append((segment, tick))
+        buffered_ticks += 1
+    # Último trade por agente (inatividade) e volume por minuto (volume %)
+    agent_activity_index.record_tick(tick)
+    volume_index.record_tick(tick)
+    # Cópia colunar do pregão para leituras sem ir ao banco
+    tick_store.append_tick(tick)
+    # Barra de 1s do rollup de candles (5s..1h derivam dela e do 1m)
+    rollup_store.record_tick(tick)
+    # Ticks novos do símbolo priorizam sua próxima análise TWAP
+    detection_scheduler.record_tick(tick.symbol)
     
 def get_buffer_status():
     """Retorna status do buffer."""
     return {
         'symbols': len(buffer_queue),
-        'total_queued': sum(len(queue) for queue in buffer_queue.values()),
-        'tick_counters': dict(tick_counters)
+        'total_queued': buffered_ticks,
+        'max_queued': HF_BUFFER_MAX_TICKS,
+        **buffer_stats,
+        'tick_counters': dict(tick_counters),
+        'journal': tick_journal.get_status(),
     }
 
 
+def _order_book_depth() -> int:
+    return len(order_book_event_queue) + len(order_book_snapshot_queue) + len(order_book_offer_queue)
+
+
+def _shed_oldest(queue: Deque, name: str) -> bool:
+    if not queue:
+        return False
+    queue.popleft()
+    order_book_stats[name]['shed'] += 1
+    return True
+
+
+def _enqueue_order_book(queue: Deque, name: str, item) -> None:
+    """Enfileira com marca d'alta: snapshots são descartados primeiro."""
+    depth = _order_book_depth()
+    if depth >= HF_BOOK_QUEUE_HIGH_WATER:
+        if name == 'snapshots':
+            order_book_stats[name]['shed'] += 1
+            return
+        # Abre espaço descartando snapshots antigos; só no limite rígido descarta o próprio tipo
+        if not _shed_oldest(order_book_snapshot_queue, 'snapshots') and depth >= 2 * HF_BOOK_QUEUE_HIGH_WATER:
+            _shed_oldest(queue, name)
+    queue.append((time.monotonic(), item))
+    order_book_stats[name]['enqueued'] += 1
+
+
 def enqueue_order_book_event(event: OrderBookEvent):
-    order_book_event_queue.append(event)
+    _enqueue_order_book(order_book_event_queue, 'events', event)
 
 
 def enqueue_order_book_snapshot(snapshot: OrderBookSnapshot):
-    order_book_snapshot_queue.append(snapshot)
+    _enqueue_order_book(order_book_snapshot_queue, 'snapshots', snapshot)
 
 
 def enqueue_order_book_offer(offer: OrderBookOffer):
-    order_book_offer_queue.append(offer)
-    logger.debug(f"📥 Enqueued offer: {offer.symbol} action={offer.action} side={offer.side} agent={offer.agent_id} (queue size: {len(order_book_offer_queue)})")
+    _enqueue_order_book(order_book_offer_queue, 'offers', offer)
 
 
-async def start_order_book_event_processor(process_event):
-    """Processa eventos incrementais do livro de ofertas."""
-    logger.info("Iniciando processador de eventos de order book...")
+async def _run_order_book_batch_writer(queue: Deque, name: str, write_batch):
+    """Drena até HF_BOOK_BATCH_MAX itens ou HF_BOOK_BATCH_MS e grava o lote de uma vez."""
+    stats = order_book_stats[name]
+    batch_timeout = HF_BOOK_BATCH_MS / 1000.0
     while True:
-        if order_book_event_queue:
-            event = order_book_event_queue.popleft()
-            try:
-                await process_event(event)
-            except Exception as exc:
-                logger.error(f"Erro ao processar evento de order book: {exc}")
-        else:
-            await asyncio.sleep(0.01)
-
-
-async def start_order_book_snapshot_processor(process_snapshot):
-    """Processa snapshots agregados do livro de ofertas."""
+        try:
+            if not queue:
+                await asyncio.sleep(0.01)
+                continue
+
+            # Espera o lote encher ou o tempo do item mais antigo estourar
+            oldest = queue[0][0]
+            wait = batch_timeout - (time.monotonic() - oldest)
+            if len(queue) < HF_BOOK_BATCH_MAX and wait > 0:
+                await asyncio.sleep(min(wait, 0.01))
+                continue
+
+            entries = [queue.popleft() for _ in range(min(HF_BOOK_BATCH_MAX, len(queue)))]
+            stats['lag_ms'] = round((time.monotonic() - entries[0][0]) * 1000, 1)
+            started = time.perf_counter()
+            ok = await write_batch([item for _, item in entries])
+            stats['last_write_ms'] = round((time.perf_counter() - started) * 1000, 1)
+            stats['batches'] += 1
+            stats['last_batch_size'] = len(entries)
+            if ok is False:
+                stats['failed'] += len(entries)
+            else:
+                stats['written'] += len(entries)
+        except Exception as exc:
+            logger.error(f"❌ Erro no gravador de {name} do order book: {exc}")
+            await asyncio.sleep(1)
+
+
+async def start_order_book_event_processor(write_events):
+    """Grava em lote os eventos incrementais do livro de ofertas."""
+    logger.info("Iniciando processador de eventos de order book...")
+    await _run_order_book_batch_writer(order_book_event_queue, 'events', write_events)
+
+
+async def start_order_book_snapshot_processor(write_snapshots):
+    """Grava em lote os snapshots agregados do livro de ofertas."""
     logger.info("Iniciando processador de snapshots de order book...")
-    while True:
-        if order_book_snapshot_queue:
-            snapshot = order_book_snapshot_queue.popleft()
-            try:
-                await process_snapshot(snapshot)
-            except Exception as exc:
-                logger.error(f"Erro ao processar snapshot de order book: {exc}")
-        else:
-            await asyncio.sleep(0.05)
-
-
-async def start_order_book_offer_processor(process_offer):
-    """Processa eventos individuais de ofertas (por agente)."""
+    await _run_order_book_batch_writer(order_book_snapshot_queue, 'snapshots', write_snapshots)
+
+
+async def start_order_book_offer_processor(write_offers):
+    """Grava em lote os eventos individuais de ofertas (por agente)."""
     logger.info("🚀 Iniciando processador de ofertas de order book...")
-    processed_count = 0
-    while True:
-        if order_book_offer_queue:
-            offer = order_book_offer_queue.popleft()
-            try:
-                await process_offer(offer)
-                processed_count += 1
-                if processed_count % 100 == 0:
-                    logger.info(f"📊 Processadas {processed_count} ofertas de order book")
-            except Exception as exc:
-                logger.error(f"❌ Erro ao processar oferta de order book: {exc}")
-        else:
-            await asyncio.sleep(0.01)
+    await _run_order_book_batch_writer(order_book_offer_queue, 'offers', write_offers)
+
+
+def get_order_book_queue_status():
+    """Profundidade, atraso e descartes das filas do livro de ofertas."""
+    now = time.monotonic()
+    queues = {
+        'events': order_book_event_queue,
+        'snapshots': order_book_snapshot_queue,
+        'offers': order_book_offer_queue,
+    }
+    status = {
+        'high_water_mark': HF_BOOK_QUEUE_HIGH_WATER,
+        'total_depth': _order_book_depth(),
+    }
+    for name, queue in queues.items():
+        status[name] = {
+            'depth': len(queue),
+            'oldest_age_ms': round((now - queue[0][0]) * 1000, 1) if queue else 0.0,
+            **order_book_stats[name],
+        }
+    return status
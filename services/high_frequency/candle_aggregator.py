@@ -2,19 +2,47 @@
 """
 Agrupador automático de ticks em candles
 Converte ticks em tempo real para candles de 1 minuto
+
+- O candle de um símbolo fecha quando chega tick do minuto seguinte ou, pelo
+  relógio, na virada do minuto + HF_CANDLE_CLOSE_GRACE_MS (símbolos sem
+  negócio não ficam com candle aberto por minutos).
+- Fechar só move o candle para a fila de gravação; um writer em background
+  faz o upsert de todos os candles pendentes em um único statement, fora do
+  caminho da ingestão.
+- Ticks atrasados de um minuto já fechado (até HF_CANDLE_LATE_MINUTES atrás)
+  corrigem o candle em memória, que é regravado no próximo lote.
 """
 
 import asyncio
 import logging
 import time
-from datetime import datetime, timezone
-from typing import Dict, Optional, List
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Optional, List, Tuple
 from dataclasses import dataclass
 from services.high_frequency.models import Tick
 from services.high_frequency.persistence import get_db_pool
+from services.high_frequency.config import HF_CANDLE_CLOSE_GRACE_MS, HF_CANDLE_FLUSH_MS, HF_CANDLE_LATE_MINUTES
 
 logger = logging.getLogger(__name__)
 
+# Upsert de vários candles em um statement (conflito na chave do candles_1m)
+_UPSERT_CANDLES_SQL = """
+    INSERT INTO candles_1m
+    (symbol, exchange, ts_minute_utc, o, h, l, c, v, vf)
+    SELECT * FROM unnest(
+        %s::varchar[], %s::varchar[], %s::timestamptz[],
+        %s::float8[], %s::float8[], %s::float8[], %s::float8[], %s::int8[], %s::float8[]
+    )
+    ON CONFLICT (symbol, ts_minute_utc)
+    DO UPDATE SET
+        o = EXCLUDED.o,
+        h = EXCLUDED.h,
+        l = EXCLUDED.l,
+        c = EXCLUDED.c,
+        v = EXCLUDED.v,
+        vf = EXCLUDED.vf
+"""
+
 @dataclass
 class CandleData:
     """Estrutura de dados para um candle."""
@@ -30,68 +58,80 @@ class CandleData:
     total_volume_financial: float
     tick_count: int
     last_update: float
+    # Timestamps (do feed) do primeiro e do último tick, para encaixar ticks atrasados
+    first_tick_time: float = 0.0
+    last_tick_time: float = 0.0
 
 class CandleAggregator:
     """Agrupa ticks em candles de 1 minuto automaticamente."""
-    
-    def __init__(self):
+
+    def __init__(
+        self,
+        close_grace_sec: float = HF_CANDLE_CLOSE_GRACE_MS / 1000.0,
+        flush_interval_sec: float = HF_CANDLE_FLUSH_MS / 1000.0,
+        late_window_minutes: int = HF_CANDLE_LATE_MINUTES,
+    ):
         self.current_candles: Dict[str, CandleData] = {}
+        # Candles já fechados, por (chave, minuto), guardados para correção por ticks atrasados
+        self.closed_candles: Dict[Tuple[str, datetime], CandleData] = {}
+        # Fechados ou corrigidos aguardando upsert, pela chave do candles_1m (symbol, minuto)
+        self.pending_writes: Dict[Tuple[str, datetime], CandleData] = {}
+        self.close_grace_sec = close_grace_sec
+        self.flush_interval_sec = flush_interval_sec
+        self.late_window = timedelta(minutes=late_window_minutes)
+        # Minutos anteriores a este não aceitam mais correção
+        self._late_cutoff: Optional[datetime] = None
         self.is_running = False
         self.aggregation_task: Optional[asyncio.Task] = None
+        self.writer_task: Optional[asyncio.Task] = None
+        self._flush_event: Optional[asyncio.Event] = None
+        # Chamado com cada candle fechado ou corrigido (rollup de timeframes maiores)
+        self.on_candle_closed: Optional[Callable[[CandleData], None]] = None
+        self.stats = {
+            'closed_by_tick': 0,
+            'closed_by_clock': 0,
+            'late_corrections': 0,
+            'late_dropped': 0,
+            'batches_written': 0,
+            'candles_written': 0,
+            'write_failures': 0,
+            'last_batch_size': 0,
+            'last_write_ms': 0.0,
+        }
         self.logger = logging.getLogger(f"{__name__}.CandleAggregator")
-        
+
     def start(self):
         """Inicia o agrupador de candles."""
         if self.is_running:
             return
-            
+
         self.is_running = True
+        self._flush_event = asyncio.Event()
         self.aggregation_task = asyncio.create_task(self._aggregation_loop())
+        self.writer_task = asyncio.create_task(self._writer_loop())
         self.logger.info("CandleAggregator iniciado")
-        
+
     def stop(self):
         """Para o agrupador de candles."""
         if not self.is_running:
             return
-            
+
         self.is_running = False
-        if self.aggregation_task:
-            self.aggregation_task.cancel()
+        for task in (self.aggregation_task, self.writer_task):
+            if task:
+                task.cancel()
         self.logger.info("CandleAggregator parado")
-        
+
     async def process_tick(self, tick: Tick):
         """Processa um tick e o agrupa no candle atual."""
         try:
             # Calcula o bucket de tempo (1 minuto)
             bucket_time = self._get_minute_bucket(tick.timestamp)
             candle_key = f"{tick.symbol}_{tick.exchange}"
-            
-            # Verifica se precisa criar novo candle
-            if (candle_key not in self.current_candles or 
-                self.current_candles[candle_key].open_time != bucket_time):
-                
-                # Fecha candle anterior se existir
-                if candle_key in self.current_candles:
-                    await self._close_and_save_candle(candle_key)
-                
-                # Cria novo candle
-                self.current_candles[candle_key] = CandleData(
-                    symbol=tick.symbol,
-                    exchange=tick.exchange,
-                    open_time=bucket_time,
-                    close_time=bucket_time.replace(second=59, microsecond=999999),
-                    open_price=tick.price,
-                    high_price=tick.price,
-                    low_price=tick.price,
-                    close_price=tick.price,
-                    total_volume=tick.volume,
-                    total_volume_financial=tick.volume_financial or (tick.price * tick.volume),
-                    tick_count=1,
-                    last_update=time.time()
-                )
-            else:
+            candle = self.current_candles.get(candle_key)
+
+            if candle is not None and candle.open_time == bucket_time:
                 # Atualiza candle existente
-                candle = self.current_candles[candle_key]
                 candle.high_price = max(candle.high_price, tick.price)
                 candle.low_price = min(candle.low_price, tick.price)
                 candle.close_price = tick.price
@@ -99,114 +139,236 @@ class CandleAggregator:
                 candle.total_volume_financial += tick.volume_financial or (tick.price * tick.volume)
                 candle.tick_count += 1
                 candle.last_update = time.time()
-                
+                candle.last_tick_time = max(candle.last_tick_time, tick.timestamp)
+                return
+
+            closed = self.closed_candles.get((candle_key, bucket_time))
+            if closed is not None or (candle is not None and bucket_time < candle.open_time):
+                # Tick atrasado: corrige o minuto já fechado sem mexer no candle aberto
+                self._apply_late_tick(candle_key, bucket_time, closed, tick)
+                return
+            if self._late_cutoff is not None and bucket_time < self._late_cutoff:
+                self.stats['late_dropped'] += 1
+                return
+
+            # Fecha candle anterior se existir (só enfileira a gravação)
+            if candle is not None:
+                self._close_candle(candle_key)
+                self.stats['closed_by_tick'] += 1
+
+            # Cria novo candle
+            self.current_candles[candle_key] = self._new_candle(tick, bucket_time)
+
         except Exception as e:
             self.logger.error(f"Erro ao processar tick para candle: {e}")
-            
+
+    async def process_ticks(self, ticks: List[Tick]):
+        """Processa um lote de ticks na ordem recebida, com o mesmo resultado de
+        process_tick em cada um; o bucket só é recalculado quando o minuto muda."""
+        now = time.time()
+        # (minuto epoch // 60, candle) aberto de cada chave; revalidado a cada tick
+        # porque o loop de agregação pode fechar candles entre um await e outro
+        open_candles: Dict[str, tuple] = {}
+        for tick in ticks:
+            try:
+                candle_key = f"{tick.symbol}_{tick.exchange}"
+                minute = int(tick.timestamp // 60)
+                candle = self.current_candles.get(candle_key)
+                cached = open_candles.get(candle_key)
+                if candle is None or cached is None or cached[0] != minute or cached[1] is not candle:
+                    await self.process_tick(tick)
+                    candle = self.current_candles.get(candle_key)
+                    if candle is not None:
+                        open_candles[candle_key] = (int(candle.open_time.timestamp()) // 60, candle)
+                    continue
+
+                price = tick.price
+                if price > candle.high_price:
+                    candle.high_price = price
+                if price < candle.low_price:
+                    candle.low_price = price
+                candle.close_price = price
+                candle.total_volume += tick.volume
+                candle.total_volume_financial += tick.volume_financial or (price * tick.volume)
+                candle.tick_count += 1
+                candle.last_update = now
+                if tick.timestamp > candle.last_tick_time:
+                    candle.last_tick_time = tick.timestamp
+            except Exception as e:
+                self.logger.error(f"Erro ao processar tick para candle: {e}")
+
     def _get_minute_bucket(self, timestamp: float) -> datetime:
         """Converte timestamp para bucket de 1 minuto."""
         dt = datetime.fromtimestamp(timestamp, tz=timezone.utc)
         return dt.replace(second=0, microsecond=0)
-        
-    async def _close_and_save_candle(self, candle_key: str):
-        """Fecha um candle e o salva no banco de dados."""
+
+    @staticmethod
+    def _new_candle(tick: Tick, bucket_time: datetime) -> CandleData:
+        return CandleData(
+            symbol=tick.symbol,
+            exchange=tick.exchange,
+            open_time=bucket_time,
+            close_time=bucket_time.replace(second=59, microsecond=999999),
+            open_price=tick.price,
+            high_price=tick.price,
+            low_price=tick.price,
+            close_price=tick.price,
+            total_volume=tick.volume,
+            total_volume_financial=tick.volume_financial or (tick.price * tick.volume),
+            tick_count=1,
+            last_update=time.time(),
+            first_tick_time=tick.timestamp,
+            last_tick_time=tick.timestamp,
+        )
+
+    def _close_candle(self, candle_key: str):
+        """Fecha o candle aberto da chave e o enfileira para o upsert em lote."""
+        candle = self.current_candles.pop(candle_key)
+        self.closed_candles[(candle_key, candle.open_time)] = candle
+        self.pending_writes[(candle.symbol, candle.open_time)] = candle
+        self._notify_closed(candle)
+        self.logger.debug(f"Candle fechado: {candle.symbol} {candle.open_time}")
+
+    def _notify_closed(self, candle: CandleData):
+        if self.on_candle_closed is None:
+            return
         try:
-            candle = self.current_candles[candle_key]
-            
-            # Salva no banco
-            await self._save_candle_to_db(candle)
-            
-            # Remove do dicionário de candles ativos
-            del self.current_candles[candle_key]
-            
-            self.logger.debug(f"Candle fechado e salvo: {candle.symbol} {candle.open_time}")
-            
+            self.on_candle_closed(candle)
         except Exception as e:
-            self.logger.error(f"Erro ao fechar candle {candle_key}: {e}")
-            
-    async def _save_candle_to_db(self, candle: CandleData):
-        """Salva um candle na tabela candles_1m."""
+            self.logger.error(f"Erro no callback de candle fechado: {e}")
+
+    def _apply_late_tick(self, candle_key: str, bucket_time: datetime, candle: Optional[CandleData], tick: Tick):
+        """Corrige (ou cria) o candle fechado do minuto do tick e agenda o regravamento."""
+        if self._late_cutoff is not None and bucket_time < self._late_cutoff:
+            self.stats['late_dropped'] += 1
+            return
+        if candle is None:
+            # Minuto sem candle em memória: o tick vira um candle fechado
+            candle = self._new_candle(tick, bucket_time)
+            self.closed_candles[(candle_key, bucket_time)] = candle
+        else:
+            candle.high_price = max(candle.high_price, tick.price)
+            candle.low_price = min(candle.low_price, tick.price)
+            if tick.timestamp < candle.first_tick_time:
+                candle.open_price = tick.price
+                candle.first_tick_time = tick.timestamp
+            if tick.timestamp >= candle.last_tick_time:
+                candle.close_price = tick.price
+                candle.last_tick_time = tick.timestamp
+            candle.total_volume += tick.volume
+            candle.total_volume_financial += tick.volume_financial or (tick.price * tick.volume)
+            candle.tick_count += 1
+            candle.last_update = time.time()
+        self.pending_writes[(candle.symbol, bucket_time)] = candle
+        self._notify_closed(candle)
+        self.stats['late_corrections'] += 1
+
+    def close_expired(self, now: float) -> int:
+        """Fecha os candles de minutos encerrados há mais que a carência e descarta
+        da memória os fechados fora da janela de correção."""
+        current_minute = self._get_minute_bucket(now - self.close_grace_sec)
+        expired = [key for key, candle in self.current_candles.items() if candle.open_time < current_minute]
+        for key in expired:
+            self._close_candle(key)
+        self.stats['closed_by_clock'] += len(expired)
+
+        self._late_cutoff = current_minute - self.late_window
+        for key in [k for k in self.closed_candles if k[1] < self._late_cutoff]:
+            del self.closed_candles[key]
+        return len(expired)
+
+    async def flush(self) -> int:
+        """Grava em um único upsert todos os candles pendentes; devolve quantos gravou."""
+        if not self.pending_writes:
+            return 0
+        batch, self.pending_writes = self.pending_writes, {}
+        started = time.perf_counter()
+        ok = await self._write_candles(list(batch.values()))
+        self.stats['last_write_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        if not ok:
+            # Volta para a fila sem sobrescrever versões corrigidas durante a escrita
+            for key, candle in batch.items():
+                self.pending_writes.setdefault(key, candle)
+            self.stats['write_failures'] += 1
+            return 0
+        self.stats['batches_written'] += 1
+        self.stats['candles_written'] += len(batch)
+        self.stats['last_batch_size'] = len(batch)
+        return len(batch)
+
+    async def _write_candles(self, candles: List[CandleData]) -> bool:
+        """Upsert em lote na tabela candles_1m."""
+        # Colunas montadas antes do primeiro await: correções posteriores entram no próximo lote
+        columns = list(zip(*[
+            (c.symbol, c.exchange, c.open_time, c.open_price, c.high_price, c.low_price,
+             c.close_price, c.total_volume, c.total_volume_financial)
+            for c in candles
+        ]))
         try:
             db_pool = await get_db_pool()
             if not db_pool:
                 self.logger.error("Pool de banco não disponível")
-                return
-                
+                return False
+
             async with db_pool.connection() as conn:
                 async with conn.cursor() as cur:
-                    # Insere ou atualiza candle
-                    query = """
-                        INSERT INTO candles_1m 
-                        (symbol, exchange, ts_minute_utc, o, h, l, c, v, vf)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-                        ON CONFLICT (symbol, ts_minute_utc) 
-                        DO UPDATE SET 
-                            o = EXCLUDED.o,
-                            h = EXCLUDED.h,
-                            l = EXCLUDED.l,
-                            c = EXCLUDED.c,
-                            v = EXCLUDED.v,
-                            vf = EXCLUDED.vf
-                    """
-                    
-                    await cur.execute(query, (
-                        candle.symbol,
-                        candle.exchange,
-                        candle.open_time,
-                        candle.open_price,
-                        candle.high_price,
-                        candle.low_price,
-                        candle.close_price,
-                        candle.total_volume,
-                        candle.total_volume_financial
-                    ))
-                    
+                    await cur.execute(_UPSERT_CANDLES_SQL, [list(col) for col in columns])
                     await conn.commit()
-                    
+            return True
+
         except Exception as e:
-            self.logger.error(f"Erro ao salvar candle no banco: {e}")
-            
+            self.logger.error(f"Erro ao salvar {len(candles)} candles no banco: {e}")
+            return False
+
     async def _aggregation_loop(self):
-        """Loop principal de agregação que roda a cada minuto."""
+        """Fecha os candles pelo relógio a cada virada de minuto + carência."""
         while self.is_running:
             try:
-                # Fecha todos os candles abertos que já passaram do minuto
-                current_time = datetime.now(timezone.utc)
-                current_minute = current_time.replace(second=0, microsecond=0)
-                
-                candles_to_close = []
-                for key, candle in self.current_candles.items():
-                    if candle.open_time < current_minute:
-                        candles_to_close.append(key)
-                
-                # Fecha candles antigos
-                for key in candles_to_close:
-                    await self._close_and_save_candle(key)
-                
-                # Aguarda até o próximo minuto
-                next_minute = current_minute.replace(minute=current_minute.minute + 1)
-                wait_seconds = (next_minute - current_time).total_seconds()
-                
-                if wait_seconds > 0:
-                    await asyncio.sleep(wait_seconds)
-                    
+                now = time.time()
+                # Próxima virada de minuto já somada a carência
+                next_close = ((now - self.close_grace_sec) // 60 + 1) * 60 + self.close_grace_sec
+                await asyncio.sleep(max(0.0, next_close - now))
+
+                if self.close_expired(time.time()):
+                    self._flush_event.set()
+
             except asyncio.CancelledError:
                 break
             except Exception as e:
                 self.logger.error(f"Erro no loop de agregação: {e}")
                 await asyncio.sleep(1)
-                
+
+    async def _writer_loop(self):
+        """Grava os candles pendentes logo após o fechamento pelo relógio ou a cada flush_interval_sec."""
+        while self.is_running:
+            try:
+                try:
+                    await asyncio.wait_for(self._flush_event.wait(), timeout=self.flush_interval_sec)
+                except asyncio.TimeoutError:
+                    pass
+                self._flush_event.clear()
+                await self.flush()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                self.logger.error(f"Erro no writer de candles: {e}")
+                await asyncio.sleep(1)
+
     def get_current_candle(self, symbol: str, exchange: str) -> Optional[CandleData]:
         """Retorna o candle atual para um símbolo."""
         candle_key = f"{symbol}_{exchange}"
         return self.current_candles.get(candle_key)
-        
+
     def get_status(self) -> Dict:
         """Retorna status do agrupador."""
         return {
             'is_running': self.is_running,
             'active_candles_count': len(self.current_candles),
-            'active_symbols': list(self.current_candles.keys())
+            'active_symbols': list(self.current_candles.keys()),
+            'closed_in_memory': len(self.closed_candles),
+            'pending_writes': len(self.pending_writes),
+            'close_grace_sec': self.close_grace_sec,
+            **self.stats,
         }
 
 # Instância global do agrupador
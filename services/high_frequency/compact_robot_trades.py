@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Compactação de robot_trades
+===========================
+Ferramenta de uso único para remover as linhas duplicadas acumuladas em
+robot_trades enquanto cada ciclo de detecção regravava todo o histórico do
+padrão. Depois da limpeza cria a chave única usada pelo modo append-only
+(só na execução completa, sem --symbol), registra a migração 4 como aplicada
+(o boot do backend não a tenta de novo depois de uma falha) e preenche
+last_trade_ts/last_trade_id de cada padrão.
+
+Uso:
+    python services/high_frequency/compact_robot_trades.py [--dry-run] [--symbol PETR4] [--vacuum]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+
+# Corrige o event loop para Windows
+if sys.platform == "win32":
+    asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
+# Adiciona o diretório atual ao path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from config import DATABASE_URL
+from robot_persistence import ROBOT_TRADES_UNIQUE_INDEX_SQL
+
+# Mesma chave do índice único uq_robot_trades_link
+_LINK_KEY = "robot_pattern_id, side, timestamp, COALESCE(trade_id, -1), price, volume"
+
+# Migração da chave única em schema_migrations.MIGRATIONS
+_UNIQUE_KEY_MIGRATION = (4, "robot_trades_unique_key")
+
+
+async def compact_robot_trades(dry_run: bool, symbol: str | None, vacuum: bool):
+    import psycopg
+
+    print(f"🔗 Conectando ao banco: {DATABASE_URL.split('@')[1] if '@' in DATABASE_URL else 'localhost'}")
+
+    async with await psycopg.AsyncConnection.connect(DATABASE_URL) as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("ALTER TABLE robot_trades ADD COLUMN IF NOT EXISTS trade_id BIGINT")
+            await cur.execute("ALTER TABLE robot_patterns ADD COLUMN IF NOT EXISTS last_trade_ts TIMESTAMPTZ")
+            await cur.execute("ALTER TABLE robot_patterns ADD COLUMN IF NOT EXISTS last_trade_id BIGINT")
+            await conn.commit()
+
+            if symbol:
+                symbols = [symbol.upper()]
+            else:
+                await cur.execute("SELECT DISTINCT symbol FROM robot_trades ORDER BY symbol")
+                symbols = [row[0] for row in await cur.fetchall()]
+
+            print(f"📋 {len(symbols)} símbolos em robot_trades")
+            total_rows = 0
+            total_removed = 0
+
+            # Um símbolo por transação para não segurar locks na tabela inteira
+            for sym in symbols:
+                await cur.execute(f"""
+                    SELECT COUNT(*), COUNT(*) - COUNT(DISTINCT ({_LINK_KEY}))
+                      FROM robot_trades
+                     WHERE symbol = %s
+                """, (sym,))
+                rows, duplicates = await cur.fetchone()
+                total_rows += rows
+
+                if duplicates == 0:
+                    continue
+
+                if dry_run:
+                    print(f"   - {sym}: {duplicates:,} duplicatas de {rows:,} linhas")
+                    total_removed += duplicates
+                    continue
+
+                await cur.execute(f"""
+                    DELETE FROM robot_trades rt
+                     USING (
+                        SELECT id, ROW_NUMBER() OVER (PARTITION BY {_LINK_KEY} ORDER BY id) AS rn
+                          FROM robot_trades
+                         WHERE symbol = %s
+                     ) d
+                     WHERE rt.id = d.id AND d.rn > 1
+                """, (sym,))
+                removed = cur.rowcount
+                await conn.commit()
+                total_removed += removed
+                print(f"   🧹 {sym}: {removed:,} duplicatas removidas de {rows:,} linhas")
+
+            action = "seriam removidas" if dry_run else "removidas"
+            print(f"\n📊 {total_removed:,} de {total_rows:,} linhas {action}")
+
+            if dry_run:
+                print("ℹ️ Dry-run: nada foi alterado")
+                return
+
+            if symbol:
+                # Os outros símbolos podem ainda ter duplicatas: a chave falharia (ou travaria a tabela à toa)
+                print("⏭️ Chave única uq_robot_trades_link não criada: rode sem --symbol para criá-la")
+            else:
+                print("🔨 Criando chave única uq_robot_trades_link...")
+                await cur.execute(ROBOT_TRADES_UNIQUE_INDEX_SQL)
+                await cur.execute(
+                    "SELECT to_regclass('schema_version') IS NOT NULL, "
+                    "to_regclass('schema_version_skipped') IS NOT NULL"
+                )
+                has_versions, has_skipped = await cur.fetchone()
+                if has_versions:
+                    await cur.execute(
+                        "INSERT INTO schema_version (version, name) VALUES (%s, %s) ON CONFLICT (version) DO NOTHING",
+                        _UNIQUE_KEY_MIGRATION,
+                    )
+                if has_skipped:
+                    await cur.execute("DELETE FROM schema_version_skipped WHERE version = %s", (_UNIQUE_KEY_MIGRATION[0],))
+                await conn.commit()
+                print(f"   ✅ Migração {_UNIQUE_KEY_MIGRATION[0]} ({_UNIQUE_KEY_MIGRATION[1]}) registrada")
+
+            print("🔨 Preenchendo last_trade_ts/last_trade_id dos padrões...")
+            await cur.execute("""
+                UPDATE robot_patterns p
+                   SET last_trade_ts = m.timestamp,
+                       last_trade_id = m.trade_id
+                  FROM (
+                      SELECT DISTINCT ON (robot_pattern_id) robot_pattern_id, timestamp, trade_id
+                        FROM robot_trades
+                       ORDER BY robot_pattern_id, timestamp DESC, COALESCE(trade_id, -1) DESC
+                  ) m
+                 WHERE p.id = m.robot_pattern_id
+                   AND p.last_trade_ts IS NULL
+            """)
+            print(f"   ✅ {cur.rowcount:,} padrões atualizados")
+            await conn.commit()
+
+    if vacuum:
+        # VACUUM não roda dentro de transação
+        print("🧽 Executando VACUUM (ANALYZE) robot_trades...")
+        async with await psycopg.AsyncConnection.connect(DATABASE_URL, autocommit=True) as conn:
+            await conn.execute("VACUUM (ANALYZE) robot_trades")
+
+    print("\n🎉 Compactação de robot_trades concluída!")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Remove duplicatas de robot_trades e cria a chave única")
+    parser.add_argument("--dry-run", action="store_true", help="Apenas conta as duplicatas")
+    parser.add_argument("--symbol", help="Limita a um símbolo")
+    parser.add_argument("--vacuum", action="store_true", help="Executa VACUUM (ANALYZE) ao final")
+    args = parser.parse_args()
+    asyncio.run(compact_robot_trades(args.dry_run, args.symbol, args.vacuum))
@@ -14,9 +14,108 @@ FIREBASE_SERVICE_ACCOUNT_PATH = os.getenv("FIREBASE_SERVICE_ACCOUNT_PATH", "fire
 HF_BATCH_MS = int(os.getenv("HF_BATCH_MS", "100"))
 HF_BATCH_MAX = int(os.getenv("HF_BATCH_MAX", "1000"))
 
+# Modo de escrita em ticks_raw: "insert" (executemany) ou "copy" (COPY binário)
+HF_TICK_WRITER = os.getenv("HF_TICK_WRITER", "insert").lower()
+# Com COPY, passa por tabela temporária e ignora trade_id já gravados
+HF_TICK_DEDUP = os.getenv("HF_TICK_DEDUP", "0").lower() in ("1", "true", "yes")
+
 # Configurações de ingestão
 HF_INGEST_URL = os.getenv("HF_INGEST_URL", "http://127.0.0.1:8002/ingest/batch")
 
 # Configurações de Order Book
 ORDER_BOOK_TOP_LEVELS = int(os.getenv("ORDER_BOOK_TOP_LEVELS", "10"))
-ORDER_BOOK_SNAPSHOT_INTERVAL_MS = int(os.getenv("ORDER_BOOK_SNAPSHOT_INTERVAL_MS", "5000"))
\ No newline at end of file
+ORDER_BOOK_SNAPSHOT_INTERVAL_MS = int(os.getenv("ORDER_BOOK_SNAPSHOT_INTERVAL_MS", "5000"))
+
+# Detecção TWAP: "incremental" (acumuladores entre ciclos), "full" (recalcula o dia
+# inteiro a cada ciclo) ou "verify" (incremental + recálculo completo para comparação)
+TWAP_DETECTION_MODE = os.getenv("TWAP_DETECTION_MODE", "incremental").lower()
+# Folga da marca d'água incremental, para não perder ticks ainda em trânsito para o banco
+TWAP_SETTLE_SECONDS = float(os.getenv("TWAP_SETTLE_SECONDS", "5"))
+# Recálculo completo (modos "full"/"verify") em colunas NumPy; sem numpy usa o caminho em Python
+TWAP_VECTORIZED = os.getenv("TWAP_VECTORIZED", "1").lower() in ("1", "true", "yes")
+# Agendador da detecção TWAP (detection_scheduler.py): símbolo com ticks novos é analisado
+# no máximo a cada MIN e todo símbolo ao menos a cada MAX segundos
+TWAP_MIN_INTERVAL_SEC = float(os.getenv("TWAP_MIN_INTERVAL_SEC", "5"))
+TWAP_MAX_INTERVAL_SEC = float(os.getenv("TWAP_MAX_INTERVAL_SEC", "60"))
+# Análises de símbolos em paralelo (orçamento global de banco/CPU do detector)
+TWAP_MAX_CONCURRENCY = int(os.getenv("TWAP_MAX_CONCURRENCY", "5"))
+# Intervalo de atualização da lista de símbolos do pregão a partir do banco
+TWAP_SYMBOLS_REFRESH_SEC = float(os.getenv("TWAP_SYMBOLS_REFRESH_SEC", "60"))
+# Trades pendentes de vínculo em robot_trades por acumulador: acima de 2x o limite ficam só os
+# TWAP_PENDING_MAX mais recentes (agente ou cluster que nunca se qualifica não cresce sem fim)
+TWAP_PENDING_MAX = int(os.getenv("TWAP_PENDING_MAX", "5000"))
+# Processos da detecção incremental, cada um com um shard de símbolos (detection_workers.py);
+# 0 = no event loop do backend
+TWAP_WORKERS = int(os.getenv("TWAP_WORKERS", "0"))
+# Snapshot do estado do detector (twap_snapshot.py) para restart a quente; vazio desliga
+TWAP_SNAPSHOT_PATH = os.getenv("TWAP_SNAPSHOT_PATH", "")
+# Intervalo mínimo entre snapshots
+TWAP_SNAPSHOT_SEC = float(os.getenv("TWAP_SNAPSHOT_SEC", "60"))
+
+# Pool de conexões compartilhado (ingestão, detector TWAP e RobotPersistence)
+HF_DB_POOL_MIN = int(os.getenv("HF_DB_POOL_MIN", "5"))
+HF_DB_POOL_MAX = int(os.getenv("HF_DB_POOL_MAX", "20"))
+# Tempo máximo aguardando uma conexão livre antes de PoolTimeout
+HF_DB_POOL_TIMEOUT_SEC = float(os.getenv("HF_DB_POOL_TIMEOUT_SEC", "30"))
+# Conexões ociosas acima de min_size são fechadas após este tempo
+HF_DB_POOL_MAX_IDLE_SEC = float(os.getenv("HF_DB_POOL_MAX_IDLE_SEC", "600"))
+# Execuções de uma mesma query antes de o psycopg prepará-la no servidor (0 = sempre)
+HF_DB_PREPARE_THRESHOLD = int(os.getenv("HF_DB_PREPARE_THRESHOLD", "2"))
+
+# Gravação em lote do livro de ofertas (eventos, snapshots e ofertas)
+HF_BOOK_BATCH_MAX = int(os.getenv("HF_BOOK_BATCH_MAX", "2000"))
+HF_BOOK_BATCH_MS = int(os.getenv("HF_BOOK_BATCH_MS", "200"))
+# Itens somados nas três filas a partir dos quais snapshots passam a ser descartados;
+# acima do dobro, eventos e ofertas mais antigos também são descartados
+HF_BOOK_QUEUE_HIGH_WATER = int(os.getenv("HF_BOOK_QUEUE_HIGH_WATER", "50000"))
+
+# Armazém de ticks intradiário em memória (NumPy), consultado antes do ticks_raw
+HF_TICK_STORE_ENABLED = os.getenv("HF_TICK_STORE_ENABLED", "1").lower() in ("1", "true", "yes")
+HF_TICK_STORE_MAX_MB = float(os.getenv("HF_TICK_STORE_MAX_MB", "1024"))
+# Linhas alocadas na criação de uma sessão; ao encher a capacidade dobra
+HF_TICK_STORE_CHUNK = int(os.getenv("HF_TICK_STORE_CHUNK", "65536"))
+
+# Transporte IPC dos feeds (services/shared/ipc_transport): "tcp://127.0.0.1:8003" ou
+# "unix:///tmp/hf_ingest.sock"; vazio desliga e os feeds seguem só por HTTP
+HF_IPC_LISTEN = os.getenv("HF_IPC_LISTEN", "")
+
+# Journal em disco do buffer de ticks (tick_journal): diretório dos segmentos; vazio desliga
+HF_JOURNAL_DIR = os.getenv("HF_JOURNAL_DIR", "")
+# Intervalo do fsync: janela máxima de perda numa queda do processo
+HF_JOURNAL_FSYNC_MS = int(os.getenv("HF_JOURNAL_FSYNC_MS", "50"))
+HF_JOURNAL_SEGMENT_MB = float(os.getenv("HF_JOURNAL_SEGMENT_MB", "64"))
+# Cota em disco; acima dela os ticks novos seguem só pela memória
+HF_JOURNAL_MAX_MB = float(os.getenv("HF_JOURNAL_MAX_MB", "4096"))
+# Ticks por lote ao regravar segmentos do journal no banco
+HF_JOURNAL_REPLAY_BATCH = int(os.getenv("HF_JOURNAL_REPLAY_BATCH", "5000"))
+# Ticks acima deste total em memória ficam só no journal e são regravados pelo replay;
+# sem journal (ou com ele acima da cota) são descartados e contados em dropped_ticks
+HF_BUFFER_MAX_TICKS = int(os.getenv("HF_BUFFER_MAX_TICKS", "500000"))
+
+# Agrupador de candles de 1m: fechamento pelo relógio na virada do minuto + carência
+HF_CANDLE_CLOSE_GRACE_MS = int(os.getenv("HF_CANDLE_CLOSE_GRACE_MS", "2000"))
+# Intervalo máximo entre upserts em lote dos candles fechados/corrigidos
+HF_CANDLE_FLUSH_MS = int(os.getenv("HF_CANDLE_FLUSH_MS", "1000"))
+# Minutos em que candles fechados ficam em memória para correção por ticks atrasados
+HF_CANDLE_LATE_MINUTES = int(os.getenv("HF_CANDLE_LATE_MINUTES", "15"))
+
+# Rollup de candles 1s..1h (services/shared/candle_rollup); o 1m vem do CandleAggregator
+HF_ROLLUP_FLUSH_MS = int(os.getenv("HF_ROLLUP_FLUSH_MS", "1000"))
+# Barras mantidas em memória por símbolo e timeframe (consultas de /ticks sem ir ao banco)
+HF_ROLLUP_RETAIN_BARS = int(os.getenv("HF_ROLLUP_RETAIN_BARS", "2000"))
+# Timeframes gravados nas tabelas candles_<tf>; vazio = só memória
+HF_ROLLUP_PERSIST = [tf.strip() for tf in os.getenv("HF_ROLLUP_PERSIST", "1s,5s,15s,5m,15m,1h").split(",") if tf.strip()]
+
+# Políticas do TimescaleDB aplicadas no startup (timescale_policies.py): agregados contínuos, compressão e retenção
+HF_DB_POLICIES = os.getenv("HF_DB_POLICIES", "1").lower() in ("1", "true", "yes")
+# Chunks de ticks_raw mais antigos que isso são comprimidos, segmentados por símbolo (0 = sem compressão)
+HF_TICKS_COMPRESS_AFTER_DAYS = int(os.getenv("HF_TICKS_COMPRESS_AFTER_DAYS", "7"))
+# Livro de ofertas: compressão e retenção em dias (0 = desligado)
+HF_ORDER_BOOK_COMPRESS_AFTER_DAYS = int(os.getenv("HF_ORDER_BOOK_COMPRESS_AFTER_DAYS", "2"))
+HF_ORDER_BOOK_RETENTION_DAYS = int(os.getenv("HF_ORDER_BOOK_RETENTION_DAYS", "30"))
+
+# Latência por símbolo em /metrics (tick_latency): limites superiores dos buckets dos histogramas, em ms
+HF_LATENCY_BUCKETS_MS = [
+    float(b) for b in os.getenv("HF_LATENCY_BUCKETS_MS", "1,2,5,10,25,50,100,250,500,1000,2500,5000,10000,30000,60000").split(",")
+    if b.strip()
+]
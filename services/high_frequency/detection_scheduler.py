@@ -0,0 +1,260 @@
+"""
+Agendador adaptativo da detecção TWAP por símbolo
+=================================================
+Em vez de analisar todos os símbolos a cada 60s, cada símbolo entra na fila
+conforme a quantidade de ticks novos recebidos desde a última análise:
+
+- um símbolo com ticks prontos (mais velhos que a folga TWAP_SETTLE_SECONDS,
+  que o incremental já consegue ler) é analisado no máximo a cada
+  TWAP_MIN_INTERVAL_SEC, com prioridade para quem acumulou mais ticks;
+- todo símbolo é reanalisado ao menos a cada TWAP_MAX_INTERVAL_SEC, mesmo
+  sem ticks (o status ativo/inativo depende da recência);
+- no máximo TWAP_MAX_CONCURRENCY análises rodam ao mesmo tempo, e um símbolo
+  nunca é analisado duas vezes em paralelo.
+
+Os ticks são contados na ingestão (buffer.add_tick_to_buffer) em baldes de
+1s do relógio monotônico; a lista de símbolos do pregão vem do banco a cada
+TWAP_SYMBOLS_REFRESH_SEC.
+"""
+
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional
+
+from services.high_frequency.config import (
+    TWAP_MIN_INTERVAL_SEC, TWAP_MAX_INTERVAL_SEC, TWAP_MAX_CONCURRENCY,
+    TWAP_SYMBOLS_REFRESH_SEC, TWAP_SETTLE_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class SymbolSchedule:
+    """Ticks pendentes e tempos de análise de um símbolo"""
+
+    __slots__ = ("arrivals", "pending", "last_end", "last_duration_ms", "avg_duration_ms",
+                 "runs", "running")
+
+    def __init__(self):
+        # [segundo monotônico, ticks recebidos nesse segundo], do mais antigo ao mais novo
+        self.arrivals: Deque[List[int]] = deque()
+        self.pending = 0
+        self.last_end: Optional[float] = None
+        self.last_duration_ms = 0.0
+        self.avg_duration_ms = 0.0
+        self.runs = 0
+        self.running = False
+
+    def ready(self, cutoff: int) -> int:
+        """Ticks pendentes chegados até o segundo cutoff"""
+        total = 0
+        for second, count in self.arrivals:
+            if second > cutoff:
+                break
+            total += count
+        return total
+
+    def consume(self, cutoff: int) -> int:
+        consumed = 0
+        while self.arrivals and self.arrivals[0][0] <= cutoff:
+            consumed += self.arrivals.popleft()[1]
+        self.pending -= consumed
+        return consumed
+
+
+class DetectionScheduler:
+    """Decide quando cada símbolo é analisado pelo TWAPDetector."""
+
+    def __init__(
+        self,
+        min_interval_sec: float = TWAP_MIN_INTERVAL_SEC,
+        max_interval_sec: float = TWAP_MAX_INTERVAL_SEC,
+        max_concurrency: int = TWAP_MAX_CONCURRENCY,
+        settle_sec: float = TWAP_SETTLE_SECONDS,
+        symbols_refresh_sec: float = TWAP_SYMBOLS_REFRESH_SEC,
+        analysis_timeout_sec: float = 90.0,
+        poll_sec: float = 0.25,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.min_interval_sec = min_interval_sec
+        self.max_interval_sec = max(max_interval_sec, min_interval_sec)
+        self.max_concurrency = max(1, max_concurrency)
+        self.settle_sec = settle_sec
+        self.symbols_refresh_sec = symbols_refresh_sec
+        self.analysis_timeout_sec = analysis_timeout_sec
+        self.poll_sec = poll_sec
+        self.clock = clock
+        self.schedules: Dict[str, SymbolSchedule] = {}
+        self.in_flight = 0
+        self.is_running = False
+        self.loop_task: Optional[asyncio.Task] = None
+        self._tasks = set()
+        self.stats = {
+            'runs': 0,
+            'timeouts': 0,
+            'errors': 0,
+            'ticks_scheduled': 0,
+            'symbol_refreshes': 0,
+        }
+
+    def _schedule(self, symbol: str) -> SymbolSchedule:
+        schedule = self.schedules.get(symbol)
+        if schedule is None:
+            schedule = self.schedules[symbol] = SymbolSchedule()
+        return schedule
+
+    def record_tick(self, symbol: str, count: int = 1) -> None:
+        """Conta ticks novos do símbolo (chamado na ingestão, O(1))"""
+        schedule = self._schedule(symbol)
+        second = int(self.clock())
+        if schedule.arrivals and schedule.arrivals[-1][0] == second:
+            schedule.arrivals[-1][1] += count
+        else:
+            schedule.arrivals.append([second, count])
+        schedule.pending += count
+
+    def set_symbols(self, symbols: List[str]) -> None:
+        """Símbolos do pregão; os que saíram da lista sem ticks pendentes são esquecidos"""
+        active = set(symbols)
+        for symbol in symbols:
+            self._schedule(symbol)
+        for symbol in [s for s, sch in self.schedules.items()
+                       if s not in active and not sch.pending and not sch.running]:
+            del self.schedules[symbol]
+
+    def _ready_cutoff(self, now: float) -> int:
+        # Ticks chegados até aqui já passaram da folga e entram na próxima análise
+        return int(now - self.settle_sec) - 1
+
+    def due_symbols(self, now: Optional[float] = None) -> List[str]:
+        """Símbolos elegíveis, na ordem de prioridade: atrasados além do intervalo
+        máximo primeiro (o mais atrasado antes), depois por ticks prontos"""
+        now = self.clock() if now is None else now
+        cutoff = self._ready_cutoff(now)
+        ranked = []
+        for symbol, schedule in self.schedules.items():
+            if schedule.running:
+                continue
+            elapsed = math.inf if schedule.last_end is None else now - schedule.last_end
+            if elapsed >= self.max_interval_sec:
+                ranked.append((0, -elapsed, 0, symbol))
+            elif elapsed >= self.min_interval_sec:
+                ready = schedule.ready(cutoff)
+                if ready:
+                    ranked.append((1, -ready, -elapsed, symbol))
+        ranked.sort()
+        return [entry[-1] for entry in ranked]
+
+    def start(
+        self,
+        analyze: Callable[[str], Awaitable],
+        list_symbols: Callable[[], Awaitable[List[str]]],
+    ):
+        """Inicia o loop do agendador."""
+        if self.is_running:
+            return
+        self.is_running = True
+        self.loop_task = asyncio.create_task(self._loop(analyze, list_symbols))
+        logger.info(
+            f"🗓️ Agendador TWAP iniciado (intervalo {self.min_interval_sec:g}-{self.max_interval_sec:g}s, "
+            f"{self.max_concurrency} análises simultâneas)"
+        )
+
+    def stop(self):
+        """Para o loop; análises em andamento são canceladas."""
+        if not self.is_running:
+            return
+        self.is_running = False
+        if self.loop_task:
+            self.loop_task.cancel()
+        for task in list(self._tasks):
+            task.cancel()
+        logger.info("🗓️ Agendador TWAP parado")
+
+    async def _loop(self, analyze, list_symbols):
+        last_refresh = -math.inf
+        while self.is_running:
+            try:
+                now = self.clock()
+                if now - last_refresh >= self.symbols_refresh_sec:
+                    last_refresh = now
+                    self.set_symbols(await list_symbols())
+                    self.stats['symbol_refreshes'] += 1
+
+                free = self.max_concurrency - self.in_flight
+                if free > 0:
+                    for symbol in self.due_symbols(now)[:free]:
+                        self._dispatch(symbol, analyze, now)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Erro no agendador TWAP: {e}")
+            await asyncio.sleep(self.poll_sec)
+
+    def _dispatch(self, symbol: str, analyze, now: float) -> None:
+        schedule = self.schedules[symbol]
+        schedule.running = True
+        self.in_flight += 1
+        self.stats['ticks_scheduled'] += schedule.consume(self._ready_cutoff(now))
+        task = asyncio.create_task(self._analyze(symbol, schedule, analyze))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _analyze(self, symbol: str, schedule: SymbolSchedule, analyze) -> None:
+        start = self.clock()
+        try:
+            await asyncio.wait_for(analyze(symbol), timeout=self.analysis_timeout_sec)
+        except asyncio.TimeoutError:
+            self.stats['timeouts'] += 1
+            logger.warning(f"⏱️ Tempo esgotado analisando {symbol}, pulando.")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.stats['errors'] += 1
+            logger.error(f"Erro ao analisar símbolo {symbol}: {e}")
+        finally:
+            end = self.clock()
+            duration_ms = (end - start) * 1000
+            schedule.last_end = end
+            schedule.last_duration_ms = duration_ms
+            schedule.avg_duration_ms = (
+                duration_ms if schedule.runs == 0 else 0.8 * schedule.avg_duration_ms + 0.2 * duration_ms
+            )
+            schedule.runs += 1
+            schedule.running = False
+            self.in_flight -= 1
+            self.stats['runs'] += 1
+
+    def get_status(self) -> Dict:
+        """Retorna status do agendador, com duração e defasagem por símbolo."""
+        now = self.clock()
+        symbols = {}
+        for symbol, schedule in sorted(self.schedules.items()):
+            symbols[symbol] = {
+                'pending_ticks': schedule.pending,
+                # Idade do tick mais antigo ainda não analisado
+                'staleness_sec': round(now - schedule.arrivals[0][0], 1) if schedule.arrivals else 0.0,
+                'last_run_age_sec': round(now - schedule.last_end, 1) if schedule.last_end is not None else None,
+                'last_duration_ms': round(schedule.last_duration_ms, 2),
+                'avg_duration_ms': round(schedule.avg_duration_ms, 2),
+                'runs': schedule.runs,
+                'running': schedule.running,
+            }
+        return {
+            'is_running': self.is_running,
+            'min_interval_sec': self.min_interval_sec,
+            'max_interval_sec': self.max_interval_sec,
+            'max_concurrency': self.max_concurrency,
+            'in_flight': self.in_flight,
+            'due': len(self.due_symbols(now)),
+            'max_staleness_sec': max((s['staleness_sec'] for s in symbols.values()), default=0.0),
+            **self.stats,
+            'symbols': symbols,
+        }
+
+
+# Instância global do agendador
+detection_scheduler = DetectionScheduler()
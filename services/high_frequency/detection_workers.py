@@ -0,0 +1,285 @@
+"""
+Detecção TWAP incremental em processos por shard de símbolos
+============================================================
+Com TWAP_WORKERS > 0 a parte de CPU da detecção sai do event loop da
+ingestão/WebSocket/HTTP: cada shard de símbolos (crc32(símbolo) % workers)
+tem um processo dedicado que mantém os SymbolTWAPState dos seus símbolos.
+
+Por análise, este processo:
+  1. busca os ticks novos [marca d'água, agora - folga) como colunas NumPy
+     (tick_store.query_columns, ou ticks_raw convertido por columns_from_rows);
+  2. envia as colunas ao worker do shard, que alimenta os acumuladores e
+     devolve os PatternDelta do ciclo (padrões alterados + trades pendentes);
+  3. grava os deltas (TWAPDetector._persist_deltas) e, na próxima análise do
+     símbolo, avisa o worker quais pendentes já foram gravados (acks).
+
+Cada shard é um ProcessPoolExecutor de um processo só, então as chamadas de um
+mesmo shard rodam em ordem. Se o processo de um shard morre, os símbolos dele
+voltam a ser lidos desde o início do dia; o mesmo vale para um símbolo com
+ticks gravados atrás da marca d'água (rewind), cujo estado o worker descarta
+na análise seguinte.
+"""
+
+import asyncio
+import logging
+import time as time_module
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, datetime, time, timedelta, timezone
+from multiprocessing import get_context
+from typing import Dict, List, Optional, Set, Tuple
+
+# Corrige imports para funcionar como módulo standalone
+try:
+    from .incremental_twap import PatternDelta, SymbolTWAPState
+    from .tick_store import TickColumns, columns_from_rows, rows_from_columns
+except ImportError:
+    from incremental_twap import PatternDelta, SymbolTWAPState
+    from tick_store import TickColumns, columns_from_rows, rows_from_columns
+
+logger = logging.getLogger(__name__)
+
+Ack = Tuple[str, int, Optional[tuple]]
+
+# ---------------------------------------------------------------------------
+# Lado do worker (roda no processo do shard)
+# ---------------------------------------------------------------------------
+
+_detector = None
+
+
+def _init_worker(config) -> None:
+    """Cria o TWAPDetector do processo; só os acumuladores e o cálculo são usados"""
+    global _detector
+    try:
+        from .robot_detector import TWAPDetector
+        from .robot_persistence import RobotPersistence
+    except ImportError:
+        from robot_detector import TWAPDetector
+        from robot_persistence import RobotPersistence
+    _detector = TWAPDetector(config=config, persistence=RobotPersistence(), mode="incremental")
+
+
+def _worker_analyze(
+    symbol: str,
+    day: date,
+    upper: datetime,
+    batch: Optional[TickColumns],
+    acks: List[Ack],
+    now: datetime,
+    reset: bool = False,
+) -> Tuple[List[PatternDelta], Dict]:
+    start = time_module.perf_counter()
+    detector = _detector
+    # Gate de recência no mesmo instante do corte calculado no backend
+    detector.clock = lambda: now
+    if reset:
+        # Os acks eram do estado descartado
+        detector.incremental_states.pop(symbol, None)
+        acks = []
+    state = detector._incremental_state(symbol, datetime.combine(day, time.min, tzinfo=timezone.utc))
+    for kind, agent_id, key in acks:
+        state.take_pending(kind, agent_id, key)
+
+    state.last_batch_size = 0
+    if batch is not None:
+        cols, exchange_names = batch
+        detector._consume_ticks(state, rows_from_columns(symbol, cols, exchange_names), upper)
+    deltas = detector._incremental_deltas(symbol, state) if state.agents else []
+    return deltas, {
+        "agents": len(state.agents),
+        "ticks_consumed": state.ticks_consumed,
+        "new_ticks": state.last_batch_size,
+        "cpu_ms": (time_module.perf_counter() - start) * 1000,
+    }
+
+
+def _worker_import(states: Dict[str, SymbolTWAPState]) -> int:
+    _detector.incremental_states.update(states)
+    return len(states)
+
+
+def _worker_export(acks: Dict[str, List[Ack]]) -> Dict[str, SymbolTWAPState]:
+    for symbol, symbol_acks in acks.items():
+        state = _detector.incremental_states.get(symbol)
+        if state is not None:
+            for kind, agent_id, key in symbol_acks:
+                state.take_pending(kind, agent_id, key)
+    return dict(_detector.incremental_states)
+
+
+# ---------------------------------------------------------------------------
+# Lado do backend
+# ---------------------------------------------------------------------------
+
+class ShardedDetection:
+    """Distribui a detecção incremental do TWAPDetector entre processos por shard."""
+
+    def __init__(self, detector, workers: int):
+        self.detector = detector
+        self.workers = workers
+        # spawn: o processo do backend tem event loop e threads, fork não é seguro
+        self._context = get_context("spawn")
+        self.executors = [self._new_executor() for _ in range(workers)]
+        # Marca d'água por símbolo (os acumuladores ficam no worker do shard)
+        self.watermarks: Dict[str, datetime] = {}
+        # Pendentes já gravados, repassados ao worker na próxima análise do símbolo
+        self.acks: Dict[str, List[Ack]] = {}
+        # Símbolos cujo estado no worker deve ser descartado na próxima análise (rewind)
+        self.resets: Set[str] = set()
+        self.symbol_info: Dict[str, Dict] = {}
+        self.shard_stats = [
+            {"runs": 0, "ticks": 0, "cpu_ms": 0.0, "last_cpu_ms": 0.0, "restarts": 0}
+            for _ in range(workers)
+        ]
+        logger.info(f"🧮 Detecção TWAP em {workers} processos (shards por símbolo)")
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=1,
+            mp_context=self._context,
+            initializer=_init_worker,
+            initargs=(self.detector.config,),
+        )
+
+    def shard_of(self, symbol: str) -> int:
+        # crc32 é estável entre processos e execuções (hash() de str não é)
+        return zlib.crc32(symbol.encode()) % self.workers
+
+    def _restart_shard(self, shard: int) -> None:
+        logger.error(f"❌ Worker de detecção do shard {shard} caiu; símbolos do shard serão relidos desde o início do dia")
+        self.executors[shard].shutdown(wait=False, cancel_futures=True)
+        self.executors[shard] = self._new_executor()
+        self.shard_stats[shard]["restarts"] += 1
+        for symbol in [s for s in self.watermarks if self.shard_of(s) == shard]:
+            self.watermarks.pop(symbol, None)
+            self.acks.pop(symbol, None)
+            self.resets.discard(symbol)
+            self.symbol_info.pop(symbol, None)
+
+    def rewind(self, symbol: str, oldest: datetime) -> bool:
+        """Ticks de `symbol` desde `oldest` gravados atrás da marca d'água: a próxima
+        análise relê o dia inteiro e o worker descarta o estado antigo"""
+        watermark = self.watermarks.get(symbol)
+        if watermark is None or oldest >= watermark:
+            return False
+        self.watermarks.pop(symbol, None)
+        self.acks.pop(symbol, None)
+        self.resets.add(symbol)
+        return True
+
+    async def _fetch_columns(self, symbol: str, start: datetime, end: datetime) -> Optional[TickColumns]:
+        """Ticks em [start, end) como colunas: armazém em memória primeiro, banco se não coberto"""
+        columns = self.detector.tick_store.query_columns(symbol, start, end)
+        if columns is not None:
+            return columns
+        rows = await self.detector.persistence.get_ticks_between(symbol, start, end)
+        if rows is None:
+            return None
+        return columns_from_rows(rows)
+
+    async def analyze_symbol(self, symbol: str):
+        """Equivalente a TWAPDetector._analyze_symbol_incremental com o estado no worker"""
+        try:
+            now_utc = self.detector.clock()
+            start_of_day = datetime.combine(now_utc.date(), time.min, tzinfo=timezone.utc)
+            watermark = self.watermarks.get(symbol)
+            if watermark is None or watermark < start_of_day:
+                watermark = start_of_day
+
+            upper = max(now_utc - timedelta(seconds=self.detector.settle_seconds), watermark)
+            batch = None
+            if upper > watermark:
+                batch = await self._fetch_columns(symbol, watermark, upper)
+                if batch is None:
+                    logger.warning(f"⚠️ Falha ao buscar ticks novos de {symbol}; marca d'água mantida em {watermark.isoformat()}")
+                    upper = watermark
+            return await self.analyze_batch(symbol, start_of_day.date(), batch, upper, now_utc)
+        except Exception as e:
+            logger.error(f"Erro ao analisar {symbol} (incremental, worker): {e}")
+            return []
+
+    async def analyze_batch(self, symbol: str, day: date, batch: Optional[TickColumns], upper: datetime,
+                            now: Optional[datetime] = None):
+        """Envia os ticks [marca d'água, upper) ao worker do shard e grava os deltas"""
+        if now is None:
+            now = self.detector.clock()
+        shard = self.shard_of(symbol)
+        acks = self.acks.pop(symbol, [])
+        reset = symbol in self.resets
+        self.resets.discard(symbol)
+        loop = asyncio.get_running_loop()
+        try:
+            deltas, info = await loop.run_in_executor(
+                self.executors[shard], _worker_analyze, symbol, day, upper, batch, acks, now, reset
+            )
+        except BrokenProcessPool:
+            self._restart_shard(shard)
+            return []
+
+        if symbol not in self.resets:
+            # Com rewind durante a análise a marca d'água continua removida
+            self.watermarks[symbol] = upper
+        self.symbol_info[symbol] = info
+        stats = self.shard_stats[shard]
+        stats["runs"] += 1
+        stats["ticks"] += info["new_ticks"]
+        stats["cpu_ms"] += info["cpu_ms"]
+        stats["last_cpu_ms"] = round(info["cpu_ms"], 2)
+        if not info["agents"]:
+            return []
+
+        saved: List[Ack] = []
+        patterns = await self.detector._persist_deltas(
+            symbol, deltas, lambda delta: saved.append((delta.kind, delta.agent_id, delta.key))
+        )
+        if saved:
+            self.acks.setdefault(symbol, []).extend(saved)
+        return patterns
+
+    def import_states(self, states: Dict[str, SymbolTWAPState]) -> None:
+        """Repassa estados já carregados (snapshot) aos shards; as chamadas de um
+        shard rodam em ordem, então chegam antes da primeira análise"""
+        by_shard: Dict[int, Dict[str, SymbolTWAPState]] = {}
+        for symbol, state in states.items():
+            by_shard.setdefault(self.shard_of(symbol), {})[symbol] = state
+            self.watermarks[symbol] = state.watermark
+        for shard, shard_states in by_shard.items():
+            self.executors[shard].submit(_worker_import, shard_states)
+
+    async def export_states(self) -> Dict[str, SymbolTWAPState]:
+        """Estados de todos os shards (para o snapshot), já sem os pendentes gravados"""
+        loop = asyncio.get_running_loop()
+        calls = []
+        for shard, executor in enumerate(self.executors):
+            acks = {s: self.acks.pop(s) for s in [s for s in self.acks if self.shard_of(s) == shard]}
+            calls.append(loop.run_in_executor(executor, _worker_export, acks))
+        states: Dict[str, SymbolTWAPState] = {}
+        for result in await asyncio.gather(*calls, return_exceptions=True):
+            if isinstance(result, Exception):
+                logger.error(f"❌ Erro ao exportar estado de um worker de detecção: {result}")
+                continue
+            states.update(result)
+        return states
+
+    def close(self) -> None:
+        for executor in self.executors:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def get_status(self) -> Dict:
+        info = self.symbol_info.values()
+        return {
+            "symbols_tracked": len(self.watermarks),
+            "agents_tracked": sum(i["agents"] for i in info),
+            "ticks_consumed": sum(i["ticks_consumed"] for i in info),
+            "last_cycle_new_ticks": sum(i["new_ticks"] for i in info),
+            "workers": [
+                {
+                    "shard": shard,
+                    "symbols": sum(1 for s in self.watermarks if self.shard_of(s) == shard),
+                    **{k: round(v, 2) if isinstance(v, float) else v for k, v in stats.items()},
+                }
+                for shard, stats in enumerate(self.shard_stats)
+            ],
+        }
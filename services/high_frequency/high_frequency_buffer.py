@@ -13,6 +13,8 @@ from dataclasses import dataclass, field
 from typing import Dict, List, Optional, Callable
 import logging
 
+from services.shared.candle_rollup import RollupEngine
+
 @dataclass
 class Tick:
 	"""Representa um tick individual com metadados."""
@@ -64,8 +66,8 @@ class HighFrequencyBuffer:
 			lambda: deque(maxlen=max_ticks_per_symbol)
 		)
 		
-		# Candles em tempo real
-		self.realtime_candles: Dict[str, Dict[str, Candle]] = defaultdict(dict)
+		# Candles em tempo real: o tick só atualiza a barra de 1s; 5s..1h derivam das barras fechadas
+		self.rollup = RollupEngine()
 		
 		# Métricas de performance
 		self.metrics = {
@@ -139,61 +141,9 @@ class HighFrequencyBuffer:
 			return False
 	
 	def _update_realtime_candle(self, tick: Tick):
-		"""Atualiza candles em tempo real para múltiplos timeframes."""
-		timeframes = ['1s', '5s', '15s', '1m', '5m', '15m', '1h']
-		
-		for timeframe in timeframes:
-			candle_key = f"{tick.symbol}_{timeframe}"
-			
-			# Calcula bucket de tempo
-			bucket_time = self._get_time_bucket(tick.timestamp, timeframe)
-			
-			with self._candle_lock:
-				if candle_key not in self.realtime_candles[tick.symbol]:
-					# Cria novo candle
-					self.realtime_candles[tick.symbol][candle_key] = Candle(
-						symbol=tick.symbol,
-						exchange=tick.exchange,
-						timeframe=timeframe,
-						open_time=bucket_time,
-						close_time=bucket_time + self._get_timeframe_seconds(timeframe),
-						open_price=tick.price,
-						high_price=tick.price,
-						low_price=tick.price,
-						close_price=tick.price,
-						total_volume=tick.volume,
-						total_volume_financial=tick.price * tick.volume,
-						tick_count=1
-					)
-				else:
-					# Atualiza candle existente
-					candle = self.realtime_candles[tick.symbol][candle_key]
-					
-					# Verifica se ainda está no mesmo bucket
-					if tick.timestamp < candle.close_time:
-						candle.high_price = max(candle.high_price, tick.price)
-						candle.low_price = min(candle.low_price, tick.price)
-						candle.close_price = tick.price
-						candle.total_volume += tick.volume
-						candle.total_volume_financial += tick.price * tick.volume
-						candle.tick_count += 1
-						candle.last_update = time.time()
-					else:
-						# Cria novo candle para o próximo bucket
-						self.realtime_candles[tick.symbol][candle_key] = Candle(
-							symbol=tick.symbol,
-							exchange=tick.exchange,
-							timeframe=timeframe,
-							open_time=bucket_time,
-							close_time=bucket_time + self._get_timeframe_seconds(timeframe),
-							open_price=tick.price,
-							high_price=tick.price,
-							low_price=tick.price,
-							close_price=tick.price,
-							total_volume=tick.volume,
-							total_volume_financial=tick.price * tick.volume,
-							tick_count=1
-						)
+		"""Atualiza a barra de 1s; os timeframes maiores são recalculados a partir das filhas fechadas."""
+		with self._candle_lock:
+			self.rollup.record_tick(tick.symbol, tick.exchange, tick.price, tick.volume, tick.timestamp)
 	
 	def _get_time_bucket(self, timestamp: float, timeframe: str) -> float:
 		"""Calcula o bucket de tempo para um timestamp e timeframe."""
@@ -215,8 +165,26 @@ class HighFrequencyBuffer:
 	
 	def get_realtime_candle(self, symbol: str, timeframe: str) -> Optional[Candle]:
 		"""Retorna o candle em tempo real para um símbolo e timeframe."""
-		candle_key = f"{symbol}_{timeframe}"
-		return self.realtime_candles.get(symbol, {}).get(candle_key)
+		if self.rollup.level_of(timeframe) is None:
+			return None
+		with self._candle_lock:
+			bar = self.rollup.live_bar(symbol, timeframe)
+		if bar is None:
+			return None
+		return Candle(
+			symbol=symbol,
+			exchange=bar.exchange,
+			timeframe=timeframe,
+			open_time=bar.bucket,
+			close_time=bar.bucket + self._get_timeframe_seconds(timeframe),
+			open_price=bar.open,
+			high_price=bar.high,
+			low_price=bar.low,
+			close_price=bar.close,
+			total_volume=bar.volume,
+			total_volume_financial=bar.volume_financial,
+			tick_count=bar.tick_count
+		)
 	
 	def get_ticks_window(self, symbol: str, start_time: float, end_time: float, limit: int = 10000) -> List[Tick]:
 		"""Retorna ticks em uma janela de tempo específica."""
@@ -0,0 +1,320 @@
+"""
+Estado incremental da detecção TWAP
+===================================
+Acumuladores por (símbolo, agente, assinatura) mantidos entre os ciclos do
+TWAPDetector. Cada ciclo consome apenas os ticks mais novos que a marca
+d'água do símbolo, de modo que o custo é O(ticks novos) e não O(ticks do dia).
+
+Os acumuladores assumem que os trades chegam em ordem cronológica, o que é
+garantido pela consulta ORDER BY timestamp e pela marca d'água com folga
+(ver TWAP_SETTLE_SECONDS).
+
+Os trades pendentes de vínculo em robot_trades são limitados por
+TWAP_PENDING_MAX: um agente ou cluster que nunca se qualifica guarda só os
+mais recentes, e os antigos deixam de ser vinculados quando ele se qualificar.
+"""
+
+import math
+from datetime import date, datetime
+from typing import Dict, List, Optional, Tuple
+
+# Corrige imports para funcionar como módulo standalone
+try:
+    from .robot_models import TickData, TradeType, RobotStatus
+    from .config import TWAP_PENDING_MAX
+except ImportError:
+    from robot_models import TickData, TradeType, RobotStatus
+    from config import TWAP_PENDING_MAX
+
+
+def _trim_pending(pending: List[TickData]) -> bool:
+    """Acima de 2x TWAP_PENDING_MAX descarta os pendentes mais antigos (custo amortizado O(1))"""
+    if TWAP_PENDING_MAX <= 0 or len(pending) < 2 * TWAP_PENDING_MAX:
+        return False
+    del pending[:len(pending) - TWAP_PENDING_MAX]
+    return True
+
+
+def _is_aggressor(trade: TickData) -> bool:
+    return (
+        (trade.trade_type == TradeType.BUY and trade.raw_trade_type == 2) or
+        (trade.trade_type == TradeType.SELL and trade.raw_trade_type == 3)
+    )
+
+
+class TradeAccumulator:
+    """Estatísticas de uma sequência cronológica de trades (agente ou cluster).
+
+    Mantém apenas somatórios, extremos e o último preço, que é tudo o que
+    `_analyze_agent_trades` precisa para montar o TWAPPattern.
+    """
+
+    __slots__ = (
+        "count", "volume_sum", "buy_volume", "sell_volume", "buy_count", "sell_count",
+        "first_ts", "last_ts", "first_price", "last_price", "min_price", "max_price",
+        "exchange", "first_direction", "aggression_sum", "aggression_count",
+        "pending", "dirty", "last_status",
+    )
+
+    def __init__(self):
+        self.count = 0
+        self.volume_sum = 0
+        self.buy_volume = 0
+        self.sell_volume = 0
+        self.buy_count = 0
+        self.sell_count = 0
+        self.first_ts: Optional[datetime] = None
+        self.last_ts: Optional[datetime] = None
+        self.first_price = 0.0
+        self.last_price = 0.0
+        self.min_price = 0.0
+        self.max_price = 0.0
+        self.exchange: Optional[str] = None
+        self.first_direction: Optional[str] = None
+        self.aggression_sum = 0.0
+        self.aggression_count = 0
+        # Trades ainda não vinculados a um padrão em robot_trades
+        self.pending: List[TickData] = []
+        self.dirty = False
+        self.last_status: Optional[RobotStatus] = None
+
+    def add(self, trade: TickData) -> None:
+        is_buy = trade.trade_type == TradeType.BUY
+        price = trade.price
+        if self.count == 0:
+            self.first_ts = trade.timestamp
+            self.first_price = price
+            self.min_price = price
+            self.max_price = price
+            self.exchange = trade.exchange
+            self.first_direction = 'buy' if is_buy else 'sell'
+        else:
+            prev_price = self.last_price
+            # Mesma regra de _calculate_price_aggression: compra que sobe ou venda que cai
+            if is_buy and price > prev_price:
+                self.aggression_sum += (price - prev_price) / prev_price
+                self.aggression_count += 1
+            elif not is_buy and price < prev_price:
+                self.aggression_sum += (prev_price - price) / prev_price
+                self.aggression_count += 1
+            if price < self.min_price:
+                self.min_price = price
+            if price > self.max_price:
+                self.max_price = price
+
+        self.count += 1
+        self.volume_sum += trade.volume
+        if is_buy:
+            self.buy_volume += trade.volume
+            self.buy_count += 1
+        else:
+            self.sell_volume += trade.volume
+            self.sell_count += 1
+        self.last_ts = trade.timestamp
+        self.last_price = price
+        self.pending.append(trade)
+        _trim_pending(self.pending)
+        self.dirty = True
+
+    @property
+    def avg_trade_size(self) -> float:
+        return self.volume_sum / self.count if self.count else 0.0
+
+    @property
+    def net_volume(self) -> int:
+        return self.buy_volume - self.sell_volume
+
+    @property
+    def avg_interval_seconds(self) -> float:
+        """Média dos intervalos consecutivos (a soma telescópica é last - first)."""
+        if self.count < 2:
+            return 0.0
+        return (self.last_ts - self.first_ts).total_seconds() / (self.count - 1)
+
+    @property
+    def price_variation(self) -> float:
+        if not self.count:
+            return 0.0
+        return ((self.max_price - self.min_price) / self.first_price) * 100
+
+    @property
+    def price_aggression(self) -> float:
+        if not self.aggression_count:
+            return 0.0
+        return (self.aggression_sum / self.aggression_count) * 100
+
+    @property
+    def majority_direction(self) -> str:
+        """Direção predominante; no empate vale a primeira vista (como no max() do dict)."""
+        if not self.count:
+            return 'unknown'
+        if self.buy_count == self.sell_count:
+            return self.first_direction
+        return 'buy' if self.buy_count > self.sell_count else 'sell'
+
+    def take_pending(self) -> List[TickData]:
+        pending, self.pending = self.pending, []
+        return pending
+
+
+class MarketTWAPAccumulator:
+    """Estatísticas de um cluster (volume, direção) para TWAP à Mercado.
+
+    Só os trades em que o agente foi o agressor entram nos intervalos, que são
+    acompanhados por Welford (média e desvio padrão amostral em uma passada).
+    """
+
+    __slots__ = (
+        "count", "aggressor_count", "first_ts", "last_ts", "exchange",
+        "interval_count", "interval_mean", "interval_m2",
+        "pending", "pending_aggressors", "dirty",
+    )
+
+    def __init__(self):
+        self.count = 0
+        self.aggressor_count = 0
+        self.first_ts: Optional[datetime] = None
+        self.last_ts: Optional[datetime] = None
+        self.exchange: Optional[str] = None
+        self.interval_count = 0
+        self.interval_mean = 0.0
+        self.interval_m2 = 0.0
+        self.pending: List[TickData] = []
+        self.pending_aggressors = 0
+        self.dirty = False
+
+    def add(self, trade: TickData) -> None:
+        self.count += 1
+        self.pending.append(trade)
+        self.dirty = True
+        is_aggressor = _is_aggressor(trade)
+        if _trim_pending(self.pending):
+            self.pending_aggressors = sum(1 for pending in self.pending if _is_aggressor(pending)) - is_aggressor
+        if not is_aggressor:
+            return
+
+        if self.aggressor_count == 0:
+            self.first_ts = trade.timestamp
+            self.exchange = trade.exchange
+        else:
+            interval = (trade.timestamp - self.last_ts).total_seconds()
+            self.interval_count += 1
+            delta = interval - self.interval_mean
+            self.interval_mean += delta / self.interval_count
+            self.interval_m2 += delta * (interval - self.interval_mean)
+        self.last_ts = trade.timestamp
+        self.aggressor_count += 1
+        self.pending_aggressors += 1
+
+    @property
+    def interval_std(self) -> float:
+        if self.interval_count < 2:
+            return 0.0
+        return math.sqrt(self.interval_m2 / (self.interval_count - 1))
+
+    def take_pending(self) -> List[TickData]:
+        pending, self.pending = self.pending, []
+        self.pending_aggressors = 0
+        return pending
+
+
+class AgentTWAPState:
+    """Acumuladores de um agente em um símbolo: agregado, clusters e TWAP à Mercado."""
+
+    __slots__ = ("aggregate", "clusters", "market", "fallback_pending", "fallback_status")
+
+    def __init__(self):
+        self.aggregate = TradeAccumulator()
+        # (volume, 'buy'|'sell') -> acumulador, mesma chave de _cluster_trades
+        self.clusters: Dict[Tuple[int, str], TradeAccumulator] = {}
+        # (volume, TradeType) -> acumulador, mesma chave de MarketTWAPDetector.cluster_trades
+        self.market: Dict[Tuple[int, TradeType], MarketTWAPAccumulator] = {}
+        # Trades do cluster "fallback" (agente inteiro) enquanto nenhum cluster se qualifica
+        self.fallback_pending: List[TickData] = []
+        self.fallback_status: Optional[RobotStatus] = None
+
+    def add(self, trade: TickData) -> None:
+        self.aggregate.add(trade)
+        direction = 'buy' if trade.trade_type == TradeType.BUY else 'sell'
+        volume = int(trade.volume)
+
+        cluster = self.clusters.get((volume, direction))
+        if cluster is None:
+            cluster = self.clusters[(volume, direction)] = TradeAccumulator()
+        cluster.add(trade)
+
+        market = self.market.get((volume, trade.trade_type))
+        if market is None:
+            market = self.market[(volume, trade.trade_type)] = MarketTWAPAccumulator()
+        market.add(trade)
+
+        self.fallback_pending.append(trade)
+        _trim_pending(self.fallback_pending)
+
+    def qualified_clusters(self, min_trades: int) -> List[Tuple[Tuple[int, str], TradeAccumulator]]:
+        return [(key, acc) for key, acc in self.clusters.items() if acc.count >= min_trades]
+
+
+class SymbolTWAPState:
+    """Estado incremental de um símbolo para o pregão corrente."""
+
+    __slots__ = ("day", "watermark", "agents", "ticks_consumed", "last_batch_size")
+
+    def __init__(self, day: date, watermark: datetime):
+        self.day = day
+        # Todos os ticks com timestamp < watermark já foram consumidos
+        self.watermark = watermark
+        self.agents: Dict[int, AgentTWAPState] = {}
+        self.ticks_consumed = 0
+        self.last_batch_size = 0
+
+    def add_trades(self, agent_id: int, trades: List[TickData]) -> None:
+        agent = self.agents.get(agent_id)
+        if agent is None:
+            agent = self.agents[agent_id] = AgentTWAPState()
+        for trade in trades:
+            agent.add(trade)
+
+    def take_pending(self, kind: str, agent_id: int, key: Optional[tuple]) -> None:
+        """Descarta os trades pendentes de um padrão já gravado com eles (ver PatternDelta)"""
+        agent = self.agents.get(agent_id)
+        if agent is None:
+            return
+        if kind == PatternDelta.AGGREGATE:
+            agent.aggregate.take_pending()
+        elif kind == PatternDelta.FALLBACK:
+            agent.fallback_pending = []
+        elif kind == PatternDelta.CLUSTER:
+            acc = agent.clusters.get(key)
+            if acc is not None:
+                acc.take_pending()
+        elif kind == PatternDelta.MARKET:
+            acc = agent.market.get(key)
+            if acc is not None:
+                acc.take_pending()
+
+
+class PatternDelta:
+    """Padrão remontado dos acumuladores em um ciclo, a persistir pelo detector.
+
+    `changed` indica que o padrão precisa ser regravado; `trades` são os trades
+    ainda não vinculados a ele. Para AGGREGATE/CLUSTER/FALLBACK os pendentes só
+    são descartados (SymbolTWAPState.take_pending) depois da gravação com sucesso;
+    para MARKET a decisão já vem tomada, como em MarketTWAPDetector.
+    """
+
+    AGGREGATE = "aggregate"
+    CLUSTER = "cluster"
+    FALLBACK = "fallback"
+    MARKET = "market"
+
+    __slots__ = ("kind", "agent_id", "key", "pattern", "changed", "trades")
+
+    def __init__(self, kind: str, agent_id: int, key: Optional[tuple], pattern, changed: bool,
+                 trades: List[TickData]):
+        self.kind = kind
+        self.agent_id = agent_id
+        self.key = key
+        self.pattern = pattern
+        self.changed = changed
+        self.trades = trades
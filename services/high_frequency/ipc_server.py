@@ -0,0 +1,160 @@
+"""
+Servidor do transporte IPC (services/shared/ipc_transport)
+==========================================================
+Recebe frames dos feeds por uma conexão persistente, entrega cada corpo ao
+handler do tipo (os mesmos caminhos dos endpoints /ingest/*) e confirma com
+ACK depois que o handler aceitou a mensagem.
+
+Por stream guarda a última sequência entregue da sessão corrente do cliente:
+reenvios após reconexão são descartados e sequências puladas contadas como
+lacunas. Cada frame é entregue sob o lock do stream: uma reconexão que chega
+enquanto o handler ainda processa o frame anterior espera por ele antes de
+responder ao HELLO, e o reenvio desse frame é descartado como repetido.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from typing import Awaitable, Callable, Dict, Optional, Set
+
+from services.shared.ipc_transport import (
+    FRAME_HEADER, KIND_ACK, KIND_HELLO, MAX_FRAME_BYTES, pack_frame, parse_address, unpack_hello,
+)
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[bytes], Awaitable[None]]
+
+
+class StreamState:
+    __slots__ = ("session", "last_seq", "frames", "duplicates", "gaps", "missing", "rejected",
+                 "connections", "connected", "last_frame_at", "lock")
+
+    def __init__(self, session: int, base_seq: int):
+        self.session = session
+        self.last_seq = base_seq - 1
+        self.frames = 0
+        self.duplicates = 0
+        self.gaps = 0
+        self.missing = 0
+        self.rejected = 0
+        self.connections = 0
+        self.connected = False
+        self.last_frame_at = 0.0
+        self.lock = asyncio.Lock()
+
+    def to_dict(self) -> Dict:
+        return {
+            "last_seq": self.last_seq,
+            "frames": self.frames,
+            "duplicates": self.duplicates,
+            "gaps": self.gaps,
+            "missing": self.missing,
+            "rejected": self.rejected,
+            "connections": self.connections,
+            "connected": self.connected,
+            "idle_sec": round(time.time() - self.last_frame_at, 1) if self.last_frame_at else None,
+        }
+
+
+class IpcServer:
+    """Servidor asyncio de frames IPC; handlers por tipo de frame."""
+
+    def __init__(self, address: str, handlers: Dict[int, Handler]):
+        self.address = address
+        self.handlers = handlers
+        self.streams: Dict[str, StreamState] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._writers: Set[asyncio.StreamWriter] = set()
+
+    async def start(self) -> None:
+        family, target = parse_address(self.address)
+        if family == "unix":
+            if os.path.exists(target):
+                os.unlink(target)
+            self._server = await asyncio.start_unix_server(self._handle_connection, path=target)
+        else:
+            host, port = target
+            self._server = await asyncio.start_server(self._handle_connection, host=host, port=port)
+        logger.info(f"🔌 Transporte IPC escutando em {self.address}")
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            # Fecha também as conexões abertas; os clientes reconectam e reenviam
+            for writer in list(self._writers):
+                writer.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        state: Optional[StreamState] = None
+        stream = "?"
+        self._writers.add(writer)
+        try:
+            length, kind, _ = FRAME_HEADER.unpack(await reader.readexactly(FRAME_HEADER.size))
+            if kind != KIND_HELLO or length > MAX_FRAME_BYTES:
+                raise ConnectionError(f"primeiro frame não é HELLO (tipo {kind})")
+            session, base_seq, stream = unpack_hello(await reader.readexactly(length))
+
+            state = self.streams.get(stream)
+            if state is None or state.session != session:
+                # Cliente novo (ou reiniciado): a numeração recomeça em base_seq
+                state = self.streams[stream] = StreamState(session, base_seq)
+            state.connections += 1
+            state.connected = True
+            async with state.lock:
+                writer.write(pack_frame(KIND_ACK, state.last_seq))
+            await writer.drain()
+            logger.info(f"🔌 Stream IPC '{stream}' conectado (retomando após seq {state.last_seq})")
+
+            while True:
+                length, kind, seq = FRAME_HEADER.unpack(await reader.readexactly(FRAME_HEADER.size))
+                if length > MAX_FRAME_BYTES:
+                    raise ConnectionError(f"frame de {length} bytes acima do limite")
+                body = await reader.readexactly(length)
+
+                async with state.lock:
+                    if seq <= state.last_seq:
+                        state.duplicates += 1
+                    else:
+                        if seq > state.last_seq + 1:
+                            state.gaps += 1
+                            state.missing += seq - state.last_seq - 1
+                            logger.warning(f"⚠️ Lacuna no stream IPC '{stream}': seq {state.last_seq + 1}..{seq - 1} não recebidas")
+                        await self._dispatch(state, stream, kind, body)
+                        state.last_seq = seq
+                        state.frames += 1
+                        state.last_frame_at = time.time()
+                    writer.write(pack_frame(KIND_ACK, state.last_seq))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError) as exc:
+            logger.info(f"🔌 Stream IPC '{stream}' desconectado: {exc}")
+        except Exception as exc:
+            logger.error(f"❌ Erro no stream IPC '{stream}': {exc}")
+        finally:
+            self._writers.discard(writer)
+            if state is not None:
+                state.connected = False
+            writer.close()
+
+    async def _dispatch(self, state: StreamState, stream: str, kind: int, body: bytes) -> None:
+        handler = self.handlers.get(kind)
+        if handler is None:
+            state.rejected += 1
+            logger.warning(f"⚠️ Frame IPC de tipo desconhecido {kind} no stream '{stream}'")
+            return
+        try:
+            await handler(body)
+        except Exception as exc:
+            # Mensagem inválida não melhora com reenvio: conta, confirma e segue
+            state.rejected += 1
+            logger.warning(f"⚠️ Frame IPC rejeitado no stream '{stream}' (tipo {kind}): {exc}")
+
+    def get_status(self) -> Dict:
+        return {
+            "address": self.address,
+            "listening": self._server is not None,
+            "streams": {name: state.to_dict() for name, state in self.streams.items()},
+        }
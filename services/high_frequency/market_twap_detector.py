@@ -57,9 +57,10 @@ class MarketTWAPConfig:
 class MarketTWAPDetector:
     """Detector de padrões TWAP à Mercado"""
     
-    def __init__(self, config: MarketTWAPConfig = None):
+    def __init__(self, config: MarketTWAPConfig = None, persistence: RobotPersistence = None):
         self.config = config or MarketTWAPConfig()
-        self.persistence = RobotPersistence()
+        # Reaproveita a persistência (e o pool) do TWAPDetector quando fornecida
+        self.persistence = persistence or RobotPersistence()
         self.detected_patterns: List[TWAPPattern] = []
         
     async def detect_market_twap_patterns(self, trades: List[TickData]) -> List[TWAPPattern]:
@@ -346,7 +347,67 @@ class MarketTWAPDetector:
         
         return pattern
     
-    def _get_matching_trades_for_pattern(self, pattern: TWAPPattern, 
+    def detect_from_accumulator(self, agent_id: int, symbol: str, volume: int,
+                                direction: TradeType, acc) -> Optional[TWAPPattern]:
+        """Equivalente a detect_market_twap_patterns para um único cluster
+        (volume, direção), a partir de um MarketTWAPAccumulator já agregado.
+
+        Aplica os mesmos filtros de _detect_direction_patterns; como o cluster
+        tem volume e direção únicos, frequência de volume e consistência
+        direcional valem 1.0.
+        """
+        if acc.count < self.config.min_volume_repetitions:
+            return None
+        if acc.aggressor_count < self.config.min_volume_repetitions:
+            return None
+        if 1.0 < self.config.min_volume_frequency:
+            return None
+
+        if acc.aggressor_count < 2 or acc.interval_count < self.config.min_time_intervals:
+            return None
+        avg_interval = acc.interval_mean
+        if avg_interval > (self.config.max_interval_minutes * 60):
+            return None
+        consistency = 1.0 - (acc.interval_std / avg_interval) if avg_interval > 0 else 0.0
+        if consistency < self.config.time_consistency_threshold:
+            return None
+
+        direction_consistency = 1.0
+        if direction_consistency < self.config.min_direction_consistency:
+            return None
+
+        frequency_score = min(acc.aggressor_count / 20.0, 1.0)
+        confidence = min(0.3 + consistency * 0.3 + direction_consistency * 0.2 + frequency_score * 0.2, 1.0)
+        if confidence < self.config.min_confidence:
+            return None
+
+        if confidence >= 0.8:
+            status = RobotStatus.ACTIVE
+        elif confidence >= 0.6:
+            status = RobotStatus.SUSPICIOUS
+        else:
+            status = RobotStatus.INACTIVE
+
+        total_volume = volume * acc.aggressor_count
+        return TWAPPattern(
+            symbol=symbol,
+            exchange=acc.exchange,
+            pattern_type="MARKET_TWAP",
+            robot_type=RobotType.MARKET_TWAP.value,
+            agent_id=agent_id,
+            first_seen=acc.first_ts,
+            last_seen=acc.last_ts,
+            total_volume=total_volume,
+            total_trades=acc.aggressor_count,
+            avg_trade_size=total_volume / acc.aggressor_count,
+            frequency_minutes=avg_interval / 60.0,
+            price_aggression=0.0,
+            confidence_score=confidence,
+            status=status,
+            market_volume_percentage=0.0
+        )
+
+    def _get_matching_trades_for_pattern(self, pattern: TWAPPattern,
                                          candidate_trades: List[TickData]) -> List[TickData]:
         """Reconstrói e retorna apenas os trades que compõem o padrão TWAP à Mercado.
         
@@ -418,8 +479,8 @@ class MarketTWAPDetector:
                 logger.warning(f"Nenhum trade matching encontrado para padrão {pattern.symbol}-{pattern.agent_id} no intervalo informado")
                 return True  # Padrão salvo, sem trades vinculados
 
-            for trade in matching_trades:
-                robot_trade = RobotTrade(
+            robot_trades = [
+                RobotTrade(
                     symbol=trade.symbol,
                     price=trade.price,
                     volume=trade.volume,
@@ -427,12 +488,14 @@ class MarketTWAPDetector:
                     trade_type=trade.trade_type,
                     agent_id=trade.agent_id,
                     exchange=trade.exchange,
-                    robot_pattern_id=pattern_id
+                    robot_pattern_id=pattern_id,
+                    trade_id=trade.trade_id,
                 )
-                
-                await self.persistence.save_robot_trade(robot_trade, pattern_id)
+                for trade in matching_trades
+            ]
+            inserted = await self.persistence.append_robot_trades(pattern_id, robot_trades)
             
-            logger.info(f"✅ Padrão TWAP à Mercado salvo: {pattern.symbol} - {get_agent_name(pattern.agent_id)} ({pattern.agent_id}) | Trades salvos: {len(matching_trades)}")
+            logger.info(f"✅ Padrão TWAP à Mercado salvo: {pattern.symbol} - {get_agent_name(pattern.agent_id)} ({pattern.agent_id}) | Trades salvos: {max(inserted, 0)}/{len(matching_trades)}")
             return True
             
         except Exception as e:
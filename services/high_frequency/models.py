@@ -1,7 +1,7 @@
 """
 Modelos de dados para o High Frequency Backend
 """
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import Optional, List
 from datetime import datetime
 
@@ -21,6 +21,10 @@ class Tick:
     trade_type: Optional[int] = None  # 2=Comprador, 3=Vendedor
     volume_financial: Optional[float] = None
     is_edit: bool = False
+    # Horário do negócio na bolsa (TradeDate da DLL); `timestamp` é o recebimento no feed
+    exchange_timestamp: Optional[float] = None
+    # Chegada ao backend (só em memória, para as latências de /metrics)
+    ingested_at: Optional[float] = field(default=None, compare=False)
     
     def to_dict(self):
         """Converte o tick para dicionário."""
@@ -35,7 +39,8 @@ class Tick:
             'sell_agent': self.sell_agent,
             'trade_type': self.trade_type,
             'volume_financial': self.volume_financial,
-            'is_edit': self.is_edit
+            'is_edit': self.is_edit,
+            'exchange_timestamp': self.exchange_timestamp,
         }
 
 
@@ -1,11 +1,18 @@
 import asyncio
 import logging
-from typing import List, Dict, Any, Optional
+from typing import Callable, List, Dict, Any, Optional
 from datetime import datetime, timezone
 from psycopg_pool import AsyncConnectionPool
 from psycopg import AsyncConnection
 from psycopg.types.json import Json
 from services.high_frequency.models import Tick, OrderBookEvent, OrderBookSnapshot, OrderBookLevel, OrderBookOffer
+from services.high_frequency.config import (
+    HF_TICK_WRITER, HF_TICK_DEDUP,
+    HF_DB_POOL_MIN, HF_DB_POOL_MAX, HF_DB_POOL_TIMEOUT_SEC, HF_DB_POOL_MAX_IDLE_SEC,
+    HF_DB_PREPARE_THRESHOLD,
+)
+from services.high_frequency.schema_migrations import run_migrations
+from services.high_frequency.tick_latency import tick_latency
 import os
 import time
 
@@ -27,6 +34,17 @@ def _should_log_tick_batch() -> bool:
 
 pool: AsyncConnectionPool | None = None
 
+# Chamados com cada lote de ticks gravado, depois do commit (ex.: TWAPDetector.rewind_for_ticks)
+_commit_listeners: List[Callable[[List[Tick]], Any]] = []
+
+def add_commit_listener(listener: Callable[[List[Tick]], Any]) -> None:
+    """Registra um ouvinte dos lotes gravados por persist_ticks"""
+    _commit_listeners.append(listener)
+
+async def _configure_connection(conn: AsyncConnection) -> None:
+    """Chamado pelo pool para cada conexão nova: queries repetidas viram prepared statements."""
+    conn.prepare_threshold = HF_DB_PREPARE_THRESHOLD
+
 async def get_db_pool(retries: int = 1, delay: float = 1.0) -> AsyncConnectionPool | None:
     """
     Retorna o pool de conexões, inicializando se necessário, com lógica de retentativa.
@@ -37,7 +55,15 @@ async def get_db_pool(retries: int = 1, delay: float = 1.0) -> AsyncConnectionPo
         for attempt in range(retries):
             try:
                 # Cria pool sem abrir automaticamente para evitar warnings
-                new_pool = AsyncConnectionPool(db_url, min_size=5, max_size=20, open=False)
+                new_pool = AsyncConnectionPool(
+                    db_url,
+                    min_size=HF_DB_POOL_MIN,
+                    max_size=max(HF_DB_POOL_MIN, HF_DB_POOL_MAX),
+                    timeout=HF_DB_POOL_TIMEOUT_SEC,
+                    max_idle=HF_DB_POOL_MAX_IDLE_SEC,
+                    configure=_configure_connection,
+                    open=False,
+                )
                 # Abre o pool manualmente
                 await new_pool.open()
                 # Tenta uma conexão para validar
@@ -55,322 +81,198 @@ async def get_db_pool(retries: int = 1, delay: float = 1.0) -> AsyncConnectionPo
                     return None
     return pool
 
+async def close_db_pool() -> None:
+    """Fecha o pool compartilhado, se existir."""
+    global pool
+    if pool is not None:
+        await pool.close()
+        pool = None
+        logger.info("Pool de conexões com o banco de dados fechado.")
+
+def get_pool_status() -> Dict[str, Any]:
+    """Uso e tempo de espera do pool compartilhado (para /metrics)."""
+    if pool is None:
+        return {"initialized": False}
+    stats = pool.get_stats()
+    requests_num = stats.get("requests_num", 0)
+    wait_ms = stats.get("requests_wait_ms", 0)
+    return {
+        "initialized": True,
+        "min_size": pool.min_size,
+        "max_size": pool.max_size,
+        "size": stats.get("pool_size", 0),
+        "available": stats.get("pool_available", 0),
+        "in_use": stats.get("pool_size", 0) - stats.get("pool_available", 0),
+        "requests_waiting": stats.get("requests_waiting", 0),
+        "requests_num": requests_num,
+        "requests_queued": stats.get("requests_queued", 0),
+        "requests_errors": stats.get("requests_errors", 0),
+        "requests_wait_ms_total": wait_ms,
+        "requests_wait_ms_avg": round(wait_ms / requests_num, 3) if requests_num else 0.0,
+        "connections_num": stats.get("connections_num", 0),
+        "connections_errors": stats.get("connections_errors", 0),
+        "prepare_threshold": HF_DB_PREPARE_THRESHOLD,
+    }
+
 async def initialize_db(conn_pool: AsyncConnectionPool):
     """
-    Inicializa o banco de dados, criando a tabela de ticks e a hypertabela se não existirem,
-    e garantindo que as colunas críticas sejam do tipo BIGINT para evitar erros de overflow.
+    Garante o esquema do banco aplicando as migrações pendentes
+    (services/high_frequency/schema_migrations.py). Com o esquema em dia é uma
+    única consulta à tabela schema_version.
     """
-    logger.info("Verificando e inicializando o esquema do banco de dados...")
-    async with conn_pool.connection() as conn:
-        async with conn.cursor() as cur:
-            try:
-                await cur.execute("CREATE EXTENSION IF NOT EXISTS timescaledb;")
-                
-                # Cria a tabela com os tipos de dados corretos (BIGINT para volume e trade_id)
-                await cur.execute("""
-                    CREATE TABLE IF NOT EXISTS ticks_raw (
-                        symbol VARCHAR(20) NOT NULL,
-                        exchange VARCHAR(10) NOT NULL,
-                        price DOUBLE PRECISION NOT NULL,
-                        volume BIGINT NOT NULL,
-                        timestamp TIMESTAMPTZ NOT NULL,
-                        trade_id BIGINT,
-                        -- Campos para dados detalhados de trade
-                        buy_agent INTEGER,
-                        sell_agent INTEGER,
-                        trade_type SMALLINT,
-                        volume_financial DOUBLE PRECISION,
-                        is_edit BOOLEAN DEFAULT FALSE
-                    );
-                """)
-
-                # Bloco PL/pgSQL para alterar as colunas apenas se necessário, de forma segura.
-                await cur.execute("""
-                    DO $$
-                    BEGIN
-                        -- Ajusta tipos existentes
-                        IF EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='ticks_raw' AND column_name='trade_id' AND data_type <> 'bigint') THEN
-                           ALTER TABLE ticks_raw ALTER COLUMN trade_id TYPE BIGINT;
-                           RAISE NOTICE 'Coluna trade_id em ticks_raw foi alterada para BIGINT.';
-                        END IF;
-                        
-                        IF EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='ticks_raw' AND column_name='volume' AND data_type <> 'bigint') THEN
-                           ALTER TABLE ticks_raw ALTER COLUMN volume TYPE BIGINT;
-                           RAISE NOTICE 'Coluna volume em ticks_raw foi alterada para BIGINT.';
-                        END IF;
-                        
-                        -- Adiciona novos campos se não existirem
-                        IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='ticks_raw' AND column_name='buy_agent') THEN
-                           ALTER TABLE ticks_raw ADD COLUMN buy_agent INTEGER;
-                           RAISE NOTICE 'Coluna buy_agent adicionada em ticks_raw.';
-                        END IF;
-                        
-                        IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='ticks_raw' AND column_name='sell_agent') THEN
-                           ALTER TABLE ticks_raw ADD COLUMN sell_agent INTEGER;
-                           RAISE NOTICE 'Coluna sell_agent adicionada em ticks_raw.';
-                        END IF;
-                        
-                        IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='ticks_raw' AND column_name='trade_type') THEN
-                           ALTER TABLE ticks_raw ADD COLUMN trade_type SMALLINT;
-                           RAISE NOTICE 'Coluna trade_type adicionada em ticks_raw.';
-                        END IF;
-                        
-                        IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='ticks_raw' AND column_name='volume_financial') THEN
-                           ALTER TABLE ticks_raw ADD COLUMN volume_financial DOUBLE PRECISION;
-                           RAISE NOTICE 'Coluna volume_financial adicionada em ticks_raw.';
-                        END IF;
-                        
-                        IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='ticks_raw' AND column_name='is_edit') THEN
-                           ALTER TABLE ticks_raw ADD COLUMN is_edit BOOLEAN DEFAULT FALSE;
-                           RAISE NOTICE 'Coluna is_edit adicionada em ticks_raw.';
-                        END IF;
-                        
-                                        -- Remover colunas desnecessárias se existirem
-                IF EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='ticks_raw' AND column_name='aggressor_side') THEN
-                   ALTER TABLE ticks_raw DROP COLUMN aggressor_side;
-                   RAISE NOTICE 'Coluna aggressor_side removida de ticks_raw (redundante com trade_type).';
-                END IF;
-                
-                IF EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='ticks_raw' AND column_name='sequence') THEN
-                   ALTER TABLE ticks_raw DROP COLUMN sequence;
-                   RAISE NOTICE 'Coluna sequence removida de ticks_raw (não necessária).';
-                END IF;
-                
-                IF EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='ticks_raw' AND column_name='buyer_maker') THEN
-                   ALTER TABLE ticks_raw DROP COLUMN buyer_maker;
-                   RAISE NOTICE 'Coluna buyer_maker removida de ticks_raw (não necessária).';
-                END IF;
-                    END $$;
-                """)
-                
-                await cur.execute("SELECT create_hypertable('ticks_raw', 'timestamp', if_not_exists => TRUE);")
-
-                await cur.execute(
-                    """
-                    CREATE TABLE IF NOT EXISTS order_book_events (
-                        id BIGINT GENERATED ALWAYS AS IDENTITY,
-                        symbol VARCHAR(20) NOT NULL,
-                        event_time TIMESTAMPTZ NOT NULL,
-                        action SMALLINT NOT NULL,
-                        side SMALLINT NOT NULL,
-                        position BIGINT,
-                        price DOUBLE PRECISION,
-                        quantity BIGINT,
-                        offer_count INTEGER,
-                        agent_id INTEGER,
-                        sequence BIGINT,
-                        raw_payload JSONB
-                    );
-                    """
-                )
-
-                await cur.execute(
-                    """
-                    DO $$
-                    BEGIN
-                        IF EXISTS (
-                            SELECT 1 FROM information_schema.columns
-                             WHERE table_name = 'order_book_events'
-                               AND column_name = 'position'
-                               AND data_type <> 'bigint'
-                        ) THEN
-                            ALTER TABLE order_book_events ALTER COLUMN position TYPE BIGINT;
-                        END IF;
-                    END $$;
-                    """
-                )
-
-                await cur.execute(
-                    """
-                    CREATE TABLE IF NOT EXISTS order_book_snapshots (
-                        id BIGINT GENERATED ALWAYS AS IDENTITY,
-                        symbol VARCHAR(20) NOT NULL,
-                        event_time TIMESTAMPTZ NOT NULL,
-                        bids JSONB NOT NULL,
-                        asks JSONB NOT NULL,
-                        best_bid_price DOUBLE PRECISION,
-                        best_bid_quantity BIGINT,
-                        best_ask_price DOUBLE PRECISION,
-                        best_ask_quantity BIGINT,
-                        levels INTEGER,
-                        sequence BIGINT,
-                        raw_event JSONB
-                    );
-                    """
-                )
-
-                await cur.execute(
-                    """
-                    CREATE TABLE IF NOT EXISTS order_book_offers (
-                        id BIGINT GENERATED ALWAYS AS IDENTITY,
-                        symbol VARCHAR(20) NOT NULL,
-                        event_time TIMESTAMPTZ NOT NULL,
-                        action SMALLINT NOT NULL,
-                        side SMALLINT NOT NULL,
-                        position BIGINT,
-                        price DOUBLE PRECISION,
-                        quantity BIGINT,
-                        agent_id INTEGER,
-                        offer_id BIGINT,
-                        flags INTEGER
-                    );
-                    """
-                )
-
-                await cur.execute(
-                    """
-                    DO $$
-                    BEGIN
-                        IF EXISTS (
-                            SELECT 1 FROM information_schema.columns
-                             WHERE table_name = 'order_book_offers'
-                               AND column_name = 'position'
-                               AND data_type <> 'bigint'
-                        ) THEN
-                            ALTER TABLE order_book_offers ALTER COLUMN position TYPE BIGINT;
-                        END IF;
-                    END $$;
-                    """
-                )
-
-                await cur.execute(
-                    "SELECT create_hypertable('order_book_events', 'event_time', if_not_exists => TRUE);"
-                )
-
-                await cur.execute(
-                    "SELECT create_hypertable('order_book_snapshots', 'event_time', if_not_exists => TRUE);"
-                )
+    logger.info("Verificando o esquema do banco de dados...")
+    try:
+        await run_migrations(conn_pool)
+    except Exception as e:
+        logger.error(f"Erro durante a inicialização do banco de dados: {e}", exc_info=True)
+        raise
+
+_TICK_COLUMNS = (
+    "symbol, exchange, price, volume, timestamp, trade_id, "
+    "buy_agent, sell_agent, trade_type, volume_financial, is_edit, exchange_time"
+)
+
+# Tipos na ordem de _TICK_COLUMNS, usados pelo COPY binário
+_TICK_COPY_TYPES = [
+    "varchar", "varchar", "float8", "int8", "timestamptz", "int8",
+    "int4", "int4", "int2", "float8", "bool", "timestamptz",
+]
+
+
+def _tick_row(t: Tick) -> tuple:
+    return (
+        t.symbol, t.exchange, t.price, t.volume,
+        datetime.fromtimestamp(t.timestamp, tz=timezone.utc), t.trade_id,
+        getattr(t, 'buy_agent', None), getattr(t, 'sell_agent', None), getattr(t, 'trade_type', None),
+        getattr(t, 'volume_financial', None), getattr(t, 'is_edit', False),
+        datetime.fromtimestamp(t.exchange_timestamp, tz=timezone.utc) if t.exchange_timestamp else None,
+    )
 
-                await cur.execute(
-                    """
-                    CREATE UNIQUE INDEX IF NOT EXISTS idx_order_book_events_event_time_id
-                    ON order_book_events(event_time, id);
-                    """
-                )
 
-                await cur.execute(
-                    """
-                    CREATE INDEX IF NOT EXISTS idx_order_book_events_symbol_time
-                    ON order_book_events(symbol, event_time DESC);
-                    """
-                )
+async def _write_ticks_executemany(cur, ticks: List[Tick], table: str = "ticks_raw"):
+    """Um INSERT parametrizado por tick (modo original)."""
+    sql = f"""
+        INSERT INTO {table} (
+            {_TICK_COLUMNS}
+        )
+        VALUES (%s, %s, %s, %s, to_timestamp(%s), %s, %s, %s, %s, %s, %s, to_timestamp(%s))
+    """
+    params = [(
+        t.symbol, t.exchange, t.price, t.volume, t.timestamp, t.trade_id,
+        getattr(t, 'buy_agent', None), getattr(t, 'sell_agent', None), getattr(t, 'trade_type', None),
+        getattr(t, 'volume_financial', None), getattr(t, 'is_edit', False), t.exchange_timestamp or None
+    ) for t in ticks]
+    await cur.executemany(sql, params)
 
-                await cur.execute(
-                    """
-                    CREATE UNIQUE INDEX IF NOT EXISTS idx_order_book_snapshots_event_time_id
-                    ON order_book_snapshots(event_time, id);
-                    """
-                )
 
-                await cur.execute(
-                    """
-                    CREATE INDEX IF NOT EXISTS idx_order_book_snapshots_symbol_time
-                    ON order_book_snapshots(symbol, event_time DESC);
-                    """
-                )
+async def _copy_ticks(cur, ticks: List[Tick], table: str):
+    async with cur.copy(f"COPY {table} ({_TICK_COLUMNS}) FROM STDIN (FORMAT BINARY)") as copy:
+        copy.set_types(_TICK_COPY_TYPES)
+        for t in ticks:
+            await copy.write_row(_tick_row(t))
 
-                await cur.execute(
-                    "SELECT create_hypertable('order_book_offers', 'event_time', if_not_exists => TRUE);"
-                )
 
-                await cur.execute(
-                    """
-                    CREATE INDEX IF NOT EXISTS idx_order_book_offers_symbol_time
-                    ON order_book_offers(symbol, event_time DESC);
-                    """
-                )
+async def _write_ticks_copy(cur, ticks: List[Tick], table: str = "ticks_raw", dedup: bool = False) -> List[Tick]:
+    """
+    COPY binário do lote inteiro. Com `dedup`, grava primeiro numa tabela
+    temporária e só insere em `table` os (symbol, trade_id) ainda inexistentes.
+    Edições (is_edit) sempre passam, pois reutilizam o trade_id original.
+    Devolve os ticks efetivamente inseridos.
+    """
+    if not dedup:
+        await _copy_ticks(cur, ticks, table)
+        return ticks
+
+    # Duplicatas dentro do próprio lote são removidas antes do COPY
+    seen = set()
+    unique_ticks = []
+    for t in ticks:
+        if t.trade_id is not None and not t.is_edit:
+            key = (t.symbol, t.trade_id)
+            if key in seen:
+                continue
+            seen.add(key)
+        unique_ticks.append(t)
+
+    await cur.execute(
+        f"CREATE TEMP TABLE IF NOT EXISTS ticks_stage (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS"
+    )
+    await _copy_ticks(cur, unique_ticks, "ticks_stage")
+    await cur.execute(
+        f"""
+        INSERT INTO {table} ({_TICK_COLUMNS})
+        SELECT {_TICK_COLUMNS}
+          FROM ticks_stage s
+         WHERE s.trade_id IS NULL
+            OR s.is_edit
+            OR NOT EXISTS (
+                SELECT 1 FROM {table} r
+                 WHERE r.symbol = s.symbol
+                   AND r.trade_id = s.trade_id
+                   AND r.timestamp >= date_trunc('day', s.timestamp)
+                   AND r.timestamp < date_trunc('day', s.timestamp) + INTERVAL '1 day'
+            )
+        RETURNING symbol, trade_id, is_edit
+        """
+    )
+    # Edições passam sempre; o trade_id delas não diz se o original era novo
+    inserted = {(symbol, trade_id) for symbol, trade_id, is_edit in await cur.fetchall() if not is_edit}
+    return [
+        t for t in unique_ticks
+        if t.trade_id is None or t.is_edit or (t.symbol, t.trade_id) in inserted
+    ]
 
-                # Cria/ajusta tabela robot_patterns (assinado)
-                await cur.execute("""
-                    CREATE TABLE IF NOT EXISTS robot_patterns (
-                        id SERIAL PRIMARY KEY,
-                        symbol VARCHAR(20) NOT NULL,
-                        exchange VARCHAR(10) NOT NULL,
-                        pattern_type VARCHAR(50) NOT NULL,
-                        robot_type VARCHAR(50) NOT NULL,
-                        confidence_score DOUBLE PRECISION NOT NULL,
-                        agent_id INTEGER NOT NULL,
-                        first_seen TIMESTAMPTZ NOT NULL,
-                        last_seen TIMESTAMPTZ NOT NULL,
-                        total_volume DOUBLE PRECISION NOT NULL,
-                        total_trades INTEGER NOT NULL,
-                        avg_trade_size DOUBLE PRECISION NOT NULL,
-                        frequency_minutes DOUBLE PRECISION NOT NULL,
-                        price_aggression DOUBLE PRECISION NOT NULL,
-                        status VARCHAR(20) NOT NULL,
-                        market_volume_percentage DOUBLE PRECISION,
-                        inactivity_notified BOOLEAN DEFAULT FALSE,
-                        created_at TIMESTAMPTZ NOT NULL,
-                        signature_volume INTEGER,
-                        signature_direction VARCHAR(10),
-                        signature_interval_seconds DOUBLE PRECISION,
-                        UNIQUE(symbol, agent_id, pattern_type, signature_volume, signature_direction, signature_interval_seconds, first_seen)
-                    );
-                """)
-
-                # Adiciona colunas de assinatura se não existirem
-                await cur.execute("""
-                    DO $$
-                    BEGIN
-                        IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='robot_patterns' AND column_name='signature_volume') THEN
-                            ALTER TABLE robot_patterns ADD COLUMN signature_volume INTEGER;
-                        END IF;
-                        IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='robot_patterns' AND column_name='signature_direction') THEN
-                            ALTER TABLE robot_patterns ADD COLUMN signature_direction VARCHAR(10);
-                        END IF;
-                        IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='robot_patterns' AND column_name='signature_interval_seconds') THEN
-                            ALTER TABLE robot_patterns ADD COLUMN signature_interval_seconds DOUBLE PRECISION;
-                        END IF;
-                    END $$;
-                """)
-
-                # Índices auxiliares
-                await cur.execute("""
-                    CREATE INDEX IF NOT EXISTS idx_robot_patterns_signature
-                      ON robot_patterns(symbol, agent_id, pattern_type, signature_volume, signature_direction, signature_interval_seconds);
-                """)
-
-                await conn.commit()
-                logger.info("Esquema do banco de dados verificado e atualizado com sucesso.")
 
-            except Exception as e:
-                logger.error(f"Erro durante a inicialização do banco de dados: {e}", exc_info=True)
-                await conn.rollback()
-                raise
+async def persist_ticks(ticks: List[Tick], conn_pool: AsyncConnectionPool, dedup: Optional[bool] = None) -> bool:
+    """
+    Grava o lote com até 5 tentativas; False se todas falharam. `dedup=True`
+    força o COPY com deduplicação (replay do journal, que pode repetir ticks
+    já gravados) independente de HF_TICK_WRITER.
+    """
+    return await persist_new_ticks(ticks, conn_pool, dedup) is not None
 
-async def persist_ticks(ticks: List[Tick], conn_pool: AsyncConnectionPool):
+async def persist_new_ticks(
+    ticks: List[Tick], conn_pool: AsyncConnectionPool, dedup: Optional[bool] = None
+) -> Optional[List[Tick]]:
+    """
+    Como persist_ticks, mas devolve os ticks efetivamente inseridos (com dedup,
+    sem os (symbol, trade_id) que já estavam no ticks_raw), ou None se todas as
+    tentativas falharam. Os ouvintes de commit recebem só esses ticks.
+    """
     if not ticks:
-        return
+        return []
 
-    sql = """
-        INSERT INTO ticks_raw (
-            symbol, exchange, price, volume, timestamp, trade_id,
-            buy_agent, sell_agent, trade_type, volume_financial, is_edit
-        )
-        VALUES (%s, %s, %s, %s, to_timestamp(%s), %s, %s, %s, %s, %s, %s)
-    """
-    params = [(
-        t.symbol, t.exchange, t.price, t.volume, t.timestamp, t.trade_id,
-        getattr(t, 'buy_agent', None), getattr(t, 'sell_agent', None), getattr(t, 'trade_type', None),
-        getattr(t, 'volume_financial', None), getattr(t, 'is_edit', False)
-    ) for t in ticks]
+    if dedup is None:
+        dedup = HF_TICK_DEDUP
+    use_copy = HF_TICK_WRITER == "copy" or dedup
 
     for attempt in range(1, 6):
         try:
             async with conn_pool.connection() as conn:
                 async with conn.cursor() as cur:
-                    await cur.executemany(sql, params)
+                    if use_copy:
+                        written = await _write_ticks_copy(cur, ticks, dedup=dedup)
+                    else:
+                        await _write_ticks_executemany(cur, ticks)
+                        written = ticks
                     await conn.commit()
+            tick_latency.record_commit(ticks, time.time())
+            for listener in _commit_listeners:
+                try:
+                    listener(written)
+                except Exception as e:
+                    logger.warning(f"⚠️ Ouvinte de commit de ticks falhou: {e}")
             # ✅ NOVO: Log com throttling (apenas a cada 1 segundo)
             if _should_log_tick_batch():
-                logger.info(f"Lote de {len(ticks)} ticks salvo no banco de dados.")
-            return
+                logger.info(f"Lote de {len(ticks)} ticks salvo no banco de dados ({'copy' if use_copy else 'insert'}).")
+            return written
         except Exception as e:
             logger.warning(f"Tentativa {attempt} falhou para o lote de ticks: {e}")
             if attempt < 5:
                 await asyncio.sleep(0.1 * attempt)
             else:
                 logger.error(f"Todas as tentativas de salvar o lote de ticks para {ticks[0].symbol} falharam.")
+    return None
 
 async def get_ticks_from_db(symbol: str, timeframe: str, limit: int, conn_pool: AsyncConnectionPool) -> List[Dict[str, Any]]:
     async with conn_pool.connection() as conn:
@@ -405,64 +307,93 @@ async def get_ticks_from_db(symbol: str, timeframe: str, limit: int, conn_pool:
             columns = [desc[0] for desc in cur.description]
             return [dict(zip(columns, row)) for row in rows]
 
-async def persist_order_book_event(event: OrderBookEvent, db_pool: AsyncConnectionPool):
-    """Persiste um evento incremental do livro de ofertas."""
-    sql = """
-        INSERT INTO order_book_events (
-            symbol,
-            event_time,
-            action,
-            side,
-            position,
-            price,
-            quantity,
-            offer_count,
-            agent_id,
-            sequence,
-            raw_payload
-        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-    """
-
-    params = (
-        event.symbol,
-        event.timestamp,
-        event.action,
-        event.side,
-        event.position,
-        event.price,
-        event.quantity,
-        event.offer_count,
-                None,
-        event.sequence,
-        Json(event.raw_payload or {}),
-    )
+# Colunas e tipos do COPY binário de cada tabela do livro de ofertas
+_ORDER_BOOK_EVENT_COLUMNS = (
+    "symbol, event_time, action, side, position, price, quantity, offer_count, agent_id, sequence, raw_payload"
+)
+_ORDER_BOOK_EVENT_TYPES = [
+    "varchar", "timestamptz", "int2", "int2", "int8", "float8", "int8", "int4", "int4", "int8", "jsonb",
+]
+
+_ORDER_BOOK_SNAPSHOT_COLUMNS = (
+    "symbol, event_time, bids, asks, best_bid_price, best_bid_quantity, "
+    "best_ask_price, best_ask_quantity, levels, sequence, raw_event"
+)
+_ORDER_BOOK_SNAPSHOT_TYPES = [
+    "varchar", "timestamptz", "jsonb", "jsonb", "float8", "int8", "float8", "int8", "int4", "int8", "jsonb",
+]
+
+_ORDER_BOOK_OFFER_COLUMNS = (
+    "symbol, event_time, action, side, position, price, quantity, agent_id, offer_id, flags"
+)
+_ORDER_BOOK_OFFER_TYPES = [
+    "varchar", "timestamptz", "int2", "int2", "int8", "float8", "int8", "int4", "int8", "int4",
+]
+
+
+async def _copy_order_book_rows(
+    db_pool: AsyncConnectionPool, table: str, columns: str, types: List[str], rows: List[tuple]
+) -> bool:
+    """COPY binário de um lote inteiro com um único commit (com retentativas)."""
+    if not rows:
+        return True
 
     for attempt in range(1, 6):
         try:
             async with db_pool.connection() as conn:
                 async with conn.cursor() as cur:
-                    await cur.execute(sql, params)
+                    async with cur.copy(f"COPY {table} ({columns}) FROM STDIN (FORMAT BINARY)") as copy:
+                        copy.set_types(types)
+                        for row in rows:
+                            await copy.write_row(row)
                     await conn.commit()
-            logger.debug(
-                "Persisted order book event %s action=%s side=%s position=%s",
-                event.symbol,
-                event.action,
-                event.side,
-                event.position,
-            )
-            return
+            logger.debug("Lote de %s linhas gravado em %s", len(rows), table)
+            return True
         except Exception as exc:
             logger.warning(
-                "Tentativa %s falhou ao persistir evento de book (%s - action %s): %s",
+                "Tentativa %s falhou ao gravar lote de %s linhas em %s: %s",
                 attempt,
-                event.symbol,
-                event.action,
+                len(rows),
+                table,
                 exc,
             )
             if attempt < 5:
                 await asyncio.sleep(0.1 * attempt)
             else:
-                logger.error("Falha definitiva ao persistir evento de book para %s", event.symbol)
+                logger.error("Falha definitiva ao gravar lote de %s linhas em %s", len(rows), table)
+    return False
+
+
+def _order_book_event_row(event: OrderBookEvent) -> tuple:
+    return (
+        event.symbol,
+        event.timestamp,
+        event.action,
+        event.side,
+        event.position,
+        event.price,
+        event.quantity,
+        event.offer_count,
+        None,
+        event.sequence,
+        Json(event.raw_payload or {}),
+    )
+
+
+async def persist_order_book_events(events: List[OrderBookEvent], db_pool: AsyncConnectionPool) -> bool:
+    """Persiste um lote de eventos incrementais do livro de ofertas."""
+    return await _copy_order_book_rows(
+        db_pool,
+        "order_book_events",
+        _ORDER_BOOK_EVENT_COLUMNS,
+        _ORDER_BOOK_EVENT_TYPES,
+        [_order_book_event_row(event) for event in events],
+    )
+
+
+async def persist_order_book_event(event: OrderBookEvent, db_pool: AsyncConnectionPool):
+    """Persiste um evento incremental do livro de ofertas."""
+    await persist_order_book_events([event], db_pool)
 
 
 def _levels_to_json(levels: List[OrderBookLevel]) -> List[Dict[str, Any]]:
@@ -477,31 +408,14 @@ def _levels_to_json(levels: List[OrderBookLevel]) -> List[Dict[str, Any]]:
     ]
 
 
-async def persist_order_book_snapshot(snapshot: OrderBookSnapshot, db_pool: AsyncConnectionPool):
-    """Persiste um snapshot completo do livro de ofertas."""
+def _order_book_snapshot_row(snapshot: OrderBookSnapshot) -> tuple:
     bids_json = _levels_to_json(snapshot.bids)
     asks_json = _levels_to_json(snapshot.asks)
 
     best_bid = bids_json[0] if bids_json else None
     best_ask = asks_json[0] if asks_json else None
 
-    sql = """
-        INSERT INTO order_book_snapshots (
-            symbol,
-            event_time,
-            bids,
-            asks,
-            best_bid_price,
-            best_bid_quantity,
-            best_ask_price,
-            best_ask_quantity,
-            levels,
-            sequence,
-            raw_event
-        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-    """
-
-    params = (
+    return (
         snapshot.symbol,
         snapshot.timestamp,
         Json(bids_json),
@@ -515,52 +429,25 @@ async def persist_order_book_snapshot(snapshot: OrderBookSnapshot, db_pool: Asyn
         Json(snapshot.source_event or {}),
     )
 
-    for attempt in range(1, 6):
-        try:
-            async with db_pool.connection() as conn:
-                async with conn.cursor() as cur:
-                    await cur.execute(sql, params)
-                    await conn.commit()
-            logger.debug(
-                "Persisted order book snapshot %s bids=%s asks=%s",
-                snapshot.symbol,
-                len(bids_json),
-                len(asks_json),
-            )
-            return
-        except Exception as exc:
-            logger.warning(
-                "Tentativa %s falhou ao persistir snapshot de %s: %s",
-                attempt,
-                snapshot.symbol,
-                exc,
-            )
-            if attempt < 5:
-                await asyncio.sleep(0.1 * attempt)
-            else:
-                logger.error("Falha definitiva ao persistir snapshot de %s", snapshot.symbol)
 
+async def persist_order_book_snapshots(snapshots: List[OrderBookSnapshot], db_pool: AsyncConnectionPool) -> bool:
+    """Persiste um lote de snapshots completos do livro de ofertas."""
+    return await _copy_order_book_rows(
+        db_pool,
+        "order_book_snapshots",
+        _ORDER_BOOK_SNAPSHOT_COLUMNS,
+        _ORDER_BOOK_SNAPSHOT_TYPES,
+        [_order_book_snapshot_row(snapshot) for snapshot in snapshots],
+    )
 
-async def persist_order_book_offer(offer: OrderBookOffer, db_pool: AsyncConnectionPool):
-    """Persiste eventos individuais de ofertas do livro (por agente)."""
-    logger.debug(f"🔄 Iniciando persistência de oferta: {offer.symbol} action={offer.action} side={offer.side} agent={offer.agent_id}")
-    
-    sql = """
-        INSERT INTO order_book_offers (
-            symbol,
-            event_time,
-            action,
-            side,
-            position,
-            price,
-            quantity,
-            agent_id,
-            offer_id,
-            flags
-        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-    """
 
-    params = (
+async def persist_order_book_snapshot(snapshot: OrderBookSnapshot, db_pool: AsyncConnectionPool):
+    """Persiste um snapshot completo do livro de ofertas."""
+    await persist_order_book_snapshots([snapshot], db_pool)
+
+
+def _order_book_offer_row(offer: OrderBookOffer) -> tuple:
+    return (
         offer.symbol,
         offer.timestamp,
         offer.action,
@@ -573,30 +460,18 @@ async def persist_order_book_offer(offer: OrderBookOffer, db_pool: AsyncConnecti
         offer.flags,
     )
 
-    for attempt in range(1, 6):
-        try:
-            async with db_pool.connection() as conn:
-                async with conn.cursor() as cur:
-                    await cur.execute(sql, params)
-                    await conn.commit()
-            logger.info(
-                "✅ Persisted order book offer %s side=%s price=%s agent=%s action=%s",
-                offer.symbol,
-                offer.side,
-                offer.price,
-                offer.agent_id,
-                offer.action,
-            )
-            return
-        except Exception as exc:
-            logger.warning(
-                "❌ Tentativa %s falhou ao persistir oferta (%s - agent %s): %s",
-                attempt,
-                offer.symbol,
-                offer.agent_id,
-                exc,
-            )
-            if attempt < 5:
-                await asyncio.sleep(0.1 * attempt)
-            else:
-                logger.error("💥 Falha definitiva ao persistir oferta de %s", offer.symbol)
\ No newline at end of file
+
+async def persist_order_book_offers(offers: List[OrderBookOffer], db_pool: AsyncConnectionPool) -> bool:
+    """Persiste um lote de eventos individuais de ofertas (por agente)."""
+    return await _copy_order_book_rows(
+        db_pool,
+        "order_book_offers",
+        _ORDER_BOOK_OFFER_COLUMNS,
+        _ORDER_BOOK_OFFER_TYPES,
+        [_order_book_offer_row(offer) for offer in offers],
+    )
+
+
+async def persist_order_book_offer(offer: OrderBookOffer, db_pool: AsyncConnectionPool):
+    """Persiste eventos individuais de ofertas do livro (por agente)."""
+    await persist_order_book_offers([offer], db_pool)
@@ -9,7 +9,6 @@ from __future__ import annotations
 from dataclasses import dataclass
 from typing import Callable, Optional, Dict, Any
 import ctypes
-import struct
 import threading
 from datetime import datetime, timezone
 
@@ -20,7 +19,11 @@ from services.high_frequency.config import (
 from services.high_frequency.models import OrderBookLevel, OrderBookSnapshot, OrderBookEvent
 from services.high_frequency.buffer import enqueue_order_book_event, enqueue_order_book_snapshot
 
+from services.market_feed_next.book_decode import HEADER, read_price_array
 from services.market_feed_next.dll import ProfitDLL as BaseProfitDLL
+from services.shared.order_book import (
+    ACTION_ADD, ACTION_EDIT, ACTION_DELETE, ACTION_DELETE_FROM, ACTION_FULL_BOOK, Level, OrderBook,
+)
 
 
 OrderBookCallback = Callable[[str, Dict[str, Any]], None]
@@ -42,8 +45,8 @@ class HFProfitClient:
         self._price_book_cb: Optional[OrderBookCallback] = None
         self._snapshot_cb: Optional[OrderBookCallback] = None
         self._connected = False
-        self._last_snapshot: Dict[str, datetime] = {}
-        self._book_state: Dict[str, Dict[str, list[OrderBookLevel]]] = {}
+        # Price book por símbolo (motor compartilhado com o feed da DLL)
+        self._books: Dict[str, OrderBook] = {}
         self._lock = threading.Lock()
         self._free_pointer = None
 
@@ -107,121 +110,47 @@ class HFProfitClient:
         array_buy = payload.get("array_buy") or 0
 
         with self._lock:
-            state = self._book_state.setdefault(symbol, {"bids": [], "asks": []})
-
-            if action == 4:  # snapshot completo
-                bids, asks = self._decode_arrays(array_buy, array_sell)
-                state["bids"] = bids
-                state["asks"] = asks
-                self._emit_snapshot(symbol, event_time, bids, asks)
-                self._emit_event(symbol, event_time, action, side, position, price, qty, count, array_buy, array_sell)
+            book = self._books.get(symbol)
+            if book is None:
+                book = self._books[symbol] = OrderBook(symbol, ORDER_BOOK_TOP_LEVELS, ORDER_BOOK_SNAPSHOT_INTERVAL_MS)
+
+            if action == ACTION_FULL_BOOK:  # snapshot completo
+                book.load(self._decode_array(array_buy), self._decode_array(array_sell))
+                self._emit_snapshot(book, event_time)
+                self._emit_event(book, event_time, action, side, position, price, qty, count, array_buy, array_sell)
                 return
 
-            levels = state["bids"] if side == 0 else state["asks"]
-
-            if action == 0:  # atAdd
-                self._handle_add(levels, position, price, qty, count)
-            elif action == 1:  # atEdit
-                self._handle_edit(levels, position, qty, count, price)
-            elif action == 2:  # atDelete
-                self._handle_delete(levels, position)
-            elif action == 3:  # atDeleteFrom
-                self._handle_delete_from(levels, position)
-            else:
+            if action not in (ACTION_ADD, ACTION_EDIT, ACTION_DELETE, ACTION_DELETE_FROM):
                 # desconhecido, ignora
                 return
+            book.apply(action, side, position, price, qty, count)
 
             # Emite evento incremental
-            self._emit_event(symbol, event_time, action, side, position, price, qty, count, array_buy, array_sell)
+            self._emit_event(book, event_time, action, side, position, price, qty, count, array_buy, array_sell)
 
             # Checa se precisamos emitir snapshot periódico
-            last_snapshot = self._last_snapshot.get(symbol)
-            if not last_snapshot or (event_time - last_snapshot).total_seconds() * 1000 >= ORDER_BOOK_SNAPSHOT_INTERVAL_MS:
-                bids_sorted = sorted(state["bids"], key=lambda lvl: lvl.price, reverse=True)[:ORDER_BOOK_TOP_LEVELS]
-                asks_sorted = sorted(state["asks"], key=lambda lvl: lvl.price)[:ORDER_BOOK_TOP_LEVELS]
-                self._emit_snapshot(symbol, event_time, bids_sorted, asks_sorted)
+            if book.snapshot_due(event_time.timestamp()):
+                self._emit_snapshot(book, event_time)
 
     # ------------------------------------------------------------------
     # Helpers
     # ------------------------------------------------------------------
 
-    def _decode_arrays(self, ptr_buy: int, ptr_sell: int) -> tuple[list[OrderBookLevel], list[OrderBookLevel]]:
-        bids = self._decode_array(ptr_buy)
-        asks = self._decode_array(ptr_sell)
-        return bids, asks
-
-    def _decode_array(self, ptr_value: int) -> list[OrderBookLevel]:
+    def _decode_array(self, ptr_value: int) -> list[Level]:
         if not ptr_value:
             return []
         if not self._free_pointer:
             raise RuntimeError("FreePointer não disponível; impossível liberar memória do callback")
 
-        result: list[OrderBookLevel] = []
-        ptr = ctypes.c_void_p(ptr_value)
-
-        # Cabeçalho: qtd (4 bytes) + size (4 bytes)
-        header = (ctypes.c_ubyte * 8).from_address(ptr_value)
-        count = int.from_bytes(bytes(header[:4]), "little", signed=False)
-        total_size = int.from_bytes(bytes(header[4:8]), "little", signed=False)
-
-        offset = 8
-        for _ in range(count):
-            # price (8 bytes)
-            price_bytes = (ctypes.c_ubyte * 8).from_address(ptr_value + offset)
-            price = struct.unpack("<d", bytes(price_bytes))[0]
-            offset += 8
-
-            # quantity (8 bytes para V2)
-            qty_bytes = (ctypes.c_ubyte * 8).from_address(ptr_value + offset)
-            quantity = struct.unpack("<q", bytes(qty_bytes))[0]
-            offset += 8
-
-            # count (4 bytes)
-            count_bytes = (ctypes.c_ubyte * 4).from_address(ptr_value + offset)
-            offer_count = struct.unpack("<i", bytes(count_bytes))[0]
-            offset += 4
-
-            result.append(
-                OrderBookLevel(
-                    price=float(price),
-                    quantity=int(quantity),
-                    offer_count=int(offer_count),
-                )
-            )
-
+        levels = read_price_array(ptr_value)
+        _, total_size = HEADER.unpack(ctypes.string_at(ptr_value, HEADER.size))
         # Libera memória alocada pela DLL
-        self._free_pointer(ptr, total_size)
-        return result
-
-    def _handle_add(self, levels: list[OrderBookLevel], position: int, price: float, qty: int, count: int) -> None:
-        idx = len(levels) - position
-        if idx < 0:
-            idx = 0
-        if idx > len(levels):
-            idx = len(levels)
-        levels.insert(idx, OrderBookLevel(price=price, quantity=qty, offer_count=count))
-
-    def _handle_edit(self, levels: list[OrderBookLevel], position: int, qty: int, count: int, price: float) -> None:
-        idx = len(levels) - position - 1
-        if 0 <= idx < len(levels):
-            level = levels[idx]
-            level.quantity = qty
-            level.offer_count = count
-            level.price = price or level.price
-
-    def _handle_delete(self, levels: list[OrderBookLevel], position: int) -> None:
-        idx = len(levels) - position - 1
-        if 0 <= idx < len(levels):
-            levels.pop(idx)
-
-    def _handle_delete_from(self, levels: list[OrderBookLevel], position: int) -> None:
-        idx = len(levels) - position - 1
-        if 0 <= idx < len(levels):
-            del levels[idx:]
+        self._free_pointer(ctypes.c_void_p(ptr_value), total_size)
+        return levels
 
     def _emit_event(
         self,
-        symbol: str,
+        book: OrderBook,
         event_time: datetime,
         action: int,
         side: int,
@@ -232,6 +161,7 @@ class HFProfitClient:
         raw_buy_ptr: int,
         raw_sell_ptr: int,
     ) -> None:
+        symbol = book.symbol
         event = OrderBookEvent(
             symbol=symbol,
             timestamp=event_time,
@@ -241,6 +171,7 @@ class HFProfitClient:
             price=price,
             quantity=qty,
             offer_count=count,
+            sequence=book.sequence,
             raw_payload={
                 "raw_buy_ptr": raw_buy_ptr,
                 "raw_sell_ptr": raw_sell_ptr,
@@ -250,23 +181,16 @@ class HFProfitClient:
         if self._price_book_cb:
             self._price_book_cb(symbol, {"event": event})
 
-    def _emit_snapshot(
-        self,
-        symbol: str,
-        event_time: datetime,
-        bids: list[OrderBookLevel],
-        asks: list[OrderBookLevel],
-    ) -> None:
+    def _emit_snapshot(self, book: OrderBook, event_time: datetime) -> None:
+        bids, asks = book.top()
         snapshot = OrderBookSnapshot(
-            symbol=symbol,
+            symbol=book.symbol,
             timestamp=event_time,
-            bids=bids,
-            asks=asks,
-            sequence=None,
+            bids=[OrderBookLevel(price=p, quantity=q, offer_count=c) for p, q, c in bids],
+            asks=[OrderBookLevel(price=p, quantity=q, offer_count=c) for p, q, c in asks],
+            sequence=book.sequence,
         )
+        book.last_snapshot_at = event_time.timestamp()
         enqueue_order_book_snapshot(snapshot)
         if self._snapshot_cb:
-            self._snapshot_cb(symbol, {"snapshot": snapshot})
-        self._last_snapshot[symbol] = event_time
-
-
+            self._snapshot_cb(book.symbol, {"snapshot": snapshot, "metrics": book.metrics()})
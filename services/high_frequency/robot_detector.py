@@ -1,8 +1,9 @@
 import logging
 import asyncio
 from datetime import datetime, timezone, timedelta, time
-from typing import List, Dict, Optional, Tuple, DefaultDict
+from typing import Callable, List, Dict, Optional, Tuple, DefaultDict
 from collections import defaultdict
+from functools import partial
 import statistics
 import math
 
@@ -15,6 +16,11 @@ try:
     from .robot_persistence import RobotPersistence
     from .agent_mapping import get_agent_name
     from .market_twap_detector import MarketTWAPDetector
+    from .incremental_twap import PatternDelta, SymbolTWAPState, TradeAccumulator
+    from .config import TWAP_DETECTION_MODE, TWAP_SETTLE_SECONDS, TWAP_VECTORIZED, TWAP_MAX_CONCURRENCY
+    from .tick_store import TickStore, tick_store as shared_tick_store
+    from .activity_index import AgentActivityIndex, VolumeIndex, agent_activity_index, volume_index as shared_volume_index
+    from .vectorized_twap import AgentTradeArrays, cluster_indices, trade_stats, np
 except ImportError:
     from robot_models import (
         TWAPPattern, RobotTrade, TradeType, RobotStatus, 
@@ -23,9 +29,19 @@ except ImportError:
     from robot_persistence import RobotPersistence
     from agent_mapping import get_agent_name
     from market_twap_detector import MarketTWAPDetector
+    from incremental_twap import PatternDelta, SymbolTWAPState, TradeAccumulator
+    from config import TWAP_DETECTION_MODE, TWAP_SETTLE_SECONDS, TWAP_VECTORIZED, TWAP_MAX_CONCURRENCY
+    from tick_store import TickStore, tick_store as shared_tick_store
+    from activity_index import AgentActivityIndex, VolumeIndex, agent_activity_index, volume_index as shared_volume_index
+    from vectorized_twap import AgentTradeArrays, cluster_indices, trade_stats, np
 
 logger = logging.getLogger(__name__)
 
+
+def _utc_now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
 class RobotStatusTracker:
     """Rastreador de mudanças de status dos robôs"""
     
@@ -146,9 +162,27 @@ class RobotStatusTracker:
 class TWAPDetector:
     """Detector de padrões TWAP (Time-Weighted Average Price)"""
     
-    def __init__(self, config: TWAPDetectionConfig, persistence: RobotPersistence):
+    DETECTION_MODES = ("incremental", "full", "verify")
+
+    def __init__(
+        self,
+        config: TWAPDetectionConfig,
+        persistence: RobotPersistence,
+        mode: Optional[str] = None,
+        activity_index: Optional[AgentActivityIndex] = None,
+        volume_index: Optional[VolumeIndex] = None,
+        tick_store: Optional[TickStore] = None,
+    ):
         self.config = config
         self.persistence = persistence
+        # Último trade por (símbolo, agente), alimentado pela ingestão
+        self.activity_index = activity_index or agent_activity_index
+        # Volume financeiro por minuto (mercado e agentes) para o volume %
+        self.volume_index = volume_index or shared_volume_index
+        # Ticks do pregão em memória; o banco só é consultado para o que não está coberto
+        self.tick_store = tick_store or shared_tick_store
+        # Padrões (símbolo, agente, assinatura) já notificados como inativos
+        self.inactivity_notified: set = set()
         self.active_patterns: Dict[str, Dict[int, Dict[str, TWAPPattern]]] = defaultdict(lambda: defaultdict(dict))
         self.status_tracker = RobotStatusTracker()  # Adiciona tracker de status
         
@@ -171,10 +205,50 @@ class TWAPDetector:
         market_twap_config.min_confidence = 0.3  # Reduzido de 0.75 para 0.3
         market_twap_config.min_time_intervals = 1  # Reduzido de 5 para 1
         market_twap_config.time_consistency_threshold = 0.1  # Reduzido de 0.75 para 0.1
-        self.market_twap_detector = MarketTWAPDetector(market_twap_config)
+        self.market_twap_detector = MarketTWAPDetector(market_twap_config, persistence=self.persistence)
         
         # ✅ NOVO: Histerese de ativação para evitar flip-flop imediato
         self.activation_times: Dict[Tuple[str, int, str], datetime] = {}
+        self.activation_cooldown_seconds: int = 90
+
+        # Detecção incremental: acumuladores por símbolo mantidos entre ciclos
+        self.detection_mode = (mode or TWAP_DETECTION_MODE).lower()
+        if self.detection_mode not in self.DETECTION_MODES:
+            logger.warning(f"⚠️ Modo de detecção TWAP desconhecido '{self.detection_mode}', usando 'incremental'")
+            self.detection_mode = "incremental"
+        self.settle_seconds = TWAP_SETTLE_SECONDS
+        # Relógio do corte da janela (agora - folga) e do gate de recência; testes fixam o instante
+        self.clock: Callable[[], datetime] = _utc_now
+        self.incremental_states: Dict[str, SymbolTWAPState] = {}
+        self.verify_stats = {"cycles": 0, "mismatches": 0, "last_mismatch": None}
+        # Estados descartados por ticks gravados atrás da marca d'água (rewind)
+        self.rewinds = 0
+        # Recálculo completo em colunas NumPy (mesmos resultados de _cluster_trades/_analyze_agent_trades)
+        self.vectorized = TWAP_VECTORIZED and np is not None
+        # Acumuladores incrementais em processos separados, por shard de símbolos (enable_workers)
+        self.workers = None
+
+    def enable_workers(self, workers: int) -> None:
+        """Modo incremental em `workers` processos: cada shard de símbolos mantém seus
+        acumuladores em um processo dedicado e este processo só busca ticks e grava.
+        Estados já carregados (snapshot) são repassados aos shards."""
+        if workers <= 0 or self.workers is not None:
+            return
+        if self.detection_mode != "incremental":
+            logger.warning(f"⚠️ Workers de detecção só valem no modo incremental (modo atual: {self.detection_mode})")
+            return
+        try:
+            from .detection_workers import ShardedDetection
+        except ImportError:
+            from detection_workers import ShardedDetection
+        self.workers = ShardedDetection(self, workers)
+        self.workers.import_states(self.incremental_states)
+        self.incremental_states.clear()
+
+    def close_workers(self) -> None:
+        if self.workers is not None:
+            self.workers.close()
+            self.workers = None
 
     def _build_signature_key(
         self,
@@ -232,8 +306,21 @@ class TWAPDetector:
             clusters[(avg_volume, direction, avg_interval)] = trade_list_sorted
 
         return clusters
-        self.activation_cooldown_seconds: int = 90
     
+    async def _fetch_ticks_since(self, symbol: str, start_time: datetime) -> List[dict]:
+        """Ticks desde start_time: armazém em memória primeiro, banco se não coberto"""
+        ticks_data = self.tick_store.query(symbol, start_time)
+        if ticks_data is not None:
+            return ticks_data
+        return await self.persistence.get_ticks_since(symbol, start_time)
+
+    async def _fetch_ticks_between(self, symbol: str, start_time: datetime, end_time: datetime) -> Optional[List[dict]]:
+        """Ticks em [start_time, end_time): armazém em memória primeiro, banco se não coberto"""
+        ticks_data = self.tick_store.query(symbol, start_time, end_time)
+        if ticks_data is not None:
+            return ticks_data
+        return await self.persistence.get_ticks_between(symbol, start_time, end_time)
+
     def _to_utc(self, dt: datetime) -> datetime:
         """Garante que o datetime seja timezone-aware em UTC"""
         if dt is None:
@@ -243,23 +330,44 @@ class TWAPDetector:
         return dt.astimezone(timezone.utc)
 
     async def analyze_symbol(self, symbol: str) -> List[TWAPPattern]:
+        """Analisa um símbolo conforme o modo de detecção configurado
+        - incremental: consome só os ticks novos desde a marca d'água do símbolo
+        - full: recalcula tudo a partir dos ticks do dia (analyze_symbol_full)
+        - verify: incremental + recálculo completo sem persistir, comparando os resultados
+        """
+        if self.detection_mode == "full":
+            return await self.analyze_symbol_full(symbol)
+
+        patterns = await self._analyze_symbol_incremental(symbol)
+        if self.detection_mode == "verify":
+            await self._verify_incremental(symbol, patterns)
+        return patterns
+
+    async def analyze_symbol_full(
+        self,
+        symbol: str,
+        ticks_data: Optional[List[dict]] = None,
+        persist: bool = True,
+    ) -> List[TWAPPattern]:
         """Analisa um símbolo específico para detectar padrões TWAP
         Estratégia em duas fases para reduzir latência:
         - Fase rápida: busca ticks dos últimos 60 minutos para atualizar robôs ativos
         - Fase completa (fallback): se nada encontrado, analisa janela maior (24h)
+        Com `ticks_data` informado usa esses ticks; com persist=False não grava nada.
         """
         try:
             logger.info(f"Analisando {symbol} para padrões TWAP...")
             
-            # Janela do dia: considera apenas dados desde o início do pregão
-            now_utc = datetime.now(timezone.utc)
-            start_of_day = datetime.combine(now_utc.date(), time.min, tzinfo=timezone.utc)
-
-            # FASE 1: janela curta para atualização rápida (< 1 min sem atualização)
-            if start_of_day is None:
-                ticks_data = await self.persistence.get_recent_ticks_minutes(symbol, 60)
-            else:
-                ticks_data = await self.persistence.get_ticks_since(symbol, start_of_day)
+            if ticks_data is None:
+                # Janela do dia: considera apenas dados desde o início do pregão
+                now_utc = self.clock()
+                start_of_day = datetime.combine(now_utc.date(), time.min, tzinfo=timezone.utc)
+
+                # FASE 1: janela curta para atualização rápida (< 1 min sem atualização)
+                if start_of_day is None:
+                    ticks_data = await self.persistence.get_recent_ticks_minutes(symbol, 60)
+                else:
+                    ticks_data = await self._fetch_ticks_since(symbol, start_of_day)
             
             if not ticks_data:
                 logger.info(f"Nenhum tick encontrado hoje para {symbol}")
@@ -275,16 +383,26 @@ class TWAPDetector:
                 if len(trades) < self.config.min_trades:
                     continue
 
-                clusters = self._cluster_trades(trades)
+                if self.vectorized:
+                    # Clusters e estatísticas viram índices sobre as colunas do agente
+                    arrays = AgentTradeArrays(trades)
+                    clusters = cluster_indices(arrays, self.config.min_trades)
+                    analyze = partial(self._analyze_agent_arrays, arrays)
+                    all_trades = arrays.sorted_index()
+                else:
+                    clusters = self._cluster_trades(trades)
+                    analyze = self._analyze_agent_trades
+                    all_trades = trades
 
                 # Primeiro: padrão agregado de pressão (volume líquido da corretora)
-                aggregated_pattern = await self._analyze_agent_trades(
+                aggregated_pattern = await analyze(
                     symbol,
                     agent_id,
-                    trades,
+                    all_trades,
                     signature_volume=None,
                     signature_direction=None,
                     signature_interval_seconds=None,
+                    persist=persist,
                 )
                 if aggregated_pattern and aggregated_pattern.confidence_score >= self.config.min_confidence:
                     signature = self._build_signature_key(
@@ -301,18 +419,20 @@ class TWAPDetector:
                         signature = pressure_signature
 
                     detected_patterns.append(aggregated_pattern)
-                    await self._persist_pattern(aggregated_pattern, signature)
+                    if persist:
+                        await self._persist_pattern(aggregated_pattern, signature)
 
                 for signature, cluster_trades in clusters.items():
                     signature_volume, signature_direction, signature_interval = signature
 
-                    pattern = await self._analyze_agent_trades(
+                    pattern = await analyze(
                         symbol,
                         agent_id,
                         cluster_trades,
                         signature_volume=signature_volume,
                         signature_direction=signature_direction,
                         signature_interval_seconds=signature_interval,
+                        persist=persist,
                     )
 
                     if pattern and pattern.confidence_score >= self.config.min_confidence:
@@ -333,7 +453,8 @@ class TWAPDetector:
 
                         detected_patterns.append(pattern)
 
-                        await self._persist_pattern(pattern, signature_key)
+                        if persist:
+                            await self._persist_pattern(pattern, signature_key)
             
             # ✅ NOVO: Detecta padrões TWAP à Mercado (janela curta primeiro)
             logger.info(f"Analisando {symbol} para padrões TWAP à Mercado...")
@@ -349,6 +470,8 @@ class TWAPDetector:
 
                     for pattern in market_twap_patterns:
                         if pattern and pattern.confidence_score >= self.market_twap_detector.config.min_confidence:
+                            # A chave do cluster é "volume:trade_type"; a assinatura vem do próprio cluster
+                            self._apply_market_signature(pattern, cluster_trades[0].volume, cluster_trades[0].trade_type)
                             signature_key = self._build_signature_key(
                                 pattern.signature_volume,
                                 pattern.signature_direction,
@@ -356,15 +479,12 @@ class TWAPDetector:
                             )
                             detected_patterns.append(pattern)
 
-                            pattern.signature_volume = signature['signature_volume']
-                            pattern.signature_direction = signature['signature_direction']
-                            pattern.signature_interval_seconds = signature['signature_interval_seconds']
-
-                            # Salva o padrão e seus trades
-                            await self.market_twap_detector.save_pattern_and_trades(pattern, cluster_trades)
+                            if persist:
+                                # Salva o padrão e seus trades
+                                await self.market_twap_detector.save_pattern_and_trades(pattern, cluster_trades)
 
-                            # ✅ NOVO: Armazena no active_patterns para exibição
-                            await self._persist_pattern(pattern, signature_key)
+                                # ✅ NOVO: Armazena no active_patterns para exibição
+                                await self._persist_pattern(pattern, signature_key)
             
             # Conta padrões TWAP à Mercado
             market_twap_count = sum(1 for p in detected_patterns if p.robot_type == RobotType.MARKET_TWAP.value)
@@ -375,6 +495,372 @@ class TWAPDetector:
             logger.error(f"Erro ao analisar {symbol}: {e}")
             return []
     
+    def _incremental_state(self, symbol: str, start_of_day: datetime) -> SymbolTWAPState:
+        """Retorna o estado incremental do símbolo, reiniciando na virada do dia"""
+        state = self.incremental_states.get(symbol)
+        if state is None or state.day != start_of_day.date():
+            # Descarta estados de pregões anteriores (inclusive de símbolos que sumiram)
+            for stale in [s for s, st in self.incremental_states.items() if st.day != start_of_day.date()]:
+                del self.incremental_states[stale]
+            state = SymbolTWAPState(day=start_of_day.date(), watermark=start_of_day)
+            self.incremental_states[symbol] = state
+        return state
+
+    def rewind(self, symbol: str, oldest: datetime) -> bool:
+        """Ticks gravados com timestamp anterior à marca d'água (atrasados além da folga,
+        replay do journal, backfill) nunca seriam consumidos: descarta o estado do símbolo
+        para que o próximo ciclo o releia desde o início do dia. Regravar os padrões é
+        seguro: _append_robot_trades vincula também os trades atrás da marca do padrão,
+        conferindo os vínculos já gravados, então os atrasados entram sem duplicar."""
+        if self.workers is not None:
+            rewound = self.workers.rewind(symbol, oldest)
+        else:
+            state = self.incremental_states.get(symbol)
+            rewound = state is not None and oldest < state.watermark
+            if rewound:
+                del self.incremental_states[symbol]
+        if rewound:
+            self.rewinds += 1
+            logger.info(f"⏪ Ticks de {symbol} desde {oldest.isoformat()} atrás da marca d'água; estado incremental refeito no próximo ciclo")
+        return rewound
+
+    def rewind_for_ticks(self, ticks) -> int:
+        """Aplica rewind ao tick mais antigo de cada símbolo de um lote gravado
+        (ouvinte de commit de persistence.persist_ticks)"""
+        oldest: Dict[str, float] = {}
+        for tick in ticks:
+            ts = tick.timestamp
+            if ts < oldest.get(tick.symbol, math.inf):
+                oldest[tick.symbol] = ts
+        return sum(
+            self.rewind(symbol, datetime.fromtimestamp(ts, tz=timezone.utc))
+            for symbol, ts in oldest.items()
+        )
+
+    def _pattern_from_accumulator(
+        self,
+        symbol: str,
+        agent_id: int,
+        acc: TradeAccumulator,
+        signature_volume: Optional[int] = None,
+        signature_direction: Optional[str] = None,
+        signature_interval_seconds: Optional[float] = None,
+    ) -> TWAPPattern:
+        if acc.count > 1:
+            avg_frequency = acc.avg_interval_seconds / 60.0
+        else:
+            avg_frequency = self.config.max_frequency_minutes
+        return self._pattern_from_stats(
+            symbol,
+            agent_id,
+            total_trades=acc.count,
+            gross_volume=acc.volume_sum,
+            buy_volume=acc.buy_volume,
+            sell_volume=acc.sell_volume,
+            avg_frequency=avg_frequency,
+            price_variation=acc.price_variation,
+            price_aggression=acc.price_aggression,
+            first_seen=acc.first_ts,
+            last_seen=acc.last_ts,
+            exchange=acc.exchange,
+            signature_volume=signature_volume,
+            signature_direction=signature_direction,
+            signature_interval_seconds=signature_interval_seconds,
+        )
+
+    def _apply_market_signature(self, pattern: TWAPPattern, volume: int, trade_type: TradeType) -> None:
+        """Assinatura de um padrão TWAP à Mercado: volume e direção do cluster + intervalo médio"""
+        pattern.signature_volume = int(volume)
+        pattern.signature_direction = 'buy' if trade_type == TradeType.BUY else 'sell'
+        pattern.signature_interval_seconds = pattern.frequency_minutes * 60.0
+
+    async def _analyze_symbol_incremental(self, symbol: str) -> List[TWAPPattern]:
+        """Detecção incremental: consome apenas os ticks em [marca d'água, agora - folga)
+        e remonta os padrões a partir dos acumuladores. O resultado é o mesmo de
+        analyze_symbol_full sobre os ticks até a marca d'água.
+
+        Só padrões cujos acumuladores receberam trades novos (ou cujo status mudou
+        pelo gate de recência) são regravados, e apenas com os trades ainda não vinculados.
+        Com workers (enable_workers) os acumuladores ficam nos processos de cada shard.
+        """
+        if self.workers is not None:
+            return await self.workers.analyze_symbol(symbol)
+        try:
+            now_utc = self.clock()
+            start_of_day = datetime.combine(now_utc.date(), time.min, tzinfo=timezone.utc)
+            state = self._incremental_state(symbol, start_of_day)
+
+            upper = max(now_utc - timedelta(seconds=self.settle_seconds), state.watermark)
+            state.last_batch_size = 0
+            if upper > state.watermark:
+                ticks_data = await self._fetch_ticks_between(symbol, state.watermark, upper)
+                if ticks_data is None:
+                    logger.warning(f"⚠️ Falha ao buscar ticks novos de {symbol}; marca d'água mantida em {state.watermark.isoformat()}")
+                else:
+                    self._consume_ticks(state, ticks_data, upper)
+
+            if not state.agents:
+                logger.info(f"Nenhum tick encontrado hoje para {symbol}")
+                return []
+
+            logger.info(f"Analisando {symbol} para padrões TWAP (incremental, {state.last_batch_size} ticks novos)...")
+
+            deltas = self._incremental_deltas(symbol, state)
+            return await self._persist_deltas(
+                symbol, deltas, lambda delta: state.take_pending(delta.kind, delta.agent_id, delta.key)
+            )
+
+        except Exception as e:
+            logger.error(f"Erro ao analisar {symbol} (incremental): {e}")
+            return []
+
+    def _consume_ticks(self, state: SymbolTWAPState, ticks_data: List[dict], upper: datetime) -> None:
+        """Alimenta os acumuladores com os ticks em [marca d'água, upper) e avança a marca"""
+        for agent_id, trades in self._group_trades_by_agent(ticks_data).items():
+            state.add_trades(agent_id, trades)
+        state.watermark = upper
+        state.last_batch_size = len(ticks_data)
+        state.ticks_consumed += len(ticks_data)
+
+    def _incremental_deltas(self, symbol: str, state: SymbolTWAPState) -> List[PatternDelta]:
+        """Parte só de CPU do ciclo incremental: remonta os padrões dos acumuladores,
+        atualiza status/dirty e diz o que precisa ser gravado (sem tocar no banco)"""
+        deltas: List[PatternDelta] = []
+        min_trades = self.config.min_trades
+        min_confidence = self.config.min_confidence
+        market_config = self.market_twap_detector.config
+
+        for agent_id, agent in state.agents.items():
+            aggregate = agent.aggregate
+            if aggregate.count < min_trades:
+                continue
+
+            # Primeiro: padrão agregado de pressão (volume líquido da corretora)
+            aggregated_pattern = self._pattern_from_accumulator(symbol, agent_id, aggregate)
+            if aggregated_pattern.confidence_score >= min_confidence:
+                changed = aggregate.dirty or aggregate.last_status != aggregated_pattern.status
+                deltas.append(PatternDelta(
+                    PatternDelta.AGGREGATE, agent_id, None, aggregated_pattern, changed,
+                    aggregate.pending if changed else [],
+                ))
+                aggregate.last_status = aggregated_pattern.status
+
+            # Clusters (volume, direção); sem nenhum qualificado, o agente inteiro vira um cluster
+            clusters = agent.qualified_clusters(min_trades)
+            if clusters:
+                agent.fallback_pending = []
+                candidates = [
+                    (key, acc, key[0], key[1], acc.avg_interval_seconds)
+                    for key, acc in clusters
+                ]
+            else:
+                candidates = [(
+                    None,
+                    None,
+                    int(round(aggregate.avg_trade_size)),
+                    aggregate.majority_direction,
+                    aggregate.avg_interval_seconds,
+                )]
+
+            for key, acc, signature_volume, signature_direction, signature_interval in candidates:
+                source = acc or aggregate
+                pattern = self._pattern_from_accumulator(
+                    symbol,
+                    agent_id,
+                    source,
+                    signature_volume=signature_volume,
+                    signature_direction=signature_direction,
+                    signature_interval_seconds=signature_interval,
+                )
+                if pattern.confidence_score < min_confidence:
+                    continue
+
+                last_status = acc.last_status if acc else agent.fallback_status
+                changed = source.dirty or last_status != pattern.status
+                pending = acc.pending if acc else agent.fallback_pending
+                deltas.append(PatternDelta(
+                    PatternDelta.CLUSTER if acc else PatternDelta.FALLBACK, agent_id, key, pattern, changed,
+                    pending if changed else [],
+                ))
+                if acc:
+                    acc.last_status = pattern.status
+                else:
+                    agent.fallback_status = pattern.status
+
+            # TWAP à Mercado por cluster (volume, direção)
+            if aggregate.count >= market_config.min_volume_repetitions:
+                for (volume, trade_type), market_acc in agent.market.items():
+                    pattern = self.market_twap_detector.detect_from_accumulator(
+                        agent_id, symbol, volume, trade_type, market_acc
+                    )
+                    if not pattern or pattern.confidence_score < market_config.min_confidence:
+                        continue
+
+                    self._apply_market_signature(pattern, volume, trade_type)
+                    cluster_trades: List[TickData] = []
+                    if market_acc.dirty:
+                        # O vínculo de trades exige min_volume_repetitions agressões no lote;
+                        # abaixo disso os trades ficam pendentes para o próximo ciclo
+                        if market_acc.pending_aggressors >= market_config.min_volume_repetitions:
+                            cluster_trades = market_acc.take_pending()
+                        else:
+                            cluster_trades = list(market_acc.pending)
+                    deltas.append(PatternDelta(
+                        PatternDelta.MARKET, agent_id, (volume, trade_type), pattern, market_acc.dirty, cluster_trades,
+                    ))
+
+            aggregate.dirty = False
+            for acc in agent.clusters.values():
+                acc.dirty = False
+            for market_acc in agent.market.values():
+                market_acc.dirty = False
+
+        return deltas
+
+    async def _persist_deltas(
+        self,
+        symbol: str,
+        deltas: List[PatternDelta],
+        on_saved: Callable[[PatternDelta], None],
+    ) -> List[TWAPPattern]:
+        """Grava os padrões alterados de um ciclo incremental; `on_saved` recebe cada
+        delta gravado junto com seus trades (para descartar os pendentes)"""
+        detected_patterns = []
+        for delta in deltas:
+            pattern = delta.pattern
+
+            if delta.kind == PatternDelta.MARKET:
+                signature_key = self._build_signature_key(
+                    pattern.signature_volume,
+                    pattern.signature_direction,
+                    pattern.signature_interval_seconds,
+                )
+                detected_patterns.append(pattern)
+                if delta.changed:
+                    await self.market_twap_detector.save_pattern_and_trades(pattern, delta.trades)
+                    await self._persist_pattern(pattern, signature_key)
+                continue
+
+            if delta.changed and await self._save_pattern_with_trades(pattern, delta.trades):
+                on_saved(delta)
+
+            if delta.kind == PatternDelta.AGGREGATE:
+                signature = self._build_signature_key(
+                    pattern.signature_volume,
+                    pattern.signature_direction,
+                    pattern.signature_interval_seconds,
+                )
+                if pattern.robot_type in self.pressure_robot_types:
+                    direction = pattern.signature_direction or 'neutral'
+                    pattern.signature_volume = pattern.total_volume
+                    pattern.signature_interval_seconds = None
+                    signature = f"pressure:{symbol}:{direction}"
+
+                detected_patterns.append(pattern)
+                if delta.changed:
+                    await self._persist_pattern(pattern, signature)
+                continue
+
+            if pattern.robot_type in self.pressure_robot_types:
+                continue
+
+            signature_key = self._build_signature_key(
+                pattern.signature_volume,
+                pattern.signature_direction,
+                pattern.signature_interval_seconds,
+            )
+            detected_patterns.append(pattern)
+            if delta.changed:
+                await self._persist_pattern(pattern, signature_key)
+
+        market_twap_count = sum(1 for p in detected_patterns if p.robot_type == RobotType.MARKET_TWAP.value)
+        logger.info(f"Detectados {len(detected_patterns)} padrões TWAP para {symbol} (incluindo {market_twap_count} TWAP à Mercado)")
+        return detected_patterns
+
+    async def _verify_incremental(self, symbol: str, patterns: List[TWAPPattern]) -> bool:
+        """Modo verify: recalcula o símbolo do zero até a marca d'água (sem persistir)
+        e compara com o resultado incremental"""
+        state = self.incremental_states.get(symbol)
+        if state is None:
+            return True
+
+        start_of_day = datetime.combine(state.day, time.min, tzinfo=timezone.utc)
+        ticks_data = await self._fetch_ticks_between(symbol, start_of_day, state.watermark)
+        if ticks_data is None:
+            return False
+
+        expected = await self.analyze_symbol_full(symbol, ticks_data=ticks_data, persist=False)
+        mismatches = self._compare_patterns(expected, patterns)
+
+        self.verify_stats["cycles"] += 1
+        if mismatches:
+            self.verify_stats["mismatches"] += len(mismatches)
+            self.verify_stats["last_mismatch"] = {
+                "symbol": symbol,
+                "timestamp": datetime.now(timezone.utc).isoformat(),
+                "details": mismatches[:5],
+            }
+            for mismatch in mismatches[:5]:
+                logger.warning(f"🔎 Divergência incremental x completo em {symbol}: {mismatch}")
+            return False
+
+        logger.debug(f"🔎 Verificação incremental OK para {symbol} ({len(patterns)} padrões)")
+        return True
+
+    def _compare_patterns(self, expected: List[TWAPPattern], actual: List[TWAPPattern]) -> List[str]:
+        """Compara dois conjuntos de padrões; robot_type e market_volume_percentage
+        ficam de fora pois dependem do banco, não dos ticks"""
+        def key(p: TWAPPattern):
+            volume = p.signature_volume if p.pattern_type == "MARKET_TWAP" else None
+            return (p.pattern_type, p.agent_id, p.signature_direction, volume)
+
+        exact_fields = ("total_trades", "total_volume", "status", "first_seen", "last_seen",
+                        "exchange", "signature_volume", "signature_direction")
+        float_fields = ("avg_trade_size", "frequency_minutes", "price_aggression",
+                        "confidence_score", "signature_interval_seconds")
+
+        expected_by_key = {key(p): p for p in expected}
+        actual_by_key = {key(p): p for p in actual}
+        mismatches: List[str] = []
+
+        for k in expected_by_key.keys() - actual_by_key.keys():
+            mismatches.append(f"{k} ausente no incremental")
+        for k in actual_by_key.keys() - expected_by_key.keys():
+            mismatches.append(f"{k} ausente no recálculo completo")
+
+        for k in expected_by_key.keys() & actual_by_key.keys():
+            exp, act = expected_by_key[k], actual_by_key[k]
+            for field in exact_fields:
+                if getattr(exp, field) != getattr(act, field):
+                    mismatches.append(f"{k} {field}: {getattr(exp, field)} != {getattr(act, field)}")
+            for field in float_fields:
+                a, b = getattr(exp, field), getattr(act, field)
+                if a is None or b is None:
+                    if a is not b:
+                        mismatches.append(f"{k} {field}: {a} != {b}")
+                elif not math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-9):
+                    mismatches.append(f"{k} {field}: {a} != {b}")
+
+        return mismatches
+
+    def get_detection_status(self) -> Dict:
+        """Resumo do modo de detecção e do estado incremental (para /metrics)"""
+        states = self.incremental_states.values()
+        status = {
+            "mode": self.detection_mode,
+            "vectorized": self.vectorized,
+            "symbols_tracked": len(self.incremental_states),
+            "agents_tracked": sum(len(s.agents) for s in states),
+            "ticks_consumed": sum(s.ticks_consumed for s in states),
+            "last_cycle_new_ticks": sum(s.last_batch_size for s in states),
+            "rewinds": self.rewinds,
+        }
+        if self.detection_mode == "verify":
+            status["verify"] = dict(self.verify_stats)
+        if self.workers is not None:
+            status.update(self.workers.get_status())
+        return status
+
     def _group_trades_by_agent(self, ticks_data: List[dict]) -> Dict[int, List[TickData]]:
         """Agrupa trades por agente (buy ou sell)"""
         agent_trades = defaultdict(list)
@@ -390,7 +876,8 @@ class TWAPDetector:
                     trade_type=TradeType.BUY,
                     agent_id=tick['buy_agent'],
                     exchange=tick['exchange'],
-                    raw_trade_type=tick.get('trade_type', 2)  # ✅ NOVO: trade_type real da tabela
+                    raw_trade_type=tick.get('trade_type', 2),  # ✅ NOVO: trade_type real da tabela
+                    trade_id=tick.get('trade_id'),
                 )
                 agent_trades[tick['buy_agent']].append(buy_tick)
             
@@ -404,7 +891,8 @@ class TWAPDetector:
                     trade_type=TradeType.SELL,
                     agent_id=tick['sell_agent'],
                     exchange=tick['exchange'],
-                    raw_trade_type=tick.get('trade_type', 3)  # ✅ NOVO: trade_type real da tabela
+                    raw_trade_type=tick.get('trade_type', 3),  # ✅ NOVO: trade_type real da tabela
+                    trade_id=tick.get('trade_id'),
                 )
                 agent_trades[tick['sell_agent']].append(sell_tick)
         
@@ -418,18 +906,16 @@ class TWAPDetector:
         signature_volume: Optional[int] = None,
         signature_direction: Optional[str] = None,
         signature_interval_seconds: Optional[float] = None,
+        persist: bool = True,
     ) -> Optional[TWAPPattern]:
         try:
             # Ordena por tempo crescente
             trades = sorted(trades, key=lambda t: t.timestamp)
             total_trades = len(trades)
             gross_volume = sum(t.volume for t in trades)
-            avg_trade_size = gross_volume / total_trades if total_trades > 0 else 0
 
             buy_volume_total = sum(t.volume for t in trades if t.trade_type == TradeType.BUY)
             sell_volume_total = sum(t.volume for t in trades if t.trade_type == TradeType.SELL)
-            net_volume = buy_volume_total - sell_volume_total
-            net_volume_abs = abs(net_volume)
             
             # Calcula frequência média entre trades (minutos)
             if total_trades > 1:
@@ -445,74 +931,28 @@ class TWAPDetector:
             prices = [t.price for t in trades]
             price_variation = ((max(prices) - min(prices)) / prices[0]) * 100 if prices else 0.0
             price_aggression = self._calculate_price_aggression(trades)
-            
-            # Score de confiança
-            confidence_score = self._calculate_confidence_score(
-                total_trades, avg_frequency, price_variation, price_aggression
-            )
-            
-            # Determina status preliminar
-            status = self._determine_status(confidence_score, avg_frequency, price_variation)
-            
-            # ✅ NOVO: Gate de recência - se último trade for antigo, força INACTIVE
-            last_seen = trades[-1].timestamp
-            now_utc = datetime.now(timezone.utc)
-            recency_minutes = (now_utc - last_seen).total_seconds() / 60.0
-            if recency_minutes > self.config.active_recency_minutes:
-                status = RobotStatus.INACTIVE
-            
-            if signature_direction is not None:
-                signature_direction_value = signature_direction
-            else:
-                if net_volume > 0:
-                    signature_direction_value = 'buy'
-                elif net_volume < 0:
-                    signature_direction_value = 'sell'
-                else:
-                    signature_direction_value = 'neutral'
-
-            # ✅ NOVO: Cria o padrão TWAP
-            pattern = TWAPPattern(
-                symbol=symbol,
-                exchange=trades[0].exchange if trades else 'B3',
-                pattern_type='TWAP',
-                robot_type=RobotType.TYPE_0.value,  # ✅ Inicialmente Tipo 0, será atualizado após calcular volume %
-                confidence_score=confidence_score,
-                agent_id=agent_id,
-                first_seen=trades[0].timestamp if trades else datetime.now(timezone.utc),
-                last_seen=trades[-1].timestamp if trades else datetime.now(timezone.utc),
-                total_volume=gross_volume,
+
+            pattern = self._pattern_from_stats(
+                symbol,
+                agent_id,
                 total_trades=total_trades,
-                avg_trade_size=avg_trade_size,
-                frequency_minutes=avg_frequency,
+                gross_volume=gross_volume,
+                buy_volume=buy_volume_total,
+                sell_volume=sell_volume_total,
+                avg_frequency=avg_frequency,
+                price_variation=price_variation,
                 price_aggression=price_aggression,
-                status=status,
-                market_volume_percentage=0.0,  # Será calculado após salvar o padrão
-                signature_volume=signature_volume or int(round(avg_trade_size)) if trades else None,
-                signature_direction=signature_direction_value,
-                signature_interval_seconds=signature_interval_seconds or (
-                    avg_frequency * 60.0 if avg_frequency else None
-                )
+                first_seen=trades[0].timestamp if trades else None,
+                last_seen=trades[-1].timestamp if trades else None,
+                exchange=trades[0].exchange if trades else None,
+                signature_volume=signature_volume,
+                signature_direction=signature_direction,
+                signature_interval_seconds=signature_interval_seconds,
             )
             
             # ✅ NOVO: Salva padrão e trades de forma atômica para evitar FK inválida
-            if pattern.confidence_score >= self.config.min_confidence:
-                # Converte TickData -> RobotTrade para persistir em lote
-                robot_trades_batch = [
-                    RobotTrade(
-                        symbol=t.symbol,
-                        price=t.price,
-                        volume=t.volume,
-                        timestamp=t.timestamp,
-                        trade_type=t.trade_type,
-                        agent_id=t.agent_id,
-                        exchange=t.exchange
-                    )
-                    for t in trades
-                ]
-                saved_pattern_id = await self.persistence.save_pattern_and_trades(pattern, robot_trades_batch)
-                if not saved_pattern_id:
-                    logger.warning(f"⚠️ Não foi possível salvar padrão+trades de {symbol}-{agent_id} (transação)")
+            if persist and pattern.confidence_score >= self.config.min_confidence:
+                await self._save_pattern_with_trades(pattern, trades)
             
             return pattern
             
@@ -520,6 +960,131 @@ class TWAPDetector:
             logger.error(f"Erro ao analisar trades do agente {agent_id} em {symbol}: {e}")
             return None
 
+    async def _analyze_agent_arrays(
+        self,
+        arrays: AgentTradeArrays,
+        symbol: str,
+        agent_id: int,
+        index,
+        signature_volume: Optional[int] = None,
+        signature_direction: Optional[str] = None,
+        signature_interval_seconds: Optional[float] = None,
+        persist: bool = True,
+    ) -> Optional[TWAPPattern]:
+        """Versão vetorizada de _analyze_agent_trades para os trades `index`
+        (ordenados por tempo) das colunas do agente"""
+        try:
+            pattern = self._pattern_from_stats(
+                symbol,
+                agent_id,
+                **trade_stats(arrays, index, self.config.max_frequency_minutes),
+                signature_volume=signature_volume,
+                signature_direction=signature_direction,
+                signature_interval_seconds=signature_interval_seconds,
+            )
+
+            if persist and pattern.confidence_score >= self.config.min_confidence:
+                await self._save_pattern_with_trades(pattern, arrays.take(index))
+
+            return pattern
+
+        except Exception as e:
+            logger.error(f"Erro ao analisar trades do agente {agent_id} em {symbol}: {e}")
+            return None
+
+    def _pattern_from_stats(
+        self,
+        symbol: str,
+        agent_id: int,
+        *,
+        total_trades: int,
+        gross_volume: int,
+        buy_volume: int,
+        sell_volume: int,
+        avg_frequency: float,
+        price_variation: float,
+        price_aggression: float,
+        first_seen: Optional[datetime],
+        last_seen: Optional[datetime],
+        exchange: Optional[str],
+        signature_volume: Optional[int] = None,
+        signature_direction: Optional[str] = None,
+        signature_interval_seconds: Optional[float] = None,
+    ) -> TWAPPattern:
+        """Monta o TWAPPattern a partir das estatísticas já calculadas
+        (recálculo completo ou acumuladores incrementais)."""
+        avg_trade_size = gross_volume / total_trades if total_trades > 0 else 0
+        net_volume = buy_volume - sell_volume
+
+        # Score de confiança
+        confidence_score = self._calculate_confidence_score(
+            total_trades, avg_frequency, price_variation, price_aggression
+        )
+        
+        # Determina status preliminar
+        status = self._determine_status(confidence_score, avg_frequency, price_variation)
+        
+        # ✅ NOVO: Gate de recência - se último trade for antigo, força INACTIVE
+        now_utc = self.clock()
+        recency_minutes = (now_utc - last_seen).total_seconds() / 60.0
+        if recency_minutes > self.config.active_recency_minutes:
+            status = RobotStatus.INACTIVE
+        
+        if signature_direction is not None:
+            signature_direction_value = signature_direction
+        else:
+            if net_volume > 0:
+                signature_direction_value = 'buy'
+            elif net_volume < 0:
+                signature_direction_value = 'sell'
+            else:
+                signature_direction_value = 'neutral'
+
+        # ✅ NOVO: Cria o padrão TWAP
+        return TWAPPattern(
+            symbol=symbol,
+            exchange=exchange if total_trades else 'B3',
+            pattern_type='TWAP',
+            robot_type=RobotType.TYPE_0.value,  # ✅ Inicialmente Tipo 0, será atualizado após calcular volume %
+            confidence_score=confidence_score,
+            agent_id=agent_id,
+            first_seen=first_seen if total_trades else now_utc,
+            last_seen=last_seen if total_trades else now_utc,
+            total_volume=gross_volume,
+            total_trades=total_trades,
+            avg_trade_size=avg_trade_size,
+            frequency_minutes=avg_frequency,
+            price_aggression=price_aggression,
+            status=status,
+            market_volume_percentage=0.0,  # Será calculado após salvar o padrão
+            signature_volume=signature_volume or int(round(avg_trade_size)) if total_trades else None,
+            signature_direction=signature_direction_value,
+            signature_interval_seconds=signature_interval_seconds or (
+                avg_frequency * 60.0 if avg_frequency else None
+            )
+        )
+
+    async def _save_pattern_with_trades(self, pattern: TWAPPattern, trades: List[TickData]) -> bool:
+        """Converte TickData -> RobotTrade e persiste padrão + trades em uma transação"""
+        robot_trades_batch = [
+            RobotTrade(
+                symbol=t.symbol,
+                price=t.price,
+                volume=t.volume,
+                timestamp=t.timestamp,
+                trade_type=t.trade_type,
+                agent_id=t.agent_id,
+                exchange=t.exchange,
+                trade_id=t.trade_id,
+            )
+            for t in trades
+        ]
+        saved_pattern_id = await self.persistence.save_pattern_and_trades(pattern, robot_trades_batch)
+        if not saved_pattern_id:
+            logger.warning(f"⚠️ Não foi possível salvar padrão+trades de {pattern.symbol}-{pattern.agent_id} (transação)")
+            return False
+        return True
+
     async def _save_robot_trades(self, trades: List[TickData], pattern: TWAPPattern) -> None:
         """Salva os trades individuais na tabela robot_trades"""
         try:
@@ -712,6 +1277,7 @@ class TWAPDetector:
                 
                 success = await self.persistence.update_twap_pattern(pattern_id, pattern)
                 if success:
+                    pattern.pattern_id = pattern_id
                     self.active_patterns[pattern.symbol][pattern.agent_id][signature_key] = pattern
 
                     if old_status_enum != pattern.status:
@@ -740,6 +1306,7 @@ class TWAPDetector:
                 # Cria novo padrão
                 pattern_id = await self.persistence.save_twap_pattern(pattern)
                 if pattern_id:
+                    pattern.pattern_id = pattern_id
                     self.active_patterns[pattern.symbol][pattern.agent_id][signature_key] = pattern
 
                     if pattern.status == RobotStatus.ACTIVE:
@@ -784,17 +1351,12 @@ class TWAPDetector:
     async def analyze_all_symbols(self) -> Dict[str, List[TWAPPattern]]:
         """Analisa todos os símbolos disponíveis"""
         try:
-            # Busca símbolos únicos das últimas 24h
-            # Foco no pregão corrente: considera símbolos com movimentação desde o início do dia
-            now_utc = datetime.now(timezone.utc)
-            start_of_day = datetime.combine(now_utc.date(), time.min, tzinfo=timezone.utc)
-            symbols = await self._get_active_symbols(start_of_day)
+            symbols = await self.get_session_symbols()
             
             all_patterns: Dict[str, List[TWAPPattern]] = {}
 
             # Limita concorrência para evitar sobrecarga no banco
-            max_concurrency = 5
-            semaphore = asyncio.Semaphore(max_concurrency)
+            semaphore = asyncio.Semaphore(TWAP_MAX_CONCURRENCY)
 
             async def process_symbol(symbol: str) -> Tuple[str, List[TWAPPattern]]:
                 async with semaphore:
@@ -836,6 +1398,12 @@ class TWAPDetector:
             logger.error(f"Erro ao analisar todos os símbolos: {e}")
             return {}
     
+    async def get_session_symbols(self) -> List[str]:
+        """Símbolos com movimentação desde o início do dia (pregão corrente)"""
+        now_utc = datetime.now(timezone.utc)
+        start_of_day = datetime.combine(now_utc.date(), time.min, tzinfo=timezone.utc)
+        return await self._get_active_symbols(start_of_day)
+
     async def _get_active_symbols(self, since: Optional[datetime] = None) -> List[str]:
         """Busca símbolos que tiveram atividade desde o instante informado."""
         try:
@@ -874,6 +1442,47 @@ class TWAPDetector:
         """Retorna todas as mudanças (status + tipo) dos robôs"""
         return self.status_tracker.get_all_changes(symbol, hours, signature_key)
 
+    # Janela máxima do volume %: desde o início do robô ou últimas 2h
+    VOLUME_WINDOW_HOURS = 2
+
+    def _volume_window(self, pattern: TWAPPattern, current_time: datetime) -> Tuple[int, int]:
+        """Minutos (epoch/60) de início e fim da janela de volume % do robô"""
+        max_start_time = current_time - timedelta(hours=self.VOLUME_WINDOW_HOURS)
+        start_time = max(self._to_utc(pattern.first_seen), max_start_time)
+        return int(start_time.timestamp() // 60), int(current_time.timestamp() // 60)
+
+    async def _ensure_volume_index(self, symbol: str, start_minute: int, current_time: datetime) -> bool:
+        """Preenche o índice de volume com o banco quando a janela começa antes da ingestão (ex.: restart).
+
+        Uma única consulta agrupada por símbolo cobre a janela máxima de todos os robôs.
+        """
+        if not self.volume_index.needs_seed(symbol, start_minute):
+            return True
+        max_start_minute = int((current_time - timedelta(hours=self.VOLUME_WINDOW_HOURS)).timestamp() // 60)
+        seed_minute = min(start_minute, max_start_minute)
+        coverage_time = datetime.fromtimestamp(self.volume_index.coverage_minute * 60, tz=timezone.utc)
+        buckets = await self.persistence.get_volume_buckets_for_period(
+            symbol, datetime.fromtimestamp(seed_minute * 60, tz=timezone.utc), coverage_time
+        )
+        if buckets is None:
+            return False
+        market_buckets, agent_buckets = buckets
+        self.volume_index.seed(symbol, seed_minute, market_buckets, agent_buckets)
+        logger.info(f"📊 Índice de volume de {symbol} preenchido pelo banco ({len(agent_buckets)} agentes, {len(market_buckets)} minutos)")
+        return True
+
+    def _volume_percentage_from_index(self, symbol: str, agent_id: int, pattern: TWAPPattern,
+                                      start_minute: int, end_minute: int) -> Tuple[float, str]:
+        """Volume % e tipo do robô pela diferença das somas prefixadas (O(1))"""
+        market_volume = self.volume_index.market_volume(symbol, start_minute, end_minute)
+        if market_volume <= 0:
+            logger.warning(f"⚠️ Volume do mercado zero para {symbol} na janela do robô {agent_id}")
+            return pattern.market_volume_percentage, pattern.robot_type
+        robot_volume = self.volume_index.agent_volume(symbol, agent_id, start_minute, end_minute)
+        new_volume_pct = round((robot_volume / market_volume) * 100.0, 2)
+        logger.debug(f"📈 {symbol}-{agent_id}: Volume robô: R$ {robot_volume:,.2f} | Mercado: R$ {market_volume:,.2f} | % = {new_volume_pct:.2f}%")
+        return new_volume_pct, self._determine_robot_type(new_volume_pct)
+
     async def recalculate_market_volume_percentage(self, symbol: str, agent_id: int, pattern: TWAPPattern) -> Tuple[float, str]:
         """
         Recalcula o volume % do mercado para um robô ativo
@@ -882,42 +1491,11 @@ class TWAPDetector:
         """
         try:
             current_time = datetime.now(timezone.utc)
-            
-            # ✅ CORRIGIDO: Calcula período inteligente baseado na atividade do robô
-            max_window_hours = 2  # Janela máxima de 2 horas
-            max_start_time = current_time - timedelta(hours=max_window_hours)
-            
-            # Se o robô começou há menos de 2h, usa desde o início
-            # Se começou há mais de 2h, usa janela móvel de 2h
-            robot_start_time = pattern.first_seen
-            start_time = max(robot_start_time, max_start_time)
-            
-            # Calcula duração do período para log
-            period_duration = (current_time - start_time).total_seconds() / 3600  # em horas
-            
-            logger.debug(f"📊 Recalculando {symbol}-{agent_id}: período de {period_duration:.1f}h (desde {start_time.strftime('%H:%M:%S')})")
-            
-            # Busca volume total do robô no período calculado
-            robot_volume = await self.persistence.get_robot_volume_for_period(
-                symbol, agent_id, start_time, current_time
-            )
-            
-            # Busca volume total do mercado no mesmo período
-            market_volume = await self.persistence.get_market_volume_for_period(
-                symbol, start_time, current_time
-            )
-            
-            if market_volume > 0:
-                new_volume_pct = round((robot_volume / market_volume) * 100.0, 2)
-                new_robot_type = self._determine_robot_type(new_volume_pct)
-                
-                logger.debug(f"📈 {symbol}-{agent_id}: Volume robô: R$ {robot_volume:,.2f} | Mercado: R$ {market_volume:,.2f} | Período: {period_duration:.1f}h | % = {new_volume_pct:.2f}%")
-                
-                return new_volume_pct, new_robot_type
-            else:
-                logger.warning(f"⚠️ Volume do mercado zero para {symbol} no período de {period_duration:.1f}h")
+            start_minute, end_minute = self._volume_window(pattern, current_time)
+            if not await self._ensure_volume_index(symbol, start_minute, current_time):
                 return pattern.market_volume_percentage, pattern.robot_type
-                
+            return self._volume_percentage_from_index(symbol, agent_id, pattern, start_minute, end_minute)
+
         except Exception as e:
             logger.error(f"Erro ao recalcular volume %: {e}")
             return pattern.market_volume_percentage, pattern.robot_type
@@ -926,82 +1504,82 @@ class TWAPDetector:
         """
         Atualiza volume % de todos os robôs ativos e detecta mudanças de tipo
         Retorna lista de mudanças de tipo detectadas
+
+        Os volumes vêm do índice em memória; todos os robôs são calculados em uma
+        passada e as alterações vão ao banco em um único UPDATE.
         """
         type_changes = []
         
         try:
+            current_time = datetime.now(timezone.utc)
+            updates: List[Tuple[int, float, str]] = []
+
             for symbol, agents in list(self.active_patterns.items()):
-                for agent_id, patterns_by_signature in list(agents.items()):
-                    for signature_key, pattern in list(patterns_by_signature.items()):
-                        if pattern.status == RobotStatus.ACTIVE:
-                            new_volume_pct, new_robot_type = await self.recalculate_market_volume_percentage(
-                                symbol, agent_id, pattern
-                            )
+                active = [
+                    (agent_id, signature_key, pattern)
+                    for agent_id, patterns_by_signature in list(agents.items())
+                    for signature_key, pattern in list(patterns_by_signature.items())
+                    if pattern.status == RobotStatus.ACTIVE
+                ]
+                if not active:
+                    continue
+
+                windows = [self._volume_window(pattern, current_time) for _, _, pattern in active]
+                if not await self._ensure_volume_index(symbol, min(w[0] for w in windows), current_time):
+                    continue
+
+                for (agent_id, signature_key, pattern), (start_minute, end_minute) in zip(active, windows):
+                    new_volume_pct, new_robot_type = self._volume_percentage_from_index(
+                        symbol, agent_id, pattern, start_minute, end_minute
+                    )
+
+                    if new_robot_type != pattern.robot_type:
+                        type_change = {
+                            'id': f"{symbol}_{agent_id}_{signature_key}_type_change_{current_time.timestamp()}",
+                            'symbol': symbol,
+                            'agent_id': agent_id,
+                            'signature_key': signature_key,
+                            'agent_name': get_agent_name(agent_id),
+                            'old_type': pattern.robot_type,
+                            'new_type': new_robot_type,
+                            'old_volume_percentage': pattern.market_volume_percentage,
+                            'new_volume_percentage': new_volume_pct,
+                            'timestamp': current_time.isoformat(),
+                            'confidence_score': pattern.confidence_score,
+                            'total_volume': pattern.total_volume,
+                            'total_trades': pattern.total_trades,
+                            'change_type': 'type_update',
+                            'pattern_type': pattern.pattern_type,
+                            'signature_volume': pattern.signature_volume,
+                            'signature_direction': pattern.signature_direction,
+                            'signature_interval_seconds': pattern.signature_interval_seconds,
+                        }
+
+                        type_changes.append(type_change)
+                        old_volume_pct = pattern.market_volume_percentage
+                        pattern.robot_type = new_robot_type
+                        pattern.market_volume_percentage = new_volume_pct
+                        self.status_tracker.add_type_change(type_change)
+
+                        logger.info(
+                            f"🔄 Mudança de tipo: {symbol} - {get_agent_name(agent_id)} ({agent_id}) signature {signature_key} ({type_change['old_type']} -> {new_robot_type}) - Volume: {old_volume_pct:.2f}% -> {new_volume_pct:.2f}%"
+                        )
+
+                    elif abs(new_volume_pct - pattern.market_volume_percentage) > 0.5:
+                        pattern.market_volume_percentage = new_volume_pct
+                        logger.debug(
+                            f"📊 Volume % atualizado: {symbol} - {get_agent_name(agent_id)} ({agent_id}) signature {signature_key}: {new_volume_pct:.2f}%"
+                        )
+                    else:
+                        continue
+
+                    if pattern.pattern_id is not None:
+                        updates.append((pattern.pattern_id, pattern.market_volume_percentage, pattern.robot_type))
+
+            # Uma única ida ao banco para todas as alterações do ciclo
+            if updates:
+                await self.persistence.update_patterns_volume_percentage(updates)
 
-                            if new_robot_type != pattern.robot_type:
-                                type_change = {
-                                    'id': f"{symbol}_{agent_id}_{signature_key}_type_change_{datetime.now(timezone.utc).timestamp()}",
-                                    'symbol': symbol,
-                                    'agent_id': agent_id,
-                                    'signature_key': signature_key,
-                                    'agent_name': get_agent_name(agent_id),
-                                    'old_type': pattern.robot_type,
-                                    'new_type': new_robot_type,
-                                    'old_volume_percentage': pattern.market_volume_percentage,
-                                    'new_volume_percentage': new_volume_pct,
-                                    'timestamp': datetime.now(timezone.utc).isoformat(),
-                                    'confidence_score': pattern.confidence_score,
-                                    'total_volume': pattern.total_volume,
-                                    'total_trades': pattern.total_trades,
-                                    'change_type': 'type_update',
-                                    'pattern_type': pattern.pattern_type,
-                                    'signature_volume': pattern.signature_volume,
-                                    'signature_direction': pattern.signature_direction,
-                                    'signature_interval_seconds': pattern.signature_interval_seconds,
-                                }
-
-                                type_changes.append(type_change)
-
-                                pattern.robot_type = new_robot_type
-                                pattern.market_volume_percentage = new_volume_pct
-
-                                existing = await self.persistence.get_existing_pattern(
-                                    symbol,
-                                    agent_id,
-                                    pattern.pattern_type,
-                                    pattern.signature_volume,
-                                    pattern.signature_direction,
-                                    pattern.signature_interval_seconds,
-                                )
-                                if existing:
-                                    pattern_id = existing[0]
-                                    await self.persistence.update_twap_pattern(pattern_id, pattern)
-
-                                self.status_tracker.add_type_change(type_change)
-
-                                logger.info(
-                                    f"🔄 Mudança de tipo: {symbol} - {get_agent_name(agent_id)} ({agent_id}) signature {signature_key} ({type_change['old_type']} -> {new_robot_type}) - Volume: {pattern.market_volume_percentage:.2f}% -> {new_volume_pct:.2f}%"
-                                )
-
-                            elif abs(new_volume_pct - pattern.market_volume_percentage) > 0.5:
-                                pattern.market_volume_percentage = new_volume_pct
-
-                                existing = await self.persistence.get_existing_pattern(
-                                    symbol,
-                                    agent_id,
-                                    pattern.pattern_type,
-                                    pattern.signature_volume,
-                                    pattern.signature_direction,
-                                    pattern.signature_interval_seconds,
-                                )
-                                if existing:
-                                    pattern_id = existing[0]
-                                    await self.persistence.update_market_volume_percentage(pattern_id, new_volume_pct)
-
-                                logger.debug(
-                                    f"📊 Volume % atualizado: {symbol} - {get_agent_name(agent_id)} ({agent_id}) signature {signature_key}: {new_volume_pct:.2f}%"
-                                )
-            
             return type_changes
             
         except Exception as e:
@@ -1108,93 +1686,113 @@ class TWAPDetector:
             return 0
 
     async def check_robot_inactivity_by_trades(self, inactivity_threshold_minutes: int = 2, use_notification_control: bool = False) -> List[Dict]:
-        """Verifica inatividade dos robôs baseado em trades reais das últimas X minutos"""
+        """Verifica inatividade dos robôs baseado em trades reais das últimas X minutos.
+
+        O último trade de cada agente vem do índice em memória alimentado pela
+        ingestão (sem SQL por robô); só as transições para inativo vão ao banco,
+        em um único UPDATE por ciclo.
+        """
         try:
             inactive_robots = []
             current_time = datetime.now(timezone.utc)  # ✅ CORRIGIDO: Usa timezone UTC
-            cutoff_time = current_time - timedelta(minutes=inactivity_threshold_minutes)
-            
-            # Verifica cada padrão ativo
+            cutoff_ts = (current_time - timedelta(minutes=inactivity_threshold_minutes)).timestamp()
+            transitions = []
+
             for symbol, agents in list(self.active_patterns.items()):
-                for agent_id, pattern in list(agents.items()):
-                    # Busca trades reais deste agente nas últimas X minutos
-                    recent_trades = await self.persistence.get_recent_ticks_for_agent(
-                        symbol, agent_id, inactivity_threshold_minutes
-                    )
-                    
-                    # Se não há trades recentes, marca como inativo
-                    if not recent_trades:
-                        # Histerese: não marcar inativo se ativado muito recentemente
-                        key = (symbol, agent_id)
-                        last_activation = self.activation_times.get(key)
-                        if last_activation:
-                            seconds_since_activation = (current_time - last_activation).total_seconds()
-                            if seconds_since_activation < self.activation_cooldown_seconds:
-                                logger.debug(f"⏳ Histerese: ignorando inatividade de {symbol}-{agent_id} ({seconds_since_activation:.1f}s desde ativação)")
+                for agent_id, patterns_by_signature in list(agents.items()):
+                    indexed_last = self.activity_index.last_trade(symbol, agent_id) or 0.0
+                    for signature_key, pattern in list(patterns_by_signature.items()):
+                        key = (symbol, agent_id, signature_key)
+                        # last_seen cobre o intervalo antes do índice existir (ex.: após restart)
+                        last_trade_ts = max(indexed_last, self._to_utc(pattern.last_seen).timestamp())
+                        if last_trade_ts >= cutoff_ts:
+                            if pattern.status != RobotStatus.INACTIVE:
+                                self.inactivity_notified.discard(key)
+                            continue
+
+                        if pattern.status == RobotStatus.INACTIVE:
+                            if key in self.inactivity_notified:
+                                # Já persistido e notificado: só reporta
+                                inactive_robots.append(self._inactive_robot_entry(
+                                    symbol, agent_id, pattern, current_time, newly_notified=False
+                                ))
                                 continue
-                        
-                        # Marca como inativo
-                        old_status = pattern.status
-                        pattern.status = RobotStatus.INACTIVE
-                        
-                        # Atualiza no banco
-                        existing = await self.persistence.get_existing_pattern(
-                            symbol,
-                            agent_id,
-                            pattern.pattern_type,
-                            pattern.signature_volume,
-                            pattern.signature_direction,
-                            pattern.signature_interval_seconds,
-                        )
-                        if existing:
-                            pattern_id = existing[0]
-                            
-                            # ✅ NOVO: Controle de notificação para evitar spam
-                            newly_notified = False
-                            if use_notification_control:
-                                # Verifica se já foi notificado como inativo
-                                # existing[6] = inactivity_notified (7º campo da tupla)
-                                if not existing[6]:  # inactivity_notified = FALSE
-                                    # Marca como notificado e rastreia mudança de status
-                                    newly_notified = True
-                                    await self.persistence.mark_inactivity_notified(pattern_id)
-                                    
-                                    # Rastreia a mudança de status apenas na primeira notificação
-                                    self.status_tracker.add_status_change(
-                                        symbol, agent_id, old_status.value, 'inactive', pattern
-                                    )
-                                    
-                                    logger.info(f"🔴 PRIMEIRA NOTIFICAÇÃO: Robô {get_agent_name(agent_id)} ({agent_id}) em {symbol} PAROU de operar")
-                                else:
-                                    logger.debug(f"📊 Robô {get_agent_name(agent_id)} ({agent_id}) em {symbol} já foi notificado como inativo")
-                            else:
-                                # Comportamento antigo (sem controle de notificação)
-                                newly_notified = True
-                                self.status_tracker.add_status_change(
-                                    symbol, agent_id, old_status.value, 'inactive', pattern
-                                )
-                            
-                            # Atualiza o padrão no banco
-                            await self.persistence.update_twap_pattern(pattern_id, pattern)
-                            
-                            # Calcula inatividade em minutos
-                            inactivity_minutes = (current_time - pattern.last_seen).total_seconds() / 60
-                            
-                            inactive_robots.append({
-                                'symbol': symbol,
-                                'agent_id': agent_id,
-                                'agent_name': get_agent_name(agent_id),  # ✅ NOVO: Nome da corretora
-                                'stopped_at': pattern.last_seen.isoformat(),
-                                'inactivity_minutes': inactivity_minutes,
-                                'reason': 'no_recent_trades',
-                                'newly_notified': newly_notified  # ✅ NOVO: Indica se é primeira notificação
-                            })
-                            
-                            if newly_notified:
-                                logger.info(f"🚫 Robô {get_agent_name(agent_id)} ({agent_id}) em {symbol} marcado como inativo - sem trades há {inactivity_minutes:.1f} minutos")
-            
+                        else:
+                            # Histerese: não marcar inativo se ativado muito recentemente
+                            last_activation = self.activation_times.get(key)
+                            if last_activation:
+                                seconds_since_activation = (current_time - last_activation).total_seconds()
+                                if seconds_since_activation < self.activation_cooldown_seconds:
+                                    logger.debug(f"⏳ Histerese: ignorando inatividade de {symbol}-{agent_id} ({seconds_since_activation:.1f}s desde ativação)")
+                                    continue
+
+                        if pattern.pattern_id is None:
+                            # Padrão ainda sem id em memória: resolve uma única vez
+                            existing = await self.persistence.get_existing_pattern(
+                                symbol,
+                                agent_id,
+                                pattern.pattern_type,
+                                pattern.signature_volume,
+                                pattern.signature_direction,
+                                pattern.signature_interval_seconds,
+                            )
+                            if not existing:
+                                continue
+                            pattern.pattern_id = existing[0]
+
+                        transitions.append((key, pattern, pattern.status))
+
+            if not transitions:
+                return inactive_robots
+
+            # Uma única ida ao banco para todas as transições do ciclo
+            previously_notified = await self.persistence.mark_patterns_inactive(
+                [pattern.pattern_id for _, pattern, _ in transitions],
+                notify=use_notification_control,
+            )
+            if previously_notified is None:
+                return inactive_robots
+
+            for key, pattern, old_status in transitions:
+                symbol, agent_id, signature_key = key
+                if pattern.pattern_id not in previously_notified:
+                    continue
+                pattern.status = RobotStatus.INACTIVE
+
+                # ✅ NOVO: Controle de notificação para evitar spam
+                newly_notified = not (use_notification_control and previously_notified[pattern.pattern_id])
+                if newly_notified:
+                    # Rastreia a mudança de status apenas na primeira notificação
+                    self.status_tracker.add_status_change(
+                        symbol, agent_id, old_status.value, 'inactive', pattern, signature_key
+                    )
+                    if use_notification_control:
+                        logger.info(f"🔴 PRIMEIRA NOTIFICAÇÃO: Robô {get_agent_name(agent_id)} ({agent_id}) em {symbol} PAROU de operar")
+                else:
+                    logger.debug(f"📊 Robô {get_agent_name(agent_id)} ({agent_id}) em {symbol} já foi notificado como inativo")
+                if use_notification_control:
+                    self.inactivity_notified.add(key)
+
+                entry = self._inactive_robot_entry(symbol, agent_id, pattern, current_time, newly_notified)
+                inactive_robots.append(entry)
+                if newly_notified:
+                    logger.info(f"🚫 Robô {get_agent_name(agent_id)} ({agent_id}) em {symbol} marcado como inativo - sem trades há {entry['inactivity_minutes']:.1f} minutos")
+
             return inactive_robots
-            
+
         except Exception as e:
             logger.error(f"Erro ao verificar inatividade por trades: {e}")
             return []
+
+    def _inactive_robot_entry(self, symbol: str, agent_id: int, pattern: TWAPPattern, current_time: datetime, newly_notified: bool) -> Dict:
+        """Monta o item retornado por check_robot_inactivity_by_trades"""
+        inactivity_minutes = (current_time - self._to_utc(pattern.last_seen)).total_seconds() / 60
+        return {
+            'symbol': symbol,
+            'agent_id': agent_id,
+            'agent_name': get_agent_name(agent_id),  # ✅ NOVO: Nome da corretora
+            'stopped_at': pattern.last_seen.isoformat(),
+            'inactivity_minutes': inactivity_minutes,
+            'reason': 'no_recent_trades',
+            'newly_notified': newly_notified  # ✅ NOVO: Indica se é primeira notificação
+        }
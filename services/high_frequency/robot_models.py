@@ -36,6 +36,7 @@ class TickData:
     agent_id: int
     exchange: str
     raw_trade_type: Optional[int] = None  # ✅ NOVO: trade_type real da tabela (2=comprador agressor, 3=vendedor agressor)
+    trade_id: Optional[int] = None  # trade_id de ticks_raw (chave de idempotência em robot_trades)
 
 @dataclass
 class TWAPPattern:
@@ -78,6 +79,7 @@ class RobotTrade:
     agent_id: int
     exchange: str
     robot_pattern_id: Optional[int] = None
+    trade_id: Optional[int] = None
 
 @dataclass
 class TWAPDetectionConfig:
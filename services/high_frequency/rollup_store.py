@@ -0,0 +1,245 @@
+"""
+Rollup de candles do backend de alta frequência
+===============================================
+Liga o RollupEngine (services/shared/candle_rollup) ao backend:
+
+- add_tick_to_buffer alimenta só a barra de 1s de cada símbolo; 5s e 15s
+  derivam dela.
+- O 1m vem dos candles fechados/corrigidos pelo CandleAggregator (que segue
+  dono do candles_1m); 5m, 15m e 1h derivam do 1m.
+- Um writer em background fecha pelo relógio as barras de 1s vencidas e grava
+  as barras novas ou recalculadas de cada timeframe em HF_ROLLUP_PERSIST
+  (tabelas candles_<tf>), com um upsert por timeframe.
+- Na subida, as barras gravadas dos buckets correntes de cada timeframe
+  derivado semeiam o motor (load_rollup_seeds), para que o primeiro 1m
+  depois de um restart não sobrescreva a 1h gravada com só aquele minuto.
+- /ticks/{symbol}?timeframe=<tf> responde da memória (com a barra em
+  andamento) e completa com a tabela do timeframe, sem time_bucket sobre o
+  ticks_raw.
+"""
+
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from services.shared.candle_rollup import Bar, RollupEngine
+from services.high_frequency.models import Tick
+from services.high_frequency.config import HF_ROLLUP_FLUSH_MS, HF_ROLLUP_RETAIN_BARS, HF_ROLLUP_PERSIST
+
+logger = logging.getLogger(__name__)
+
+# Tabela e coluna de tempo de cada timeframe
+ROLLUP_TABLES: Dict[str, Tuple[str, str]] = {
+    "1s": ("candles_1s", "ts_bucket_utc"),
+    "5s": ("candles_5s", "ts_bucket_utc"),
+    "15s": ("candles_15s", "ts_bucket_utc"),
+    "1m": ("candles_1m", "ts_minute_utc"),
+    "5m": ("candles_5m", "ts_bucket_utc"),
+    "15m": ("candles_15m", "ts_bucket_utc"),
+    "1h": ("candles_1h", "ts_bucket_utc"),
+}
+
+rollup_engine = RollupEngine(external_levels=("1m",), retain_bars=HF_ROLLUP_RETAIN_BARS)
+# O 1m é gravado pelo CandleAggregator
+_persisted = [tf for tf in HF_ROLLUP_PERSIST if tf in ROLLUP_TABLES and tf != "1m"]
+
+rollup_stats: Dict[str, Any] = {
+    'batches_written': 0,
+    'bars_written': 0,
+    'write_failures': 0,
+    'last_flush_ms': 0.0,
+    'last_flush_bars': 0,
+}
+
+
+def record_tick(tick: Tick) -> None:
+    rollup_engine.record_tick(tick.symbol, tick.exchange, tick.price, tick.volume, tick.timestamp,
+                              tick.volume_financial)
+
+
+def add_minute_candle(candle) -> None:
+    """Callback do CandleAggregator: candle de 1m fechado ou corrigido."""
+    rollup_engine.add_bar(
+        "1m", candle.symbol, candle.exchange, int(candle.open_time.timestamp()),
+        candle.open_price, candle.high_price, candle.low_price, candle.close_price,
+        candle.total_volume, candle.total_volume_financial, candle.tick_count,
+    )
+
+
+async def ensure_rollup_tables(conn_pool) -> None:
+    """Cria as tabelas dos timeframes gravados (hypertables por tempo)."""
+    async with conn_pool.connection() as conn:
+        async with conn.cursor() as cur:
+            for timeframe in _persisted:
+                table, ts_column = ROLLUP_TABLES[timeframe]
+                await cur.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {table} (
+                        symbol VARCHAR(20) NOT NULL,
+                        exchange VARCHAR(10) NOT NULL,
+                        {ts_column} TIMESTAMPTZ NOT NULL,
+                        o DOUBLE PRECISION NOT NULL,
+                        h DOUBLE PRECISION NOT NULL,
+                        l DOUBLE PRECISION NOT NULL,
+                        c DOUBLE PRECISION NOT NULL,
+                        v BIGINT NOT NULL,
+                        vf DOUBLE PRECISION,
+                        n INTEGER,
+                        PRIMARY KEY (symbol, {ts_column})
+                    );
+                """)
+                await cur.execute(f"SELECT create_hypertable('{table}', '{ts_column}', if_not_exists => TRUE);")
+        await conn.commit()
+    logger.info(f"✅ Tabelas de rollup verificadas: {', '.join(ROLLUP_TABLES[tf][0] for tf in _persisted)}")
+
+
+async def load_rollup_seeds(conn_pool, now: Optional[float] = None) -> int:
+    """Semeia o motor com as barras gravadas do bucket corrente e do anterior
+    de cada timeframe derivado (o anterior ainda pode receber a última filha)."""
+    now = time.time() if now is None else now
+    seeded = 0
+    async with conn_pool.connection() as conn:
+        async with conn.cursor() as cur:
+            for timeframe in _persisted:
+                level = rollup_engine.level_of(timeframe)
+                if level == 0:
+                    continue
+                table, ts_column = ROLLUP_TABLES[timeframe]
+                size = rollup_engine.seconds[level]
+                since = datetime.fromtimestamp(int(now // size) * size - size, tz=timezone.utc)
+                await cur.execute(
+                    f"SELECT symbol, exchange, {ts_column}, o, h, l, c, v, vf, n FROM {table} WHERE {ts_column} >= %s",
+                    (since,),
+                )
+                for symbol, exchange, bucket_time, o, h, l, c, v, vf, n in await cur.fetchall():
+                    rollup_engine.seed_bar(timeframe, symbol, exchange, int(bucket_time.timestamp()), o, h, l, c,
+                                           v, vf or 0.0, n or 0, as_of=now)
+                    seeded += 1
+    if seeded:
+        logger.info(f"🕯️ Rollup semeado com {seeded} barras já gravadas dos buckets correntes")
+    return seeded
+
+
+async def _write_bars(conn_pool, timeframe: str, rows: List[Tuple[str, Bar]]) -> bool:
+    table, ts_column = ROLLUP_TABLES[timeframe]
+    columns = list(zip(*[
+        (symbol, bar.exchange, datetime.fromtimestamp(bar.bucket, tz=timezone.utc), bar.open, bar.high,
+         bar.low, bar.close, bar.volume, bar.volume_financial, bar.tick_count)
+        for symbol, bar in rows
+    ]))
+    try:
+        async with conn_pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    f"""
+                    INSERT INTO {table} (symbol, exchange, {ts_column}, o, h, l, c, v, vf, n)
+                    SELECT * FROM unnest(
+                        %s::varchar[], %s::varchar[], %s::timestamptz[], %s::float8[], %s::float8[],
+                        %s::float8[], %s::float8[], %s::int8[], %s::float8[], %s::int4[]
+                    )
+                    ON CONFLICT (symbol, {ts_column}) DO UPDATE SET
+                        o = EXCLUDED.o, h = EXCLUDED.h, l = EXCLUDED.l, c = EXCLUDED.c,
+                        v = EXCLUDED.v, vf = EXCLUDED.vf, n = EXCLUDED.n
+                    """,
+                    [list(col) for col in columns],
+                )
+            await conn.commit()
+        return True
+    except Exception as e:
+        logger.error(f"❌ Erro ao gravar {len(rows)} barras de {timeframe} em {table}: {e}")
+        return False
+
+
+async def flush_rollups(conn_pool) -> int:
+    """Fecha as barras de 1s vencidas e grava as barras sujas de cada timeframe."""
+    rollup_engine.seal_expired(time.time())
+    dirty = rollup_engine.take_dirty()
+    if conn_pool is None:
+        return 0
+    started = time.perf_counter()
+    written = 0
+    for timeframe in _persisted:
+        rows = dirty.get(timeframe)
+        if not rows:
+            continue
+        if await _write_bars(conn_pool, timeframe, rows):
+            written += len(rows)
+            rollup_stats['batches_written'] += 1
+        else:
+            rollup_engine.mark_dirty(timeframe, rows)
+            rollup_stats['write_failures'] += 1
+    rollup_stats['bars_written'] += written
+    rollup_stats['last_flush_bars'] = written
+    rollup_stats['last_flush_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    return written
+
+
+async def run_rollup_writer(conn_pool) -> None:
+    """Loop do writer incremental das tabelas de rollup."""
+    logger.info(f"🕯️ Rollup de candles iniciado (gravando {', '.join(_persisted) or 'nenhum timeframe'})")
+    while True:
+        try:
+            await asyncio.sleep(HF_ROLLUP_FLUSH_MS / 1000.0)
+            await flush_rollups(conn_pool)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Erro no writer de rollup: {e}")
+            await asyncio.sleep(1)
+
+
+def _candle_row(bar: Bar) -> Dict[str, Any]:
+    # Mesmas chaves do time_bucket de get_ticks_from_db
+    return {
+        "candle_time": datetime.fromtimestamp(bar.bucket, tz=timezone.utc),
+        "open": bar.open,
+        "high": bar.high,
+        "low": bar.low,
+        "close": bar.close,
+        "volume": bar.volume,
+    }
+
+
+async def get_rollup_candles(symbol: str, timeframe: str, limit: int, conn_pool) -> Optional[List[Dict[str, Any]]]:
+    """Candles mais recentes primeiro: memória e, para o que faltar, a tabela do
+    timeframe. None se o timeframe não é do rollup."""
+    if rollup_engine.level_of(timeframe) is None:
+        return None
+    bars = rollup_engine.get_bars(symbol, timeframe, limit)
+    # Barra em andamento: as derivadas só têm as filhas já fechadas
+    live = rollup_engine.live_bar(symbol, timeframe)
+    if live is not None:
+        if bars and bars[0].bucket == live.bucket:
+            bars[0] = live
+        elif not bars or live.bucket > bars[0].bucket:
+            bars = [live] + bars[:max(0, limit - 1)]
+    rows = [_candle_row(bar) for bar in bars]
+    table, ts_column = ROLLUP_TABLES[timeframe]
+    if len(rows) >= limit or conn_pool is None or (timeframe not in _persisted and timeframe != "1m"):
+        return rows
+
+    older_than = rows[-1]["candle_time"] if rows else None
+    async with conn_pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                f"""
+                SELECT {ts_column} AS candle_time, o AS open, h AS high, l AS low, c AS close, v AS volume
+                  FROM {table}
+                 WHERE symbol = %s AND (%s::timestamptz IS NULL OR {ts_column} < %s::timestamptz)
+                 ORDER BY {ts_column} DESC
+                 LIMIT %s
+                """,
+                (symbol, older_than, older_than, limit - len(rows)),
+            )
+            columns = [desc[0] for desc in cur.description]
+            rows.extend(dict(zip(columns, row)) for row in await cur.fetchall())
+    return rows
+
+
+def get_rollup_status() -> Dict[str, Any]:
+    return {
+        "persisted_timeframes": _persisted,
+        **rollup_engine.get_status(),
+        **rollup_stats,
+    }
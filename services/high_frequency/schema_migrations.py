@@ -0,0 +1,497 @@
+"""
+Migrações versionadas do esquema do backend HF
+==============================================
+Cada passo do esquema é uma migração numerada. As já aplicadas ficam
+registradas na tabela schema_version, então um boot com o esquema em dia faz
+uma única consulta em vez de refazer CREATE/ALTER/DO $$/create_hypertable.
+
+- Migração nova: acrescente ao fim de MIGRATIONS com a próxima versão; nunca
+  altere uma já publicada (bancos existentes não a rodam de novo).
+- Cada migração roda na própria transação, junto com o registro em
+  schema_version.
+- Migrações `optional` que falham não impedem a subida: a falha fica registrada
+  em schema_version_skipped e os boots seguintes não a tentam de novo (nem
+  seguram o advisory lock por ela). Para tentar de novo, apague a linha; a
+  chave única de robot_trades (4) é criada e registrada por
+  compact_robot_trades.py.
+- Um advisory lock serializa instâncias subindo ao mesmo tempo.
+
+As migrações 1-4 são o antigo corpo de initialize_db, idempotentes: um banco
+criado antes do schema_version roda todas uma vez e passa a ser registrado.
+"""
+
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Set, Tuple
+
+from psycopg import AsyncConnection, AsyncCursor
+from psycopg_pool import AsyncConnectionPool
+
+from services.high_frequency.robot_persistence import ROBOT_TRADES_UNIQUE_INDEX_SQL
+
+logger = logging.getLogger(__name__)
+
+# Chave do pg_advisory_lock das migrações
+_MIGRATION_LOCK_KEY = 0x48465343  # "HFSC"
+
+SCHEMA_VERSION_SQL = """
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        applied_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        duration_ms DOUBLE PRECISION
+    )
+"""
+
+# Migrações opcionais que falharam: não são tentadas de novo a cada boot
+SCHEMA_VERSION_SKIPPED_SQL = """
+    CREATE TABLE IF NOT EXISTS schema_version_skipped (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        error TEXT,
+        failed_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    )
+"""
+
+
+@dataclass
+class Migration:
+    version: int
+    name: str
+    apply: Callable[[AsyncConnection, AsyncCursor], Awaitable[None]]
+    optional: bool = False
+
+
+async def _m001_ticks_raw(conn: AsyncConnection, cur: AsyncCursor) -> None:
+    await cur.execute("CREATE EXTENSION IF NOT EXISTS timescaledb;")
+
+    # Cria a tabela com os tipos de dados corretos (BIGINT para volume e trade_id)
+    await cur.execute("""
+        CREATE TABLE IF NOT EXISTS ticks_raw (
+            symbol VARCHAR(20) NOT NULL,
+            exchange VARCHAR(10) NOT NULL,
+            price DOUBLE PRECISION NOT NULL,
+            volume BIGINT NOT NULL,
+            timestamp TIMESTAMPTZ NOT NULL,
+            trade_id BIGINT,
+            -- Campos para dados detalhados de trade
+            buy_agent INTEGER,
+            sell_agent INTEGER,
+            trade_type SMALLINT,
+            volume_financial DOUBLE PRECISION,
+            is_edit BOOLEAN DEFAULT FALSE
+        );
+    """)
+
+    # Bloco PL/pgSQL para alterar as colunas apenas se necessário, de forma segura.
+    await cur.execute("""
+        DO $$
+        BEGIN
+            -- Ajusta tipos existentes
+            IF EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='ticks_raw' AND column_name='trade_id' AND data_type <> 'bigint') THEN
+               ALTER TABLE ticks_raw ALTER COLUMN trade_id TYPE BIGINT;
+               RAISE NOTICE 'Coluna trade_id em ticks_raw foi alterada para BIGINT.';
+            END IF;
+
+            IF EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='ticks_raw' AND column_name='volume' AND data_type <> 'bigint') THEN
+               ALTER TABLE ticks_raw ALTER COLUMN volume TYPE BIGINT;
+               RAISE NOTICE 'Coluna volume em ticks_raw foi alterada para BIGINT.';
+            END IF;
+
+            -- Adiciona novos campos se não existirem
+            IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='ticks_raw' AND column_name='buy_agent') THEN
+               ALTER TABLE ticks_raw ADD COLUMN buy_agent INTEGER;
+               RAISE NOTICE 'Coluna buy_agent adicionada em ticks_raw.';
+            END IF;
+
+            IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='ticks_raw' AND column_name='sell_agent') THEN
+               ALTER TABLE ticks_raw ADD COLUMN sell_agent INTEGER;
+               RAISE NOTICE 'Coluna sell_agent adicionada em ticks_raw.';
+            END IF;
+
+            IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='ticks_raw' AND column_name='trade_type') THEN
+               ALTER TABLE ticks_raw ADD COLUMN trade_type SMALLINT;
+               RAISE NOTICE 'Coluna trade_type adicionada em ticks_raw.';
+            END IF;
+
+            IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='ticks_raw' AND column_name='volume_financial') THEN
+               ALTER TABLE ticks_raw ADD COLUMN volume_financial DOUBLE PRECISION;
+               RAISE NOTICE 'Coluna volume_financial adicionada em ticks_raw.';
+            END IF;
+
+            IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='ticks_raw' AND column_name='is_edit') THEN
+               ALTER TABLE ticks_raw ADD COLUMN is_edit BOOLEAN DEFAULT FALSE;
+               RAISE NOTICE 'Coluna is_edit adicionada em ticks_raw.';
+            END IF;
+
+                            -- Remover colunas desnecessárias se existirem
+    IF EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='ticks_raw' AND column_name='aggressor_side') THEN
+       ALTER TABLE ticks_raw DROP COLUMN aggressor_side;
+       RAISE NOTICE 'Coluna aggressor_side removida de ticks_raw (redundante com trade_type).';
+    END IF;
+
+    IF EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='ticks_raw' AND column_name='sequence') THEN
+       ALTER TABLE ticks_raw DROP COLUMN sequence;
+       RAISE NOTICE 'Coluna sequence removida de ticks_raw (não necessária).';
+    END IF;
+
+    IF EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='ticks_raw' AND column_name='buyer_maker') THEN
+       ALTER TABLE ticks_raw DROP COLUMN buyer_maker;
+       RAISE NOTICE 'Coluna buyer_maker removida de ticks_raw (não necessária).';
+    END IF;
+        END $$;
+    """)
+
+    await cur.execute("SELECT create_hypertable('ticks_raw', 'timestamp', if_not_exists => TRUE);")
+
+
+async def _m002_order_book_tables(conn: AsyncConnection, cur: AsyncCursor) -> None:
+    await cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS order_book_events (
+            id BIGINT GENERATED ALWAYS AS IDENTITY,
+            symbol VARCHAR(20) NOT NULL,
+            event_time TIMESTAMPTZ NOT NULL,
+            action SMALLINT NOT NULL,
+            side SMALLINT NOT NULL,
+            position BIGINT,
+            price DOUBLE PRECISION,
+            quantity BIGINT,
+            offer_count INTEGER,
+            agent_id INTEGER,
+            sequence BIGINT,
+            raw_payload JSONB
+        );
+        """
+    )
+
+    await cur.execute(
+        """
+        DO $$
+        BEGIN
+            IF EXISTS (
+                SELECT 1 FROM information_schema.columns
+                 WHERE table_name = 'order_book_events'
+                   AND column_name = 'position'
+                   AND data_type <> 'bigint'
+            ) THEN
+                ALTER TABLE order_book_events ALTER COLUMN position TYPE BIGINT;
+            END IF;
+        END $$;
+        """
+    )
+
+    await cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS order_book_snapshots (
+            id BIGINT GENERATED ALWAYS AS IDENTITY,
+            symbol VARCHAR(20) NOT NULL,
+            event_time TIMESTAMPTZ NOT NULL,
+            bids JSONB NOT NULL,
+            asks JSONB NOT NULL,
+            best_bid_price DOUBLE PRECISION,
+            best_bid_quantity BIGINT,
+            best_ask_price DOUBLE PRECISION,
+            best_ask_quantity BIGINT,
+            levels INTEGER,
+            sequence BIGINT,
+            raw_event JSONB
+        );
+        """
+    )
+
+    await cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS order_book_offers (
+            id BIGINT GENERATED ALWAYS AS IDENTITY,
+            symbol VARCHAR(20) NOT NULL,
+            event_time TIMESTAMPTZ NOT NULL,
+            action SMALLINT NOT NULL,
+            side SMALLINT NOT NULL,
+            position BIGINT,
+            price DOUBLE PRECISION,
+            quantity BIGINT,
+            agent_id INTEGER,
+            offer_id BIGINT,
+            flags INTEGER
+        );
+        """
+    )
+
+    await cur.execute(
+        """
+        DO $$
+        BEGIN
+            IF EXISTS (
+                SELECT 1 FROM information_schema.columns
+                 WHERE table_name = 'order_book_offers'
+                   AND column_name = 'position'
+                   AND data_type <> 'bigint'
+            ) THEN
+                ALTER TABLE order_book_offers ALTER COLUMN position TYPE BIGINT;
+            END IF;
+        END $$;
+        """
+    )
+
+    await cur.execute(
+        "SELECT create_hypertable('order_book_events', 'event_time', if_not_exists => TRUE);"
+    )
+
+    await cur.execute(
+        "SELECT create_hypertable('order_book_snapshots', 'event_time', if_not_exists => TRUE);"
+    )
+
+    await cur.execute(
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_order_book_events_event_time_id
+        ON order_book_events(event_time, id);
+        """
+    )
+
+    await cur.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_order_book_events_symbol_time
+        ON order_book_events(symbol, event_time DESC);
+        """
+    )
+
+    await cur.execute(
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_order_book_snapshots_event_time_id
+        ON order_book_snapshots(event_time, id);
+        """
+    )
+
+    await cur.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_order_book_snapshots_symbol_time
+        ON order_book_snapshots(symbol, event_time DESC);
+        """
+    )
+
+    await cur.execute(
+        "SELECT create_hypertable('order_book_offers', 'event_time', if_not_exists => TRUE);"
+    )
+
+    await cur.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_order_book_offers_symbol_time
+        ON order_book_offers(symbol, event_time DESC);
+        """
+    )
+
+
+async def _m003_robot_tables(conn: AsyncConnection, cur: AsyncCursor) -> None:
+    # Cria/ajusta tabela robot_patterns (assinado)
+    await cur.execute("""
+        CREATE TABLE IF NOT EXISTS robot_patterns (
+            id SERIAL PRIMARY KEY,
+            symbol VARCHAR(20) NOT NULL,
+            exchange VARCHAR(10) NOT NULL,
+            pattern_type VARCHAR(50) NOT NULL,
+            robot_type VARCHAR(50) NOT NULL,
+            confidence_score DOUBLE PRECISION NOT NULL,
+            agent_id INTEGER NOT NULL,
+            first_seen TIMESTAMPTZ NOT NULL,
+            last_seen TIMESTAMPTZ NOT NULL,
+            total_volume DOUBLE PRECISION NOT NULL,
+            total_trades INTEGER NOT NULL,
+            avg_trade_size DOUBLE PRECISION NOT NULL,
+            frequency_minutes DOUBLE PRECISION NOT NULL,
+            price_aggression DOUBLE PRECISION NOT NULL,
+            status VARCHAR(20) NOT NULL,
+            market_volume_percentage DOUBLE PRECISION,
+            inactivity_notified BOOLEAN DEFAULT FALSE,
+            created_at TIMESTAMPTZ NOT NULL,
+            signature_volume INTEGER,
+            signature_direction VARCHAR(10),
+            signature_interval_seconds DOUBLE PRECISION,
+            UNIQUE(symbol, agent_id, pattern_type, signature_volume, signature_direction, signature_interval_seconds, first_seen)
+        );
+    """)
+
+    # Adiciona colunas de assinatura se não existirem
+    await cur.execute("""
+        DO $$
+        BEGIN
+            IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='robot_patterns' AND column_name='signature_volume') THEN
+                ALTER TABLE robot_patterns ADD COLUMN signature_volume INTEGER;
+            END IF;
+            IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='robot_patterns' AND column_name='signature_direction') THEN
+                ALTER TABLE robot_patterns ADD COLUMN signature_direction VARCHAR(10);
+            END IF;
+            IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='robot_patterns' AND column_name='signature_interval_seconds') THEN
+                ALTER TABLE robot_patterns ADD COLUMN signature_interval_seconds DOUBLE PRECISION;
+            END IF;
+        END $$;
+    """)
+
+    # Índices auxiliares
+    await cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_robot_patterns_signature
+          ON robot_patterns(symbol, agent_id, pattern_type, signature_volume, signature_direction, signature_interval_seconds);
+    """)
+
+    # robot_trades em modo append-only: trade_id para idempotência e marca do último
+    # trade vinculado por padrão (last_trade_ts/last_trade_id)
+    await cur.execute("""
+        CREATE TABLE IF NOT EXISTS robot_trades (
+            id BIGSERIAL PRIMARY KEY,
+            robot_pattern_id BIGINT REFERENCES robot_patterns(id) ON DELETE CASCADE,
+            symbol TEXT NOT NULL,
+            agent_id INTEGER NOT NULL,
+            timestamp TIMESTAMP WITH TIME ZONE NOT NULL,
+            price DOUBLE PRECISION NOT NULL,
+            volume INTEGER NOT NULL,
+            side TEXT NOT NULL CHECK (side IN ('buy', 'sell')),
+            pattern_id BIGINT,
+            trade_id BIGINT,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+        );
+    """)
+    await cur.execute("""
+        DO $$
+        BEGIN
+            IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='robot_trades' AND column_name='trade_id') THEN
+                ALTER TABLE robot_trades ADD COLUMN trade_id BIGINT;
+            END IF;
+            IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='robot_patterns' AND column_name='last_trade_ts') THEN
+                ALTER TABLE robot_patterns ADD COLUMN last_trade_ts TIMESTAMPTZ;
+            END IF;
+            IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='robot_patterns' AND column_name='last_trade_id') THEN
+                ALTER TABLE robot_patterns ADD COLUMN last_trade_id BIGINT;
+            END IF;
+        END $$;
+    """)
+
+
+async def _m004_robot_trades_unique_key(conn: AsyncConnection, cur: AsyncCursor) -> None:
+    # Falha se já houver duplicatas antigas: fica registrada como pulada (os vínculos
+    # conferem os já gravados) até rodar compact_robot_trades.py
+    await cur.execute(ROBOT_TRADES_UNIQUE_INDEX_SQL)
+
+
+async def _m005_ticks_exchange_time(conn: AsyncConnection, cur: AsyncCursor) -> None:
+    # Horário do negócio na bolsa (TradeDate da DLL); `timestamp` segue sendo o recebimento no feed.
+    # Nula e sem default: não reescreve os chunks existentes (nem os comprimidos)
+    await cur.execute("ALTER TABLE ticks_raw ADD COLUMN IF NOT EXISTS exchange_time TIMESTAMPTZ")
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "ticks_raw", _m001_ticks_raw),
+    Migration(2, "order_book_tables", _m002_order_book_tables),
+    Migration(3, "robot_tables", _m003_robot_tables),
+    Migration(4, "robot_trades_unique_key", _m004_robot_trades_unique_key, optional=True),
+    Migration(5, "ticks_exchange_time", _m005_ticks_exchange_time),
+]
+
+# Resultado da última execução (exposto em /metrics)
+migration_status: Dict[str, Any] = {
+    "schema_version": 0,
+    "applied": [],
+    "pending_optional": [],
+    "duration_ms": 0.0,
+}
+
+
+async def _applied_versions(cur: AsyncCursor) -> Tuple[Set[int], Dict[int, str]]:
+    """Versões aplicadas e migrações opcionais puladas (versão -> nome)."""
+    await cur.execute(
+        "SELECT to_regclass('schema_version') IS NOT NULL, to_regclass('schema_version_skipped') IS NOT NULL"
+    )
+    has_versions, has_skipped = await cur.fetchone()
+    if not has_versions:
+        return set(), {}
+    if not has_skipped:
+        await cur.execute("SELECT version, NULL FROM schema_version")
+    else:
+        await cur.execute(
+            "SELECT version, NULL FROM schema_version UNION ALL SELECT version, name FROM schema_version_skipped"
+        )
+    done: Set[int] = set()
+    skipped: Dict[int, str] = {}
+    for version, skipped_name in await cur.fetchall():
+        if skipped_name is None:
+            done.add(version)
+        else:
+            skipped[version] = skipped_name
+    return done, skipped
+
+
+async def run_migrations(conn_pool: AsyncConnectionPool, migrations: List[Migration] = MIGRATIONS) -> Dict[str, Any]:
+    """Aplica as migrações pendentes; com o esquema em dia é uma consulta só."""
+    started = time.perf_counter()
+    applied: List[str] = []
+    pending_optional: List[str] = []
+    async with conn_pool.connection() as conn:
+        async with conn.cursor() as cur:
+            done, skipped = await _applied_versions(cur)
+            await conn.commit()
+            pending = [m for m in migrations if m.version not in done and m.version not in skipped]
+            for version, name in sorted(skipped.items()):
+                if version not in done:
+                    pending_optional.append(name)
+                    logger.warning(f"⏭️ Migração opcional {version} ({name}) pulada: falhou num boot anterior "
+                                   f"(registrada em schema_version_skipped)")
+
+            if pending:
+                logger.info(f"🧱 Migrações pendentes: {', '.join(f'{m.version}:{m.name}' for m in pending)}")
+                # Outra instância pode estar migrando: espera e relê o que já foi aplicado
+                await cur.execute("SELECT pg_advisory_lock(%s)", (_MIGRATION_LOCK_KEY,))
+                await conn.commit()
+                try:
+                    await cur.execute(SCHEMA_VERSION_SQL)
+                    await cur.execute(SCHEMA_VERSION_SKIPPED_SQL)
+                    done, skipped = await _applied_versions(cur)
+                    await conn.commit()
+                    for migration in pending:
+                        if migration.version in done or migration.version in skipped:
+                            continue
+                        step_started = time.perf_counter()
+                        try:
+                            async with conn.transaction():
+                                await migration.apply(conn, cur)
+                                await cur.execute(
+                                    "INSERT INTO schema_version (version, name, duration_ms) VALUES (%s, %s, %s)",
+                                    (migration.version, migration.name,
+                                     round((time.perf_counter() - step_started) * 1000, 1)),
+                                )
+                        except Exception as e:
+                            if not migration.optional:
+                                logger.error(f"❌ Migração {migration.version} ({migration.name}) falhou: {e}")
+                                raise
+                            pending_optional.append(migration.name)
+                            logger.warning(
+                                f"⚠️ Migração opcional {migration.version} ({migration.name}) não aplicada; "
+                                f"registrada em schema_version_skipped e pulada nos próximos boots: {e}"
+                            )
+                            await cur.execute(
+                                "INSERT INTO schema_version_skipped (version, name, error) VALUES (%s, %s, %s) "
+                                "ON CONFLICT (version) DO UPDATE SET error = EXCLUDED.error, failed_at = now()",
+                                (migration.version, migration.name, str(e)),
+                            )
+                            await conn.commit()
+                            continue
+                        done.add(migration.version)
+                        applied.append(migration.name)
+                finally:
+                    await cur.execute("SELECT pg_advisory_unlock(%s)", (_MIGRATION_LOCK_KEY,))
+                    await conn.commit()
+
+    migration_status.update(
+        schema_version=max(done, default=0),
+        applied=applied,
+        pending_optional=pending_optional,
+        duration_ms=round((time.perf_counter() - started) * 1000, 1),
+    )
+    if applied or pending_optional:
+        logger.info(
+            f"✅ Esquema na versão {migration_status['schema_version']} "
+            f"({len(applied)} migrações aplicadas em {migration_status['duration_ms']} ms)"
+        )
+    else:
+        logger.info(f"✅ Esquema em dia (versão {migration_status['schema_version']}, "
+                    f"{migration_status['duration_ms']} ms)")
+    return migration_status
@@ -0,0 +1,104 @@
+"""
+Teste do fechamento de candles pelo relógio e da gravação em lote
+=================================================================
+Confere que CandleAggregator fecha candles na virada do minuto + carência
+mesmo sem tick novo, que fechar não grava no caminho da ingestão (tudo sai
+num único upsert por flush), que ticks atrasados corrigem o candle fechado e
+geram novo upsert, e que um lote recusado pelo banco é regravado depois.
+"""
+
+import asyncio
+import sys
+from pathlib import Path
+
+# Adiciona o projeto ao path
+_PROJECT_ROOT = Path(__file__).resolve().parents[2]
+if str(_PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(_PROJECT_ROOT))
+
+from services.high_frequency.models import Tick
+from services.high_frequency.candle_aggregator import CandleAggregator
+
+MINUTE = 1_700_000_040.0  # início de um minuto (múltiplo de 60)
+
+
+def tick(symbol: str, ts: float, price: float, volume: int = 100) -> Tick:
+    return Tick(symbol=symbol, exchange="B", price=price, volume=volume, timestamp=ts)
+
+
+def recording_aggregator(fail_first: bool = False):
+    agg = CandleAggregator(close_grace_sec=2.0, late_window_minutes=5)
+    batches = []
+
+    async def write(candles):
+        if fail_first and not batches:
+            batches.append(None)
+            return False
+        batches.append([(c.symbol, c.open_time.timestamp(), c.open_price, c.high_price, c.low_price,
+                         c.close_price, c.total_volume, c.tick_count) for c in candles])
+        return True
+
+    agg._write_candles = write
+    return agg, batches
+
+
+async def test_clock_close_and_single_batch():
+    agg, batches = recording_aggregator()
+    for i, symbol in enumerate(("PETR4", "VALE3", "ILLIQ3")):
+        await agg.process_tick(tick(symbol, MINUTE + 10 + i, 10.0 + i))
+        await agg.process_tick(tick(symbol, MINUTE + 50, 11.0 + i))
+    # PETR4 negocia no minuto seguinte: fecha o anterior sem gravar na hora
+    await agg.process_tick(tick("PETR4", MINUTE + 61, 12.0))
+    assert batches == [] and len(agg.pending_writes) == 1
+
+    # Ainda dentro da carência: nada fecha pelo relógio
+    assert agg.close_expired(MINUTE + 61) == 0
+    # Passada a carência, ILLIQ3 e VALE3 fecham sem tick novo; o PETR4 aberto fica
+    assert agg.close_expired(MINUTE + 62.5) == 2
+    assert set(agg.current_candles) == {"PETR4_B"}
+
+    assert await agg.flush() == 3
+    assert len(batches) == 1
+    assert sorted(row[0] for row in batches[0]) == ["ILLIQ3", "PETR4", "VALE3"]
+    assert await agg.flush() == 0
+
+
+async def test_late_tick_corrects_closed_candle():
+    agg, batches = recording_aggregator()
+    await agg.process_tick(tick("PETR4", MINUTE + 10, 10.0))
+    await agg.process_tick(tick("PETR4", MINUTE + 40, 10.5))
+    await agg.process_tick(tick("PETR4", MINUTE + 70, 11.0))
+    await agg.flush()
+
+    # Dois ticks atrasados do minuto fechado: um antes do primeiro, outro novo máximo no fim
+    await agg.process_tick(tick("PETR4", MINUTE + 5, 9.5, volume=50))
+    await agg.process_tick(tick("PETR4", MINUTE + 55, 12.0, volume=30))
+    open_candle = agg.current_candles["PETR4_B"]
+    assert open_candle.tick_count == 1 and open_candle.close_price == 11.0
+
+    await agg.flush()
+    assert batches[-1] == [("PETR4", MINUTE, 9.5, 12.0, 9.5, 12.0, 280, 4)]
+    assert agg.stats["late_corrections"] == 2
+
+    # Fora da janela de correção o tick atrasado é descartado (continua no ticks_raw)
+    agg.close_expired(MINUTE + 10 * 60)
+    await agg.flush()
+    await agg.process_tick(tick("PETR4", MINUTE + 20, 8.0))
+    assert agg.stats["late_dropped"] == 1 and not agg.pending_writes
+
+
+async def test_failed_batch_is_retried():
+    agg, batches = recording_aggregator(fail_first=True)
+    await agg.process_tick(tick("PETR4", MINUTE + 10, 10.0))
+    agg.close_expired(MINUTE + 63)
+    assert await agg.flush() == 0
+    assert len(agg.pending_writes) == 1 and agg.stats["write_failures"] == 1
+    assert await agg.flush() == 1
+    assert batches[-1][0][0] == "PETR4"
+    print("✅ Candles: fechamento pelo relógio, upsert em lote, correção de atrasados e regravação conferidos")
+
+
+if __name__ == "__main__":
+    asyncio.run(test_clock_close_and_single_batch())
+    asyncio.run(test_late_tick_corrects_closed_candle())
+    asyncio.run(test_failed_batch_is_retried())
@@ -0,0 +1,285 @@
+"""
+Teste do rollup de candles em múltiplos timeframes
+==================================================
+Confere que as barras de 5s..1h derivadas das barras-filhas fechadas são
+iguais à agregação direta dos ticks, que ticks atrasados corrigem todos os
+níveis, que com o 1m alimentado pelo CandleAggregator os níveis 5m..1h saem
+dos candles fechados, que depois de um restart as barras semeadas do banco
+não são sobrescritas só com as filhas novas, a fila de barras sujas e a
+consulta de /ticks (memória + tabela do timeframe, com a barra em andamento).
+"""
+
+import asyncio
+import random
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+
+# Adiciona o projeto ao path
+_PROJECT_ROOT = Path(__file__).resolve().parents[2]
+if str(_PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(_PROJECT_ROOT))
+
+from services.shared.candle_rollup import RollupEngine, TIMEFRAMES
+from services.high_frequency import rollup_store
+from services.high_frequency.candle_aggregator import CandleAggregator
+from services.high_frequency.high_frequency_buffer import HighFrequencyBuffer, Tick as BufferTick
+from services.high_frequency.models import Tick
+
+START = 1_700_000_000.0 - 1_700_000_000 % 3600  # início de uma hora
+
+
+def make_ticks(rng: random.Random, seconds: int, symbols=("PETR4", "VALE3")):
+    ticks, ts = [], START
+    while ts < START + seconds:
+        ts += rng.expovariate(4.0)
+        ticks.append((rng.choice(symbols), round(30 + rng.random() * 5, 2), rng.choice((100, 200, 500)), ts))
+    return ticks
+
+
+def direct_bars(ticks, seconds: int):
+    """Agregação direta dos ticks: (símbolo, bucket) -> (o, h, l, c, v, n)."""
+    bars = {}
+    for symbol, price, volume, ts in sorted(ticks, key=lambda t: t[3]):
+        key = (symbol, int(ts // seconds) * seconds)
+        bar = bars.get(key)
+        if bar is None:
+            bars[key] = [price, price, price, price, volume, 1]
+        else:
+            bar[1], bar[2] = max(bar[1], price), min(bar[2], price)
+            bar[3], bar[4], bar[5] = price, bar[4] + volume, bar[5] + 1
+    return {key: tuple(bar) for key, bar in bars.items()}
+
+
+def engine_bars(engine: RollupEngine, timeframe: str, symbols=("PETR4", "VALE3")):
+    return {
+        (symbol, bar.bucket): (bar.open, bar.high, bar.low, bar.close, bar.volume, bar.tick_count)
+        for symbol in symbols
+        for bar in engine.get_bars(symbol, timeframe, 10**6)
+    }
+
+
+def test_derived_bars_match_direct_aggregation():
+    rng = random.Random(3)
+    ticks = make_ticks(rng, 2 * 3600 + 17)
+    engine = RollupEngine(retain_bars=10**6)
+    for symbol, price, volume, ts in ticks:
+        engine.record_tick(symbol, "B", price, volume, ts)
+    engine.seal_expired(ticks[-1][3] + 60)
+    for timeframe, seconds in TIMEFRAMES:
+        assert engine_bars(engine, timeframe) == direct_bars(ticks, seconds), timeframe
+    assert engine.stats["late_ticks"] == 0
+
+
+def test_late_tick_corrects_every_level():
+    rng = random.Random(4)
+    ticks = make_ticks(rng, 600, symbols=("PETR4",))
+    engine = RollupEngine(retain_bars=10**6, late_window_sec=60)
+    for symbol, price, volume, ts in ticks:
+        engine.record_tick(symbol, "B", price, volume, ts)
+    engine.take_dirty()
+
+    # Tick atrasado 30s atrás, com novo máximo: corrige 1s..1h
+    late = ("PETR4", 99.0, 300, ticks[-1][3] - 30)
+    engine.record_tick(late[0], "B", late[1], late[2], late[3])
+    engine.seal_expired(ticks[-1][3] + 60)
+    for timeframe, seconds in TIMEFRAMES:
+        assert engine_bars(engine, timeframe, ("PETR4",)) == direct_bars(ticks + [late], seconds), timeframe
+    dirty = engine.take_dirty()
+    assert {tf for tf, _ in TIMEFRAMES} <= set(dirty)
+    assert [bar.high for _, bar in dirty["1h"]] == [99.0]
+
+    # Fora da janela: descartado, nada muda
+    engine.record_tick("PETR4", "B", 1.0, 100, ticks[-1][3] - 300)
+    assert engine.stats["late_dropped"] == 1 and engine.take_dirty() == {}
+
+
+async def test_minute_candles_feed_larger_timeframes():
+    rng = random.Random(5)
+    ticks = make_ticks(rng, 3600 + 120)
+    engine = RollupEngine(external_levels=("1m",), retain_bars=10**6)
+    agg = CandleAggregator(close_grace_sec=2.0, late_window_minutes=5)
+
+    def on_closed(candle):
+        engine.add_bar("1m", candle.symbol, candle.exchange, int(candle.open_time.timestamp()),
+                       candle.open_price, candle.high_price, candle.low_price, candle.close_price,
+                       candle.total_volume, candle.total_volume_financial, candle.tick_count)
+
+    agg.on_candle_closed = on_closed
+    for symbol, price, volume, ts in ticks:
+        engine.record_tick(symbol, "B", price, volume, ts)
+        await agg.process_tick(Tick(symbol=symbol, exchange="B", price=price, volume=volume, timestamp=ts))
+    agg.close_expired(ticks[-1][3] + 120)
+    engine.seal_expired(ticks[-1][3] + 120)
+
+    for timeframe, seconds in TIMEFRAMES:
+        assert engine_bars(engine, timeframe) == direct_bars(ticks, seconds), timeframe
+    # 15s não recalcula o 1m (nível externo): ele só muda pelo candle fechado
+    assert engine.stats["external_bars"] == len(direct_bars(ticks, 60))
+
+
+def write_dirty(engine: RollupEngine, table: dict) -> None:
+    """Upsert que substitui a linha, como o _write_bars."""
+    for timeframe, rows in engine.take_dirty().items():
+        for symbol, bar in rows:
+            table[(timeframe, symbol, bar.bucket)] = (bar.open, bar.high, bar.low, bar.close, bar.volume, bar.tick_count)
+
+
+def test_restart_keeps_persisted_bars():
+    rng = random.Random(8)
+    ticks = make_ticks(rng, 3600)
+    restart = START + 45 * 60 + 7
+    table = {}
+    before = RollupEngine(retain_bars=10**6)
+    for symbol, price, volume, ts in ticks:
+        if ts < restart:
+            before.record_tick(symbol, "B", price, volume, ts)
+    before.seal_expired(restart + 1)
+    write_dirty(before, table)
+
+    after = RollupEngine(retain_bars=10**6)
+    for (timeframe, symbol, bucket), (o, h, l, c, v, n) in table.items():
+        level = after.level_of(timeframe)
+        if level and bucket >= int(restart // after.seconds[level]) * after.seconds[level] - after.seconds[level]:
+            after.seed_bar(timeframe, symbol, "B", bucket, o, h, l, c, v, v * 30.0, n, as_of=restart)
+    for symbol, price, volume, ts in ticks:
+        if ts >= restart:
+            after.record_tick(symbol, "B", price, volume, ts)
+    after.seal_expired(ticks[-1][3] + 60)
+    write_dirty(after, table)
+
+    for timeframe, seconds in TIMEFRAMES:
+        stored = {(symbol, bucket): bar for (tf, symbol, bucket), bar in table.items() if tf == timeframe}
+        assert stored == direct_bars(ticks, seconds), timeframe
+
+    # 1m externo: o primeiro minuto depois do restart não reduz a 1h gravada a ele
+    engine = RollupEngine(external_levels=("1m",))
+    engine.seed_bar("1h", "PETR4", "B", int(START), 10.0, 12.0, 9.0, 11.0, 4500, 45000.0, 45, as_of=START + 45 * 60)
+    engine.add_bar("1m", "PETR4", "B", int(START) + 45 * 60, 11.0, 13.0, 11.0, 12.5, 100, 1250.0, 1)
+    hour = engine.take_dirty()["1h"][0][1]
+    assert (hour.open, hour.high, hour.low, hour.close, hour.volume, hour.tick_count) == (10.0, 13.0, 9.0, 12.5, 4600, 46)
+
+
+def test_dirty_rows_and_retry():
+    engine = RollupEngine()
+    engine.record_tick("PETR4", "B", 10.0, 100, START + 0.5)
+    engine.record_tick("PETR4", "B", 11.0, 100, START + 1.5)
+    dirty = engine.take_dirty()
+    assert {tf: [(s, b.bucket) for s, b in rows] for tf, rows in dirty.items()} == {
+        tf: [("PETR4", int(START))] for tf, _ in TIMEFRAMES
+    }
+    assert engine.take_dirty() == {}
+    # Gravação recusada: volta para a próxima
+    engine.mark_dirty("5m", dirty["5m"])
+    assert list(engine.take_dirty()) == ["5m"]
+
+
+def test_realtime_candle_includes_open_second():
+    rng = random.Random(6)
+    ticks = make_ticks(rng, 900, symbols=("PETR4",))
+    buffer = HighFrequencyBuffer(max_ticks_per_symbol=10)
+    for symbol, price, volume, ts in ticks:
+        buffer._update_realtime_candle(BufferTick(symbol=symbol, exchange="B", price=price, volume=volume, timestamp=ts))
+    for timeframe, seconds in TIMEFRAMES:
+        candle = buffer.get_realtime_candle("PETR4", timeframe)
+        expected = direct_bars(ticks, seconds)[("PETR4", int(ticks[-1][3] // seconds) * seconds)]
+        assert (candle.open_price, candle.high_price, candle.low_price, candle.close_price,
+                candle.total_volume, candle.tick_count) == expected, timeframe
+        assert candle.close_time - candle.open_time == seconds
+    assert buffer.get_realtime_candle("PETR4", "2m") is None
+
+
+class _FakeCursor:
+    def __init__(self, rows):
+        self.rows, self.params, self.description = rows, None, [(name,) for name in
+                                                                ("candle_time", "open", "high", "low", "close", "volume")]
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, sql, params):
+        self.sql, self.params = sql, params
+
+    async def fetchall(self):
+        return self.rows
+
+
+class _FakePool:
+    def __init__(self, rows):
+        self.cursor_obj = _FakeCursor(rows)
+
+    def connection(self):
+        pool = self
+
+        class _Conn:
+            async def __aenter__(self):
+                return self
+
+            async def __aexit__(self, *exc):
+                return False
+
+            def cursor(self):
+                return pool.cursor_obj
+
+        return _Conn()
+
+
+async def test_query_merges_memory_and_table():
+    original = rollup_store.rollup_engine
+    rollup_store.rollup_engine = RollupEngine(external_levels=("1m",))
+    try:
+        for i in range(3):
+            rollup_store.record_tick(Tick(symbol="PETR4", exchange="B", price=10.0 + i, volume=100,
+                                          timestamp=START + 5 * i))
+        assert await rollup_store.get_rollup_candles("PETR4", "2m", 10, None) is None
+        # A barra em andamento (segundo ainda aberto) também sai no 5s
+        live = await rollup_store.get_rollup_candles("PETR4", "5s", 10, None)
+        assert [row["close"] for row in live] == [12.0, 11.0, 10.0]
+        assert len(await rollup_store.get_rollup_candles("PETR4", "5s", 2, None)) == 2
+        assert len(await rollup_store.get_rollup_candles("PETR4", "1s", 10, None)) == 3
+        rollup_store.rollup_engine.seal_expired(START + 20)
+
+        memory = await rollup_store.get_rollup_candles("PETR4", "5s", 10, None)
+        assert [row["close"] for row in memory] == [12.0, 11.0, 10.0]
+        assert memory[0]["candle_time"] == datetime.fromtimestamp(START + 10, tz=timezone.utc)
+
+        older = datetime.fromtimestamp(START - 5, tz=timezone.utc)
+        pool = _FakePool([(older, 9.0, 9.0, 9.0, 9.0, 100)])
+        rows = await rollup_store.get_rollup_candles("PETR4", "5s", 4, pool)
+        assert [row["close"] for row in rows] == [12.0, 11.0, 10.0, 9.0]
+        # Só busca no banco o que é mais antigo que a memória, e só o que falta
+        symbol, cutoff, _, remaining = pool.cursor_obj.params
+        assert "candles_5s" in pool.cursor_obj.sql and cutoff == memory[-1]["candle_time"] and remaining == 1
+        # O 1m vem do candles_1m
+        await rollup_store.get_rollup_candles("PETR4", "1m", 4, pool)
+        assert "candles_1m" in pool.cursor_obj.sql and "ts_minute_utc" in pool.cursor_obj.sql
+
+        # 5m acima do 1m externo: minutos fechados + segundos do minuto corrente + segundo aberto
+        rollup_store.rollup_engine = RollupEngine(external_levels=("1m",))
+        rng = random.Random(9)
+        ticks = make_ticks(rng, 200, symbols=("PETR4",))
+        for _, price, volume, ts in ticks:
+            rollup_store.record_tick(Tick(symbol="PETR4", exchange="B", price=price, volume=volume, timestamp=ts))
+        for (_, bucket), (o, h, l, c, v, n) in direct_bars(ticks, 60).items():
+            if bucket + 60 <= ticks[-1][3] - 5:
+                rollup_store.rollup_engine.add_bar("1m", "PETR4", "B", bucket, o, h, l, c, v, 0.0, n)
+        rows = await rollup_store.get_rollup_candles("PETR4", "5m", 3, None)
+        o, h, l, c, v, _ = direct_bars(ticks, 300)[("PETR4", int(START))]
+        assert len(rows) == 1
+        assert (rows[0]["open"], rows[0]["high"], rows[0]["low"], rows[0]["close"], rows[0]["volume"]) == (o, h, l, c, v)
+    finally:
+        rollup_store.rollup_engine = original
+    print("✅ Rollup de candles: derivação, correção de atrasados, 1m externo, barras sujas e consulta conferidos")
+
+
+if __name__ == "__main__":
+    test_derived_bars_match_direct_aggregation()
+    test_late_tick_corrects_every_level()
+    asyncio.run(test_minute_candles_feed_larger_timeframes())
+    test_restart_keeps_persisted_bars()
+    test_dirty_rows_and_retry()
+    test_realtime_candle_includes_open_second()
+    asyncio.run(test_query_merges_memory_and_table())
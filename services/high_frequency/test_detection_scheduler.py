@@ -0,0 +1,132 @@
+"""
+Teste do agendador adaptativo da detecção TWAP
+==============================================
+Confere a ordem de prioridade (nunca analisados e atrasados além do
+intervalo máximo primeiro, depois por ticks prontos), o respeito ao
+intervalo mínimo e à folga da marca d'água, o orçamento global de
+concorrência e as métricas por símbolo.
+"""
+
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+# Adiciona o projeto ao path
+_PROJECT_ROOT = Path(__file__).resolve().parents[2]
+if str(_PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(_PROJECT_ROOT))
+
+from services.high_frequency.detection_scheduler import DetectionScheduler
+
+
+class FakeClock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def finish(scheduler: DetectionScheduler, symbol: str) -> None:
+    """Simula uma análise concluída agora"""
+    schedule = scheduler.schedules[symbol]
+    schedule.consume(scheduler._ready_cutoff(scheduler.clock()))
+    schedule.last_end = scheduler.clock()
+    schedule.runs += 1
+
+
+def test_priority_and_intervals():
+    clock = FakeClock()
+    scheduler = DetectionScheduler(min_interval_sec=5, max_interval_sec=60, settle_sec=5, clock=clock)
+    scheduler.set_symbols(["AFHI11", "BBAS3", "PETR4"])
+
+    # Nunca analisados: todos elegíveis
+    assert sorted(scheduler.due_symbols()) == ["AFHI11", "BBAS3", "PETR4"]
+    for symbol in ("AFHI11", "BBAS3", "PETR4"):
+        finish(scheduler, symbol)
+    assert scheduler.due_symbols() == []
+
+    # BBAS3 recebe muito mais ticks que PETR4; AFHI11 fica quieto
+    for _ in range(300):
+        scheduler.record_tick("BBAS3")
+    for _ in range(20):
+        scheduler.record_tick("PETR4")
+
+    # Dentro da folga os ticks ainda não são lidos pelo incremental
+    clock.now += 5
+    assert scheduler.due_symbols() == []
+    clock.now += 2
+    assert scheduler.due_symbols() == ["BBAS3", "PETR4"]
+
+    # Ticks recentes demais não são consumidos no despacho e seguem pendentes
+    finish(scheduler, "BBAS3")
+    scheduler.record_tick("BBAS3")
+    assert scheduler.schedules["BBAS3"].pending == 1
+    clock.now += 1
+    # Intervalo mínimo: BBAS3 acabou de rodar
+    assert scheduler.due_symbols() == ["PETR4"]
+
+    # Intervalo máximo: o símbolo quieto volta mesmo sem ticks, à frente dos demais
+    clock.now += 60
+    due = scheduler.due_symbols()
+    assert due[:2] == ["AFHI11", "PETR4"] and "BBAS3" in due, due
+
+    # Símbolos fora da lista do pregão e sem ticks pendentes são esquecidos
+    finish(scheduler, "PETR4")
+    scheduler.set_symbols(["BBAS3", "PETR4"])
+    assert "AFHI11" not in scheduler.schedules
+
+
+async def test_concurrency_budget():
+    # Relógio 10x mais rápido: baldes de 1s do agendador viram 0,1s reais
+    scheduler = DetectionScheduler(min_interval_sec=0.5, max_interval_sec=3.0, max_concurrency=3,
+                                   settle_sec=0, symbols_refresh_sec=600, poll_sec=0.01,
+                                   clock=lambda: time.monotonic() * 10)
+    symbols = [f"SYM{i}" for i in range(12)]
+    running = set()
+    peak = 0
+    analyzed = []
+
+    async def analyze(symbol):
+        nonlocal peak
+        assert symbol not in running, f"{symbol} analisado em paralelo consigo mesmo"
+        running.add(symbol)
+        peak = max(peak, len(running))
+        await asyncio.sleep(0.02 if symbol != "SYM0" else 0.1)
+        running.discard(symbol)
+        analyzed.append(symbol)
+
+    async def list_symbols():
+        return symbols
+
+    scheduler.start(analyze, list_symbols)
+    for _ in range(30):
+        for _ in range(50):
+            scheduler.record_tick("SYM5")
+        await asyncio.sleep(0.02)
+    scheduler.stop()
+    await asyncio.sleep(0.15)
+
+    assert peak == 3, peak
+    assert set(analyzed) == set(symbols)
+    # O símbolo movimentado é reanalisado bem mais que os quietos
+    assert analyzed.count("SYM5") > analyzed.count("SYM7"), (analyzed.count("SYM5"), analyzed.count("SYM7"))
+
+    status = scheduler.get_status()
+    assert status["in_flight"] == 0 and status["runs"] == len(analyzed)
+    sym0 = status["symbols"]["SYM0"]
+    assert sym0["avg_duration_ms"] >= 900 and sym0["last_run_age_sec"] is not None
+    assert {"pending_ticks", "staleness_sec", "last_duration_ms", "runs"} <= set(sym0)
+    print(f"   {len(analyzed)} análises, pico de {peak} simultâneas; "
+          f"SYM5 (movimentado) {analyzed.count('SYM5')}x, SYM7 (quieto) {analyzed.count('SYM7')}x")
+    print("✅ Agendador: prioridade, intervalos, folga, orçamento de concorrência e métricas conferidos")
+
+
+async def main():
+    test_priority_and_intervals()
+    await test_concurrency_budget()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
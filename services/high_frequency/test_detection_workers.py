@@ -0,0 +1,117 @@
+"""
+Teste da detecção TWAP em processos por shard
+=============================================
+Roda o mesmo pregão simulado no detector incremental do event loop e no
+modo com workers (acumuladores em processos por shard de símbolos) e confere
+que os padrões, os trades vinculados e os ticks consumidos são idênticos, e
+que os estados exportados dos workers (snapshot) cobrem todos os ticks. Ticks
+gravados atrás da marca d'água fazem o worker refazer o símbolo.
+
+Não usa o banco: reaproveita a persistência em memória de test_incremental_twap.
+"""
+
+import asyncio
+from types import SimpleNamespace
+from datetime import datetime, timezone, timedelta, time
+
+from robot_models import TWAPDetectionConfig
+from robot_detector import TWAPDetector
+from test_incremental_twap import InMemoryPersistence, create_ticks
+
+SYMBOLS = ["PETR4", "VALE3", "BBAS3", "AFHI11"]
+CYCLES = 4
+
+
+def new_detector(ticks, workers=0):
+    persistence = InMemoryPersistence(ticks)
+    config = TWAPDetectionConfig(min_trades=5, min_confidence=0.3, active_recency_minutes=60.0)
+    detector = TWAPDetector(config=config, persistence=persistence, mode="incremental")
+    detector.market_twap_detector.persistence = persistence
+    detector.enable_workers(workers)
+    return detector, persistence
+
+
+async def run_day(detector, start, end):
+    patterns = {}
+    for i in range(1, CYCLES + 1):
+        cutoff = start + (end - start) * i / CYCLES + timedelta(seconds=1)
+        # Relógio fixo no corte: a subida dos processos no primeiro ciclo com workers
+        # não move a janela nem o gate de recência
+        detector.clock = lambda: cutoff
+        detector.settle_seconds = 0.0
+        for symbol in SYMBOLS:
+            patterns[symbol] = await detector.analyze_symbol(symbol)
+    return patterns
+
+
+async def test_workers_match_event_loop():
+    now = datetime.now(timezone.utc)
+    start_of_day = datetime.combine(now.date(), time.min, tzinfo=timezone.utc)
+    start = max(start_of_day, now - timedelta(hours=1))
+    end = now - timedelta(seconds=30)
+    ticks = [t for symbol in SYMBOLS for t in create_ticks(symbol, start, end)]
+
+    in_loop, loop_persistence = new_detector(ticks)
+    expected = await run_day(in_loop, start, end)
+
+    sharded, sharded_persistence = new_detector(ticks, workers=2)
+    try:
+        assert sharded.workers is not None
+        actual = await run_day(sharded, start, end)
+
+        for symbol in SYMBOLS:
+            mismatches = sharded._compare_patterns(expected[symbol], actual[symbol])
+            assert not mismatches, (symbol, mismatches[:5])
+            assert len(expected[symbol]) == len(actual[symbol]) > 0
+        assert sharded_persistence.linked_trades == loop_persistence.linked_trades > 0
+
+        status = sharded.get_detection_status()
+        assert status["symbols_tracked"] == len(SYMBOLS)
+        assert status["ticks_consumed"] == len(ticks), (status["ticks_consumed"], len(ticks))
+        assert sum(w["runs"] for w in status["workers"]) == CYCLES * len(SYMBOLS)
+
+        # Snapshot com workers: estados exportados equivalem aos do event loop
+        states = await sharded.workers.export_states()
+        assert sorted(states) == sorted(in_loop.incremental_states)
+        for symbol, state in states.items():
+            reference = in_loop.incremental_states[symbol]
+            assert state.ticks_consumed == reference.ticks_consumed
+            assert sorted(state.agents) == sorted(reference.agents)
+            for agent_id, agent in state.agents.items():
+                assert len(agent.aggregate.pending) == len(reference.agents[agent_id].aggregate.pending)
+    finally:
+        sharded.close_workers()
+
+    print(f"   {len(ticks)} ticks em {len(SYMBOLS)} símbolos, {CYCLES} ciclos, 2 workers; "
+          f"{sharded_persistence.linked_trades} trades vinculados")
+    print("✅ Workers por shard idênticos à detecção incremental no event loop")
+
+
+async def test_workers_rewind():
+    now = datetime.now(timezone.utc)
+    start_of_day = datetime.combine(now.date(), time.min, tzinfo=timezone.utc)
+    start = max(start_of_day, now - timedelta(hours=1))
+    ticks = create_ticks("PETR4", start, now - timedelta(seconds=30))
+    late = ticks[len(ticks) // 3:len(ticks) // 2]
+
+    sharded, persistence = new_detector([t for t in ticks if t not in late], workers=2)
+    sharded.settle_seconds = 10
+    try:
+        await sharded.analyze_symbol("PETR4")
+        assert sharded.get_detection_status()["ticks_consumed"] == len(ticks) - len(late)
+
+        persistence.ticks = ticks
+        committed = [SimpleNamespace(symbol="PETR4", timestamp=t['timestamp'].timestamp()) for t in late]
+        assert sharded.rewind_for_ticks(committed) == 1
+        await sharded.analyze_symbol("PETR4")
+        status = sharded.get_detection_status()
+        assert status["ticks_consumed"] == len(ticks), (status["ticks_consumed"], len(ticks))
+        assert status["rewinds"] == 1 and not sharded.workers.resets
+    finally:
+        sharded.close_workers()
+    print(f"✅ Worker refaz o símbolo com {len(late)} ticks gravados atrás da marca d'água")
+
+
+if __name__ == "__main__":
+    asyncio.run(test_workers_match_event_loop())
+    asyncio.run(test_workers_rewind())
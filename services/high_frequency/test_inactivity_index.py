@@ -0,0 +1,80 @@
+"""
+Teste do monitor de inatividade com índice em memória
+=====================================================
+Confere que check_robot_inactivity_by_trades usa o último trade do índice
+(sem SQL por robô) e persiste só as transições, em um UPDATE por ciclo.
+"""
+
+import asyncio
+import time
+from datetime import datetime, timezone, timedelta
+
+from robot_models import TWAPDetectionConfig, TWAPPattern, RobotStatus
+from robot_detector import TWAPDetector
+from activity_index import AgentActivityIndex
+
+
+class CountingPersistence:
+    """Conta as idas ao banco feitas pelo monitor de inatividade"""
+
+    def __init__(self):
+        self.batch_updates = []
+        self.notified = set()
+        self.per_robot_queries = 0
+
+    async def mark_patterns_inactive(self, pattern_ids, notify=True):
+        self.batch_updates.append(list(pattern_ids))
+        previous = {pid: pid in self.notified for pid in pattern_ids}
+        if notify:
+            self.notified.update(pattern_ids)
+        return previous
+
+    async def get_recent_ticks_for_agent(self, *args):
+        self.per_robot_queries += 1
+        return []
+
+    async def get_existing_pattern(self, *args):
+        self.per_robot_queries += 1
+        return None
+
+
+def make_pattern(symbol: str, agent_id: int, pattern_id: int, last_seen: datetime) -> TWAPPattern:
+    return TWAPPattern(
+        symbol=symbol, exchange='B', agent_id=agent_id, first_seen=last_seen - timedelta(hours=1),
+        last_seen=last_seen, status=RobotStatus.ACTIVE, signature_volume=100,
+        signature_direction='buy', signature_interval_seconds=30.0, pattern_id=pattern_id,
+    )
+
+
+async def test_inactivity_from_index():
+    persistence = CountingPersistence()
+    index = AgentActivityIndex()
+    detector = TWAPDetector(
+        config=TWAPDetectionConfig(), persistence=persistence, mode="full", activity_index=index
+    )
+
+    stale = datetime.now(timezone.utc) - timedelta(minutes=30)
+    for agent_id in range(1, 201):
+        detector.active_patterns['PETR4'][agent_id]['100|buy|30'] = make_pattern('PETR4', agent_id, agent_id, stale)
+
+    # Metade dos agentes continua operando (vistos pela ingestão)
+    now = time.time()
+    for agent_id in range(1, 101):
+        index.record('PETR4', agent_id, 999, now - 10)
+
+    inactive = await detector.check_robot_inactivity_by_trades(15, use_notification_control=True)
+    assert len(inactive) == 100, len(inactive)
+    assert all(r['newly_notified'] for r in inactive)
+    assert len(persistence.batch_updates) == 1 and len(persistence.batch_updates[0]) == 100
+    assert persistence.per_robot_queries == 0
+
+    # Segundo ciclo: nada novo para persistir, só reporta os já notificados
+    inactive = await detector.check_robot_inactivity_by_trades(15, use_notification_control=True)
+    assert len(inactive) == 100 and not any(r['newly_notified'] for r in inactive)
+    assert len(persistence.batch_updates) == 1
+
+    print(f"✅ 200 robôs verificados: 100 inativos em 1 UPDATE, {persistence.per_robot_queries} consultas por robô")
+
+
+if __name__ == "__main__":
+    asyncio.run(test_inactivity_from_index())
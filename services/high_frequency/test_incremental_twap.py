@@ -0,0 +1,295 @@
+"""
+Teste de paridade da detecção TWAP incremental
+==============================================
+Alimenta o TWAPDetector em modo "verify" com ticks simulados liberados em
+vários ciclos e confere que o resultado incremental é idêntico ao recálculo
+completo (analyze_symbol_full) sobre os mesmos ticks, que ticks gravados
+atrás da marca d'água (atrasados, replay, backfill) rebobinam o símbolo e
+são vinculados em robot_trades apesar da marca do padrão, e que os trades
+pendentes de um agente que nunca se qualifica ficam limitados.
+
+Não usa o banco: a persistência é substituída por uma versão em memória.
+"""
+
+import asyncio
+import logging
+import random
+from types import SimpleNamespace
+from datetime import datetime, timezone, timedelta, time
+from typing import List, Optional
+
+import incremental_twap
+from incremental_twap import SymbolTWAPState
+from robot_models import TWAPDetectionConfig, TickData, TradeType
+from robot_detector import TWAPDetector
+from robot_persistence import RobotTrade, _append_robot_trades
+
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+
+class InMemoryPersistence:
+    """Implementa só o que o TWAPDetector usa, guardando tudo em memória"""
+
+    def __init__(self, ticks: List[dict]):
+        self.ticks = ticks
+        self.patterns = {}
+        self.linked_trades = 0
+        self._next_id = 1
+
+    async def get_ticks_since(self, symbol: str, start_time: datetime) -> List[dict]:
+        return [t for t in self.ticks if t['symbol'] == symbol and t['timestamp'] >= start_time]
+
+    async def get_ticks_between(self, symbol: str, start_time: datetime, end_time: datetime) -> Optional[List[dict]]:
+        return [t for t in self.ticks if t['symbol'] == symbol and start_time <= t['timestamp'] < end_time]
+
+    async def save_pattern_and_trades(self, pattern, trades) -> Optional[int]:
+        self.linked_trades += len(trades)
+        return await self.save_twap_pattern(pattern)
+
+    async def save_twap_pattern(self, pattern) -> Optional[int]:
+        pattern_id = self._next_id
+        self._next_id += 1
+        self.patterns[pattern_id] = pattern
+        return pattern_id
+
+    async def append_robot_trades(self, pattern_id: int, trades) -> int:
+        self.linked_trades += len(trades)
+        return len(trades)
+
+    async def get_existing_pattern(self, *args, **kwargs):
+        return None
+
+
+class RobotTradesCursor:
+    """Cursor que emula robot_patterns (marca do último trade) e robot_trades (chave única)"""
+
+    def __init__(self):
+        self.watermarks = {}
+        self.links = set()
+        self.rowcount = 0
+        self._row = None
+
+    async def execute(self, sql: str, params=None, prepare: bool = False):
+        if "SELECT last_trade_ts" in sql:
+            self._row = self.watermarks.get(params[0], (None, None))
+        elif "INSERT INTO robot_trades" in sql:
+            pattern_id = params["pattern_id"]
+            before = len(self.links)
+            for side, ts, trade_id, price, volume in zip(
+                params["sides"], params["timestamps"], params["trade_ids"], params["prices"], params["volumes"],
+            ):
+                self.links.add((pattern_id, side, ts, -1 if trade_id is None else trade_id, price, volume))
+            self.rowcount = len(self.links) - before
+        elif "UPDATE robot_patterns" in sql:
+            ts, trade_id, pattern_id, _, key_id = params
+            current = self.watermarks.get(pattern_id)
+            if current is None or (current[0], -1 if current[1] is None else current[1]) < (ts, key_id):
+                self.watermarks[pattern_id] = (ts, trade_id)
+
+    async def fetchone(self):
+        return self._row
+
+
+class LinkingPersistence(InMemoryPersistence):
+    """Vincula os trades pelo _append_robot_trades real, com um id estável por padrão"""
+
+    def __init__(self, ticks: List[dict]):
+        super().__init__(ticks)
+        self.cursor = RobotTradesCursor()
+        self.ids = {}
+
+    async def save_twap_pattern(self, pattern) -> Optional[int]:
+        market = pattern.pattern_type == "MARKET_TWAP"
+        key = (pattern.pattern_type, pattern.agent_id,
+               pattern.signature_volume if market else None, pattern.signature_direction if market else None)
+        return self.ids.setdefault(key, len(self.ids) + 1)
+
+    async def save_pattern_and_trades(self, pattern, trades) -> Optional[int]:
+        pattern_id = await self.save_twap_pattern(pattern)
+        await self.append_robot_trades(pattern_id, [
+            RobotTrade(symbol=t.symbol, price=t.price, volume=t.volume, timestamp=t.timestamp,
+                       trade_type=t.trade_type, agent_id=t.agent_id, exchange=t.exchange, trade_id=t.trade_id)
+            for t in trades
+        ])
+        return pattern_id
+
+    async def append_robot_trades(self, pattern_id: int, trades) -> int:
+        return await _append_robot_trades(self.cursor, pattern_id, trades)
+
+    def linked(self, pattern_type: str, agent_id: int) -> set:
+        """Timestamps dos trades vinculados ao padrão agregado do agente"""
+        pattern_id = self.ids.get((pattern_type, agent_id, None, None))
+        return {link[2] for link in self.cursor.links if link[0] == pattern_id}
+
+
+def create_ticks(symbol: str, start: datetime, end: datetime) -> List[dict]:
+    """Robôs regulares (TWAP e TWAP à Mercado) misturados com ruído"""
+    rng = random.Random(42)
+    ticks = []
+    span = (end - start).total_seconds()
+
+    def add(ts: datetime, price: float, volume: int, buy: int, sell: int, trade_type: int):
+        ticks.append({
+            'symbol': symbol, 'price': round(price, 2), 'volume': volume, 'timestamp': ts,
+            'buy_agent': buy, 'sell_agent': sell, 'exchange': 'B', 'trade_type': trade_type,
+        })
+
+    # Agente 72 compra 500 a cada 20s como agressor (TWAP à Mercado)
+    t = 0.0
+    while t < span:
+        add(start + timedelta(seconds=t), 30 + rng.random() * 0.2, 500, 72, rng.randint(1, 50), 2)
+        t += 20 + rng.uniform(-1, 1)
+
+    # Agente 120 vende 100 a cada ~45s, passivo
+    t = 5.0
+    while t < span:
+        add(start + timedelta(seconds=t), 30 + rng.random() * 0.2, 100, rng.randint(1, 50), 120, 2)
+        t += 45 + rng.uniform(-5, 5)
+
+    # Ruído de mercado
+    for _ in range(int(span / 3)):
+        add(start + timedelta(seconds=rng.random() * span), 30 + rng.random() * 0.5,
+            rng.choice((100, 200, 300, 1000)), rng.randint(1, 60), rng.randint(1, 60), rng.choice((2, 3)))
+
+    ticks.sort(key=lambda x: x['timestamp'])
+    return ticks
+
+
+async def test_incremental_parity():
+    symbol = "PETR4"
+    now = datetime.now(timezone.utc)
+    start_of_day = datetime.combine(now.date(), time.min, tzinfo=timezone.utc)
+    start = max(start_of_day, now - timedelta(hours=1))
+    end = now - timedelta(seconds=30)
+
+    persistence = InMemoryPersistence(create_ticks(symbol, start, end))
+    config = TWAPDetectionConfig(min_trades=5, min_confidence=0.3, active_recency_minutes=60.0)
+    detector = TWAPDetector(config=config, persistence=persistence, mode="verify")
+    detector.market_twap_detector.persistence = persistence
+
+    # Libera os ticks em 6 ciclos movendo a folga da marca d'água
+    cycles = 6
+    patterns = []
+    for i in range(1, cycles + 1):
+        cutoff = start + (end - start) * i / cycles + timedelta(seconds=1)
+        detector.settle_seconds = max(0.0, (datetime.now(timezone.utc) - cutoff).total_seconds())
+        patterns = await detector.analyze_symbol(symbol)
+        state = detector.incremental_states[symbol]
+        print(f"ciclo {i}: {state.last_batch_size} ticks novos, {len(patterns)} padrões")
+
+    stats = detector.verify_stats
+    assert stats["cycles"] == cycles, stats
+    assert stats["mismatches"] == 0, stats["last_mismatch"]
+    assert any(p.pattern_type == "MARKET_TWAP" and p.agent_id == 72 for p in patterns)
+    assert persistence.linked_trades > 0
+
+    total_ticks = detector.incremental_states[symbol].ticks_consumed
+    assert total_ticks == len(persistence.ticks), (total_ticks, len(persistence.ticks))
+    print(f"✅ Incremental idêntico ao recálculo completo em {cycles} ciclos ({total_ticks} ticks)")
+
+
+async def test_rewind_on_ticks_behind_watermark():
+    symbol = "PETR4"
+    now = datetime.now(timezone.utc)
+    start_of_day = datetime.combine(now.date(), time.min, tzinfo=timezone.utc)
+    start = max(start_of_day, now - timedelta(hours=1))
+    end = now - timedelta(seconds=30)
+
+    ticks = create_ticks(symbol, start, end)
+    # Um terço dos ticks chega depois (backfill de uma lacuna no meio da janela)
+    late = ticks[len(ticks) // 3:len(ticks) // 2]
+    persistence = InMemoryPersistence([t for t in ticks if t not in late])
+    config = TWAPDetectionConfig(min_trades=5, min_confidence=0.3, active_recency_minutes=60.0)
+    detector = TWAPDetector(config=config, persistence=persistence, mode="verify")
+    detector.market_twap_detector.persistence = persistence
+    detector.settle_seconds = 10
+
+    await detector.analyze_symbol(symbol)
+    assert detector.incremental_states[symbol].ticks_consumed == len(persistence.ticks)
+
+    # Tick novo (à frente da marca d'água) não rebobina
+    assert detector.rewind_for_ticks([SimpleNamespace(symbol=symbol, timestamp=now.timestamp())]) == 0
+    assert symbol in detector.incremental_states
+
+    persistence.ticks = ticks
+    committed = [SimpleNamespace(symbol=t['symbol'], timestamp=t['timestamp'].timestamp()) for t in late]
+    assert detector.rewind_for_ticks(committed) == 1
+    assert symbol not in detector.incremental_states
+
+    await detector.analyze_symbol(symbol)
+    assert detector.incremental_states[symbol].ticks_consumed == len(ticks)
+    assert detector.verify_stats["mismatches"] == 0, detector.verify_stats["last_mismatch"]
+    assert detector.get_detection_status()["rewinds"] == 1
+    print(f"✅ {len(late)} ticks atrás da marca d'água rebobinam o símbolo e entram no recálculo")
+
+
+async def test_late_trades_are_linked_after_rewind():
+    symbol = "PETR4"
+    now = datetime.now(timezone.utc)
+    start_of_day = datetime.combine(now.date(), time.min, tzinfo=timezone.utc)
+    start = max(start_of_day, now - timedelta(hours=1))
+    end = now - timedelta(seconds=30)
+
+    ticks = create_ticks(symbol, start, end)
+    late = ticks[len(ticks) // 3:len(ticks) // 2]
+    persistence = LinkingPersistence([t for t in ticks if t not in late])
+    config = TWAPDetectionConfig(min_trades=5, min_confidence=0.3, active_recency_minutes=60.0)
+    detector = TWAPDetector(config=config, persistence=persistence, mode="incremental")
+    detector.market_twap_detector.persistence = persistence
+    detector.settle_seconds = 10
+
+    await detector.analyze_symbol(symbol)
+    late_72 = {t['timestamp'] for t in late if t['buy_agent'] == 72}
+    linked_before = persistence.linked("TWAP", 72)
+    assert late_72 and linked_before and not late_72 & linked_before
+    assert max(linked_before) > max(late_72)
+
+    # Backfill grava os ticks atrás da marca d'água: o recálculo vincula os trades
+    # deles, mesmo com a marca dos padrões já à frente
+    persistence.ticks = ticks
+    detector.rewind_for_ticks([SimpleNamespace(symbol=symbol, timestamp=t['timestamp'].timestamp()) for t in late])
+    await detector.analyze_symbol(symbol)
+    assert late_72 <= persistence.linked("TWAP", 72)
+    print(f"✅ {len(late_72)} trades do agente 72 atrás da marca do padrão vinculados após o rewind")
+
+
+def test_pending_is_bounded():
+    cap = 50
+    saved_cap = incremental_twap.TWAP_PENDING_MAX
+    incremental_twap.TWAP_PENDING_MAX = cap
+    try:
+        # Confiança mínima inalcançável: nenhum padrão é gravado e nada consome os pendentes
+        config = TWAPDetectionConfig(min_trades=5, min_confidence=1.01)
+        detector = TWAPDetector(config=config, persistence=InMemoryPersistence([]), mode="incremental")
+        start = datetime(2025, 11, 3, 13, 0, tzinfo=timezone.utc)
+        state = SymbolTWAPState(start.date(), start)
+        rng = random.Random(7)
+        for cycle in range(40):
+            trades = [
+                TickData(symbol="PETR4", price=30 + rng.random(), volume=rng.choice((100, 200)),
+                         timestamp=start + timedelta(seconds=cycle * 100 + i), trade_type=rng.choice(list(TradeType)),
+                         agent_id=9, exchange="B", raw_trade_type=rng.choice((2, 3)))
+                for i in range(100)
+            ]
+            state.add_trades(9, trades)
+            detector._incremental_deltas("PETR4", state)
+
+        agent = state.agents[9]
+        accumulators = [agent.aggregate, *agent.clusters.values(), *agent.market.values()]
+        assert agent.aggregate.count == 4000
+        assert all(len(acc.pending) < 2 * cap for acc in accumulators)
+        assert len(agent.fallback_pending) < 2 * cap
+        for market in agent.market.values():
+            expected = sum(1 for t in market.pending if incremental_twap._is_aggressor(t))
+            assert market.pending_aggressors == expected, (market.pending_aggressors, expected)
+        print(f"✅ Pendentes limitados a {2 * cap} trades por acumulador (4000 trades sem padrão)")
+    finally:
+        incremental_twap.TWAP_PENDING_MAX = saved_cap
+
+
+if __name__ == "__main__":
+    asyncio.run(test_incremental_parity())
+    asyncio.run(test_rewind_on_ticks_behind_watermark())
+    asyncio.run(test_late_trades_are_linked_after_rewind())
+    test_pending_is_bounded()
@@ -0,0 +1,239 @@
+"""
+Teste do transporte IPC entre feeds e backend
+=============================================
+Sobe o IpcServer num loop asyncio em thread separada e confere com o
+IpcClient: entrega em ordem com ACK, reconexão com reenvio sem duplicar,
+contagem de lacunas, send() devolvendo False sem servidor (fallback HTTP),
+frame com falha de escrita não reenviado na reconexão, frame já escrito que
+estoura o ack_timeout mantido na fila de reenvio (sem voltar pelo HTTP) e
+frames rejeitados pelo handler ainda confirmados.
+"""
+
+import asyncio
+import socket
+import sys
+import threading
+import time
+from pathlib import Path
+
+# Adiciona o projeto ao path
+_PROJECT_ROOT = Path(__file__).resolve().parents[2]
+if str(_PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(_PROJECT_ROOT))
+
+from services.high_frequency.ipc_server import IpcServer
+from services.shared.ipc_transport import (
+    FRAME_HEADER, KIND_BOOK_EVENT, KIND_HELLO, KIND_TICKS, IpcClient, pack_frame, pack_hello, parse_address,
+)
+from services.shared.tick_codec import decode_ticks, encode_ticks
+
+
+def free_address() -> str:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return f"tcp://127.0.0.1:{sock.getsockname()[1]}"
+
+
+class ServerThread:
+    """IpcServer rodando num loop próprio; handlers registram o que recebem"""
+
+    def __init__(self, address: str):
+        self.received = []
+        self.delay = 0.0
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+        async def ticks(body: bytes):
+            await asyncio.sleep(self.delay)
+            self.received.extend(t[3] for t in decode_ticks(body).rows(0.0))
+
+        async def book_event(body: bytes):
+            raise ValueError("evento inválido")
+
+        self.server = IpcServer(address, {KIND_TICKS: ticks, KIND_BOOK_EVENT: book_event})
+        self.call(self.server.start())
+
+    def call(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(5)
+
+    def stop(self):
+        self.call(self.server.stop())
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(5)
+
+
+def batch(volume: int) -> bytes:
+    return encode_ticks([{"symbol": "PETR4", "price": 30.0, "volume": volume, "timestamp": 1.0}])
+
+
+def wait_until(predicate, timeout: float = 3.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return predicate()
+
+
+def test_ordering_ack_and_reconnect():
+    address = free_address()
+    server = ServerThread(address)
+    client = IpcClient(address, "test.ticks", reconnect_backoff_sec=0.05)
+
+    for volume in range(1, 101):
+        assert client.send(KIND_TICKS, batch(volume), wait=volume % 10 == 0)
+    assert wait_until(lambda: client.stats()["inflight"] == 0)
+    assert server.received == list(range(1, 101))
+
+    # Frames rejeitados pelo handler continuam sendo confirmados
+    assert client.send(KIND_BOOK_EVENT, b"{}", wait=True)
+    status = server.server.get_status()["streams"]["test.ticks"]
+    assert status["rejected"] == 1 and status["duplicates"] == 0
+
+    # Servidor cai: send() falha (o chamador usa o HTTP) até ele voltar
+    server.stop()
+    assert wait_until(lambda: not client.stats()["connected"])
+    assert not client.send(KIND_TICKS, batch(999), wait=True)
+
+    server.call(server.server.start())
+    time.sleep(0.1)
+    assert wait_until(lambda: client.send(KIND_TICKS, batch(101), wait=True))
+    assert server.received == list(range(1, 102)), server.received[-5:]
+    stats = client.stats()
+    assert stats["reconnects"] == 1 and stats["inflight"] == 0
+
+    client.close()
+    server.stop()
+    server.close()
+
+
+def test_resend_after_lost_acks_is_deduplicated():
+    address = free_address()
+    server = ServerThread(address)
+    client = IpcClient(address, "test.resend", reconnect_backoff_sec=0.05)
+
+    assert client.send(KIND_TICKS, batch(1), wait=True)
+    # Simula ACKs perdidos: frames entregues continuam na fila de reenvio
+    with client._lock:
+        client._acked_seq = 0
+        client._inflight[1] = pack_frame(KIND_TICKS, 1, batch(1))
+        client._disconnect_locked()
+        client._next_connect_at = 0.0
+
+    assert client.send(KIND_TICKS, batch(2), wait=True)
+    assert server.received == [1, 2]
+    stream = server.server.get_status()["streams"]["test.resend"]
+    assert stream["frames"] == 2 and stream["gaps"] == 0
+
+    client.close()
+    server.stop()
+    server.close()
+
+
+class FailingSocket:
+    """Socket cuja escrita falha; fechar fecha o socket real"""
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+
+    def sendall(self, data: bytes) -> None:
+        raise ConnectionResetError("escrita falhou")
+
+    def close(self) -> None:
+        self.sock.close()
+
+
+def test_failed_write_is_not_resent():
+    address = free_address()
+    server = ServerThread(address)
+    client = IpcClient(address, "test.write", reconnect_backoff_sec=0.05)
+
+    assert client.send(KIND_TICKS, batch(1), wait=True)
+    with client._lock:
+        client._sock = FailingSocket(client._sock)
+    # Sem wait o chamador também manda pelo HTTP: o frame não pode voltar na reconexão
+    assert not client.send(KIND_TICKS, batch(2))
+    assert client.stats()["inflight"] == 0
+
+    assert wait_until(lambda: client.send(KIND_TICKS, batch(3), wait=True))
+    assert server.received == [1, 3], server.received
+    assert client.stats()["frames_resent"] == 0
+
+    client.close()
+    server.stop()
+    server.close()
+
+
+def test_ack_timeout_keeps_written_frame():
+    address = free_address()
+    server = ServerThread(address)
+    client = IpcClient(address, "test.slow", ack_timeout_sec=0.1, reconnect_backoff_sec=0.05)
+
+    # Ingestão lenta: o frame já foi escrito, então send() não manda o chamador ao HTTP
+    server.delay = 0.5
+    assert client.send(KIND_TICKS, batch(1), wait=True)
+    stats = client.stats()
+    assert stats["ack_timeouts"] == 1 and stats["inflight"] == 1
+
+    # Conexão cai com o handler ainda ocupado: a reconexão espera a entrega e não duplica
+    server.delay = 0.0
+    with client._lock:
+        client._disconnect_locked()
+        client._next_connect_at = 0.0
+    assert wait_until(lambda: client.send(KIND_TICKS, batch(2), wait=True))
+    assert wait_until(lambda: client.stats()["inflight"] == 0)
+    assert server.received == [1, 2], server.received
+    assert server.server.get_status()["streams"]["test.slow"]["frames"] == 2
+
+    client.close()
+    server.stop()
+    server.close()
+
+
+def test_gaps_are_counted():
+    address = free_address()
+    server = ServerThread(address)
+    _, target = parse_address(address)
+
+    with socket.create_connection(target, timeout=2) as sock:
+        sock.sendall(pack_frame(KIND_HELLO, 0, pack_hello(7, 1, "test.gaps")))
+        acks = []
+
+        def read_ack():
+            header = b""
+            while len(header) < FRAME_HEADER.size:
+                header += sock.recv(FRAME_HEADER.size - len(header))
+            acks.append(FRAME_HEADER.unpack(header)[2])
+
+        read_ack()
+        for seq in (1, 2, 5, 6, 9):
+            sock.sendall(pack_frame(KIND_TICKS, seq, batch(seq)))
+            read_ack()
+
+    assert acks == [0, 1, 2, 5, 6, 9]
+    stream = server.server.get_status()["streams"]["test.gaps"]
+    assert stream["gaps"] == 2 and stream["missing"] == 4
+    assert server.received == [1, 2, 5, 6, 9]
+
+    server.stop()
+    server.close()
+
+
+def test_send_without_server_returns_false():
+    client = IpcClient(free_address(), "test.down", connect_timeout_sec=0.2)
+    assert not client.send(KIND_TICKS, batch(1))
+    assert not client.send(KIND_TICKS, batch(1), wait=True)
+    assert client.stats()["frames_sent"] == 0
+    print("✅ Transporte IPC: ordem, ACK, reconexão sem duplicatas, falha de escrita, ACK atrasado, lacunas e fallback conferidos")
+
+
+if __name__ == "__main__":
+    test_ordering_ack_and_reconnect()
+    test_resend_after_lost_acks_is_deduplicated()
+    test_failed_write_is_not_resent()
+    test_ack_timeout_keeps_written_frame()
+    test_gaps_are_counted()
+    test_send_without_server_returns_false()
@@ -0,0 +1,155 @@
+"""
+Teste do motor de price book compartilhado
+==========================================
+Confere que services/shared/order_book aplica add/edit/delete/delete from
+exatamente como as listas de níveis que dll.py e profit.py mantinham, que o
+top-N sai do melhor para o pior, que posições fora do book e sequências
+externas puladas viram lacunas (fora de sincronia até o próximo book
+completo), as métricas derivadas e o intervalo dos snapshots periódicos.
+"""
+
+import random
+import sys
+from pathlib import Path
+
+# Adiciona o projeto ao path
+_PROJECT_ROOT = Path(__file__).resolve().parents[2]
+if str(_PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(_PROJECT_ROOT))
+
+from services.shared.order_book import (
+    ACTION_ADD, ACTION_DELETE, ACTION_DELETE_FROM, ACTION_EDIT, SIDE_BUY, SIDE_SELL, OrderBook,
+)
+
+
+class LegacyBook:
+    """Listas de níveis com índices a partir do fim, como profit.py fazia"""
+
+    def __init__(self):
+        self.sides = {SIDE_BUY: [], SIDE_SELL: []}
+
+    def apply(self, action, side, position, price, qty, count):
+        levels = self.sides[side]
+        if action == ACTION_ADD:
+            idx = min(max(len(levels) - position, 0), len(levels))
+            levels.insert(idx, [price, qty, count])
+        elif action == ACTION_EDIT:
+            idx = len(levels) - position - 1
+            if 0 <= idx < len(levels):
+                level = levels[idx]
+                level[1], level[2] = qty, count
+                level[0] = price or level[0]
+        elif action == ACTION_DELETE:
+            idx = len(levels) - position - 1
+            if 0 <= idx < len(levels):
+                levels.pop(idx)
+        elif action == ACTION_DELETE_FROM:
+            idx = len(levels) - position - 1
+            if 0 <= idx < len(levels):
+                del levels[idx:]
+
+
+def make_events(rng: random.Random, n: int):
+    """Eventos válidos de um book vivo, com a atividade concentrada perto do topo
+    (posições pequenas)"""
+    sides = {SIDE_BUY: [], SIDE_SELL: []}
+    events = []
+    for _ in range(n):
+        side = rng.choice((SIDE_BUY, SIDE_SELL))
+        levels = sides[side]
+        position = min(int(rng.expovariate(0.3)), len(levels))
+        # Book de ~50 níveis por lado: acima disso as inserções rareiam
+        roll = rng.random() + (0.3 if len(levels) > 50 else 0.0)
+        if not levels or roll < 0.35:
+            # Preço entre os vizinhos, crescente até o topo (só a posição importa ao motor)
+            index = len(levels) - position
+            below = levels[index - 1][0] if index > 0 else 0.0
+            above = levels[index][0] if index < len(levels) else below + 2.0
+            price = (below + above) / 2
+            event = (ACTION_ADD, side, position, price, rng.randint(1, 50) * 100, rng.randint(1, 20))
+            levels.insert(index, list(event[3:]))
+        elif roll < 0.75:
+            position = min(position, len(levels) - 1)
+            event = (ACTION_EDIT, side, position, 0.0, rng.randint(1, 50) * 100, rng.randint(1, 20))
+            levels[len(levels) - position - 1][1:] = event[4:]
+        elif roll < 0.97 or roll >= 1.0:
+            position = min(position, len(levels) - 1)
+            event = (ACTION_DELETE, side, position, 0.0, 0, 0)
+            levels.pop(len(levels) - position - 1)
+        else:
+            position = min(position, len(levels) - 1, 2)
+            event = (ACTION_DELETE_FROM, side, position, 0.0, 0, 0)
+            del levels[len(levels) - position - 1:]
+        events.append(event)
+    return events
+
+
+def test_matches_legacy_lists():
+    rng = random.Random(5)
+    events = make_events(rng, 20000)
+    legacy = LegacyBook()
+    book = OrderBook("PETR4", top_levels=5)
+    book.load([], [])
+    for i, event in enumerate(events):
+        legacy.apply(*event)
+        assert book.apply(*event), (i, event)
+        if i % 500 == 0 or i == len(events) - 1:
+            for side, book_side in ((SIDE_BUY, book.bids), (SIDE_SELL, book.asks)):
+                expected = [tuple(level) for level in legacy.sides[side]]
+                actual = list(zip(book_side.prices, book_side.quantities, book_side.counts))
+                assert actual == expected, (i, side)
+
+    bids, asks = book.top()
+    assert bids == [tuple(l) for l in reversed(legacy.sides[SIDE_BUY][-5:])]
+    assert asks == [tuple(l) for l in reversed(legacy.sides[SIDE_SELL][-5:])]
+    assert [p for p, _, _ in bids] == sorted((p for p, _, _ in bids), reverse=True)
+    assert book.in_sync and book.gaps == 0 and book.sequence == len(events) + 1
+
+
+def test_gaps_and_resync():
+    book = OrderBook("VALE3")
+    book.load([(29.98, 100, 1), (29.99, 200, 2)], [(30.02, 300, 3), (30.01, 400, 4)], sequence=10)
+    assert book.in_sync
+    assert book.apply(ACTION_EDIT, SIDE_BUY, 0, 0.0, 500, 5, sequence=11)
+    assert book.in_sync and book.gaps == 0
+    # Sequência externa pulada
+    assert book.apply(ACTION_EDIT, SIDE_BUY, 0, 0.0, 600, 6, sequence=13)
+    assert not book.in_sync and book.gaps == 1
+    book.load([(29.99, 100, 1)], [(30.01, 100, 1)])
+    assert book.in_sync
+    # Posição fora do book
+    assert not book.apply(ACTION_DELETE, SIDE_SELL, 5)
+    assert not book.apply(ACTION_EDIT, SIDE_BUY, 3, 0.0, 1, 1)
+    assert not book.apply(ACTION_ADD, SIDE_BUY, 7, 29.90, 100, 1)
+    assert not book.in_sync and book.gaps == 4
+    assert book.status()["bid_levels"] == 2
+
+
+def test_metrics_and_snapshots():
+    book = OrderBook("WINZ25", top_levels=2, snapshot_interval_ms=500)
+    book.load(
+        [(9.97, 100, 1), (9.98, 300, 1), (9.99, 100, 1)],
+        [(10.03, 500, 1), (10.02, 200, 1), (10.01, 300, 1)],
+    )
+    metrics = book.metrics()
+    assert metrics["best_bid"] == 9.99 and metrics["best_ask"] == 10.01
+    assert abs(metrics["spread"] - 0.02) < 1e-9 and abs(metrics["mid"] - 10.0) < 1e-9
+    # Mais quantidade no ask do topo: microprice abaixo do mid
+    assert abs(metrics["microprice"] - (9.99 * 300 + 10.01 * 100) / 400) < 1e-9
+    assert abs(metrics["imbalance"] - (400 - 500) / 900) < 1e-9
+    assert OrderBook("X").metrics()["spread"] is None
+
+    assert book.snapshot_due(100.0)
+    snapshot = book.snapshot(100.0)
+    assert snapshot["bids"] == [{"price": 9.99, "quantity": 100, "offer_count": 1},
+                                {"price": 9.98, "quantity": 300, "offer_count": 1}]
+    assert [level["price"] for level in snapshot["asks"]] == [10.01, 10.02]
+    assert snapshot["sequence"] == book.sequence
+    assert not book.snapshot_due(100.4) and book.snapshot_due(100.5)
+
+
+if __name__ == "__main__":
+    test_matches_legacy_lists()
+    test_gaps_and_resync()
+    test_metrics_and_snapshots()
+    print("✅ Motor de price book idêntico às listas antigas; lacunas, métricas e snapshots conferidos")
@@ -0,0 +1,187 @@
+"""
+Teste das migrações versionadas e da ingestão antes do banco
+============================================================
+Confere que o primeiro boot aplica e registra todas as migrações, que um boot
+com o esquema em dia faz só a consulta ao schema_version, que uma migração
+opcional com falha é registrada em schema_version_skipped e os boots seguintes
+não a tentam de novo (até ser registrada como aplicada), que uma migração
+obrigatória com falha interrompe a subida, e que ticks aceitos antes do banco
+ficar pronto são gravados quando o processador do buffer sobe.
+"""
+
+import asyncio
+import sys
+from pathlib import Path
+
+# Adiciona o projeto ao path
+_PROJECT_ROOT = Path(__file__).resolve().parents[2]
+if str(_PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(_PROJECT_ROOT))
+
+from services.high_frequency import buffer
+from services.high_frequency.models import Tick
+from services.high_frequency.robot_persistence import ROBOT_TRADES_UNIQUE_INDEX_SQL
+from services.high_frequency.schema_migrations import MIGRATIONS, Migration, run_migrations
+
+
+class FakeDatabase:
+    """Só o necessário do pool/conexão/cursor do psycopg para o runner."""
+
+    def __init__(self, fail_on: str = ""):
+        self.versions = {}
+        self.skipped = {}
+        self.has_table = False
+        self.has_skipped_table = False
+        self.statements = []
+        self.fail_on = fail_on
+        self._result = None
+        self._pending_versions = {}
+
+    # pool
+    def connection(self):
+        return _Context(self)
+
+    # conexão
+    def cursor(self):
+        return _Context(self)
+
+    def transaction(self):
+        db = self
+
+        class _Transaction:
+            async def __aenter__(self):
+                db._pending_versions = {}
+                return self
+
+            async def __aexit__(self, exc_type, *exc):
+                if exc_type is None:
+                    db.versions.update(db._pending_versions)
+                return False
+
+        return _Transaction()
+
+    async def commit(self):
+        pass
+
+    # cursor
+    async def execute(self, sql, params=None):
+        self.statements.append(sql)
+        if self.fail_on and self.fail_on in sql:
+            raise RuntimeError("duplicatas em robot_trades")
+        if "to_regclass('schema_version')" in sql:
+            self._result = [(self.has_table, self.has_skipped_table)]
+        elif "SELECT version, NULL FROM schema_version" in sql:
+            self._result = [(v, None) for v in self.versions]
+            if "schema_version_skipped" in sql:
+                self._result += list(self.skipped.items())
+        elif "CREATE TABLE IF NOT EXISTS schema_version_skipped" in sql:
+            self.has_skipped_table = True
+        elif "CREATE TABLE IF NOT EXISTS schema_version" in sql:
+            self.has_table = True
+        elif sql.startswith("INSERT INTO schema_version_skipped"):
+            self.skipped[params[0]] = params[1]
+        elif sql.startswith("INSERT INTO schema_version"):
+            self._pending_versions[params[0]] = params[1]
+
+    async def fetchone(self):
+        return self._result[0]
+
+    async def fetchall(self):
+        return self._result
+
+
+class _Context:
+    def __init__(self, value):
+        self.value = value
+
+    async def __aenter__(self):
+        return self.value
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+async def test_first_boot_applies_and_second_boot_skips():
+    db = FakeDatabase(fail_on=ROBOT_TRADES_UNIQUE_INDEX_SQL)
+    status = await run_migrations(db)
+    # A chave única de robot_trades falha (duplicatas): opcional, registrada como pulada
+    assert sorted(db.versions) == [1, 2, 3, 5]
+    assert status["pending_optional"] == ["robot_trades_unique_key"]
+    assert db.skipped == {4: "robot_trades_unique_key"}
+    first_boot = len(db.statements)
+    assert first_boot > 20
+
+    # Próximo boot não tenta de novo nem pega o advisory lock
+    db.statements.clear()
+    status = await run_migrations(db)
+    assert len(db.statements) == 2 and status["applied"] == []
+    assert status["pending_optional"] == ["robot_trades_unique_key"]
+    assert not any(ROBOT_TRADES_UNIQUE_INDEX_SQL in sql or "pg_advisory_lock" in sql for sql in db.statements)
+
+    # compact_robot_trades.py criou a chave e registrou a migração
+    db.versions[4] = db.skipped.pop(4)
+    db.fail_on = ""
+
+    # Esquema em dia: só a consulta ao schema_version
+    db.statements.clear()
+    status = await run_migrations(db)
+    assert len(db.statements) == 2 and status["applied"] == [] and status["schema_version"] == 5
+    print(f"   boot com esquema em dia: {len(db.statements)} comandos (primeiro boot: {first_boot})")
+
+
+async def test_required_failure_stops_startup():
+    async def broken(conn, cur):
+        await cur.execute("ALTER TABLE quebrada")
+
+    db = FakeDatabase(fail_on="ALTER TABLE quebrada")
+    migrations = MIGRATIONS[:1] + [Migration(2, "broken", broken), Migration(3, "after", broken)]
+    try:
+        await run_migrations(db, migrations)
+    except RuntimeError:
+        pass
+    else:
+        raise AssertionError("migração obrigatória com falha deveria interromper")
+    assert sorted(db.versions) == [1]
+    # O lock é sempre liberado
+    assert "pg_advisory_unlock" in db.statements[-1]
+
+
+async def test_ticks_accepted_before_db_are_flushed():
+    saved = []
+
+    async def persist(ticks, pool, dedup=None):
+        saved.extend(ticks)
+        return True
+
+    original = (buffer.persist_ticks,)
+    buffer.persist_ticks = persist
+    buffer.buffer_queue.clear()
+    buffer.buffered_ticks = 0
+    try:
+        # Banco ainda subindo: os ticks só entram no buffer
+        for i in range(50):
+            buffer.add_tick_to_buffer(Tick(symbol="PETR4", exchange="B", price=30.0, volume=100,
+                                           timestamp=1_700_000_000 + i, trade_id=i + 1))
+        assert buffer.buffered_ticks == 50 and saved == []
+
+        # Banco pronto: o processador sobe e grava o que foi aceito antes
+        processor = asyncio.create_task(buffer.start_buffer_processor(None))
+        await asyncio.sleep(0.3)
+        processor.cancel()
+        assert [t.trade_id for t in saved] == list(range(1, 51))
+        assert buffer.buffered_ticks == 0
+    finally:
+        buffer.persist_ticks = original[0]
+        buffer.buffer_queue.clear()
+        buffer.buffered_ticks = 0
+    print("✅ Migrações: aplicação, registro, pulo no boot seguinte, opcional pulada e ingestão antes do banco conferidos")
+
+
+async def main():
+    await test_first_boot_applies_and_second_boot_skips()
+    await test_required_failure_stops_startup()
+    await test_ticks_accepted_before_db_are_flushed()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
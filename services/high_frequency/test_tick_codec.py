@@ -0,0 +1,163 @@
+"""
+Teste do formato colunar de ingestão
+====================================
+Confere que um lote codificado por services/shared/tick_codec vira os mesmos
+Ticks que o /ingest/batch monta a partir do JSON (opcionais ausentes, upper()
+em símbolo/exchange), que lotes da versão 1 (sem horário da bolsa)
+continuam legíveis, que payloads malformados são rejeitados e que
+CandleAggregator.process_ticks dá os mesmos candles que process_tick por tick.
+"""
+
+import asyncio
+import random
+import struct
+import sys
+import time
+from pathlib import Path
+
+# Adiciona o projeto ao path
+_PROJECT_ROOT = Path(__file__).resolve().parents[2]
+if str(_PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(_PROJECT_ROOT))
+
+from services.high_frequency.models import Tick
+from services.high_frequency.candle_aggregator import CandleAggregator
+from services.shared.tick_codec import TickCodecError, decode_ticks, encode_ticks
+
+
+def make_payload(count: int, rng: random.Random):
+    now = time.time()
+    ticks = []
+    for i in range(count):
+        tick = {
+            "symbol": rng.choice(("petr4", "VALE3", "WINZ25")),
+            "exchange": rng.choice(("B", "f")),
+            "price": round(30 + rng.random() * 5, 2),
+            "volume": rng.choice((100, 200, 500)),
+            "timestamp": now - 600 + i * 0.25,
+        }
+        # Campos opcionais ausentes, nulos ou presentes, como chegam dos feeds
+        if rng.random() < 0.8:
+            tick.update(trade_id=i + 1, buy_agent=rng.randint(1, 300), sell_agent=rng.randint(1, 300),
+                        trade_type=rng.choice((2, 3)))
+        if rng.random() < 0.3:
+            tick["volume_financial"] = tick["price"] * tick["volume"]
+        if rng.random() < 0.1:
+            tick["timestamp"] = None
+        if rng.random() < 0.05:
+            tick["is_edit"] = True
+        if rng.random() < 0.7:
+            tick["exchange_timestamp"] = now - 600.5 + i * 0.25
+        ticks.append(tick)
+    return ticks
+
+
+def tick_from_json(t: dict, default_ts: float) -> Tick:
+    """O que o /ingest/batch monta a partir de cada IngestTick"""
+    return Tick(
+        symbol=t["symbol"].upper(), exchange=t.get("exchange", "B").upper(), price=t["price"],
+        volume=t["volume"], timestamp=t.get("timestamp") or default_ts, trade_id=t.get("trade_id"),
+        buy_agent=t.get("buy_agent"), sell_agent=t.get("sell_agent"), trade_type=t.get("trade_type"),
+        volume_financial=t.get("volume_financial"), is_edit=t.get("is_edit", False),
+        exchange_timestamp=t.get("exchange_timestamp"),
+    )
+
+
+def test_round_trip_matches_json_ingest():
+    rng = random.Random(17)
+    payload = make_payload(5000, rng)
+    columns = decode_ticks(encode_ticks(payload))
+    assert len(columns) == len(payload)
+
+    default_ts = time.time()
+    got = [Tick(*row) for row in columns.rows(default_ts)]
+    expected = [tick_from_json(t, default_ts) for t in payload]
+    assert got == expected
+    assert list(decode_ticks(encode_ticks([])).rows(default_ts)) == []
+
+
+def encode_v1(ticks) -> bytes:
+    """Lote da versão 1 (sem a coluna exchange_timestamp), como nos journals antigos"""
+    data = bytearray(encode_ticks({k: v for k, v in t.items() if k != "exchange_timestamp"} for t in ticks))
+    data[4] = 1
+    return bytes(data[:-8 * len(ticks)])
+
+
+def test_version_1_still_decodes():
+    rng = random.Random(29)
+    payload = make_payload(200, rng)
+    default_ts = time.time()
+    got = [Tick(*row) for row in decode_ticks(encode_v1(payload)).rows(default_ts)]
+    expected = [tick_from_json({**t, "exchange_timestamp": None}, default_ts) for t in payload]
+    assert got == expected
+
+
+def test_malformed_payloads_are_rejected():
+    rng = random.Random(19)
+    data = encode_ticks(make_payload(50, rng))
+    bad = [
+        b"",
+        b"XXXX" + data[4:],
+        data[:-3],
+        data + b"\x00",
+        encode_ticks([{"symbol": "PETR4", "price": float("nan"), "volume": 100}]),
+        encode_ticks([{"symbol": "PETR4", "price": 10.0, "volume": -1}]),
+        encode_ticks([{"symbol": "PETR4", "price": 0.0, "volume": 100}]),
+        encode_ticks([{"symbol": "", "price": 10.0, "volume": 100}]),
+    ]
+    # Índice de símbolo fora da tabela: reescreve o primeiro índice (logo após a tabela)
+    one = bytearray(encode_ticks([{"symbol": "PETR4", "exchange": "B", "price": 10.0, "volume": 100}]))
+    struct.pack_into("<H", one, 12 + 1 + 5 + 1 + 1, 3)
+    bad.append(bytes(one))
+
+    for payload in bad:
+        try:
+            decode_ticks(payload)
+        except TickCodecError:
+            continue
+        raise AssertionError(f"payload aceito: {payload[:32]!r}")
+
+
+async def test_batch_candles_match_per_tick():
+    rng = random.Random(23)
+    default_ts = time.time()
+    ticks = [Tick(*row) for row in decode_ticks(encode_ticks(make_payload(3000, rng))).rows(default_ts)]
+
+    closed = {"single": [], "batch": []}
+
+    def aggregator(name: str) -> CandleAggregator:
+        agg = CandleAggregator()
+
+        async def write(candles):
+            closed[name].extend(candles)
+            return True
+
+        agg._write_candles = write
+        return agg
+
+    single, batch = aggregator("single"), aggregator("batch")
+    for tick in ticks:
+        await single.process_tick(tick)
+    # Em lotes de tamanhos variados, como chegam no endpoint
+    i = 0
+    while i < len(ticks):
+        size = rng.randint(1, 400)
+        await batch.process_ticks(ticks[i:i + size])
+        i += size
+    await single.flush()
+    await batch.flush()
+
+    def snapshot(candles):
+        return [(c.symbol, c.exchange, c.open_time, c.open_price, c.high_price, c.low_price, c.close_price,
+                 c.total_volume, round(c.total_volume_financial, 6), c.tick_count) for c in candles]
+
+    assert snapshot(closed["single"]) == snapshot(closed["batch"])
+    assert snapshot(single.current_candles.values()) == snapshot(batch.current_candles.values())
+    print(f"✅ Formato colunar confere com o JSON ({len(ticks)} ticks, {len(closed['batch'])} candles fechados)")
+
+
+if __name__ == "__main__":
+    test_round_trip_matches_json_ingest()
+    test_version_1_still_decodes()
+    test_malformed_payloads_are_rejected()
+    asyncio.run(test_batch_candles_match_per_tick())
@@ -0,0 +1,241 @@
+"""
+Teste do journal em disco do buffer de ticks
+============================================
+Confere que segmentos confirmados no banco são apagados, que lotes recusados
+e ticks acima do limite de memória voltam pelo replay sem perda, que uma
+execução nova regrava o que ficou em disco (ignorando registro truncado), que
+o close sela o segmento corrente, a cota de disco e o limite de memória sem
+journal (ticks descartados e contados).
+"""
+
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# Adiciona o projeto ao path
+_PROJECT_ROOT = Path(__file__).resolve().parents[2]
+if str(_PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(_PROJECT_ROOT))
+
+from services.high_frequency import buffer
+from services.high_frequency.models import Tick
+from services.high_frequency.tick_journal import TickJournal
+
+
+def make_ticks(count: int, rng: random.Random, start_id: int = 1):
+    now = time.time()
+    return [
+        Tick(
+            symbol=rng.choice(("PETR4", "VALE3")), exchange="B",
+            # Preço zero passa pelo /ingest/batch e precisa sobreviver ao journal
+            price=0.0 if i == 0 else round(30 + rng.random() * 5, 2),
+            volume=rng.choice((100, 200)), timestamp=now + i * 0.001, trade_id=start_id + i,
+            buy_agent=rng.randint(1, 50) if rng.random() < 0.9 else None,
+            sell_agent=rng.randint(1, 50), trade_type=rng.choice((2, 3, None)),
+            volume_financial=None, is_edit=rng.random() < 0.05,
+        )
+        for i in range(count)
+    ]
+
+
+def new_journal(directory: str, **kwargs) -> TickJournal:
+    options = dict(segment_max_bytes=1, fsync_ms=10, max_bytes=64 * 1024 * 1024)
+    options.update(kwargs)
+    journal = TickJournal(directory, **options)
+    journal.open()
+    return journal
+
+
+def segment_files(directory: str):
+    return sorted(name for name in os.listdir(directory) if name.endswith(".wal"))
+
+
+async def test_commit_truncates_and_failures_replay():
+    rng = random.Random(5)
+    with tempfile.TemporaryDirectory() as directory:
+        journal = new_journal(directory)
+        first, second = make_ticks(300, rng), make_ticks(200, rng, start_id=1000)
+
+        segs_first = [journal.append(t) for t in first]
+        await journal.flush()  # segment_max_bytes=1: cada flush fecha o próprio segmento
+        segs_second = [journal.append(t) for t in second]
+        await journal.flush()
+        await journal.flush()
+        assert len(segment_files(directory)) == 2
+
+        journal.commit(segs_first)
+        assert len(segment_files(directory)) == 1
+        # Segundo lote recusado pelo banco: volta do disco, igual ao que entrou
+        journal.mark_for_replay(segs_second)
+        assert journal.get_status()["segments_pending_replay"] == 1
+
+        written = []
+
+        async def write(ticks):
+            written.extend(ticks)
+            return True
+
+        assert await journal.replay(write) == len(second)
+        assert written == second
+        assert segment_files(directory) == []
+        assert journal.get_status()["lag_ticks"] == 0
+
+
+async def test_recovery_after_restart_ignores_torn_record():
+    rng = random.Random(7)
+    with tempfile.TemporaryDirectory() as directory:
+        journal = new_journal(directory, segment_max_bytes=64 * 1024 * 1024)
+        ticks = make_ticks(500, rng)
+        for t in ticks[:400]:
+            journal.append(t)
+        await journal.flush()
+        for t in ticks[400:]:
+            journal.append(t)
+        await journal.close()
+
+        # Queda no meio de uma escrita: registro final incompleto
+        path = os.path.join(directory, segment_files(directory)[0])
+        with open(path, "ab") as f:
+            f.write(b"\x40\x00\x00\x00\x01\x02")
+
+        restarted = TickJournal(directory, segment_max_bytes=1, fsync_ms=10, max_bytes=64 * 1024 * 1024)
+        assert restarted.open() == 1
+
+        written = []
+
+        async def flaky(batch):
+            # Primeira tentativa recusada: o segmento fica para a próxima
+            if not written:
+                written.append(None)
+                return False
+            written.extend(batch)
+            return True
+
+        assert await restarted.replay(flaky) == 0
+        assert len(segment_files(directory)) == 1
+        assert await restarted.replay(flaky) == len(ticks)
+        assert written[1:] == ticks
+        status = restarted.get_status()
+        # O segmento é relido a cada tentativa
+        assert status["corrupt_records"] == 2 and status["replay_failures"] == 1
+        assert segment_files(directory) == []
+
+
+async def test_close_seals_current_segment():
+    rng = random.Random(13)
+    with tempfile.TemporaryDirectory() as directory:
+        journal = new_journal(directory, segment_max_bytes=64 * 1024 * 1024)
+        ticks = make_ticks(100, rng)
+        segments = [journal.append(t) for t in ticks]
+        await journal.flush()
+        journal.commit(segments[:60])
+        await journal.close()
+        # Ainda falta confirmar parte do segmento: fica em disco
+        assert len(segment_files(directory)) == 1
+        assert journal.append(ticks[0]) is None
+
+        # Buffer grava o resto depois do close: o segmento selado é apagado
+        journal.commit(segments[60:])
+        assert segment_files(directory) == []
+        assert journal.get_status()["segments"] == 0
+
+        # Tudo confirmado antes do close: apagado já no close
+        journal = new_journal(directory, segment_max_bytes=64 * 1024 * 1024)
+        journal.commit([journal.append(t) for t in ticks])
+        await journal.flush()
+        await journal.close()
+        assert segment_files(directory) == []
+
+
+async def test_quota_stops_journaling():
+    rng = random.Random(9)
+    with tempfile.TemporaryDirectory() as directory:
+        journal = new_journal(directory, segment_max_bytes=64 * 1024 * 1024, max_bytes=1024)
+        ticks = make_ticks(200, rng)
+        for t in ticks:
+            journal.append(t)
+        await journal.flush()
+        assert journal.get_status()["over_quota"]
+        assert journal.append(ticks[0]) is None
+        assert journal.stats["unjournaled"] == 1
+        await journal.close()
+
+
+async def test_buffer_spills_and_replays_failed_batches():
+    rng = random.Random(11)
+    with tempfile.TemporaryDirectory() as directory:
+        journal = new_journal(directory)
+        saved, calls = [], {"n": 0}
+
+        async def persist(ticks, pool, dedup=None):
+            calls["n"] += 1
+            if calls["n"] == 1:
+                return False  # banco fora no primeiro lote
+            saved.extend(ticks)
+            return True
+
+        original = (buffer.tick_journal, buffer.persist_ticks, buffer.HF_BUFFER_MAX_TICKS)
+        buffer.tick_journal, buffer.persist_ticks, buffer.HF_BUFFER_MAX_TICKS = journal, persist, 300
+        buffer.buffer_queue.clear()
+        buffer.buffered_ticks = 0
+        try:
+            ticks = make_ticks(500, rng)
+            for t in ticks:
+                buffer.add_tick_to_buffer(t)
+            # Acima de 300 em memória o resto fica só no journal
+            assert buffer.buffered_ticks == 300 and buffer.buffer_stats["spilled_ticks"] == 200
+
+            processor = asyncio.create_task(buffer.start_buffer_processor(None))
+            flusher = asyncio.create_task(journal.run_flusher())
+            await asyncio.sleep(0.3)
+            await journal.flush()
+            await journal.replay(lambda batch: persist(batch, None, dedup=True))
+            processor.cancel()
+            flusher.cancel()
+
+            assert buffer.buffered_ticks == 0
+            # Sem perdas: cada tick gravado ao menos uma vez (o replay deduplica por trade_id no banco)
+            assert {t.trade_id for t in saved} == {t.trade_id for t in ticks}
+            assert buffer.buffer_stats["lost_ticks"] == 0
+            assert journal.get_status()["segments_pending_replay"] == 0
+        finally:
+            buffer.tick_journal, buffer.persist_ticks, buffer.HF_BUFFER_MAX_TICKS = original
+            buffer.buffer_queue.clear()
+            buffer.buffered_ticks = 0
+
+
+def test_buffer_cap_without_journal_drops():
+    rng = random.Random(13)
+    original = (buffer.tick_journal, buffer.HF_BUFFER_MAX_TICKS)
+    buffer.tick_journal, buffer.HF_BUFFER_MAX_TICKS = TickJournal("", 1, 10, 1), 300
+    buffer.buffer_queue.clear()
+    buffer.buffered_ticks = 0
+    dropped = buffer.buffer_stats["dropped_ticks"]
+    try:
+        for t in make_ticks(500, rng):
+            buffer.add_tick_to_buffer(t)
+        assert buffer.buffered_ticks == 300 == sum(len(q) for q in buffer.buffer_queue.values())
+        assert buffer.buffer_stats["dropped_ticks"] - dropped == 200
+        assert buffer.get_buffer_status()["max_queued"] == 300
+    finally:
+        buffer.tick_journal, buffer.HF_BUFFER_MAX_TICKS = original
+        buffer.buffer_queue.clear()
+        buffer.buffered_ticks = 0
+    print("✅ Journal de ticks: truncagem, replay, recuperação, cota e limite de memória conferidos")
+
+
+async def main():
+    await test_commit_truncates_and_failures_replay()
+    await test_recovery_after_restart_ignores_torn_record()
+    await test_close_seals_current_segment()
+    await test_quota_stops_journaling()
+    await test_buffer_spills_and_replays_failed_batches()
+    test_buffer_cap_without_journal_drops()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,177 @@
+"""
+Teste da latência de ponta a ponta dos ticks
+============================================
+Confere os histogramas de services/high_frequency/tick_latency (buckets,
+quantis, intervalos negativos), que add_tick_to_buffer marca a chegada e
+mede bolsa → backend e feed → backend, que persist_ticks mede backend →
+COMMIT e grava o horário da bolsa na coluna exchange_time, e que ticks sem
+horário da bolsa ou sem chegada (replay do journal) ficam de fora. Com dedup,
+persist_new_ticks devolve (e entrega aos ouvintes de commit) só os ticks
+inseridos.
+"""
+
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+# Adiciona o projeto ao path
+_PROJECT_ROOT = Path(__file__).resolve().parents[2]
+if str(_PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(_PROJECT_ROOT))
+
+from services.high_frequency import buffer, persistence
+from services.high_frequency.models import Tick
+from services.high_frequency.tick_latency import (
+    EXCHANGE_TO_INGEST, INGEST_TO_COMMIT, RECEIPT_TO_INGEST, LatencyHistogram, tick_latency,
+)
+
+
+def test_histogram_buckets_and_quantiles():
+    hist = LatencyHistogram([1, 10, 100])
+    for ms in [0.5] * 50 + [5] * 40 + [50] * 9 + [700] + [-3]:
+        hist.record(ms)
+    status = hist.to_dict()
+    assert status["count"] == 101 and status["negative"] == 1
+    assert status["buckets"] == {"le_1": 51, "le_10": 40, "le_100": 9, "inf": 1}
+    assert status["p50_ms"] == 1 and status["p95_ms"] == 100 and status["p99_ms"] == 100
+    assert status["max_ms"] == 700
+    assert hist.quantile(1.0) == 700
+    assert LatencyHistogram([1]).to_dict()["p50_ms"] is None
+
+
+class _FakePool:
+    """Só o necessário de pool/conexão/cursor para persist_ticks no modo insert."""
+
+    def __init__(self):
+        self.rows = []
+
+    def connection(self):
+        return _Context(self)
+
+    def cursor(self):
+        return _Context(self)
+
+    async def executemany(self, sql, params):
+        assert "exchange_time" in sql
+        self.rows.extend(params)
+
+    async def commit(self):
+        pass
+
+
+class _FakeCopy:
+    def __init__(self, pool):
+        self.pool = pool
+
+    def set_types(self, types):
+        pass
+
+    async def write_row(self, row):
+        self.pool.stage.append(row)
+
+
+class _FakeDedupPool(_FakePool):
+    """COPY na tabela temporária + INSERT ... RETURNING dos (symbol, trade_id) novos."""
+
+    def __init__(self, existing):
+        super().__init__()
+        self.existing = set(existing)
+        self.stage = []
+        self.returned = []
+
+    def copy(self, sql):
+        assert "ticks_stage" in sql
+        return _Context(_FakeCopy(self))
+
+    async def execute(self, sql, params=None):
+        if "RETURNING" not in sql:
+            return
+        self.returned = []
+        for row in self.stage:
+            symbol, trade_id, is_edit = row[0], row[5], row[10]
+            if trade_id is None or is_edit or (symbol, trade_id) not in self.existing:
+                self.rows.append(row)
+                self.returned.append((symbol, trade_id, is_edit))
+                if not is_edit:
+                    self.existing.add((symbol, trade_id))
+        self.stage = []
+
+    async def fetchall(self):
+        return self.returned
+
+
+class _Context:
+    def __init__(self, value):
+        self.value = value
+
+    async def __aenter__(self):
+        return self.value
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+async def test_ingest_and_commit_latency():
+    tick_latency.clear()
+    buffer.buffer_queue.clear()
+    buffer.buffered_ticks = 0
+    now = time.time()
+    try:
+        # Negócio 200 ms antes da chegada, recebido no feed 50 ms antes
+        live = Tick(symbol="PETR4", exchange="B", price=30.0, volume=100, timestamp=now - 0.05, trade_id=1,
+                    exchange_timestamp=now - 0.2, ingested_at=now)
+        # Feed antigo: sem horário da bolsa; chegada marcada pelo buffer
+        legacy = Tick(symbol="VALE3", exchange="B", price=60.0, volume=100, timestamp=now, trade_id=2)
+        buffer.add_tick_to_buffer(live)
+        buffer.add_tick_to_buffer(legacy)
+        assert legacy.ingested_at is not None
+
+        # Replay do journal: sem chegada, não entra no backend → COMMIT
+        replayed = Tick(symbol="PETR4", exchange="B", price=30.0, volume=100, timestamp=now - 60, trade_id=3)
+        pool = _FakePool()
+        assert await persistence.persist_ticks([live, legacy, replayed], pool, dedup=False)
+        assert [row[-1] for row in pool.rows] == [now - 0.2, None, None]
+
+        status = tick_latency.get_status()
+        petr = status["symbols"]["PETR4"]
+        assert petr[EXCHANGE_TO_INGEST]["count"] == 1 and abs(petr[EXCHANGE_TO_INGEST]["max_ms"] - 200) < 1
+        assert abs(petr[RECEIPT_TO_INGEST]["max_ms"] - 50) < 1
+        assert petr[INGEST_TO_COMMIT]["count"] == 1
+        vale = status["symbols"]["VALE3"]
+        assert vale[EXCHANGE_TO_INGEST]["count"] == 0 and vale[INGEST_TO_COMMIT]["count"] == 1
+        assert status["total"][INGEST_TO_COMMIT]["count"] == 2
+        assert status["total"][RECEIPT_TO_INGEST]["count"] == 2
+    finally:
+        buffer.buffer_queue.clear()
+        buffer.buffered_ticks = 0
+        tick_latency.clear()
+    print("✅ Latência bolsa → backend → COMMIT por símbolo conferida; exchange_time gravado")
+
+
+async def test_dedup_returns_inserted_ticks():
+    def tick(trade_id, is_edit=False):
+        return Tick(symbol="PETR4", exchange="B", price=30.0, volume=100, timestamp=1000.0 + (trade_id or 0),
+                    trade_id=trade_id, is_edit=is_edit)
+
+    committed = []
+    persistence.add_commit_listener(committed.append)
+    try:
+        # 1 e 2 já chegaram ao vivo; a edição de 2 e o negócio sem número sempre passam
+        pool = _FakeDedupPool({("PETR4", 1), ("PETR4", 2)})
+        batch = [tick(1), tick(2), tick(3), tick(3), tick(2, is_edit=True), tick(None), tick(4)]
+        inserted = await persistence.persist_new_ticks(batch, pool, dedup=True)
+        assert [(t.trade_id, t.is_edit) for t in inserted] == [(3, False), (2, True), (None, False), (4, False)]
+        assert len(pool.rows) == 4
+        assert committed == [inserted]
+        assert await persistence.persist_new_ticks([], pool, dedup=True) == []
+    finally:
+        persistence._commit_listeners.remove(committed.append)
+        tick_latency.clear()
+    print("✅ Dedup devolve só os ticks inseridos aos ouvintes de commit")
+
+
+if __name__ == "__main__":
+    test_histogram_buckets_and_quantiles()
+    asyncio.run(test_ingest_and_commit_latency())
+    asyncio.run(test_dedup_returns_inserted_ticks())
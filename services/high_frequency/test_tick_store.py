@@ -0,0 +1,123 @@
+"""
+Teste do armazém de ticks em memória
+====================================
+Confere fatias por tempo, visões por agente e últimos ticks contra uma busca
+direta na lista de ticks (inclusive com ticks fora de ordem), o fallback para
+o banco em intervalos não cobertos, o despejo de pregões anteriores e o
+crescimento geométrico das colunas.
+"""
+
+import random
+import time
+from datetime import datetime, timezone
+
+from models import Tick
+from tick_store import TickStore
+
+
+def make_ticks(symbol: str, start: float, count: int, rng: random.Random):
+    ticks = []
+    for i in range(count):
+        # ~2% chegam atrasados alguns segundos
+        ts = start + i * 0.5 - (rng.random() * 5 if rng.random() < 0.02 else 0.0)
+        ticks.append(Tick(
+            symbol=symbol, exchange='B', price=round(30 + rng.random(), 2), volume=rng.choice((100, 200)),
+            timestamp=ts, trade_id=i + 1, buy_agent=rng.randint(1, 20), sell_agent=rng.randint(1, 20),
+            trade_type=rng.choice((2, 3)),
+        ))
+    return ticks
+
+
+def brute_force(ticks, start_ts, end_ts, agent_id=None):
+    rows = [
+        t for t in ticks
+        if start_ts <= t.timestamp < end_ts and (agent_id is None or agent_id in (t.buy_agent, t.sell_agent))
+    ]
+    rows.sort(key=lambda t: t.timestamp)
+    return [t.trade_id for t in rows]
+
+
+def test_queries_match_brute_force():
+    rng = random.Random(3)
+    store = TickStore(max_bytes=256 * 1024 * 1024, chunk=1000)
+    start = time.time() - 3600
+    store.started_at = start - 1
+    ticks = make_ticks('PETR4', start, 5000, rng)
+    for t in ticks:
+        store.append_tick(t)
+
+    for _ in range(50):
+        a = start + rng.random() * 2500
+        b = a + rng.random() * 600
+        lo = datetime.fromtimestamp(a, tz=timezone.utc)
+        hi = datetime.fromtimestamp(b, tz=timezone.utc)
+        got = store.query('PETR4', lo, hi)
+        # Empates de timestamp mantêm a ordem de chegada; compara como conjunto ordenado por tempo
+        assert sorted(r['trade_id'] for r in got) == sorted(brute_force(ticks, a, b))
+        assert all(got[i]['timestamp'] <= got[i + 1]['timestamp'] for i in range(len(got) - 1))
+
+        agent_id = rng.randint(1, 20)
+        got = store.agent_query('PETR4', agent_id, lo, hi)
+        assert sorted(r['trade_id'] for r in got) == sorted(brute_force(ticks, a, b, agent_id))
+
+    latest = store.latest('PETR4', 10)
+    expected = sorted(ticks, key=lambda t: t.timestamp)[-10:]
+    assert [r['trade_id'] for r in latest] == [t.trade_id for t in reversed(expected)]
+    assert latest[0]['exchange'] == 'B' and latest[0]['volume_financial'] is None
+
+
+def test_uncovered_ranges_fall_back():
+    store = TickStore(max_bytes=64 * 1024 * 1024, chunk=100)
+    before_start = datetime.fromtimestamp(store.started_at - 60, tz=timezone.utc)
+    assert store.query('VALE3', before_start) is None
+    assert store.query('VALE3', datetime.now(timezone.utc)) == []
+    assert store.latest('VALE3', 10) is None
+
+
+def test_previous_sessions_are_evicted_first():
+    rng = random.Random(5)
+    store = TickStore(max_bytes=64 * 1024 * 1024, chunk=100)
+    now = time.time()
+    store.started_at = now - 3 * 86400
+    yesterday = make_ticks('PETR4', now - 86400, 200, rng)
+    for t in yesterday:
+        store.append_tick(t)
+    store.max_bytes = sum(s.nbytes for by_day in store.sessions.values() for s in by_day.values()) + 1
+
+    for t in make_ticks('PETR4', now - 60, 100, rng):
+        store.append_tick(t)
+    assert store.stats['evicted_sessions'] == 1
+    day_before = datetime.fromtimestamp(now - 86400 - 1, tz=timezone.utc)
+    assert store.query('PETR4', day_before) is None
+    assert len(store.query('PETR4', datetime.fromtimestamp(now - 120, tz=timezone.utc))) == 100
+
+    # Sessão corrente sozinha acima do limite: congela e volta ao banco
+    store.max_bytes = 1
+    for t in make_ticks('PETR4', now, 150, rng):
+        store.append_tick(t)
+    assert store.query('PETR4', datetime.fromtimestamp(now - 120, tz=timezone.utc)) is None
+
+
+def test_sessions_grow_geometrically():
+    rng = random.Random(9)
+    store = TickStore(max_bytes=256 * 1024 * 1024, chunk=100)
+    store.started_at = time.time() - 3600
+    ticks = make_ticks('PETR4', store.started_at + 1, 20000, rng)
+    grows = 0
+    for t in ticks:
+        session = store.sessions.get('PETR4', {}).get(datetime.fromtimestamp(t.timestamp, tz=timezone.utc).date())
+        grows += session is not None and session.size == session.capacity
+        store.append_tick(t)
+    sessions = list(store.sessions['PETR4'].values())
+    # 100 -> 200 -> ... -> 25600: 8 cópias em vez de 199 com blocos fixos
+    assert grows <= 8 * len(sessions), grows
+    assert sum(s.size for s in sessions) == len(ticks)
+    assert all(s.capacity < 2 * max(s.size, s.chunk) for s in sessions)
+
+
+if __name__ == "__main__":
+    test_queries_match_brute_force()
+    test_uncovered_ranges_fall_back()
+    test_previous_sessions_are_evicted_first()
+    test_sessions_grow_geometrically()
+    print("✅ Armazém de ticks confere com a busca direta")
@@ -0,0 +1,143 @@
+"""
+Teste do snapshot do TWAPDetector (restart a quente)
+====================================================
+Roda o detector por alguns ciclos, grava o snapshot, "reinicia" em um
+detector novo restaurado do arquivo e termina o pregão simulado. Confere que
+o resultado é idêntico ao de um detector que nunca parou, que o detector
+restaurado só lê os ticks posteriores à marca d'água do snapshot, e que
+snapshots de outro pregão ou de outra versão não restauram acumuladores.
+
+Não usa o banco: reaproveita a persistência em memória de test_incremental_twap.
+"""
+
+import asyncio
+import os
+import tempfile
+from datetime import datetime, timezone, timedelta, time
+
+from robot_models import TWAPDetectionConfig
+from robot_detector import TWAPDetector
+from test_incremental_twap import InMemoryPersistence, create_ticks
+import twap_snapshot
+from twap_snapshot import load_detector_snapshot, save_detector_snapshot, restore_detector_state, encode_detector_state
+
+SYMBOL = "PETR4"
+CYCLES = 6
+
+
+class CountingPersistence(InMemoryPersistence):
+    """Registra as janelas e a quantidade de ticks lidos"""
+
+    def __init__(self, ticks):
+        super().__init__(ticks)
+        self.fetches = []
+
+    async def get_ticks_between(self, symbol, start_time, end_time):
+        rows = await super().get_ticks_between(symbol, start_time, end_time)
+        self.fetches.append((start_time, end_time, len(rows)))
+        return rows
+
+
+def new_detector(ticks, mode="verify"):
+    persistence = CountingPersistence(ticks)
+    config = TWAPDetectionConfig(min_trades=5, min_confidence=0.3, active_recency_minutes=60.0)
+    detector = TWAPDetector(config=config, persistence=persistence, mode=mode)
+    detector.market_twap_detector.persistence = persistence
+    return detector, persistence
+
+
+async def run_cycles(detector, start, end, cycles):
+    patterns = []
+    for i in cycles:
+        cutoff = start + (end - start) * i / CYCLES + timedelta(seconds=1)
+        detector.settle_seconds = max(0.0, (datetime.now(timezone.utc) - cutoff).total_seconds())
+        patterns = await detector.analyze_symbol(SYMBOL)
+    return patterns
+
+
+async def test_warm_restart_matches_uninterrupted_run():
+    now = datetime.now(timezone.utc)
+    start_of_day = datetime.combine(now.date(), time.min, tzinfo=timezone.utc)
+    start = max(start_of_day, now - timedelta(hours=1))
+    end = now - timedelta(seconds=30)
+    ticks = create_ticks(SYMBOL, start, end)
+
+    # Referência: um detector que roda o pregão todo sem parar
+    reference, _ = new_detector(ticks)
+    expected = await run_cycles(reference, start, end, range(1, CYCLES + 1))
+
+    # Primeira metade, snapshot e "queda" do processo
+    before, _ = new_detector(ticks)
+    await run_cycles(before, start, end, range(1, CYCLES // 2 + 1))
+    watermark = before.incremental_states[SYMBOL].watermark
+    consumed = before.incremental_states[SYMBOL].ticks_consumed
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "snapshots", "twap_detector.msgpack")
+        assert await save_detector_snapshot(before, path)
+        assert not os.path.exists(f"{path}.tmp")
+        size = os.path.getsize(path)
+
+        after, persistence = new_detector(ticks)
+        result = load_detector_snapshot(after, path)
+
+    assert result["restored"] and result["symbols"] == 1, result
+    assert result["patterns"] == sum(len(s) for a in before.active_patterns.values() for s in a.values())
+    assert after.activation_times == before.activation_times
+    assert after.status_tracker.status_history == before.status_tracker.status_history
+    assert after.incremental_states[SYMBOL].watermark == watermark
+
+    actual = await run_cycles(after, start, end, range(CYCLES // 2 + 1, CYCLES + 1))
+
+    # Só os ticks depois da marca d'água do snapshot foram lidos pelo incremental
+    incremental_fetches = [f for f in persistence.fetches if f[0] != start_of_day]
+    assert incremental_fetches[0][0] == watermark, incremental_fetches[0]
+    read_after_restart = sum(f[2] for f in incremental_fetches)
+    assert read_after_restart == len(ticks) - consumed, (read_after_restart, len(ticks), consumed)
+
+    mismatches = after._compare_patterns(expected, actual)
+    assert not mismatches, mismatches[:5]
+    assert after.verify_stats["mismatches"] == 0, after.verify_stats["last_mismatch"]
+    assert after.incremental_states[SYMBOL].ticks_consumed == len(ticks)
+    print(f"   snapshot de {size} bytes; após o restart lidos {read_after_restart} de {len(ticks)} ticks")
+    print("✅ Restart a quente idêntico ao detector sem interrupção")
+
+
+async def test_stale_or_incompatible_snapshot():
+    now = datetime.now(timezone.utc)
+    start_of_day = datetime.combine(now.date(), time.min, tzinfo=timezone.utc)
+    start = max(start_of_day, now - timedelta(hours=1))
+    end = now - timedelta(seconds=30)
+    ticks = create_ticks(SYMBOL, start, end)
+
+    detector, _ = new_detector(ticks)
+    await run_cycles(detector, start, end, range(1, CYCLES + 1))
+    detector.status_tracker.status_history.insert(0, {"symbol": SYMBOL, "timestamp": now.isoformat()})
+    data = encode_detector_state(detector)
+
+    # Pregão seguinte: só os históricos voltam
+    fresh, _ = new_detector(ticks)
+    result = restore_detector_state(fresh, data, now=now + timedelta(days=1))
+    assert result["restored"] and result["symbols"] == 0 and result["patterns"] == 0
+    assert not fresh.incremental_states and not fresh.active_patterns
+    assert fresh.status_tracker.status_history[0]["symbol"] == SYMBOL
+
+    # Versão de esquema diferente: nada é restaurado
+    original = twap_snapshot.SNAPSHOT_SCHEMA_VERSION
+    twap_snapshot.SNAPSHOT_SCHEMA_VERSION = original + 1
+    try:
+        fresh, _ = new_detector(ticks)
+        result = restore_detector_state(fresh, data)
+    finally:
+        twap_snapshot.SNAPSHOT_SCHEMA_VERSION = original
+    assert not result["restored"] and not fresh.status_tracker.status_history
+    print("✅ Snapshot de outro pregão ou de outra versão não restaura acumuladores")
+
+
+async def main():
+    await test_warm_restart_matches_uninterrupted_run()
+    await test_stale_or_incompatible_snapshot()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,106 @@
+"""
+Teste de paridade da detecção TWAP vetorizada
+=============================================
+Confere que os clusters e os TWAPPattern do caminho NumPy (vectorized_twap)
+são os mesmos de _cluster_trades/_analyze_agent_trades, inclusive com trades
+fora de ordem, empates de timestamp e o cluster de fallback, e que
+analyze_symbol_full devolve os mesmos padrões nos dois caminhos.
+"""
+
+import asyncio
+import logging
+import math
+import random
+from datetime import datetime, timezone, timedelta
+
+from robot_models import TWAPDetectionConfig, TickData, TradeType
+from robot_detector import TWAPDetector
+from vectorized_twap import AgentTradeArrays, cluster_indices
+from test_incremental_twap import InMemoryPersistence, create_ticks
+
+logging.basicConfig(level=logging.WARNING)
+
+
+def make_agent_trades(rng: random.Random, count: int, volumes=(100, 200, 300, 500)):
+    now = datetime.now(timezone.utc)
+    trades = []
+    for i in range(count):
+        # Alguns timestamps repetidos e a lista fora de ordem, como sai do agrupamento por agente
+        offset = rng.randint(0, count // 2) * 7.25 + rng.choice((0, 0, 0.000001, 0.5))
+        trades.append(TickData(
+            symbol='PETR4', price=round(30 + rng.random(), 2), volume=rng.choice(volumes),
+            timestamp=now - timedelta(minutes=50) + timedelta(seconds=offset),
+            trade_type=rng.choice((TradeType.BUY, TradeType.SELL)), agent_id=7, exchange='B', trade_id=i,
+        ))
+    return trades
+
+
+def make_detector(vectorized: bool, persistence=None) -> TWAPDetector:
+    config = TWAPDetectionConfig(min_trades=5, min_confidence=0.3, active_recency_minutes=60.0)
+    detector = TWAPDetector(config=config, persistence=persistence, mode="full")
+    detector.vectorized = vectorized
+    if persistence is not None:
+        detector.market_twap_detector.persistence = persistence
+    return detector
+
+
+def assert_same_clusters(legacy, vectorized, arrays):
+    assert len(legacy) == len(vectorized), (list(legacy), list(vectorized))
+    for (exp_key, exp_trades), (key, index) in zip(legacy.items(), vectorized.items()):
+        assert exp_key[:2] == key[:2], (exp_key, key)
+        assert math.isclose(exp_key[2], key[2], rel_tol=1e-9, abs_tol=1e-9), (exp_key, key)
+        assert [t.trade_id for t in exp_trades] == [t.trade_id for t in arrays.take(index)]
+
+
+async def test_clusters_and_patterns_match():
+    rng = random.Random(13)
+    legacy = make_detector(False)
+    detector = make_detector(True)
+    cases = [make_agent_trades(rng, n) for n in (2, 5, 40, 400, 4000)]
+    # Fallback: nenhum grupo (volume, direção) atinge min_trades, com empate de direção
+    fallback = make_agent_trades(rng, 4, volumes=(100, 200, 300, 400))
+    cases.append(fallback)
+
+    for trades in cases:
+        arrays = AgentTradeArrays(trades)
+        expected_clusters = legacy._cluster_trades(trades)
+        clusters = cluster_indices(arrays, detector.config.min_trades)
+        assert_same_clusters(expected_clusters, clusters, arrays)
+
+        expected, actual = [], []
+        for (signature, exp_trades), (key, index) in zip(expected_clusters.items(), clusters.items()):
+            expected.append(await legacy._analyze_agent_trades(
+                'PETR4', 7, exp_trades, signature[0], signature[1], signature[2], persist=False))
+            actual.append(await detector._analyze_agent_arrays(
+                arrays, 'PETR4', 7, index, key[0], key[1], key[2], persist=False))
+        expected.append(await legacy._analyze_agent_trades('PETR4', 7, trades, persist=False))
+        actual.append(await detector._analyze_agent_arrays(arrays, 'PETR4', 7, arrays.sorted_index(), persist=False))
+
+        for exp, act in zip(expected, actual):
+            mismatches = legacy._compare_patterns([exp], [act])
+            assert not mismatches, mismatches
+
+
+async def test_full_analysis_parity():
+    symbol = "PETR4"
+    end = datetime.now(timezone.utc) - timedelta(seconds=30)
+    ticks = create_ticks(symbol, end - timedelta(hours=1), end)
+
+    legacy_persistence = InMemoryPersistence(ticks)
+    persistence = InMemoryPersistence(ticks)
+    legacy = make_detector(False, legacy_persistence)
+    detector = make_detector(True, persistence)
+
+    expected = await legacy.analyze_symbol_full(symbol, ticks_data=ticks)
+    actual = await detector.analyze_symbol_full(symbol, ticks_data=ticks)
+    assert expected, "nenhum padrão detectado"
+    mismatches = legacy._compare_patterns(expected, actual)
+    assert not mismatches, mismatches
+    # Os mesmos trades vinculados aos padrões gravados
+    assert legacy_persistence.linked_trades == persistence.linked_trades
+    print(f"✅ Caminho vetorizado idêntico ao original ({len(expected)} padrões, {len(ticks)} ticks)")
+
+
+if __name__ == "__main__":
+    asyncio.run(test_clusters_and_patterns_match())
+    asyncio.run(test_full_analysis_parity())
@@ -0,0 +1,142 @@
+"""
+Teste do índice de volume por minuto
+====================================
+Confere que as somas prefixadas do VolumeIndex batem com a soma direta dos
+ticks (mesmo critério do SQL: buy_agent = X OR sell_agent = X), inclusive após
+preencher minutos antigos pelo banco e descartar minutos fora da retenção, e
+que update_active_robots_volume_percentage faz um único UPDATE por ciclo.
+"""
+
+import asyncio
+import random
+import time
+from datetime import datetime, timezone, timedelta
+
+from activity_index import VolumeIndex
+from robot_models import TWAPDetectionConfig, TWAPPattern, RobotStatus, RobotType
+from robot_detector import TWAPDetector
+
+
+def brute_force(ticks, symbol, agent_id, start_minute, end_minute):
+    market = robot = 0.0
+    for t in ticks:
+        minute = int(t['timestamp'] // 60)
+        if t['symbol'] != symbol or not (start_minute <= minute <= end_minute):
+            continue
+        financial = t['price'] * t['volume']
+        market += financial
+        if agent_id in (t['buy_agent'], t['sell_agent']):
+            robot += financial
+    return market, robot
+
+
+def make_ticks(now: float, minutes: int, rng: random.Random):
+    ticks = []
+    for _ in range(minutes * 40):
+        ticks.append({
+            'symbol': 'PETR4', 'price': round(30 + rng.random(), 2), 'volume': rng.choice((100, 200, 500)),
+            'timestamp': now - rng.random() * minutes * 60,
+            'buy_agent': rng.randint(1, 12), 'sell_agent': rng.randint(1, 12),
+        })
+    return ticks
+
+
+def test_prefix_sums_match_brute_force():
+    rng = random.Random(7)
+    now = time.time()
+    ticks = make_ticks(now, 150, rng)
+    index = VolumeIndex(retention_minutes=240)
+    # Ticks fora de ordem, como chegam da ingestão
+    for t in ticks:
+        index.record(t['symbol'], t['buy_agent'], t['sell_agent'], t['price'], t['volume'], t['timestamp'])
+
+    end_minute = int(now // 60)
+    for _ in range(200):
+        start_minute = end_minute - rng.randint(0, 160)
+        agent_id = rng.randint(1, 12)
+        market, robot = brute_force(ticks, 'PETR4', agent_id, start_minute, end_minute)
+        assert abs(index.market_volume('PETR4', start_minute, end_minute) - market) < 1e-6
+        assert abs(index.agent_volume('PETR4', agent_id, start_minute, end_minute) - robot) < 1e-6
+
+    # Descarta o que passou da retenção: janelas recentes continuam exatas
+    index.trim(end_minute - 60 + index.retention_minutes)
+    start_minute = end_minute - 30
+    market, robot = brute_force(ticks, 'PETR4', 3, start_minute, end_minute)
+    assert abs(index.market_volume('PETR4', start_minute, end_minute) - market) < 1e-6
+    assert abs(index.agent_volume('PETR4', 3, start_minute, end_minute) - robot) < 1e-6
+
+
+def test_seed_fills_minutes_before_ingestion():
+    rng = random.Random(11)
+    index = VolumeIndex()
+    now = index.coverage_minute * 60 + 30
+    ticks = make_ticks(now, 120, rng)
+    before = [t for t in ticks if int(t['timestamp'] // 60) < index.coverage_minute]
+    for t in ticks:
+        if int(t['timestamp'] // 60) >= index.coverage_minute:
+            index.record(t['symbol'], t['buy_agent'], t['sell_agent'], t['price'], t['volume'], t['timestamp'])
+
+    start_minute = int(now // 60) - 119
+    assert index.needs_seed('PETR4', start_minute)
+
+    # O que a consulta agrupada de get_volume_buckets_for_period devolveria
+    market_buckets, agent_buckets = {}, {}
+    for t in before:
+        minute = int(t['timestamp'] // 60)
+        financial = t['price'] * t['volume']
+        market_buckets[minute] = market_buckets.get(minute, 0.0) + financial
+        agents = {t['buy_agent'], t['sell_agent']}
+        for agent_id in agents:
+            buckets = agent_buckets.setdefault(agent_id, {})
+            buckets[minute] = buckets.get(minute, 0.0) + financial
+    index.seed('PETR4', start_minute - 1, market_buckets, agent_buckets)
+    assert not index.needs_seed('PETR4', start_minute)
+
+    end_minute = int(now // 60)
+    for agent_id in range(1, 13):
+        market, robot = brute_force(ticks, 'PETR4', agent_id, start_minute, end_minute)
+        assert abs(index.market_volume('PETR4', start_minute, end_minute) - market) < 1e-6
+        assert abs(index.agent_volume('PETR4', agent_id, start_minute, end_minute) - robot) < 1e-6
+
+
+class BatchPersistence:
+    def __init__(self):
+        self.update_calls = []
+
+    async def update_patterns_volume_percentage(self, updates):
+        self.update_calls.append(list(updates))
+        return True
+
+
+async def test_single_pass_type_update():
+    index = VolumeIndex()
+    now = time.time()
+    # Agente 1 faz metade do volume do mercado, agente 2 quase nada
+    for i in range(60):
+        index.record('VALE3', 1, 50, 10.0, 100, now - i * 30)
+        index.record('VALE3', 40, 50, 10.0, 100, now - i * 30 - 1)
+    index.record('VALE3', 2, 50, 10.0, 1, now - 5)
+
+    persistence = BatchPersistence()
+    detector = TWAPDetector(config=TWAPDetectionConfig(), persistence=persistence, mode="full", volume_index=index)
+    detector.volume_index.coverage_minute = 0
+    first_seen = datetime.now(timezone.utc) - timedelta(minutes=40)
+    for agent_id in (1, 2):
+        detector.active_patterns['VALE3'][agent_id]['100|buy|30'] = TWAPPattern(
+            symbol='VALE3', exchange='B', agent_id=agent_id, first_seen=first_seen,
+            last_seen=datetime.now(timezone.utc), status=RobotStatus.ACTIVE, pattern_id=agent_id,
+            market_volume_percentage=20.0, robot_type=RobotType.TYPE_3.value,
+        )
+
+    changes = await detector.update_active_robots_volume_percentage()
+    assert len(persistence.update_calls) == 1, persistence.update_calls
+    assert {u[0] for u in persistence.update_calls[0]} == {1, 2}
+    assert [c['agent_id'] for c in changes] == [2]
+    assert detector.active_patterns['VALE3'][2]['100|buy|30'].robot_type == RobotType.TYPE_0.value
+
+
+if __name__ == "__main__":
+    test_prefix_sums_match_brute_force()
+    test_seed_fills_minutes_before_ingestion()
+    asyncio.run(test_single_pass_type_update())
+    print("✅ VolumeIndex confere com a soma direta e atualiza os robôs em um único UPDATE")
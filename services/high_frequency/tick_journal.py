@@ -0,0 +1,391 @@
+"""
+Journal em disco (write-ahead) do buffer de ticks
+=================================================
+Todo tick que entra em add_tick_to_buffer é também anotado num journal
+append-only, em segmentos numerados em HF_JOURNAL_DIR. As escritas são
+acumuladas em memória e gravadas com fsync a cada HF_JOURNAL_FSYNC_MS, então
+a janela de perda numa queda do processo é esse intervalo.
+
+- Registro: <II tamanho e crc32 do corpo, corpo no formato colunar de
+  services/shared/tick_codec. Um registro truncado ou com crc errado (queda
+  no meio da escrita) encerra a leitura do segmento.
+- Cada tick no buffer carrega o número do segmento; quando todos os ticks de
+  um segmento fechado foram confirmados no banco o arquivo é apagado.
+- Lotes que o banco recusou (persist_ticks esgotou as tentativas) e ticks que
+  não couberam na memória (HF_BUFFER_MAX_TICKS) marcam o segmento para
+  replay: ele é relido do disco e regravado quando o banco volta.
+- Segmentos encontrados na inicialização são de um processo anterior e são
+  todos reenviados.
+- O replay grava com deduplicação por (symbol, trade_id), pois parte do
+  segmento pode já estar no banco; ticks sem trade_id podem se repetir.
+- Acima de HF_JOURNAL_MAX_MB em disco os ticks novos deixam de ser anotados
+  (seguem só pela memória, como sem journal) até o espaço ser liberado.
+"""
+
+import asyncio
+import logging
+import os
+import struct
+import time
+import zlib
+from collections import Counter
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional
+
+# Corrige imports para funcionar como módulo standalone
+try:
+    from .config import (
+        HF_JOURNAL_DIR, HF_JOURNAL_FSYNC_MS, HF_JOURNAL_SEGMENT_MB, HF_JOURNAL_MAX_MB,
+        HF_JOURNAL_REPLAY_BATCH,
+    )
+    from .models import Tick
+except ImportError:
+    from config import (
+        HF_JOURNAL_DIR, HF_JOURNAL_FSYNC_MS, HF_JOURNAL_SEGMENT_MB, HF_JOURNAL_MAX_MB,
+        HF_JOURNAL_REPLAY_BATCH,
+    )
+    from models import Tick
+
+from services.shared.tick_codec import TickCodecError, decode_ticks, encode_ticks
+
+logger = logging.getLogger(__name__)
+
+_RECORD = struct.Struct("<II")
+_SEGMENT_PREFIX = "ticks-"
+_SEGMENT_SUFFIX = ".wal"
+# Bytes por tick no formato colunar (sem cabeçalho e tabela de símbolos), para estimar a rotação
+_TICK_BYTES = 52
+# Segmento corrente marcado para replay é fechado depois deste tempo, para o replay alcançá-lo
+_REPLAY_ROTATE_SEC = 5.0
+
+
+class _Segment:
+    __slots__ = ("journaled", "committed", "released", "bytes", "closed", "needs_replay", "created_at")
+
+    def __init__(self, closed: bool = False, needs_replay: bool = False, size: int = 0):
+        self.journaled = 0
+        self.committed = 0
+        # Ticks que já saíram da memória (gravados, recusados pelo banco ou sem espaço)
+        self.released = 0
+        self.bytes = size
+        self.closed = closed
+        self.needs_replay = needs_replay
+        self.created_at = time.time()
+
+
+class TickJournal:
+    """Segmentos append-only com fsync periódico, truncados após o commit no banco."""
+
+    def __init__(self, directory: str, segment_max_bytes: int, fsync_ms: int, max_bytes: int,
+                 replay_batch: int = 5000):
+        self.directory = directory
+        self.enabled = bool(directory)
+        self.segment_max_bytes = segment_max_bytes
+        self.fsync_interval = fsync_ms / 1000.0
+        self.max_bytes = max_bytes
+        self.replay_batch = replay_batch
+
+        self._opened = False
+        self._segments: Dict[int, _Segment] = {}
+        self._current = 0
+        self._file = None
+        self._file_segment = 0
+        self._flush_lock = asyncio.Lock()
+        self._pending: List[Tick] = []
+        self._over_quota = False
+
+        self.stats = {
+            'journaled': 0,
+            'committed': 0,
+            'unjournaled': 0,
+            'spilled': 0,
+            'fsyncs': 0,
+            'last_fsync_ms': 0.0,
+            'max_fsync_ms': 0.0,
+            'write_errors': 0,
+            'corrupt_records': 0,
+            'segments_deleted': 0,
+            'replayed_segments': 0,
+            'replayed_ticks': 0,
+            'replay_failures': 0,
+            'last_replay_ticks_per_sec': 0.0,
+        }
+
+    # ------------------------------------------------------------ ciclo de vida
+    def open(self) -> int:
+        """Cria o diretório e registra os segmentos deixados por um processo anterior."""
+        if not self.enabled or self._opened:
+            return 0
+        os.makedirs(self.directory, exist_ok=True)
+        recovered = 0
+        for name in sorted(os.listdir(self.directory)):
+            segment = self._segment_from_name(name)
+            if segment is None:
+                continue
+            size = os.path.getsize(self._path(segment))
+            self._segments[segment] = _Segment(closed=True, needs_replay=True, size=size)
+            self._current = max(self._current, segment)
+            recovered += 1
+        self._current += 1
+        self._segments[self._current] = _Segment()
+        self._opened = True
+        if recovered:
+            logger.warning(f"📼 Journal de ticks: {recovered} segmentos de execução anterior serão regravados")
+        logger.info(f"📼 Journal de ticks em {self.directory} (fsync a cada {self.fsync_interval * 1000:.0f} ms)")
+        return recovered
+
+    async def close(self) -> None:
+        """Grava o que está pendente e sela o segmento corrente, que é apagado assim
+        que todos os seus ticks forem confirmados no banco (inclusive depois do close)."""
+        if not self._opened:
+            return
+        await self.flush()
+        async with self._flush_lock:
+            self._opened = False
+            if self._file is not None:
+                await asyncio.to_thread(self._file.close)
+                self._file = None
+            state = self._segments.get(self._current)
+            if state is not None:
+                state.closed = True
+                self._maybe_delete(self._current, state)
+
+    # ------------------------------------------------------------------ ingestão
+    def append(self, tick: Tick) -> Optional[int]:
+        """Anota o tick (gravado no próximo fsync); devolve o segmento ou None se não anotou."""
+        if not self._opened:
+            return None
+        if self._over_quota:
+            self.stats['unjournaled'] += 1
+            return None
+        self._pending.append(tick)
+        self._segments[self._current].journaled += 1
+        self.stats['journaled'] += 1
+        return self._current
+
+    def commit(self, segments: Iterable[Optional[int]]) -> None:
+        """Ticks desses segmentos foram confirmados no banco."""
+        for segment, count in Counter(segments).items():
+            state = self._segments.get(segment)
+            if state is None:
+                continue
+            state.committed += count
+            state.released += count
+            self.stats['committed'] += count
+            self._maybe_delete(segment, state)
+
+    def mark_for_replay(self, segments: Iterable[Optional[int]], spilled: bool = False) -> None:
+        """Ticks desses segmentos não vão chegar ao banco pela memória: regravar do disco."""
+        for segment, count in Counter(segments).items():
+            state = self._segments.get(segment)
+            if state is None:
+                continue
+            state.needs_replay = True
+            state.released += count
+            if spilled:
+                self.stats['spilled'] += count
+
+    # -------------------------------------------------------------------- escrita
+    async def run_flusher(self) -> None:
+        """Loop de fsync periódico."""
+        while True:
+            try:
+                await asyncio.sleep(self.fsync_interval)
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                self.stats['write_errors'] += 1
+                logger.error(f"❌ Erro ao gravar journal de ticks: {exc}")
+                await asyncio.sleep(1)
+
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            await self._flush_pending()
+
+    async def _flush_pending(self) -> None:
+        if not self._pending:
+            return
+        ticks, self._pending = self._pending, []
+        segment = self._current
+        state = self._segments[segment]
+
+        # Decide a rotação antes de escrever: ticks anotados durante a escrita já vão para o próximo
+        rotate = state.bytes + len(ticks) * _TICK_BYTES >= self.segment_max_bytes or (
+            state.needs_replay and time.time() - state.created_at >= _REPLAY_ROTATE_SEC
+        )
+        if rotate:
+            self._current += 1
+            self._segments[self._current] = _Segment()
+
+        started = time.perf_counter()
+        try:
+            written = await asyncio.to_thread(self._write, segment, ticks, rotate)
+        except Exception:
+            # Os ticks deste lote seguem pela memória; o segmento rotacionado fecha mesmo assim
+            state.closed = state.closed or rotate
+            raise
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        state.bytes += written
+        self.stats['fsyncs'] += 1
+        self.stats['last_fsync_ms'] = round(elapsed_ms, 2)
+        self.stats['max_fsync_ms'] = max(self.stats['max_fsync_ms'], round(elapsed_ms, 2))
+        if rotate:
+            state.closed = True
+            self._maybe_delete(segment, state)
+        self._update_quota()
+
+    def _write(self, segment: int, ticks: List[Tick], close_after: bool) -> int:
+        body = encode_ticks(t.to_dict() for t in ticks)
+        record = _RECORD.pack(len(body), zlib.crc32(body)) + body
+        if self._file is not None and self._file_segment != segment:
+            # Uma rotação anterior falhou antes de fechar o arquivo
+            self._file.close()
+            self._file = None
+        if self._file is None:
+            self._file = open(self._path(segment), "ab")
+            self._file_segment = segment
+        self._file.write(record)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        if close_after:
+            self._file.close()
+            self._file = None
+        return len(record)
+
+    def _maybe_delete(self, segment: int, state: _Segment) -> None:
+        if not state.closed or state.needs_replay or state.committed < state.journaled:
+            return
+        self._delete(segment)
+
+    def _delete(self, segment: int) -> None:
+        self._segments.pop(segment, None)
+        try:
+            os.remove(self._path(segment))
+        except FileNotFoundError:
+            pass
+        self.stats['segments_deleted'] += 1
+        self._update_quota()
+
+    def _update_quota(self) -> None:
+        over = sum(s.bytes for s in self._segments.values()) >= self.max_bytes
+        if over != self._over_quota:
+            if over:
+                logger.warning(f"⚠️ Journal de ticks acima de {self.max_bytes // (1024 * 1024)} MB: ticks novos sem journal")
+            else:
+                logger.info("📼 Journal de ticks abaixo da cota: anotação retomada")
+            self._over_quota = over
+
+    # --------------------------------------------------------------------- replay
+    def read_segment(self, segment: int) -> List[Tick]:
+        """Ticks gravados no segmento, até o primeiro registro incompleto ou corrompido."""
+        ticks: List[Tick] = []
+        with open(self._path(segment), "rb") as f:
+            data = f.read()
+        offset = 0
+        while offset < len(data):
+            if offset + _RECORD.size > len(data):
+                self.stats['corrupt_records'] += 1
+                break
+            size, crc = _RECORD.unpack_from(data, offset)
+            body = data[offset + _RECORD.size:offset + _RECORD.size + size]
+            if len(body) < size or zlib.crc32(body) != crc:
+                self.stats['corrupt_records'] += 1
+                logger.warning(f"⚠️ Registro inválido no segmento {segment} do journal (offset {offset}); restante ignorado")
+                break
+            try:
+                columns = decode_ticks(body, normalize=str, validate=False)
+            except TickCodecError as exc:
+                self.stats['corrupt_records'] += 1
+                logger.warning(f"⚠️ Registro ilegível no segmento {segment} do journal: {exc}")
+                break
+            ticks.extend(Tick(*row) for row in columns.rows(0.0))
+            offset += _RECORD.size + size
+        return ticks
+
+    def replay_candidates(self) -> List[int]:
+        """Segmentos fechados a regravar cujos ticks já saíram todos da memória
+        (senão o replay correria com a gravação normal dos mesmos ticks)."""
+        return sorted(
+            seg for seg, state in self._segments.items()
+            if state.closed and state.needs_replay and state.released >= state.journaled
+        )
+
+    async def replay(self, write_batch: Callable[[List[Tick]], Awaitable[bool]]) -> int:
+        """Regrava os segmentos fechados marcados para replay; para no primeiro lote recusado."""
+        replayed = 0
+        for segment in self.replay_candidates():
+            started = time.perf_counter()
+            ticks = await asyncio.to_thread(self.read_segment, segment)
+            for i in range(0, len(ticks), self.replay_batch):
+                if not await write_batch(ticks[i:i + self.replay_batch]):
+                    self.stats['replay_failures'] += 1
+                    return replayed
+            elapsed = time.perf_counter() - started
+            self.stats['replayed_segments'] += 1
+            self.stats['replayed_ticks'] += len(ticks)
+            if elapsed > 0:
+                self.stats['last_replay_ticks_per_sec'] = round(len(ticks) / elapsed, 1)
+            replayed += len(ticks)
+            logger.info(f"📼 Segmento {segment} do journal regravado ({len(ticks)} ticks em {elapsed * 1000:.0f} ms)")
+            self._delete(segment)
+        return replayed
+
+    async def run_replayer(self, write_batch: Callable[[List[Tick]], Awaitable[bool]],
+                           interval_sec: float = 1.0, backoff_sec: float = 5.0) -> None:
+        """Loop que regrava segmentos pendentes assim que o banco aceita."""
+        while True:
+            try:
+                if self.replay_candidates():
+                    before = self.stats['replay_failures']
+                    await self.replay(write_batch)
+                    if self.stats['replay_failures'] > before:
+                        await asyncio.sleep(backoff_sec)
+                        continue
+                await asyncio.sleep(interval_sec)
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                logger.error(f"❌ Erro no replay do journal de ticks: {exc}")
+                await asyncio.sleep(backoff_sec)
+
+    # -------------------------------------------------------------------- status
+    def _path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"{_SEGMENT_PREFIX}{segment:012d}{_SEGMENT_SUFFIX}")
+
+    @staticmethod
+    def _segment_from_name(name: str) -> Optional[int]:
+        if not (name.startswith(_SEGMENT_PREFIX) and name.endswith(_SEGMENT_SUFFIX)):
+            return None
+        number = name[len(_SEGMENT_PREFIX):-len(_SEGMENT_SUFFIX)]
+        return int(number) if number.isdigit() else None
+
+    def get_status(self) -> Dict:
+        if not self.enabled:
+            return {"enabled": False}
+        now = time.time()
+        pending_replay = [s for s in self._segments.values() if s.needs_replay]
+        uncommitted = [s for s in self._segments.values() if s.committed < s.journaled and not s.needs_replay]
+        return {
+            "enabled": True,
+            "directory": self.directory,
+            "current_segment": self._current,
+            "segments": len(self._segments),
+            "disk_mb": round(sum(s.bytes for s in self._segments.values()) / (1024 * 1024), 2),
+            "max_disk_mb": round(self.max_bytes / (1024 * 1024), 1),
+            "over_quota": self._over_quota,
+            "pending_fsync": len(self._pending),
+            # Atraso do journal: anotados ainda não confirmados no banco
+            "lag_ticks": sum(s.journaled - s.committed for s in uncommitted),
+            "oldest_uncommitted_age_sec": round(now - min(s.created_at for s in uncommitted), 1) if uncommitted else 0.0,
+            "segments_pending_replay": len(pending_replay),
+            **self.stats,
+        }
+
+
+tick_journal = TickJournal(
+    directory=HF_JOURNAL_DIR,
+    segment_max_bytes=int(HF_JOURNAL_SEGMENT_MB * 1024 * 1024),
+    fsync_ms=HF_JOURNAL_FSYNC_MS,
+    max_bytes=int(HF_JOURNAL_MAX_MB * 1024 * 1024),
+    replay_batch=HF_JOURNAL_REPLAY_BATCH,
+)
@@ -0,0 +1,126 @@
+"""
+Latência de ponta a ponta dos ticks
+===================================
+Cada tick carrega os horários das etapas por onde passou (epoch em segundos):
+
+- exchange_timestamp: negócio na bolsa (TradeDate da DLL);
+- timestamp:          recebimento no callback da DLL, no feed;
+- ingested_at:        chegada ao backend (add_tick_to_buffer);
+- commit:             COMMIT do lote no ticks_raw (persist_ticks).
+
+Os intervalos entre elas vão para histogramas de buckets fixos
+(HF_LATENCY_BUCKETS_MS), por símbolo e no total, expostos em /metrics.
+Ticks sem o horário de uma etapa (feeds antigos, replay do journal) ficam
+de fora do intervalo correspondente. Relógios de máquinas diferentes podem
+dar intervalos negativos: contam no primeiro bucket e em `negative`.
+"""
+
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional
+
+from services.high_frequency.config import HF_LATENCY_BUCKETS_MS
+
+EXCHANGE_TO_INGEST = "exchange_to_ingest"
+RECEIPT_TO_INGEST = "receipt_to_ingest"
+INGEST_TO_COMMIT = "ingest_to_commit"
+STAGES = (EXCHANGE_TO_INGEST, RECEIPT_TO_INGEST, INGEST_TO_COMMIT)
+
+
+class LatencyHistogram:
+    """Contagem por bucket (limite superior em ms; o último é o excedente)."""
+
+    __slots__ = ("bounds", "counts", "count", "total_ms", "max_ms", "negative")
+
+    def __init__(self, bounds: List[float]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.negative = 0
+
+    def record(self, ms: float) -> None:
+        if ms < 0:
+            self.negative += 1
+            ms = 0.0
+        self.counts[bisect_left(self.bounds, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+        if ms > self.max_ms:
+            self.max_ms = ms
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Limite superior do bucket que contém o quantil q (máximo observado no excedente)"""
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= target and n:
+                return self.bounds[i] if i < len(self.bounds) else round(self.max_ms, 1)
+        return round(self.max_ms, 1)
+
+    def to_dict(self) -> Dict:
+        buckets = {f"le_{bound:g}": n for bound, n in zip(self.bounds, self.counts)}
+        buckets["inf"] = self.counts[-1]
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total_ms / self.count, 2) if self.count else None,
+            "max_ms": round(self.max_ms, 2),
+            "p50_ms": self.quantile(0.50),
+            "p95_ms": self.quantile(0.95),
+            "p99_ms": self.quantile(0.99),
+            "negative": self.negative,
+            "buckets": buckets,
+        }
+
+
+class TickLatency:
+    """Histogramas por símbolo e etapa, alimentados pela ingestão e pela gravação."""
+
+    def __init__(self, bounds_ms: Optional[List[float]] = None):
+        self.bounds = sorted(bounds_ms if bounds_ms is not None else HF_LATENCY_BUCKETS_MS)
+        self._symbols: Dict[str, Dict[str, LatencyHistogram]] = {}
+        self._totals = self._new_stages()
+
+    def _new_stages(self) -> Dict[str, LatencyHistogram]:
+        return {stage: LatencyHistogram(self.bounds) for stage in STAGES}
+
+    def _record(self, symbol: str, stage: str, ms: float) -> None:
+        stages = self._symbols.get(symbol)
+        if stages is None:
+            stages = self._symbols[symbol] = self._new_stages()
+        stages[stage].record(ms)
+        self._totals[stage].record(ms)
+
+    def record_ingest(self, tick) -> None:
+        """Bolsa → backend e feed → backend de um tick recém-chegado (ingested_at preenchido)."""
+        ingested_at = tick.ingested_at
+        if tick.exchange_timestamp:
+            self._record(tick.symbol, EXCHANGE_TO_INGEST, (ingested_at - tick.exchange_timestamp) * 1000.0)
+        self._record(tick.symbol, RECEIPT_TO_INGEST, (ingested_at - tick.timestamp) * 1000.0)
+
+    def record_commit(self, ticks: Iterable, committed_at: float) -> None:
+        """Backend → COMMIT no ticks_raw dos ticks de um lote gravado."""
+        for tick in ticks:
+            if tick.ingested_at is not None:
+                self._record(tick.symbol, INGEST_TO_COMMIT, (committed_at - tick.ingested_at) * 1000.0)
+
+    def clear(self) -> None:
+        self._symbols.clear()
+        self._totals = self._new_stages()
+
+    def get_status(self) -> Dict:
+        return {
+            "buckets_ms": self.bounds,
+            "total": {stage: hist.to_dict() for stage, hist in self._totals.items()},
+            "symbols": {
+                symbol: {stage: hist.to_dict() for stage, hist in stages.items()}
+                for symbol, stages in sorted(self._symbols.items())
+            },
+        }
+
+
+# Instância única do processo, alimentada pelo buffer e pela persistência
+tick_latency = TickLatency()
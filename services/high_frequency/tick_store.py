@@ -0,0 +1,447 @@
+"""
+Armazém de ticks intradiário em memória
+=======================================
+Cópia colunar (NumPy) dos ticks ingeridos pelo processo, por símbolo e por
+pregão, alimentada por add_tick_to_buffer. O detector TWAP e os endpoints de
+leitura consultam este armazém primeiro e só vão ao ticks_raw quando o
+intervalo pedido não está coberto (histórico anterior ao início do processo,
+pregões já despejados ou sessão que estourou o limite de memória).
+
+- Colunas começam com HF_TICK_STORE_CHUNK linhas e dobram de capacidade ao
+  encher (cópia amortizada O(1) por tick).
+- Fatias por tempo usam busca binária (np.searchsorted) sobre o timestamp.
+- Cada agente tem um vetor de índices de linha (compra ou venda), mantido
+  na ingestão, para visões por agente sem varrer a sessão.
+- Acima de HF_TICK_STORE_MAX_MB as sessões de pregões anteriores são
+  despejadas primeiro; se a sessão corrente sozinha passar do limite ela
+  para de crescer e deixa de ser usada nas consultas.
+"""
+
+import logging
+import time
+from array import array
+from datetime import date, datetime, timezone
+from typing import Dict, List, Optional, Set, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - numpy é dependência do backend
+    np = None
+
+# Corrige imports para funcionar como módulo standalone
+try:
+    from .config import (
+        HF_TICK_STORE_ENABLED, HF_TICK_STORE_MAX_MB, HF_TICK_STORE_CHUNK,
+        HF_TICK_WRITER, HF_TICK_DEDUP,
+    )
+except ImportError:
+    from config import (
+        HF_TICK_STORE_ENABLED, HF_TICK_STORE_MAX_MB, HF_TICK_STORE_CHUNK,
+        HF_TICK_WRITER, HF_TICK_DEDUP,
+    )
+
+logger = logging.getLogger(__name__)
+
+# Nome da coluna e dtype; ausências viram sentinelas (0 para agentes, -1 para ids/tipo, NaN)
+_COLUMNS: Tuple[Tuple[str, str], ...] = (
+    ("timestamp", "float64"),
+    ("price", "float64"),
+    ("volume", "int64"),
+    ("buy_agent", "int32"),
+    ("sell_agent", "int32"),
+    ("trade_type", "int8"),
+    ("trade_id", "int64"),
+    ("volume_financial", "float64"),
+    ("is_edit", "bool"),
+    ("exchange", "int16"),
+)
+
+
+# Colunas de _COLUMNS + nomes das bolsas indexados pela coluna "exchange"
+TickColumns = Tuple[Dict[str, "np.ndarray"], List[Optional[str]]]
+
+
+def rows_from_columns(symbol: str, cols: Dict[str, "np.ndarray"], exchange_names: List[Optional[str]]) -> List[dict]:
+    """Linhas no formato de RobotPersistence.get_ticks_between a partir das colunas"""
+    timestamps = cols["timestamp"].tolist()
+    prices = cols["price"].tolist()
+    volumes = cols["volume"].tolist()
+    buys = cols["buy_agent"].tolist()
+    sells = cols["sell_agent"].tolist()
+    types = cols["trade_type"].tolist()
+    trade_ids = cols["trade_id"].tolist()
+    financial = cols["volume_financial"].tolist()
+    edits = cols["is_edit"].tolist()
+    exchanges = cols["exchange"].tolist()
+    names = exchange_names
+    return [
+        {
+            'symbol': symbol,
+            'price': prices[i],
+            'volume': volumes[i],
+            'timestamp': datetime.fromtimestamp(timestamps[i], tz=timezone.utc),
+            'buy_agent': buys[i] or None,
+            'sell_agent': sells[i] or None,
+            'exchange': names[exchanges[i]],
+            'trade_type': types[i] if types[i] >= 0 else None,
+            'trade_id': trade_ids[i] if trade_ids[i] >= 0 else None,
+            'volume_financial': None if financial[i] != financial[i] else financial[i],
+            'is_edit': edits[i],
+        }
+        for i in range(len(timestamps))
+    ]
+
+
+def columns_from_rows(rows: List[dict]) -> TickColumns:
+    """Inverso de rows_from_columns, para linhas lidas do ticks_raw"""
+    names: List[Optional[str]] = []
+    codes: Dict[Optional[str], int] = {}
+    exchanges = []
+    for row in rows:
+        exchange = row.get('exchange')
+        code = codes.get(exchange)
+        if code is None:
+            code = codes[exchange] = len(names)
+            names.append(exchange)
+        exchanges.append(code)
+    financial = [row.get('volume_financial') for row in rows]
+    cols = {
+        "timestamp": np.array([row['timestamp'].timestamp() for row in rows], dtype=np.float64),
+        "price": np.array([row['price'] for row in rows], dtype=np.float64),
+        "volume": np.array([row['volume'] for row in rows], dtype=np.int64),
+        "buy_agent": np.array([row['buy_agent'] or 0 for row in rows], dtype=np.int32),
+        "sell_agent": np.array([row['sell_agent'] or 0 for row in rows], dtype=np.int32),
+        "trade_type": np.array([-1 if row.get('trade_type') is None else row['trade_type'] for row in rows], dtype=np.int8),
+        "trade_id": np.array([-1 if row.get('trade_id') is None else row['trade_id'] for row in rows], dtype=np.int64),
+        "volume_financial": np.array([np.nan if v is None else v for v in financial], dtype=np.float64),
+        "is_edit": np.array([bool(row.get('is_edit')) for row in rows], dtype=bool),
+        "exchange": np.array(exchanges, dtype=np.int16),
+    }
+    return cols, names
+
+
+class SymbolSession:
+    """Ticks de um símbolo em um pregão, em colunas NumPy que dobram ao encher."""
+
+    def __init__(self, symbol: str, day: date, chunk: int, dedup: bool):
+        self.symbol = symbol
+        self.day = day
+        self.chunk = chunk
+        self.size = 0
+        self.capacity = chunk
+        self.cols = {name: np.empty(chunk, dtype=dtype) for name, dtype in _COLUMNS}
+        # Linhas de cada agente, em ordem de timestamp enquanto a sessão estiver ordenada
+        self.agent_rows: Dict[int, array] = {}
+        self.is_sorted = True
+        self.last_ts = float("-inf")
+        self.overflow = False
+        self.trade_ids: Optional[Set[int]] = set() if dedup else None
+
+    @property
+    def nbytes(self) -> int:
+        columns = sum(col.nbytes for col in self.cols.values())
+        agents = sum(rows.itemsize * len(rows) for rows in self.agent_rows.values())
+        return columns + agents
+
+    def _grow(self) -> None:
+        self.capacity = max(self.chunk, self.capacity * 2)
+        for name, col in self.cols.items():
+            grown = np.empty(self.capacity, dtype=col.dtype)
+            grown[:self.size] = col[:self.size]
+            self.cols[name] = grown
+
+    def append(self, tick, exchange_code: int) -> bool:
+        """Acrescenta um tick; retorna True se a sessão precisou crescer."""
+        trade_id = tick.trade_id
+        if self.trade_ids is not None and trade_id is not None and not tick.is_edit:
+            # Mesmo critério do COPY com dedup: trade_id repetido não entra
+            if trade_id in self.trade_ids:
+                return False
+            self.trade_ids.add(trade_id)
+
+        grew = False
+        if self.size == self.capacity:
+            self._grow()
+            grew = True
+
+        i = self.size
+        cols = self.cols
+        ts = tick.timestamp
+        buy_agent = tick.buy_agent or 0
+        sell_agent = tick.sell_agent or 0
+        cols["timestamp"][i] = ts
+        cols["price"][i] = tick.price
+        cols["volume"][i] = tick.volume
+        cols["buy_agent"][i] = buy_agent
+        cols["sell_agent"][i] = sell_agent
+        cols["trade_type"][i] = tick.trade_type if tick.trade_type is not None else -1
+        cols["trade_id"][i] = trade_id if trade_id is not None else -1
+        cols["volume_financial"][i] = tick.volume_financial if tick.volume_financial is not None else np.nan
+        cols["is_edit"][i] = bool(tick.is_edit)
+        cols["exchange"][i] = exchange_code
+        self.size = i + 1
+
+        if ts < self.last_ts:
+            self.is_sorted = False
+        else:
+            self.last_ts = ts
+
+        if self.is_sorted:
+            for agent_id in (buy_agent, sell_agent):
+                if not agent_id:
+                    continue
+                rows = self.agent_rows.get(agent_id)
+                if rows is None:
+                    rows = self.agent_rows[agent_id] = array("q")
+                if not rows or rows[-1] != i:
+                    rows.append(i)
+        return grew
+
+    def ensure_sorted(self) -> None:
+        """Reordena por timestamp (estável) após ticks fora de ordem e refaz os índices por agente."""
+        if self.is_sorted:
+            return
+        n = self.size
+        order = np.argsort(self.cols["timestamp"][:n], kind="stable")
+        for col in self.cols.values():
+            col[:n] = col[:n][order]
+        self.last_ts = float(self.cols["timestamp"][n - 1]) if n else float("-inf")
+        self._rebuild_agent_rows()
+        self.is_sorted = True
+
+    def _rebuild_agent_rows(self) -> None:
+        n = self.size
+        rows = np.arange(n, dtype=np.int64)
+        buy = self.cols["buy_agent"][:n]
+        sell = self.cols["sell_agent"][:n]
+        # Compra e venda; a venda do próprio comprador não duplica a linha
+        agents = np.concatenate((buy, sell[sell != buy]))
+        positions = np.concatenate((rows, rows[sell != buy]))
+        keep = agents != 0
+        agents, positions = agents[keep], positions[keep]
+        order = np.lexsort((positions, agents))
+        agents, positions = agents[order], positions[order]
+        self.agent_rows = {}
+        if not len(agents):
+            return
+        bounds = np.flatnonzero(np.diff(agents)) + 1
+        for group in np.split(np.arange(len(agents)), bounds):
+            self.agent_rows[int(agents[group[0]])] = array("q", positions[group].tolist())
+
+    def bounds(self, start_ts: float, end_ts: float) -> Tuple[int, int]:
+        """Linhas [lo, hi) com start_ts <= timestamp < end_ts (busca binária)."""
+        self.ensure_sorted()
+        ts = self.cols["timestamp"][:self.size]
+        lo = int(np.searchsorted(ts, start_ts, side="left"))
+        hi = int(np.searchsorted(ts, end_ts, side="left"))
+        return lo, hi
+
+    def agent_indices(self, agent_id: int, start_ts: float, end_ts: float):
+        """Índices de linha do agente no intervalo [start_ts, end_ts)."""
+        lo, hi = self.bounds(start_ts, end_ts)
+        rows = self.agent_rows.get(agent_id)
+        if rows is None or lo >= hi:
+            return np.empty(0, dtype=np.int64)
+        rows = np.frombuffer(rows, dtype=np.int64)
+        a = int(np.searchsorted(rows, lo, side="left"))
+        b = int(np.searchsorted(rows, hi, side="left"))
+        return rows[a:b]
+
+
+class TickStore:
+    """Sessões por símbolo e pregão com limite global de memória."""
+
+    def __init__(self, max_bytes: int, chunk: int, dedup: bool = False, enabled: bool = True):
+        self.enabled = enabled and np is not None
+        if enabled and np is None:
+            logger.warning("⚠️ NumPy indisponível: armazém de ticks em memória desativado")
+        self.max_bytes = max_bytes
+        self.chunk = chunk
+        self.dedup = dedup
+        self.sessions: Dict[str, Dict[date, SymbolSession]] = {}
+        self.evicted: Dict[str, Set[date]] = {}
+        self.exchange_codes: Dict[str, int] = {}
+        self.exchange_names: List[Optional[str]] = []
+        # Ticks anteriores ao início do processo só existem no banco
+        self.started_at = time.time()
+        self.nbytes = 0
+        self.stats = {"appended": 0, "dropped": 0, "evicted_sessions": 0, "hits": 0, "misses": 0}
+
+    def _exchange_code(self, exchange: Optional[str]) -> int:
+        code = self.exchange_codes.get(exchange)
+        if code is None:
+            code = self.exchange_codes[exchange] = len(self.exchange_names)
+            self.exchange_names.append(exchange)
+        return code
+
+    def append_tick(self, tick) -> None:
+        if not self.enabled:
+            return
+        day = datetime.fromtimestamp(tick.timestamp, tz=timezone.utc).date()
+        by_day = self.sessions.get(tick.symbol)
+        if by_day is None:
+            by_day = self.sessions[tick.symbol] = {}
+        session = by_day.get(day)
+        if session is None:
+            if day in self.evicted.get(tick.symbol, ()):
+                self.stats["dropped"] += 1
+                return
+            session = by_day[day] = SymbolSession(tick.symbol, day, self.chunk, self.dedup)
+            self.nbytes += session.nbytes
+            self._enforce_cap(day)
+        if session.overflow:
+            self.stats["dropped"] += 1
+            return
+
+        before = session.nbytes if session.size == session.capacity else 0
+        if session.append(tick, self._exchange_code(tick.exchange)):
+            self.nbytes += session.nbytes - before
+            self._enforce_cap(day)
+        self.stats["appended"] += 1
+
+    def _enforce_cap(self, current_day: date) -> None:
+        """Despeja pregões anteriores (mais antigos primeiro); depois congela a sessão corrente."""
+        if self.nbytes <= self.max_bytes:
+            return
+        old = sorted(
+            ((session.day, symbol) for symbol, by_day in self.sessions.items()
+             for session in by_day.values() if session.day < current_day)
+        )
+        for day, symbol in old:
+            if self.nbytes <= self.max_bytes:
+                return
+            session = self.sessions[symbol].pop(day)
+            self.nbytes -= session.nbytes
+            self.evicted.setdefault(symbol, set()).add(day)
+            self.stats["evicted_sessions"] += 1
+            logger.info(f"🧹 Armazém de ticks: pregão {day} de {symbol} despejado ({session.size} ticks)")
+
+        if self.nbytes > self.max_bytes:
+            largest = max(
+                (s for by_day in self.sessions.values() for s in by_day.values() if not s.overflow),
+                key=lambda s: s.nbytes,
+                default=None,
+            )
+            if largest is not None:
+                largest.overflow = True
+                logger.warning(
+                    f"⚠️ Armazém de ticks acima de {self.max_bytes / 1e6:.0f} MB: sessão {largest.symbol} "
+                    f"{largest.day} congelada, consultas voltam ao banco"
+                )
+
+    def _sessions_for(self, symbol: str, start_ts: float, end_ts: float) -> Optional[List[SymbolSession]]:
+        """Sessões que cobrem [start_ts, end_ts) ou None se algum trecho só existe no banco."""
+        if not self.enabled or start_ts < self.started_at:
+            return None
+        by_day = self.sessions.get(symbol, {})
+        evicted = self.evicted.get(symbol, ())
+        first = datetime.fromtimestamp(start_ts, tz=timezone.utc).date()
+        last = datetime.fromtimestamp(max(start_ts, end_ts - 1e-6), tz=timezone.utc).date()
+        sessions = []
+        for day in sorted(set(by_day) | set(evicted)):
+            if day < first or day > last:
+                continue
+            if day in evicted:
+                return None
+            session = by_day[day]
+            if session.overflow:
+                return None
+            sessions.append(session)
+        return sessions
+
+    def _rows(self, session: SymbolSession, index) -> List[dict]:
+        cols = {name: col[:session.size][index] for name, col in session.cols.items()}
+        return rows_from_columns(session.symbol, cols, self.exchange_names)
+
+    def _hit(self, found: bool) -> None:
+        self.stats["hits" if found else "misses"] += 1
+
+    def query(self, symbol: str, start: datetime, end: Optional[datetime] = None) -> Optional[List[dict]]:
+        """Ticks do símbolo em [start, end) em ordem de timestamp, no formato de
+        RobotPersistence.get_ticks_between; None quando o intervalo não está coberto."""
+        start_ts = start.timestamp()
+        end_ts = end.timestamp() if end is not None else float("inf")
+        sessions = self._sessions_for(symbol, start_ts, min(end_ts, time.time() + 86400))
+        self._hit(sessions is not None)
+        if sessions is None:
+            return None
+        rows: List[dict] = []
+        for session in sessions:
+            lo, hi = session.bounds(start_ts, end_ts)
+            if hi > lo:
+                rows.extend(self._rows(session, slice(lo, hi)))
+        return rows
+
+    def query_columns(self, symbol: str, start: datetime, end: Optional[datetime] = None) -> Optional[TickColumns]:
+        """Mesmo recorte de query() como cópia das colunas NumPy (sem montar dicts),
+        para enviar a outros processos; None quando o intervalo não está coberto."""
+        start_ts = start.timestamp()
+        end_ts = end.timestamp() if end is not None else float("inf")
+        sessions = self._sessions_for(symbol, start_ts, min(end_ts, time.time() + 86400))
+        self._hit(sessions is not None)
+        if sessions is None:
+            return None
+        parts = []
+        for session in sessions:
+            lo, hi = session.bounds(start_ts, end_ts)
+            if hi > lo:
+                parts.append({name: col[lo:hi] for name, col in session.cols.items()})
+        cols = {
+            name: np.concatenate([part[name] for part in parts]) if parts else np.empty(0, dtype=dtype)
+            for name, dtype in _COLUMNS
+        }
+        return cols, list(self.exchange_names)
+
+    def agent_query(self, symbol: str, agent_id: int, start: datetime, end: Optional[datetime] = None) -> Optional[List[dict]]:
+        """Ticks em que o agente comprou ou vendeu, via índice por agente; None se não coberto."""
+        start_ts = start.timestamp()
+        end_ts = end.timestamp() if end is not None else float("inf")
+        sessions = self._sessions_for(symbol, start_ts, min(end_ts, time.time() + 86400))
+        self._hit(sessions is not None)
+        if sessions is None:
+            return None
+        rows: List[dict] = []
+        for session in sessions:
+            index = session.agent_indices(agent_id, start_ts, end_ts)
+            if len(index):
+                rows.extend(self._rows(session, index))
+        return rows
+
+    def latest(self, symbol: str, limit: int) -> Optional[List[dict]]:
+        """Últimos `limit` ticks (mais novo primeiro) se a sessão corrente os contém."""
+        if not self.enabled:
+            return None
+        by_day = self.sessions.get(symbol)
+        if not by_day:
+            self._hit(False)
+            return None
+        session = by_day[max(by_day)]
+        if session.overflow or session.size < limit:
+            self._hit(False)
+            return None
+        session.ensure_sorted()
+        self._hit(True)
+        rows = self._rows(session, slice(session.size - limit, session.size))
+        rows.reverse()
+        return rows
+
+    def get_status(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "symbols": len(self.sessions),
+            "sessions": sum(len(by_day) for by_day in self.sessions.values()),
+            "ticks": sum(s.size for by_day in self.sessions.values() for s in by_day.values()),
+            "memory_mb": round(self.nbytes / 1e6, 1),
+            "max_memory_mb": round(self.max_bytes / 1e6, 1),
+            "covered_since": datetime.fromtimestamp(self.started_at, tz=timezone.utc).isoformat(),
+            **self.stats,
+        }
+
+
+# Instância única do processo, alimentada pelo buffer de ingestão
+tick_store = TickStore(
+    max_bytes=int(HF_TICK_STORE_MAX_MB * 1024 * 1024),
+    chunk=HF_TICK_STORE_CHUNK,
+    dedup=HF_TICK_WRITER == "copy" and HF_TICK_DEDUP,
+    enabled=HF_TICK_STORE_ENABLED,
+)
@@ -0,0 +1,171 @@
+"""
+Políticas do TimescaleDB
+========================
+Camada aplicada no startup depois de initialize_db, idempotente (pode rodar
+a cada subida do backend):
+
+- Agregados contínuos de ticks_raw: OHLCV de 1m, 5m e 1h (com volume
+  agressor de compra/venda) e volume por corretora compradora/vendedora por
+  minuto. São consultados em tempo real (materialized_only = false), então o
+  trecho ainda não materializado vem do ticks_raw.
+- Compressão nativa dos chunks antigos, segmentada por símbolo, em ticks_raw
+  e nas tabelas do livro de ofertas.
+- Retenção das tabelas do livro de ofertas.
+
+CREATE MATERIALIZED VIEW ... WITH (timescaledb.continuous) não roda dentro de
+transação: cada comando vai numa conexão em autocommit, e a falha de um não
+impede os demais (fica no log e no resultado de ensure_db_policies).
+
+Relatório de compressão e refresh do histórico: check_compression.py.
+"""
+
+import logging
+from typing import Any, Dict, List, Tuple
+
+from psycopg_pool import AsyncConnectionPool
+
+from services.high_frequency.config import (
+    HF_TICKS_COMPRESS_AFTER_DAYS,
+    HF_ORDER_BOOK_COMPRESS_AFTER_DAYS,
+    HF_ORDER_BOOK_RETENTION_DAYS,
+)
+
+logger = logging.getLogger(__name__)
+
+# OHLCV de ticks_raw: nome da view -> (bucket, start_offset, end_offset, schedule_interval) da política de refresh
+OHLCV_AGGREGATES: Dict[str, Tuple[str, str, str, str]] = {
+    "ticks_ohlcv_1m": ("1 minute", "2 hours", "1 minute", "1 minute"),
+    "ticks_ohlcv_5m": ("5 minutes", "6 hours", "5 minutes", "5 minutes"),
+    "ticks_ohlcv_1h": ("1 hour", "3 days", "1 hour", "30 minutes"),
+}
+
+# Volume por corretora e lado: nome da view -> coluna do agente
+AGENT_AGGREGATES: Dict[str, str] = {
+    "agent_buy_volume_1m": "buy_agent",
+    "agent_sell_volume_1m": "sell_agent",
+}
+
+# Compressão: tabela -> (segmentby, orderby, dias até comprimir). As colunas
+# dos índices únicos precisam estar no segmentby/orderby.
+COMPRESSED_TABLES: Dict[str, Tuple[str, str, int]] = {
+    "ticks_raw": ("symbol", "timestamp DESC", HF_TICKS_COMPRESS_AFTER_DAYS),
+    "order_book_events": ("symbol", "event_time DESC, id", HF_ORDER_BOOK_COMPRESS_AFTER_DAYS),
+    "order_book_snapshots": ("symbol", "event_time DESC, id", HF_ORDER_BOOK_COMPRESS_AFTER_DAYS),
+    "order_book_offers": ("symbol", "event_time DESC", HF_ORDER_BOOK_COMPRESS_AFTER_DAYS),
+}
+
+RETENTION_TABLES: Tuple[str, ...] = ("order_book_events", "order_book_snapshots", "order_book_offers")
+
+
+def _ohlcv_view_sql(view: str, bucket: str) -> str:
+    # trade_type 2 = agressor comprador, 3 = agressor vendedor
+    return f"""
+        CREATE MATERIALIZED VIEW IF NOT EXISTS {view}
+        WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+        SELECT
+            time_bucket(INTERVAL '{bucket}', timestamp) AS bucket,
+            symbol,
+            first(price, timestamp) AS open,
+            max(price) AS high,
+            min(price) AS low,
+            last(price, timestamp) AS close,
+            sum(volume) AS volume,
+            sum(COALESCE(volume_financial, price * volume)) AS volume_financial,
+            count(*) AS trades,
+            sum(volume) FILTER (WHERE trade_type = 2) AS buy_volume,
+            sum(volume) FILTER (WHERE trade_type = 3) AS sell_volume
+        FROM ticks_raw
+        GROUP BY bucket, symbol
+        WITH NO DATA
+    """
+
+
+def _agent_view_sql(view: str, agent_column: str) -> str:
+    return f"""
+        CREATE MATERIALIZED VIEW IF NOT EXISTS {view}
+        WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+        SELECT
+            time_bucket(INTERVAL '1 minute', timestamp) AS bucket,
+            symbol,
+            {agent_column} AS agent_id,
+            sum(volume) AS volume,
+            sum(COALESCE(volume_financial, price * volume)) AS volume_financial,
+            count(*) AS trades
+        FROM ticks_raw
+        WHERE {agent_column} IS NOT NULL
+        GROUP BY bucket, symbol, {agent_column}
+        WITH NO DATA
+    """
+
+
+def policy_statements() -> List[Tuple[str, str]]:
+    """(descrição, SQL) na ordem de aplicação; todos idempotentes."""
+    statements: List[Tuple[str, str]] = []
+    for view, (bucket, start, end, schedule) in OHLCV_AGGREGATES.items():
+        statements.append((f"agregado {view}", _ohlcv_view_sql(view, bucket)))
+        statements.append((f"refresh de {view}", f"""
+            SELECT add_continuous_aggregate_policy('{view}',
+                start_offset => INTERVAL '{start}', end_offset => INTERVAL '{end}',
+                schedule_interval => INTERVAL '{schedule}', if_not_exists => TRUE)
+        """))
+    for view, agent_column in AGENT_AGGREGATES.items():
+        statements.append((f"agregado {view}", _agent_view_sql(view, agent_column)))
+        statements.append((f"refresh de {view}", f"""
+            SELECT add_continuous_aggregate_policy('{view}',
+                start_offset => INTERVAL '2 hours', end_offset => INTERVAL '1 minute',
+                schedule_interval => INTERVAL '5 minutes', if_not_exists => TRUE)
+        """))
+
+    for table, (segmentby, orderby, days) in COMPRESSED_TABLES.items():
+        if days <= 0:
+            continue
+        # ALTER TABLE ... SET só quando a compressão ainda não foi habilitada
+        statements.append((f"compressão de {table}", f"""
+            DO $$
+            BEGIN
+                IF NOT EXISTS (
+                    SELECT 1 FROM timescaledb_information.hypertables
+                     WHERE hypertable_name = '{table}' AND compression_enabled
+                ) THEN
+                    ALTER TABLE {table} SET (
+                        timescaledb.compress,
+                        timescaledb.compress_segmentby = '{segmentby}',
+                        timescaledb.compress_orderby = '{orderby}'
+                    );
+                END IF;
+            END $$;
+        """))
+        statements.append((f"política de compressão de {table}", f"""
+            SELECT add_compression_policy('{table}', INTERVAL '{days} days', if_not_exists => TRUE)
+        """))
+
+    if HF_ORDER_BOOK_RETENTION_DAYS > 0:
+        for table in RETENTION_TABLES:
+            statements.append((f"retenção de {table}", f"""
+                SELECT add_retention_policy('{table}', INTERVAL '{HF_ORDER_BOOK_RETENTION_DAYS} days',
+                    if_not_exists => TRUE)
+            """))
+    return statements
+
+
+async def ensure_db_policies(conn_pool: AsyncConnectionPool) -> Dict[str, Any]:
+    """Aplica agregados, compressão e retenção; retorna o que foi aplicado e o que falhou."""
+    applied: List[str] = []
+    failed: Dict[str, str] = {}
+    async with conn_pool.connection() as conn:
+        previous = conn.autocommit
+        await conn.set_autocommit(True)
+        try:
+            async with conn.cursor() as cur:
+                for description, sql in policy_statements():
+                    try:
+                        await cur.execute(sql)
+                        applied.append(description)
+                    except Exception as e:
+                        failed[description] = str(e).strip()
+                        logger.warning(f"⚠️ Política do TimescaleDB não aplicada ({description}): {e}")
+        finally:
+            await conn.set_autocommit(previous)
+
+    logger.info(f"🗜️ Políticas do TimescaleDB: {len(applied)} aplicadas, {len(failed)} com falha")
+    return {"applied": applied, "failed": failed}
@@ -0,0 +1,345 @@
+"""
+Snapshot do estado do TWAPDetector para restart a quente
+========================================================
+Grava periodicamente em um arquivo local (msgpack) tudo o que o detector
+acumula em memória ao longo do pregão: acumuladores incrementais com suas
+marcas d'água, padrões ativos, histerese de ativação, controle de
+notificação de inatividade e históricos de mudança de status/tipo.
+
+No startup o snapshot é restaurado antes do primeiro ciclo, e o modo
+incremental consome só os ticks posteriores à marca d'água de cada símbolo,
+em vez de reler o dia inteiro.
+
+O arquivo leva SNAPSHOT_SCHEMA_VERSION e a lista de campos de cada classe
+serializada; qualquer divergência (versão nova do código) descarta o
+snapshot e o detector volta ao recálculo a partir do início do dia.
+"""
+
+import asyncio
+import logging
+import os
+import struct
+import time as time_module
+from dataclasses import fields
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from enum import Enum
+from typing import Dict, Optional
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - sem msgpack o snapshot fica desligado
+    msgpack = None
+
+# Corrige imports para funcionar como módulo standalone
+try:
+    from .robot_models import TWAPPattern, TickData, TradeType, RobotStatus, RobotType
+    from .incremental_twap import AgentTWAPState, MarketTWAPAccumulator, SymbolTWAPState, TradeAccumulator
+except ImportError:
+    from robot_models import TWAPPattern, TickData, TradeType, RobotStatus, RobotType
+    from incremental_twap import AgentTWAPState, MarketTWAPAccumulator, SymbolTWAPState, TradeAccumulator
+
+logger = logging.getLogger(__name__)
+
+# Incrementar quando o significado do estado mudar sem mudar os nomes dos campos
+SNAPSHOT_SCHEMA_VERSION = 1
+
+# Tipos de extensão do msgpack
+_EXT_DATETIME = 1        # datetime com fuso, microssegundos desde a época (UTC)
+_EXT_NAIVE_DATETIME = 2  # datetime sem fuso, mesmos microssegundos
+_EXT_TICK = 3            # TickData como lista na ordem dos campos
+_EXT_ENUM = 4            # [código do enum, valor]
+
+_ENUMS = {1: RobotStatus, 2: TradeType, 3: RobotType}
+_ENUM_CODES = {cls: code for code, cls in _ENUMS.items()}
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_EPOCH_NAIVE = datetime(1970, 1, 1)
+_US = struct.Struct("<q")
+
+_TICK_FIELDS = tuple(f.name for f in fields(TickData))
+_PATTERN_FIELDS = tuple(f.name for f in fields(TWAPPattern))
+_SCHEMA_FIELDS = {
+    "TickData": list(_TICK_FIELDS),
+    "TWAPPattern": list(_PATTERN_FIELDS),
+    "TradeAccumulator": list(TradeAccumulator.__slots__),
+    "MarketTWAPAccumulator": list(MarketTWAPAccumulator.__slots__),
+}
+
+# Métricas do último snapshot gravado/restaurado (expostas em /metrics)
+snapshot_stats: Dict = {
+    "enabled": False,
+    "path": None,
+    "saves": 0,
+    "last_saved_at": None,
+    "last_bytes": 0,
+    "last_encode_ms": 0.0,
+    "last_write_ms": 0.0,
+    "errors": 0,
+    "restore": None,
+}
+
+
+def _micros(dt: datetime) -> int:
+    if dt.tzinfo is None:
+        return (dt - _EPOCH_NAIVE) // timedelta(microseconds=1)
+    return (dt - _EPOCH) // timedelta(microseconds=1)
+
+
+def _default(obj):
+    """Tipos que o msgpack não conhece (com strict_types, subclasses também caem aqui)"""
+    if isinstance(obj, datetime):
+        code = _EXT_DATETIME if obj.tzinfo is not None else _EXT_NAIVE_DATETIME
+        return msgpack.ExtType(code, _US.pack(_micros(obj)))
+    if isinstance(obj, TickData):
+        values = [getattr(obj, name) for name in _TICK_FIELDS]
+        return msgpack.ExtType(_EXT_TICK, _pack(values))
+    if isinstance(obj, Enum):
+        return msgpack.ExtType(_EXT_ENUM, _pack([_ENUM_CODES[type(obj)], obj.value]))
+    if isinstance(obj, tuple):
+        return list(obj)
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, float):
+        return float(obj)
+    if isinstance(obj, int):
+        return int(obj)
+    if isinstance(obj, str):
+        return str(obj)
+    if hasattr(obj, "item"):  # escalares NumPy vindos do tick_store
+        return obj.item()
+    raise TypeError(f"Tipo não serializável no snapshot: {type(obj).__name__}")
+
+
+def _ext_hook(code: int, data: bytes):
+    if code == _EXT_DATETIME:
+        return _EPOCH + timedelta(microseconds=_US.unpack(data)[0])
+    if code == _EXT_NAIVE_DATETIME:
+        return _EPOCH_NAIVE + timedelta(microseconds=_US.unpack(data)[0])
+    if code == _EXT_TICK:
+        return TickData(**dict(zip(_TICK_FIELDS, _unpack(data))))
+    if code == _EXT_ENUM:
+        enum_code, value = _unpack(data)
+        return _ENUMS[enum_code](value)
+    return msgpack.ExtType(code, data)
+
+
+def _pack(obj) -> bytes:
+    return msgpack.packb(obj, default=_default, strict_types=True, use_bin_type=True)
+
+
+def _unpack(data: bytes):
+    return msgpack.unpackb(data, ext_hook=_ext_hook, raw=False, strict_map_key=False)
+
+
+def _slots_values(obj) -> list:
+    return [getattr(obj, name) for name in type(obj).__slots__]
+
+
+def _from_slots(cls, values: list):
+    obj = cls()
+    for name, value in zip(cls.__slots__, values):
+        setattr(obj, name, value)
+    return obj
+
+
+def _encode_state(state: SymbolTWAPState) -> dict:
+    agents = []
+    for agent_id, agent in state.agents.items():
+        agents.append([
+            agent_id,
+            _slots_values(agent.aggregate),
+            [[volume, direction, _slots_values(acc)] for (volume, direction), acc in agent.clusters.items()],
+            [[volume, trade_type, _slots_values(acc)] for (volume, trade_type), acc in agent.market.items()],
+            agent.fallback_pending,
+            agent.fallback_status,
+        ])
+    return {
+        "day": state.day.isoformat(),
+        "watermark": state.watermark,
+        "ticks_consumed": state.ticks_consumed,
+        "agents": agents,
+    }
+
+
+def _decode_state(data: dict) -> SymbolTWAPState:
+    state = SymbolTWAPState(day=date.fromisoformat(data["day"]), watermark=data["watermark"])
+    state.ticks_consumed = data["ticks_consumed"]
+    for agent_id, aggregate, clusters, market, fallback_pending, fallback_status in data["agents"]:
+        agent = AgentTWAPState()
+        agent.aggregate = _from_slots(TradeAccumulator, aggregate)
+        agent.clusters = {
+            (volume, direction): _from_slots(TradeAccumulator, values)
+            for volume, direction, values in clusters
+        }
+        agent.market = {
+            (volume, trade_type): _from_slots(MarketTWAPAccumulator, values)
+            for volume, trade_type, values in market
+        }
+        agent.fallback_pending = fallback_pending
+        agent.fallback_status = fallback_status
+        state.agents[agent_id] = agent
+    return state
+
+
+def encode_detector_state(detector, states: Optional[Dict[str, SymbolTWAPState]] = None) -> bytes:
+    """Serializa o estado em memória do detector (no event loop, sem await no meio).
+
+    Com análises em andamento o estado continua consistente: trades pendentes só
+    saem dos acumuladores depois de gravados, e no pior caso um padrão é regravado
+    após o restore por ainda estar marcado como dirty. Com workers de detecção os
+    estados vêm de `states` (ShardedDetection.export_states).
+    """
+    if states is None:
+        states = detector.incremental_states
+    patterns = [
+        [symbol, agent_id, signature, [getattr(pattern, name) for name in _PATTERN_FIELDS]]
+        for symbol, agents in detector.active_patterns.items()
+        for agent_id, by_signature in agents.items()
+        for signature, pattern in by_signature.items()
+    ]
+    payload = {
+        "schema": SNAPSHOT_SCHEMA_VERSION,
+        "fields": _SCHEMA_FIELDS,
+        "saved_at": datetime.now(timezone.utc),
+        "mode": detector.detection_mode,
+        "states": {symbol: _encode_state(state) for symbol, state in states.items()},
+        "patterns": patterns,
+        "activation_times": [[*key, ts] for key, ts in detector.activation_times.items()],
+        "inactivity_notified": [list(key) for key in detector.inactivity_notified],
+        "status_history": detector.status_tracker.status_history,
+        "type_change_history": detector.status_tracker.type_change_history,
+    }
+    return _pack(payload)
+
+
+def restore_detector_state(detector, data: bytes, now: Optional[datetime] = None) -> Dict:
+    """Restaura um snapshot no detector recém-criado.
+
+    Os históricos de status/tipo são sempre restaurados (as consultas já filtram
+    por janela de horas); acumuladores, padrões ativos, histerese e controle de
+    inatividade só quando o snapshot é do pregão corrente.
+    """
+    payload = _unpack(data)
+    if payload.get("schema") != SNAPSHOT_SCHEMA_VERSION:
+        return {"restored": False, "reason": f"versão {payload.get('schema')} != {SNAPSHOT_SCHEMA_VERSION}"}
+    if payload.get("fields") != _SCHEMA_FIELDS:
+        return {"restored": False, "reason": "campos serializados mudaram"}
+
+    tracker = detector.status_tracker
+    tracker.status_history = payload["status_history"][:tracker.max_history_size]
+    tracker.type_change_history = payload["type_change_history"][:tracker.max_history_size]
+
+    saved_at: datetime = payload["saved_at"]
+    today = (now or datetime.now(timezone.utc)).date()
+    result = {
+        "restored": True,
+        "saved_at": saved_at.isoformat(),
+        "age_sec": round(((now or datetime.now(timezone.utc)) - saved_at).total_seconds(), 1),
+        "status_changes": len(tracker.status_history),
+        "type_changes": len(tracker.type_change_history),
+        "symbols": 0,
+        "agents": 0,
+        "patterns": 0,
+    }
+    if saved_at.date() != today:
+        result["reason"] = "snapshot de outro pregão: só os históricos foram restaurados"
+        return result
+
+    for symbol, encoded in payload["states"].items():
+        state = _decode_state(encoded)
+        if state.day == today:
+            detector.incremental_states[symbol] = state
+            result["symbols"] += 1
+            result["agents"] += len(state.agents)
+
+    for symbol, agent_id, signature, values in payload["patterns"]:
+        detector.active_patterns[symbol][agent_id][signature] = TWAPPattern(**dict(zip(_PATTERN_FIELDS, values)))
+        result["patterns"] += 1
+    for symbol, agent_id, signature, ts in payload["activation_times"]:
+        detector.activation_times[(symbol, agent_id, signature)] = ts
+    detector.inactivity_notified.update(tuple(key) for key in payload["inactivity_notified"])
+    return result
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    """Grava em arquivo temporário + fsync + rename: uma queda no meio nunca deixa um snapshot truncado"""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    if hasattr(os, "O_DIRECTORY"):
+        dir_fd = os.open(directory, os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+async def save_detector_snapshot(detector, path: str) -> bool:
+    """Serializa no event loop (estado consistente) e grava o arquivo numa thread"""
+    if msgpack is None or not path:
+        return False
+    try:
+        states = await detector.workers.export_states() if detector.workers is not None else None
+        start = time_module.perf_counter()
+        data = encode_detector_state(detector, states)
+        encoded = time_module.perf_counter()
+        await asyncio.to_thread(_write_atomic, path, data)
+        written = time_module.perf_counter()
+    except Exception as e:
+        snapshot_stats["errors"] += 1
+        logger.error(f"❌ Erro ao gravar snapshot do detector TWAP em {path}: {e}")
+        return False
+
+    snapshot_stats.update(
+        saves=snapshot_stats["saves"] + 1,
+        last_saved_at=datetime.now(timezone.utc).isoformat(),
+        last_bytes=len(data),
+        last_encode_ms=round((encoded - start) * 1000, 2),
+        last_write_ms=round((written - encoded) * 1000, 2),
+    )
+    logger.debug(f"💾 Snapshot do detector TWAP gravado: {len(data)} bytes")
+    return True
+
+
+def load_detector_snapshot(detector, path: str) -> Optional[Dict]:
+    """Restaura o snapshot de path no detector (startup, antes do primeiro ciclo)"""
+    snapshot_stats["path"] = path or None
+    if not path:
+        return None
+    if msgpack is None:
+        logger.warning("⚠️ msgpack não instalado: snapshot do detector TWAP desligado")
+        return None
+    snapshot_stats["enabled"] = True
+    if not os.path.exists(path):
+        logger.info(f"💾 Nenhum snapshot do detector TWAP em {path}; começando do início do dia")
+        return None
+
+    start = time_module.perf_counter()
+    try:
+        with open(path, "rb") as f:
+            result = restore_detector_state(detector, f.read())
+    except Exception as e:
+        # Arquivo corrompido ou ilegível: segue sem estado, como num primeiro boot
+        logger.error(f"❌ Snapshot do detector TWAP ilegível em {path}, ignorado: {e}")
+        result = {"restored": False, "reason": str(e)}
+    result["load_ms"] = round((time_module.perf_counter() - start) * 1000, 2)
+    snapshot_stats["restore"] = result
+
+    if result["restored"]:
+        logger.info(
+            f"♻️ Detector TWAP restaurado do snapshot ({result['age_sec']}s): {result['symbols']} símbolos, "
+            f"{result['agents']} agentes, {result['patterns']} padrões ativos em {result['load_ms']} ms"
+        )
+    else:
+        logger.warning(f"⚠️ Snapshot do detector TWAP descartado: {result['reason']}")
+    return result
+
+
+def get_snapshot_status() -> Dict:
+    return dict(snapshot_stats)
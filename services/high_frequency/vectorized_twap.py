@@ -0,0 +1,166 @@
+"""
+Caminho vetorizado (NumPy) da detecção TWAP
+===========================================
+Mesmas regras de TWAPDetector._cluster_trades, _analyze_agent_trades e
+_calculate_price_aggression, calculadas sobre colunas NumPy por agente em vez
+de laços sobre objetos TickData.
+
+Os timestamps são guardados em microssegundos inteiros, então os intervalos
+são exatos; as médias usam math.fsum e diferem do statistics.mean no máximo
+no último bit (a verificação usa a mesma tolerância de _compare_patterns).
+"""
+
+from __future__ import annotations
+
+import math
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - sem numpy o detector usa o caminho em Python puro
+    np = None
+
+# Corrige imports para funcionar como módulo standalone
+try:
+    from .robot_models import TickData, TradeType
+except ImportError:
+    from robot_models import TickData, TradeType
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_EPOCH_NAIVE = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def _mean(values: np.ndarray) -> float:
+    return math.fsum(values.tolist()) / len(values)
+
+
+class AgentTradeArrays:
+    """Colunas dos trades de um agente, na ordem recebida.
+
+    `trades` guarda os TickData originais para montar o padrão (first/last
+    seen, exchange) e para vincular os trades em robot_trades.
+    """
+
+    __slots__ = ("trades", "ts_us", "price", "volume", "is_buy")
+
+    def __init__(self, trades: List[TickData]):
+        self.trades = trades
+        # Divisão inteira de timedelta: microssegundos exatos, sem passar por float
+        epoch = _EPOCH if trades and trades[0].timestamp.tzinfo is not None else _EPOCH_NAIVE
+        self.ts_us = np.array([(t.timestamp - epoch) // _MICROSECOND for t in trades], dtype=np.int64)
+        self.price = np.array([t.price for t in trades], dtype=np.float64)
+        self.volume = np.array([int(t.volume) for t in trades], dtype=np.int64)
+        self.is_buy = np.array([t.trade_type for t in trades], dtype=np.int64) == TradeType.BUY.value
+
+    def __len__(self) -> int:
+        return len(self.trades)
+
+    def sorted_index(self, index: Optional[np.ndarray] = None) -> np.ndarray:
+        """Índices em ordem de timestamp, estável como sorted(key=timestamp)."""
+        if index is None:
+            return np.argsort(self.ts_us, kind="stable")
+        return index[np.argsort(self.ts_us[index], kind="stable")]
+
+    def take(self, index: np.ndarray) -> List[TickData]:
+        trades = self.trades
+        return [trades[i] for i in index.tolist()]
+
+
+def mean_interval_seconds(ts_us: np.ndarray) -> float:
+    """Média dos intervalos consecutivos em segundos (ts_us já ordenado)."""
+    if len(ts_us) < 2:
+        return 0.0
+    return _mean(np.diff(ts_us) / 1_000_000)
+
+
+def cluster_indices(arrays: AgentTradeArrays, min_trades: int) -> Dict[Tuple[int, str, float], np.ndarray]:
+    """Equivalente a _cluster_trades: grupos (volume, direção) com min_trades,
+    na ordem da primeira aparição, com o intervalo médio na chave."""
+    if not len(arrays):
+        return {}
+
+    # Chave única por (volume, direção): volume * 2 + (0 = buy, 1 = sell)
+    keys = arrays.volume * 2 + (~arrays.is_buy)
+    unique_keys, first_index, inverse, counts = np.unique(
+        keys, return_index=True, return_inverse=True, return_counts=True
+    )
+    inverse = inverse.reshape(-1)
+
+    # Agrupa as posições por chave mantendo a ordem original dentro de cada grupo
+    by_group = np.argsort(inverse, kind="stable")
+    bounds = np.concatenate(([0], np.cumsum(counts)))
+
+    clusters: Dict[Tuple[int, str, float], np.ndarray] = {}
+    for group in np.argsort(first_index, kind="stable").tolist():
+        if counts[group] < min_trades:
+            continue
+        index = arrays.sorted_index(by_group[bounds[group]:bounds[group + 1]])
+        volume, sell = divmod(int(unique_keys[group]), 2)
+        direction_name = 'sell' if sell else 'buy'
+        clusters[(volume, direction_name, mean_interval_seconds(arrays.ts_us[index]))] = index
+
+    if not clusters:
+        index = arrays.sorted_index()
+        buy_count = int(np.count_nonzero(arrays.is_buy))
+        sell_count = len(index) - buy_count
+        if buy_count == sell_count:
+            # max() do dict devolve a primeira direção vista em ordem de tempo
+            direction_name = 'buy' if arrays.is_buy[index[0]] else 'sell'
+        else:
+            direction_name = 'buy' if buy_count > sell_count else 'sell'
+        avg_volume = int(round(int(arrays.volume.sum()) / len(index)))
+        clusters[(avg_volume, direction_name, mean_interval_seconds(arrays.ts_us[index]))] = index
+
+    return clusters
+
+
+def price_aggression(price: np.ndarray, is_buy: np.ndarray) -> float:
+    """Equivalente a _calculate_price_aggression sobre preços em ordem de tempo."""
+    if len(price) < 2:
+        return 0.0
+    prev = price[:-1]
+    curr = price[1:]
+    buy = is_buy[1:]
+    up = buy & (curr > prev)
+    down = ~buy & (curr < prev)
+    aggressions = np.where(up, curr - prev, prev - curr)[up | down] / prev[up | down]
+    if not len(aggressions):
+        return 0.0
+    return _mean(aggressions) * 100
+
+
+def trade_stats(arrays: AgentTradeArrays, index: np.ndarray, default_frequency: float) -> Dict:
+    """Estatísticas de _analyze_agent_trades para os trades `index` (já ordenados),
+    no formato dos argumentos nomeados de TWAPDetector._pattern_from_stats."""
+    total_trades = len(index)
+    volume = arrays.volume[index]
+    is_buy = arrays.is_buy[index]
+    price = arrays.price[index]
+    ts_us = arrays.ts_us[index]
+
+    if total_trades > 1:
+        avg_frequency = _mean(np.diff(ts_us) / 1_000_000 / 60.0)
+    else:
+        avg_frequency = default_frequency
+
+    if total_trades:
+        price_variation = ((float(price.max()) - float(price.min())) / float(price[0])) * 100
+        first, last = arrays.trades[int(index[0])], arrays.trades[int(index[-1])]
+    else:
+        price_variation = 0.0
+        first = last = None
+
+    return {
+        "total_trades": total_trades,
+        "gross_volume": int(volume.sum()),
+        "buy_volume": int(volume[is_buy].sum()),
+        "sell_volume": int(volume[~is_buy].sum()),
+        "avg_frequency": avg_frequency,
+        "price_variation": price_variation,
+        "price_aggression": price_aggression(price, is_buy),
+        "first_seen": first.timestamp if first else None,
+        "last_seen": last.timestamp if last else None,
+        "exchange": first.exchange if first else None,
+    }
@@ -0,0 +1,355 @@
+import logging
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+import requests
+
+from services.market_feed_next.buffer import TickItem
+
+logger = logging.getLogger("market_feed_next.backfill")
+
+# (símbolo, início, fim) em epoch do horário da bolsa -> código de retorno da DLL (0 = aceito)
+RequestHistory = Callable[[str, float, float], int]
+
+
+class GapRequest:
+	"""Janela de negócios perdidos de um símbolo (epoch, horário da bolsa).
+
+	Com `first_id`/`last_id` a lacuna veio de números de negócio pulados e só
+	esses números são aproveitados do histórico; sem eles veio de silêncio no
+	stream e valem os negócios estritamente dentro da janela. Lacunas juntadas
+	guardam cada faixa de números (`ids`) ou janela (`windows`) em separado:
+	o pedido à DLL cobre de `start` a `end`, mas os negócios recebidos ao vivo
+	entre elas ficam de fora.
+	"""
+	__slots__ = (
+		"symbol", "start", "end", "ids", "windows", "attempts", "not_before",
+		"split", "trades", "dispatched_at", "last_trade_at", "unsent",
+	)
+	def __init__(self, symbol: str, start: float, end: float, first_id: Optional[int] = None, last_id: Optional[int] = None):
+		self.symbol = symbol
+		self.start = start
+		self.end = end
+		self.ids: List[Tuple[int, int]] = [(first_id, last_id)] if first_id is not None else []
+		self.windows: List[Tuple[float, float]] = [] if first_id is not None else [(start, end)]
+		self.attempts = 0
+		self.not_before = 0.0
+		# Pedaço de uma janela maior que BACKFILL_MINUTES: não dá para saber quantos negócios esperar
+		self.split = False
+		self.trades: List[TickItem] = []
+		self.dispatched_at = 0.0
+		self.last_trade_at = 0.0
+		# Lotes que o backend recusou: na repetição só eles são reenviados, sem pedir à DLL de novo
+		self.unsent: List[dict] = []
+
+	@property
+	def by_id(self) -> bool:
+		return bool(self.ids)
+
+	def merge(self, other: "GapRequest") -> None:
+		"""Junta outra lacuna do mesmo tipo (por número ou por silêncio)."""
+		self.start = min(self.start, other.start)
+		self.end = max(self.end, other.end)
+		self.ids.extend(other.ids)
+		self.windows.extend(other.windows)
+
+	def chunk(self, start: float, end: float) -> "GapRequest":
+		"""Pedaço [start, end] da janela, com as mesmas faixas."""
+		piece = GapRequest(self.symbol, start, end)
+		piece.ids = list(self.ids)
+		piece.windows = list(self.windows)
+		piece.split = True
+		return piece
+
+	def expected(self) -> Optional[int]:
+		if not self.ids or self.split:
+			return None
+		return sum(last - first + 1 for first, last in self.ids)
+
+	def wants(self, item: TickItem) -> bool:
+		if self.ids:
+			return item.trade_id is not None and any(first <= item.trade_id <= last for first, last in self.ids)
+		ts = item.exchange_timestamp
+		return ts is not None and any(start < ts < end for start, end in self.windows)
+
+
+class HistoryBackfill:
+	"""Detecta lacunas no stream de negócios e recupera o que faltou pelo histórico da DLL.
+
+	observe() roda no callback de trade: guarda o último número de negócio e
+	horário por símbolo e, num salto de número (ou silêncio acima de
+	`gap_threshold_sec` quando o feed não traz número), enfileira a janela
+	perdida. A fila é limitada (`queue_max`); lacunas do mesmo símbolo e tipo
+	ainda não pedidas se juntam num pedido só. A thread do serviço pede à DLL no
+	máximo `concurrency` janelas por vez (uma por símbolo), em pedaços de até
+	`max_window_sec`, recolhe os negócios do callback de histórico até
+	`idle_sec` sem novidade (ou todos os números esperados, ou `timeout_sec`),
+	filtra os da janela e envia em lote ao backend, que grava com dedup por
+	(symbol, trade_id) contra o que já está no ticks_raw. Um lote recusado é
+	reenviado sozinho na repetição, sem pedir de novo os que o backend aceitou.
+	"""
+	def __init__(self, request_history: RequestHistory, backfill_url: str, gap_threshold_sec: float = 12.0,
+			max_window_sec: float = 180.0, queue_max: int = 256, concurrency: int = 1, idle_sec: float = 2.0,
+			timeout_sec: float = 15.0, max_attempts: int = 3, retry_sec: float = 5.0, batch_max: int = 5000,
+			poll_sec: float = 0.2, send_timeout_sec: float = 10.0, clock: Callable[[], float] = time.monotonic):
+		self._request_history = request_history
+		self._url = backfill_url
+		self._gap_threshold = gap_threshold_sec
+		self._max_window = max(1.0, max_window_sec)
+		self._queue_max = max(1, queue_max)
+		self._concurrency = max(1, concurrency)
+		self._idle = idle_sec
+		self._timeout = timeout_sec
+		self._max_attempts = max(1, max_attempts)
+		self._retry = retry_sec
+		self._batch_max = max(1, batch_max)
+		self._poll_sec = poll_sec
+		self._send_timeout = send_timeout_sec
+		self._clock = clock
+		self._session = requests.Session()
+		# Último (trade_id, horário) por símbolo; só o callback de trade escreve
+		self._last: Dict[str, tuple] = {}
+		self._lock = threading.Lock()
+		self._pending: Deque[GapRequest] = deque()
+		self._active: Dict[str, GapRequest] = {}
+		self._thread: Optional[threading.Thread] = None
+		self._stop = threading.Event()
+		self.gaps_detected = 0
+		self.gaps_merged = 0
+		self.gaps_rejected = 0
+		self.requests_sent = 0
+		self.requests_failed = 0
+		self.requests_timed_out = 0
+		self.gaps_abandoned = 0
+		self.history_trades = 0
+		self.unsolicited = 0
+		self.ticks_sent = 0
+		self.ticks_filtered = 0
+		self.ticks_failed = 0
+		self.batches_failed = 0
+
+	def observe(self, symbol: str, trade_id: Optional[int], ts: float, is_edit: bool = False) -> None:
+		"""Chamado no callback de trade com o horário da bolsa (ou do recebimento, na falta dele)."""
+		if is_edit:
+			return
+		last = self._last.get(symbol)
+		# Primeiro negócio visto ou novo pregão (a numeração recomeça): só registra
+		if last is None or int(ts // 86400) != int(last[1] // 86400):
+			self._last[symbol] = (trade_id, ts)
+			return
+		last_id, last_ts = last
+		if trade_id is not None and last_id is not None:
+			if trade_id <= last_id:
+				return  # repetido ou fora de ordem
+			self._last[symbol] = (trade_id, ts)
+			if trade_id > last_id + 1:
+				self._enqueue(GapRequest(symbol, min(last_ts, ts), max(last_ts, ts), last_id + 1, trade_id - 1))
+			return
+		self._last[symbol] = (trade_id, ts)
+		if ts - last_ts > self._gap_threshold:
+			self._enqueue(GapRequest(symbol, last_ts, ts))
+
+	def _enqueue(self, gap: GapRequest) -> None:
+		with self._lock:
+			self.gaps_detected += 1
+			for queued in self._pending:
+				if queued.symbol == gap.symbol and queued.by_id == gap.by_id and not queued.unsent:
+					queued.merge(gap)
+					self.gaps_merged += 1
+					return
+			if len(self._pending) >= self._queue_max:
+				self.gaps_rejected += 1
+				logger.warning("⚠️ Fila de backfill cheia (%s); lacuna de %s descartada", self._queue_max, gap.symbol)
+				return
+			self._pending.append(gap)
+		logger.info("🕳️ Lacuna em %s: %.1fs, negócios %s", gap.symbol, gap.end - gap.start, gap.ids or "sem número")
+
+	def on_history_trade(self, symbol: str, price: float, qty: int, ts: float, extra_data: dict) -> None:
+		"""Callback de histórico da DLL: entrega o negócio ao pedido ativo do símbolo.
+
+		Sem recebimento ao vivo, `ts` (o `timestamp` do tick) já é o horário da bolsa.
+		"""
+		item = TickItem(
+			symbol,
+			"B",
+			price,
+			qty,
+			ts,
+			extra_data.get("trade_id"),
+			buy_agent=extra_data.get("buy_agent"),
+			sell_agent=extra_data.get("sell_agent"),
+			trade_type=extra_data.get("trade_type"),
+			volume_financial=extra_data.get("volume_financial"),
+			exchange_timestamp=extra_data.get("exchange_timestamp"),
+		)
+		with self._lock:
+			self.history_trades += 1
+			request = self._active.get(symbol)
+			if request is None:
+				self.unsolicited += 1
+				return
+			request.trades.append(item)
+			request.last_trade_at = self._clock()
+
+	def start(self) -> None:
+		if self._thread and self._thread.is_alive():
+			return
+		self._stop.clear()
+		self._thread = threading.Thread(target=self._run, name="history-backfill", daemon=True)
+		self._thread.start()
+
+	def stop(self, timeout_sec: float = 5.0) -> None:
+		self._stop.set()
+		if self._thread:
+			self._thread.join(timeout_sec)
+
+	def _run(self) -> None:
+		while not self._stop.wait(self._poll_sec):
+			try:
+				self.poll()
+			except Exception as exc:
+				logger.error("Erro no ciclo de backfill: %s", exc)
+
+	def poll(self) -> None:
+		"""Fecha os pedidos concluídos e despacha os próximos da fila, dentro do limite de concorrência."""
+		now = self._clock()
+		finished = []
+		with self._lock:
+			for symbol, request in list(self._active.items()):
+				if self._is_done(request, now):
+					finished.append(self._active.pop(symbol))
+		for request in finished:
+			self._finish(request)
+		while True:
+			with self._lock:
+				request = self._next_request(now)
+			if request is None:
+				break
+			if request.unsent:
+				self._send_ticks(request, request.unsent)
+			else:
+				self._dispatch(request)
+
+	def _is_done(self, request: GapRequest, now: float) -> bool:
+		expected = request.expected()
+		if expected is not None and sum(1 for t in request.trades if request.wants(t)) >= expected:
+			return True
+		if request.trades and now - request.last_trade_at >= self._idle:
+			return True
+		if now - request.dispatched_at >= self._timeout:
+			if not request.trades:
+				self.requests_timed_out += 1
+			return True
+		return False
+
+	def _next_request(self, now: float) -> Optional[GapRequest]:
+		"""Tira da fila a próxima janela despachável (chamado com o lock)."""
+		if len(self._active) >= self._concurrency:
+			return None
+		for request in self._pending:
+			if request.symbol not in self._active and request.not_before <= now:
+				break
+		else:
+			return None
+		self._pending.remove(request)
+		if request.unsent:
+			# Só reenvia os lotes recusados; não ocupa vaga de pedido à DLL
+			return request
+		if request.end - request.start > self._max_window:
+			# Janela longa: pede o primeiro pedaço e devolve o resto à frente da fila
+			self._pending.appendleft(request.chunk(request.start + self._max_window, request.end))
+			request.end = request.start + self._max_window
+			request.split = True
+		request.trades = []
+		request.dispatched_at = now
+		self._active[request.symbol] = request
+		return request
+
+	def _dispatch(self, request: GapRequest) -> None:
+		try:
+			code = self._request_history(request.symbol, request.start, request.end)
+		except Exception as exc:
+			logger.warning("Erro ao pedir histórico de %s: %s", request.symbol, exc)
+			code = -1
+		with self._lock:
+			if code == 0:
+				self.requests_sent += 1
+				return
+			self.requests_failed += 1
+			self._active.pop(request.symbol, None)
+			self._retry_later(request)
+		logger.warning("GetHistoryTrades %s -> %s (tentativa %s/%s)", request.symbol, code, request.attempts, self._max_attempts)
+
+	def _retry_later(self, request: GapRequest) -> None:
+		"""Devolve a janela à fila com espera crescente, até max_attempts (chamado com o lock)."""
+		request.attempts += 1
+		if request.attempts >= self._max_attempts:
+			self.gaps_abandoned += 1
+			logger.error("❌ Desistindo do backfill de %s após %s tentativas", request.symbol, request.attempts)
+			return
+		request.not_before = self._clock() + self._retry * request.attempts
+		self._pending.append(request)
+
+	def _finish(self, request: GapRequest) -> None:
+		ticks = []
+		seen = set()
+		for item in request.trades:
+			if not request.wants(item) or item.trade_id in seen:
+				continue
+			if item.trade_id is not None:
+				seen.add(item.trade_id)
+			ticks.append(item.to_dict())
+		self.ticks_filtered += len(request.trades) - len(ticks)
+		if self._send_ticks(request, ticks):
+			logger.info("✅ Backfill %s: %s negócios recuperados (%s recebidos)", request.symbol, len(ticks), len(request.trades))
+
+	def _send_ticks(self, request: GapRequest, ticks: List[dict]) -> bool:
+		"""Envia em lotes; no primeiro lote recusado guarda o resto em `unsent` e agenda a repetição."""
+		for start in range(0, len(ticks), self._batch_max):
+			batch = ticks[start:start + self._batch_max]
+			if self.send(batch):
+				self.ticks_sent += len(batch)
+				continue
+			self.batches_failed += 1
+			request.unsent = ticks[start:]
+			with self._lock:
+				self._retry_later(request)
+			if request.attempts >= self._max_attempts:
+				self.ticks_failed += len(request.unsent)
+			return False
+		request.unsent = []
+		return True
+
+	def send(self, ticks: List[dict]) -> bool:
+		try:
+			resp = self._session.post(self._url, json={"ticks": ticks}, timeout=self._send_timeout)
+			if resp.status_code == 404:
+				logger.error("Backend sem %s; backfill não gravado", self._url)
+			return 200 <= resp.status_code < 300
+		except Exception as exc:
+			logger.debug("Erro ao enviar backfill: %s", exc)
+			return False
+
+	def stats(self) -> dict:
+		with self._lock:
+			return {
+				"pending": len(self._pending),
+				"active": len(self._active),
+				"queue_max": self._queue_max,
+				"concurrency": self._concurrency,
+				"gaps_detected": self.gaps_detected,
+				"gaps_merged": self.gaps_merged,
+				"gaps_rejected": self.gaps_rejected,
+				"gaps_abandoned": self.gaps_abandoned,
+				"requests_sent": self.requests_sent,
+				"requests_failed": self.requests_failed,
+				"requests_timed_out": self.requests_timed_out,
+				"history_trades": self.history_trades,
+				"unsolicited": self.unsolicited,
+				"ticks_sent": self.ticks_sent,
+				"ticks_filtered": self.ticks_filtered,
+				"ticks_failed": self.ticks_failed,
+				"batches_failed": self.batches_failed,
+			}
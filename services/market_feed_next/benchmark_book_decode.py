@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Benchmark da decodificação dos arrays de livro da ProfitDLL
+===========================================================
+Compara, em níveis decodificados por segundo, a leitura campo a campo
+anterior do dll.py (from_address + bytes + struct.unpack + dict por nível)
+com book_decode (memoryview sobre a memória + leitura em bloco, tuplas) e
+com as variantes NumPy, sobre buffers no layout nativo em memória ctypes.
+
+Uso:
+    python services/market_feed_next/benchmark_book_decode.py [--levels 10,100,1000] [--seconds 1.0]
+"""
+
+import argparse
+import ctypes
+import random
+import sys
+import time
+from pathlib import Path
+
+# Adiciona o projeto ao path
+_PROJECT_ROOT = Path(__file__).resolve().parents[2]
+if str(_PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(_PROJECT_ROOT))
+
+from services.market_feed_next.book_decode import (
+    map_buffer, offers_array, price_levels_array, read_offer_array, read_price_array,
+)
+from services.market_feed_next.test_book_decode import (
+    legacy_offers, legacy_price_levels, make_book, offer_buffer, price_buffer,
+)
+
+
+def rate(fn, address: int, levels: int, seconds: float) -> float:
+    """Níveis por segundo chamando fn(address) repetidamente por ~seconds"""
+    calls = 0
+    start = time.perf_counter()
+    deadline = start + seconds
+    while True:
+        for _ in range(10):
+            fn(address)
+        calls += 10
+        now = time.perf_counter()
+        if now >= deadline:
+            return calls * levels / (now - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark da decodificação dos arrays de livro")
+    parser.add_argument("--levels", default="10,100,1000", help="Níveis por array, separados por vírgula")
+    parser.add_argument("--seconds", type=float, default=1.0, help="Tempo por medição")
+    args = parser.parse_args()
+
+    rng = random.Random(3)
+    print(f"{'livro':>6} {'níveis':>7} {'campo a campo/s':>16} {'tuplas/s':>12} {'numpy/s':>12} {'speedup':>8}")
+    for count in (int(c) for c in args.levels.split(",")):
+        levels, offers, agents = make_book(rng, count)
+        price_raw = ctypes.create_string_buffer(price_buffer(levels))
+        offer_raw = ctypes.create_string_buffer(offer_buffer(offers, agents))
+        offer_size = len(offer_raw.raw) - 1
+        cases = (
+            ("price", ctypes.addressof(price_raw), legacy_price_levels, read_price_array,
+             lambda a: price_levels_array(map_buffer(a, len(price_raw.raw) - 1))),
+            ("offer", ctypes.addressof(offer_raw), legacy_offers, read_offer_array,
+             lambda a: offers_array(map_buffer(a, offer_size))),
+        )
+        for name, address, legacy, bulk, numpy_decode in cases:
+            legacy_rate = rate(legacy, address, count or 1, args.seconds)
+            bulk_rate = rate(bulk, address, count or 1, args.seconds)
+            numpy_rate = rate(numpy_decode, address, count or 1, args.seconds)
+            print(f"{name:>6} {count:>7} {legacy_rate:>16,.0f} {bulk_rate:>12,.0f} {numpy_rate:>12,.0f} "
+                  f"{bulk_rate / legacy_rate:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
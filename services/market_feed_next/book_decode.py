@@ -0,0 +1,161 @@
+"""
+Decodificação em bloco dos arrays de livro da ProfitDLL
+=======================================================
+Os callbacks de livro (price book e offer book) recebem ponteiros para arrays
+nativos com o layout:
+
+    cabeçalho: count (uint32) + total_size (uint32)
+    price book: count × [price double, quantity int64, offer_count int32]   (20 bytes)
+    offer book: count × [price double, quantity int64, agent int32,
+                         offer_id int64, length uint16, length bytes]      (30 + length)
+                + flags (uint32, ex.: OB_LAST_PACKET)
+
+Em vez de um from_address/bytes/struct.unpack por campo e um dict por nível,
+o buffer é mapeado uma vez (memoryview sobre a memória da DLL, sem cópia) e
+os registros de largura fixa são lidos em bloco: struct.iter_unpack no price
+book, um unpack_from por registro no offer book (a string do agente tem
+tamanho variável, então o offset do próximo registro depende do anterior).
+O resultado são tuplas; as variantes *_array devolvem arrays estruturados
+NumPy (copiados, pois a memória da DLL não sobrevive ao callback).
+
+Sem dependência da DLL (WinDLL/WINFUNCTYPE), para rodar teste e benchmark em
+qualquer plataforma a partir de buffers capturados.
+"""
+
+import ctypes
+import struct
+from typing import List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - numpy é dependência do backend
+    np = None
+
+HEADER = struct.Struct("<II")
+PRICE_LEVEL = struct.Struct("<dqi")
+OFFER_FIXED = struct.Struct("<dqiqH")
+OFFER_FLAGS_SIZE = 4
+
+# (price, quantity, offer_count)
+PriceLevel = Tuple[float, int, int]
+# (price, quantity, agent_id, offer_id)
+Offer = Tuple[float, int, int, int]
+
+if np is not None:
+    PRICE_LEVEL_DTYPE = np.dtype([("price", "<f8"), ("quantity", "<i8"), ("offer_count", "<i4")])
+    OFFER_DTYPE = np.dtype([
+        ("price", "<f8"), ("quantity", "<i8"), ("agent_id", "<i4"), ("offer_id", "<i8"), ("length", "<u2"),
+    ])
+    assert PRICE_LEVEL_DTYPE.itemsize == PRICE_LEVEL.size and OFFER_DTYPE.itemsize == OFFER_FIXED.size
+
+
+class BookDecodeError(ValueError):
+    """Buffer de livro truncado ou inconsistente com o cabeçalho"""
+
+
+def map_buffer(address: int, size: int) -> memoryview:
+    """Memória nativa em `address` como memoryview, sem copiar"""
+    return memoryview((ctypes.c_char * size).from_address(address)).cast("B")
+
+
+def read_header(buf) -> Tuple[int, int]:
+    if len(buf) < HEADER.size:
+        raise BookDecodeError(f"buffer de {len(buf)} bytes sem cabeçalho")
+    return HEADER.unpack_from(buf, 0)
+
+
+def _price_body(buf) -> memoryview:
+    count, _ = read_header(buf)
+    end = HEADER.size + count * PRICE_LEVEL.size
+    if len(buf) < end:
+        raise BookDecodeError(f"price book com {count} níveis exige {end} bytes, recebidos {len(buf)}")
+    return memoryview(buf)[HEADER.size:end]
+
+
+def decode_price_levels(buf) -> List[PriceLevel]:
+    """Níveis do price book como tuplas (price, quantity, offer_count)"""
+    return list(PRICE_LEVEL.iter_unpack(_price_body(buf)))
+
+
+def price_levels_array(buf) -> "np.ndarray":
+    """Níveis do price book como array estruturado (PRICE_LEVEL_DTYPE)"""
+    return np.frombuffer(_price_body(buf), dtype=PRICE_LEVEL_DTYPE).copy()
+
+
+def offer_offsets(buf) -> List[int]:
+    """Tabela de offsets dos registros do offer book (o tamanho da string do
+    agente decide onde começa o próximo)"""
+    count, _ = read_header(buf)
+    size = len(buf)
+    fixed = OFFER_FIXED.size
+    length_at = fixed - 2
+    unpack_length = struct.Struct("<H").unpack_from
+    offsets = []
+    offset = HEADER.size
+    for _ in range(count):
+        if offset + fixed > size:
+            raise BookDecodeError(f"offer book truncado no registro {len(offsets)} de {count}")
+        offsets.append(offset)
+        offset += fixed + unpack_length(buf, offset + length_at)[0]
+    if offset > size:
+        raise BookDecodeError(f"offer book truncado: string do agente além de {size} bytes")
+    return offsets
+
+
+def decode_offers(buf) -> List[Offer]:
+    """Ofertas como tuplas (price, quantity, agent_id, offer_id)"""
+    count, _ = read_header(buf)
+    size = len(buf)
+    fixed = OFFER_FIXED.size
+    unpack = OFFER_FIXED.unpack_from
+    offers: List[Offer] = []
+    append = offers.append
+    offset = HEADER.size
+    for _ in range(count):
+        if offset + fixed > size:
+            raise BookDecodeError(f"offer book truncado no registro {len(offers)} de {count}")
+        price, quantity, agent_id, offer_id, length = unpack(buf, offset)
+        append((price, quantity, agent_id, offer_id))
+        offset += fixed + length
+    if offset > size:
+        raise BookDecodeError(f"offer book truncado: string do agente além de {size} bytes")
+    return offers
+
+
+def offers_array(buf) -> "np.ndarray":
+    """Ofertas como array estruturado (OFFER_DTYPE), juntando os registros de
+    largura fixa pela tabela de offsets"""
+    offsets = offer_offsets(buf)
+    if not offsets:
+        return np.empty(0, dtype=OFFER_DTYPE)
+    raw = np.frombuffer(buf, dtype=np.uint8)
+    first = offsets[0]
+    stride = offsets[1] - first if len(offsets) > 1 else OFFER_FIXED.size
+    if offsets[-1] == first + stride * (len(offsets) - 1):
+        # Strings do mesmo tamanho (caso comum): registros a passo constante
+        view = np.lib.stride_tricks.as_strided(
+            raw[first:], shape=(len(offsets), OFFER_FIXED.size), strides=(stride, 1)
+        )
+    else:
+        view = raw[np.asarray(offsets)[:, None] + np.arange(OFFER_FIXED.size)]
+    return np.ascontiguousarray(view).view(OFFER_DTYPE).reshape(len(offsets))
+
+
+def read_price_array(address: Optional[int]) -> List[PriceLevel]:
+    """Decodifica o price book apontado por `address` (memória da DLL)"""
+    if not address:
+        return []
+    count, _ = HEADER.unpack(ctypes.string_at(address, HEADER.size))
+    return decode_price_levels(map_buffer(address, HEADER.size + count * PRICE_LEVEL.size))
+
+
+def read_offer_array(address: Optional[int]) -> Tuple[List[Offer], int]:
+    """Decodifica o offer book apontado por `address`; devolve também o
+    total_size do cabeçalho, usado para liberar o array (FreePointer)"""
+    if not address:
+        return [], 0
+    count, total_size = HEADER.unpack(ctypes.string_at(address, HEADER.size))
+    minimum = HEADER.size + count * OFFER_FIXED.size
+    if total_size < minimum:
+        raise BookDecodeError(f"offer book com {count} registros e total_size {total_size} < {minimum}")
+    return decode_offers(map_buffer(address, total_size)), total_size
@@ -0,0 +1,182 @@
+import json
+import logging
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+import requests
+
+from services.shared.ipc_transport import KIND_BOOK_BATCH, KIND_BOOK_EVENT, KIND_BOOK_OFFER, KIND_BOOK_SNAPSHOT, IpcClient
+from services.shared.order_book import ACTION_EDIT
+
+logger = logging.getLogger("market_feed_next.book_forwarder")
+
+BATCH_KEYS = {KIND_BOOK_EVENT: "events", KIND_BOOK_SNAPSHOT: "snapshots", KIND_BOOK_OFFER: "offers"}
+SINGLE_PATHS = {
+	KIND_BOOK_EVENT: "/ingest/order-book-event",
+	KIND_BOOK_SNAPSHOT: "/ingest/order-book-snapshot",
+	KIND_BOOK_OFFER: "/ingest/order-book-offer",
+}
+
+
+def coalesce(items: List[Tuple[int, dict]]) -> Tuple[Dict[str, List[dict]], int]:
+	"""Junta os itens de uma janela num lote, descartando os redundantes.
+
+	- edições repetidas do mesmo (símbolo, lado, posição) ficam só com a última,
+	  desde que nenhum add/delete do mesmo lado tenha deslocado as posições entre elas;
+	- snapshots do mesmo símbolo ficam só com o último;
+	- ofertas seguem todas, na ordem.
+	Devolve o lote e quantos itens foram descartados.
+	"""
+	events: List[dict] = []
+	offers: List[dict] = []
+	snapshots: Dict[str, dict] = {}
+	# (símbolo, lado) -> {posição: índice em events} das edições ainda juntáveis
+	open_edits: Dict[Tuple[str, int], Dict[int, int]] = {}
+	coalesced = 0
+	for kind, payload in items:
+		if kind == KIND_BOOK_EVENT:
+			side_key = (payload["symbol"], payload["side"])
+			if payload["action"] == ACTION_EDIT:
+				edits = open_edits.setdefault(side_key, {})
+				index = edits.get(payload["position"])
+				if index is not None:
+					events[index] = payload
+					coalesced += 1
+					continue
+				edits[payload["position"]] = len(events)
+			else:
+				open_edits.pop(side_key, None)
+			events.append(payload)
+		elif kind == KIND_BOOK_SNAPSHOT:
+			if payload["symbol"] in snapshots:
+				coalesced += 1
+			snapshots[payload["symbol"]] = payload
+		else:
+			offers.append(payload)
+	return {"events": events, "snapshots": list(snapshots.values()), "offers": offers}, coalesced
+
+
+class BookForwarder:
+	"""Encaminha eventos, snapshots e ofertas de book ao backend HF fora do callback da DLL.
+
+	O callback só faz push() numa deque (append/popleft são atômicos no CPython,
+	sem lock); a thread de envio drena a cada `batch_ms`, junta as edições
+	repetidas (coalesce) e manda um lote por IPC (KIND_BOOK_BATCH) ou por POST
+	em /ingest/order-book-batch numa Session reaproveitada. Backend sem o
+	endpoint de lote: cai para os endpoints por item, na mesma Session.
+	"""
+	def __init__(self, batch_url: str, batch_ms: int = 50, batch_max: int = 2000, maxlen: int = 100_000,
+			timeout_sec: float = 2.0, ipc: Optional[IpcClient] = None):
+		self._batch_url: Optional[str] = batch_url
+		self._base_url = batch_url.split("/ingest")[0]
+		self._batch_sec = batch_ms / 1000.0
+		self._batch_max = max(1, batch_max)
+		self._maxlen = maxlen
+		self._timeout = timeout_sec
+		self._ipc = ipc
+		self._queue: Deque[Tuple[int, dict]] = deque(maxlen=maxlen)
+		self._session = requests.Session()
+		self._thread: Optional[threading.Thread] = None
+		self._stop = threading.Event()
+		# Cada contador tem um único escritor: o callback (received, overflow) ou a thread de envio
+		self.received = 0
+		self.overflow = 0
+		self.coalesced = 0
+		self.sent = 0
+		self.failed = 0
+		self.batches_sent = 0
+		self.batches_failed = 0
+		self.ipc_batches = 0
+		self.last_batch_ms = 0.0
+		self.max_batch_ms = 0.0
+
+	def push(self, kind: int, payload: dict) -> None:
+		"""Chamado no callback da DLL: nunca bloqueia; fila cheia descarta o mais antigo."""
+		if len(self._queue) >= self._maxlen:
+			self.overflow += 1
+		self._queue.append((kind, payload))
+		self.received += 1
+
+	def start(self) -> None:
+		if self._thread and self._thread.is_alive():
+			return
+		self._stop.clear()
+		self._thread = threading.Thread(target=self._run, name="hf-book-forwarder", daemon=True)
+		self._thread.start()
+
+	def stop(self, timeout_sec: float = 5.0) -> None:
+		self._stop.set()
+		if self._thread:
+			self._thread.join(timeout_sec)
+
+	def _run(self) -> None:
+		while not self._stop.wait(self._batch_sec):
+			self.flush()
+		# Drena o que sobrou antes de sair
+		self.flush()
+
+	def flush(self) -> None:
+		"""Envia tudo o que está na fila, em lotes de até batch_max itens."""
+		queue = self._queue
+		while queue:
+			items = []
+			while queue and len(items) < self._batch_max:
+				items.append(queue.popleft())
+			batch, coalesced = coalesce(items)
+			self.coalesced += coalesced
+			count = len(items) - coalesced
+			start = time.perf_counter()
+			ok = self.send(batch)
+			elapsed_ms = (time.perf_counter() - start) * 1000.0
+			if ok:
+				self.batches_sent += 1
+				self.sent += count
+				self.last_batch_ms = elapsed_ms
+				if elapsed_ms > self.max_batch_ms:
+					self.max_batch_ms = elapsed_ms
+			else:
+				self.batches_failed += 1
+				self.failed += count
+				logger.warning("Falha ao enviar lote de book com %s itens (%.1fms); descartado", count, elapsed_ms)
+
+	def send(self, batch: Dict[str, List[dict]]) -> bool:
+		if self._ipc is not None and self._ipc.send(KIND_BOOK_BATCH, json.dumps(batch).encode("utf-8")):
+			self.ipc_batches += 1
+			return True
+		try:
+			if self._batch_url:
+				resp = self._session.post(self._batch_url, json=batch, timeout=self._timeout)
+				if resp.status_code != 404:
+					return 200 <= resp.status_code < 300
+				logger.warning("Backend sem %s; enviando book item a item", self._batch_url)
+				self._batch_url = None
+			ok = True
+			for kind, key in BATCH_KEYS.items():
+				url = self._base_url + SINGLE_PATHS[kind]
+				for payload in batch[key]:
+					resp = self._session.post(url, json=payload, timeout=self._timeout)
+					ok = ok and 200 <= resp.status_code < 300
+			return ok
+		except Exception as exc:
+			logger.debug("Erro ao enviar lote de book: %s", exc)
+			return False
+
+	def stats(self) -> dict:
+		return {
+			"queued": len(self._queue),
+			"maxlen": self._maxlen,
+			"received": self.received,
+			"coalesced": self.coalesced,
+			"sent": self.sent,
+			"dropped": self.overflow + self.failed,
+			"dropped_overflow": self.overflow,
+			"dropped_failed": self.failed,
+			"batches_sent": self.batches_sent,
+			"batches_failed": self.batches_failed,
+			"ipc_batches": self.ipc_batches,
+			"last_batch_ms": round(self.last_batch_ms, 2),
+			"max_batch_ms": round(self.max_batch_ms, 2),
+			"format": "batch" if self._batch_url else "single",
+		}
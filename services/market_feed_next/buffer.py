@@ -4,23 +4,71 @@ from collections import deque
 from typing import Deque, Dict, List, Optional
 
 class TickItem:
-	__slots__ = ("symbol", "exchange", "price", "volume", "timestamp", "trade_id")
-	def __init__(self, symbol: str, exchange: str, price: float, volume: int, timestamp: float, trade_id: int | None):
+	__slots__ = (
+		"symbol", "exchange", "price", "volume", "timestamp", "trade_id",
+		"buy_agent", "sell_agent", "trade_type", "volume_financial", "is_edit", "exchange_timestamp",
+	)
+	def __init__(self, symbol: str, exchange: str, price: float, volume: int, timestamp: float, trade_id: int | None,
+			buy_agent: int | None = None, sell_agent: int | None = None, trade_type: int | None = None,
+			volume_financial: float | None = None, is_edit: bool = False, exchange_timestamp: float | None = None):
 		self.symbol = symbol
 		self.exchange = exchange
 		self.price = float(price)
 		self.volume = int(volume)
 		self.timestamp = float(timestamp)
 		self.trade_id = trade_id
+		self.buy_agent = buy_agent
+		self.sell_agent = sell_agent
+		self.trade_type = trade_type
+		self.volume_financial = volume_financial
+		self.is_edit = bool(is_edit)
+		# Horário do negócio na bolsa; `timestamp` é o recebimento no callback da DLL
+		self.exchange_timestamp = exchange_timestamp
+
+	def to_dict(self) -> dict:
+		return {
+			"symbol": self.symbol,
+			"exchange": self.exchange,
+			"price": self.price,
+			"volume": self.volume,
+			"timestamp": self.timestamp,
+			"trade_id": self.trade_id,
+			"buy_agent": self.buy_agent,
+			"sell_agent": self.sell_agent,
+			"trade_type": self.trade_type,
+			"volume_financial": self.volume_financial,
+			"is_edit": self.is_edit,
+			"exchange_timestamp": self.exchange_timestamp,
+		}
 
 class TickBuffer:
-	def __init__(self, maxlen: int = 200_000):
+	"""Fila limitada entre o callback da DLL e a thread de envio.
+
+	Quando cheia, descarta o tick mais antigo (deque com maxlen) e contabiliza
+	em `overflow`, para que o callback nunca bloqueie.
+	"""
+	def __init__(self, maxlen: int = 200_000, notify_at: int = 1000):
 		self._q: Deque[TickItem] = deque(maxlen=maxlen)
+		self._maxlen = maxlen
+		self._notify_at = max(1, notify_at)
 		self._lock = threading.Lock()
+		self._ready = threading.Condition(self._lock)
+		self.pushed = 0
+		self.overflow = 0
+		self.high_water = 0
 
 	def push(self, item: TickItem) -> None:
 		with self._lock:
+			size = len(self._q)
+			if size >= self._maxlen:
+				self.overflow += 1
 			self._q.append(item)
+			self.pushed += 1
+			size = len(self._q)
+			if size > self.high_water:
+				self.high_water = size
+			if size >= self._notify_at:
+				self._ready.notify()
 
 	def drain_batch(self, max_items: int) -> List[TickItem]:
 		batch: List[TickItem] = []
@@ -29,6 +77,34 @@ class TickBuffer:
 				batch.append(self._q.popleft())
 		return batch
 
+	def wait_batch(self, max_items: int, timeout_sec: float) -> List[TickItem]:
+		"""Aguarda até `max_items` ticks ou `timeout_sec`, o que vier primeiro, e drena."""
+		deadline = time.monotonic() + timeout_sec
+		with self._lock:
+			while len(self._q) < max_items:
+				remaining = deadline - time.monotonic()
+				if remaining <= 0:
+					break
+				self._ready.wait(remaining)
+			batch: List[TickItem] = []
+			while self._q and len(batch) < max_items:
+				batch.append(self._q.popleft())
+		return batch
+
+	def wake(self) -> None:
+		with self._lock:
+			self._ready.notify_all()
+
 	def size(self) -> int:
 		with self._lock:
 			return len(self._q)
+
+	def stats(self) -> Dict[str, int]:
+		with self._lock:
+			return {
+				"queued": len(self._q),
+				"maxlen": self._maxlen,
+				"pushed": self.pushed,
+				"overflow": self.overflow,
+				"high_water": self.high_water,
+			}
@@ -11,12 +11,40 @@ DLL_DIR_CANDIDATES = [
 
 # Variáveis de ambiente
 HF_INGEST_URL = os.getenv("HF_INGEST_URL", "http://127.0.0.1:8002/ingest/batch")
+# "json" (/ingest/batch) ou "columnar" (/ingest/columnar, formato binário de services/shared/tick_codec)
+HF_INGEST_FORMAT = os.getenv("HF_INGEST_FORMAT", "json").lower()
+HF_INGEST_COLUMNAR_URL = os.getenv("HF_INGEST_COLUMNAR_URL", HF_INGEST_URL.split("/ingest")[0] + "/ingest/columnar")
+# Transporte IPC para o backend (HF_IPC_LISTEN do lado de lá); vazio = só HTTP
+HF_IPC_ADDRESS = os.getenv("HF_IPC_ADDRESS", "")
 HF_BATCH_MS = int(os.getenv("HF_BATCH_MS", "50"))
 HF_BATCH_MAX = int(os.getenv("HF_BATCH_MAX", "1000"))
+# Limite de ticks em memória entre o callback da DLL e a thread de envio
+HF_BUFFER_MAXLEN = int(os.getenv("HF_BUFFER_MAXLEN", "200000"))
+# Livro de ofertas: lote (/ingest/order-book-batch) montado pela thread do BookForwarder a cada
+# HF_BOOK_BATCH_MS, com até HF_BOOK_BATCH_MAX itens; a fila descarta os mais antigos acima de HF_BOOK_BUFFER_MAXLEN
+HF_BOOK_BATCH_URL = os.getenv("HF_BOOK_BATCH_URL", HF_INGEST_URL.split("/ingest")[0] + "/ingest/order-book-batch")
+HF_BOOK_BATCH_MS = int(os.getenv("HF_BOOK_BATCH_MS", "50"))
+HF_BOOK_BATCH_MAX = int(os.getenv("HF_BOOK_BATCH_MAX", "2000"))
+HF_BOOK_BUFFER_MAXLEN = int(os.getenv("HF_BOOK_BUFFER_MAXLEN", "100000"))
+HF_SEND_RETRIES = int(os.getenv("HF_SEND_RETRIES", "3"))
+HF_STATS_INTERVAL_SEC = int(os.getenv("HF_STATS_INTERVAL_SEC", "60"))
 
 KEEPALIVE_INTERVAL_SEC = int(os.getenv("KEEPALIVE_INTERVAL_SEC", "20"))
+# Backfill de lacunas (services/market_feed_next/backfill): salto no número de negócio, ou silêncio acima de
+# GAP_THRESHOLD_SEC quando o feed não traz o número, vira um pedido de histórico da janela perdida
+BACKFILL_ENABLED = os.getenv("BACKFILL_ENABLED", "1").lower() in ("1", "true", "yes")
 GAP_THRESHOLD_SEC = float(os.getenv("GAP_THRESHOLD_SEC", "12"))
+# Janela máxima de cada GetHistoryTrades; lacunas maiores viram pedidos consecutivos
 BACKFILL_MINUTES = int(os.getenv("BACKFILL_MINUTES", "3"))
+HF_BACKFILL_URL = os.getenv("HF_BACKFILL_URL", HF_INGEST_URL.split("/ingest")[0] + "/ingest/backfill")
+# Lacunas aguardando pedido (as do mesmo símbolo se juntam); acima disso são descartadas
+BACKFILL_QUEUE_MAX = int(os.getenv("BACKFILL_QUEUE_MAX", "256"))
+# Pedidos de histórico simultâneos na DLL (um por símbolo)
+BACKFILL_CONCURRENCY = int(os.getenv("BACKFILL_CONCURRENCY", "1"))
+# Pedido concluído após BACKFILL_IDLE_SEC sem negócios novos no callback; sem nenhum, após BACKFILL_TIMEOUT_SEC
+BACKFILL_IDLE_SEC = float(os.getenv("BACKFILL_IDLE_SEC", "2"))
+BACKFILL_TIMEOUT_SEC = float(os.getenv("BACKFILL_TIMEOUT_SEC", "15"))
+BACKFILL_MAX_ATTEMPTS = int(os.getenv("BACKFILL_MAX_ATTEMPTS", "3"))
 
 FEED_HOST = os.getenv("FEED_HOST", "0.0.0.0")
 FEED_PORT = int(os.getenv("FEED_PORT", "8001"))
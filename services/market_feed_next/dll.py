@@ -1,3 +1,4 @@
+import math
 import os
 import time
 import threading
@@ -6,10 +7,16 @@ from typing import Callable, Optional, Dict
 import ctypes
 import logging
 import asyncio
-import struct
 import httpx
-import requests
 from services.high_frequency.config import ORDER_BOOK_SNAPSHOT_INTERVAL_MS, ORDER_BOOK_TOP_LEVELS
+from services.market_feed_next.book_decode import HEADER, Offer, read_offer_array, read_price_array
+from services.market_feed_next.book_forwarder import BookForwarder
+from services.market_feed_next.config import (
+    HF_BOOK_BATCH_MAX, HF_BOOK_BATCH_MS, HF_BOOK_BATCH_URL, HF_BOOK_BUFFER_MAXLEN, HF_IPC_ADDRESS,
+)
+from services.shared.exchange_time import exchange_epoch, format_exchange_time, parse_exchange_time
+from services.shared.ipc_transport import IpcClient, KIND_BOOK_EVENT, KIND_BOOK_SNAPSHOT, KIND_BOOK_OFFER
+from services.shared.order_book import ACTION_FULL_BOOK, Level, OrderBook
 
 logger = logging.getLogger("market_feed_next")
 
@@ -133,6 +140,7 @@ class ProfitDLL:
     def __init__(self) -> None:
         self._on_trade: Optional[Callable[[str, float, int, float], None]] = None
         self._on_price_book: Optional[Callable[[str, dict], None]] = None
+        self._on_history_trade: Optional[Callable[[str, float, int, float, dict], None]] = None
         self._dll: Optional[ctypes.WinDLL] = None
         self._initialized = False
         self._connected = False
@@ -144,8 +152,18 @@ class ProfitDLL:
         self._unsubscribe_book = None
         self._subscribe_offer = None
         self._unsubscribe_offer = None
-        self._last_snapshot_ts: Dict[str, float] = {}
-        self._book_cache: Dict[str, Dict[str, list[dict]]] = {}
+        self._get_history_trades = None
+        # Price book por símbolo (motor compartilhado com o backend HF)
+        self._books: Dict[str, OrderBook] = {}
+        # Livro de ofertas: o callback só enfileira; a thread do forwarder junta as
+        # edições repetidas e envia em lote (IPC quando configurado, HTTP como fallback)
+        self._book_forwarder = BookForwarder(
+            HF_BOOK_BATCH_URL,
+            batch_ms=HF_BOOK_BATCH_MS,
+            batch_max=HF_BOOK_BATCH_MAX,
+            maxlen=HF_BOOK_BUFFER_MAXLEN,
+            ipc=IpcClient(HF_IPC_ADDRESS, "market_feed_next.book") if HF_IPC_ADDRESS else None,
+        )
         self._free_pointer = None
 
         @StateCallbackType
@@ -171,13 +189,6 @@ class ProfitDLL:
                                 logger.info("SubscribeOfferBook(%s,B) -> %s", sym, ret_offer)
                         except Exception as exc:
                             logger.warning("SubscribeTicker error %s: %s", sym, exc)
-                    try:
-                        if hasattr(self, "_get_history_trades") and self._get_history_trades:
-                            day = time.strftime("%d/%m/%Y", time.localtime())
-                            ret = self._get_history_trades("ALL", "B", day, day)
-                            logger.info("GetHistoryTrades recent -> %s", ret)
-                    except Exception as exc:
-                        logger.warning("GetHistory recent error: %s", exc)
             else:
                 if state_type == 2 and result in (0, 1, 2):
                     with self._lock:
@@ -197,7 +208,8 @@ class ProfitDLL:
                 symbol = _safe_wstring(getattr(asset, "ticker", None)).upper() or "UNKNOWN"
                 quantity = int(qtd or 0)
                 if self._on_trade:
-                    self._on_trade(symbol, float(price), quantity, time.time())
+                    self._on_trade(symbol, float(price), quantity, time.time(),
+                                   {"trade_id": int(trade_number), "exchange_timestamp": parse_exchange_time(date)})
                     logger.debug("DLL trade: %s %.4f %s", symbol, price, quantity)
             except Exception:
                 pass
@@ -205,8 +217,28 @@ class ProfitDLL:
         self._trade_cb_fn = _trade_cb
 
         @HistoryTradeCallbackType
-        def _history_cb(_asset_ptr: ctypes.POINTER(TTradeAsset), _date: str, *_args) -> None:
-            return
+        def _history_cb(asset_ptr: ctypes.POINTER(TTradeAsset), date: str, trade_number: int, price: float, vol: float, qtd: int, buy_agent: int, sell_agent: int, trade_type: int) -> None:
+            try:
+                if not self._on_history_trade:
+                    return
+                symbol = _safe_wstring(getattr(asset_ptr.contents, "ticker", None)).upper() or "UNKNOWN"
+                exchange_ts = parse_exchange_time(date)
+                self._on_history_trade(
+                    symbol,
+                    float(price),
+                    int(qtd or 0),
+                    exchange_ts or time.time(),
+                    {
+                        "trade_id": int(trade_number),
+                        "buy_agent": int(buy_agent) if buy_agent else None,
+                        "sell_agent": int(sell_agent) if sell_agent else None,
+                        "trade_type": int(trade_type),
+                        "volume_financial": float(vol),
+                        "exchange_timestamp": exchange_ts,
+                    },
+                )
+            except Exception as exc:
+                logger.warning("History trade callback error: %s", exc)
 
         self._history_cb_fn = _history_cb
 
@@ -226,39 +258,26 @@ class ProfitDLL:
                     "array_sell": int(p_array_sell or 0),
                     "array_buy": int(p_array_buy or 0),
                 }
+                if n_action == ACTION_FULL_BOOK:
+                    # Decodifica antes do callback externo, que pode liberar os arrays (FreePointer)
+                    bids = self._decode_price_array(p_array_buy)
+                    asks = self._decode_price_array(p_array_sell)
                 if self._on_price_book:
                     self._on_price_book(symbol, payload)
 
                 now = time.time()
+                book = self._books.get(symbol)
+                if book is None:
+                    book = self._books[symbol] = OrderBook(symbol, ORDER_BOOK_TOP_LEVELS, ORDER_BOOK_SNAPSHOT_INTERVAL_MS)
 
-                if symbol not in self._book_cache:
-                    self._book_cache[symbol] = {"bids": [], "asks": []}
-
-                if n_action == 4:
-                    snapshot_payload = self._build_snapshot_payload(symbol, p_array_buy, p_array_sell)
-                    if snapshot_payload:
-                        self._book_cache[symbol]["bids"] = snapshot_payload["bids"].copy()
-                        self._book_cache[symbol]["asks"] = snapshot_payload["asks"].copy()
-                        self._last_snapshot_ts[symbol] = now
-                        self._forward_snapshot(snapshot_payload)
+                if n_action == ACTION_FULL_BOOK:
+                    book.load(bids, asks)
+                    self._forward_snapshot(book.snapshot(now))
                     return
 
-                # Atualiza cache incremental
-                cache = self._book_cache[symbol]
-                if side == 1:
-                    self._update_side_cache(cache, "asks", n_action, n_position, price, n_qtd, n_count)
-                else:
-                    self._update_side_cache(cache, "bids", n_action, n_position, price, n_qtd, n_count)
-
-                last_ts = self._last_snapshot_ts.get(symbol, 0)
-                if now - last_ts >= ORDER_BOOK_SNAPSHOT_INTERVAL_MS / 1000.0:
-                    snapshot_payload = {
-                        "symbol": symbol,
-                        "bids": [dict(level) for level in cache["bids"]],
-                        "asks": [dict(level) for level in cache["asks"]],
-                    }
-                    self._last_snapshot_ts[symbol] = now
-                    self._forward_snapshot(snapshot_payload)
+                book.apply(n_action, side, n_position, price, n_qtd, n_count)
+                if book.snapshot_due(now):
+                    self._forward_snapshot(book.snapshot(now))
 
                 # Envia evento incremental
                 self._forward_event(symbol, n_action, side, n_position, price, n_qtd, n_count)
@@ -274,16 +293,17 @@ class ProfitDLL:
                 symbol = _safe_wstring(getattr(asset, "ticker", None) or getattr(asset, "Ticker", None)).upper() or "UNKNOWN"
                 offers = self._decode_offer_arrays(side, p_array_sell, p_array_buy)
                 if offers:
-                    for idx, offer in enumerate(offers):
+                    last = len(offers) - 1
+                    for idx, (offer_price, quantity, agent_id, offer_id) in enumerate(offers):
                         payload = {
                             "symbol": symbol,
                             "action": int(n_action),
-                            "position": len(offers) - idx - 1,
+                            "position": last - idx,
                             "side": int(side),
-                            "quantity": offer.get("quantity"),
-                            "agent_id": offer.get("agent_id"),
-                            "offer_id": offer.get("offer_id"),
-                            "price": offer.get("price"),
+                            "quantity": quantity,
+                            "agent_id": agent_id,
+                            "offer_id": offer_id,
+                            "price": offer_price,
                         }
                         self._forward_offer(payload)
                 else:
@@ -323,6 +343,11 @@ class ProfitDLL:
                     trade_type = int(trade_struct.TradeType)
                     trade_number = int(trade_struct.TradeNumber)
                     is_edit = bool(flags & 1)
+                    trade_date = trade_struct.TradeDate
+                    exchange_ts = exchange_epoch(
+                        trade_date.wYear, trade_date.wMonth, trade_date.wDay, trade_date.wHour,
+                        trade_date.wMinute, trade_date.wSecond, trade_date.wMilliseconds,
+                    )
                     logger.info(
                         "TRADE RECEBIDO: %s, Preço: %s, Quant: %s, TradeNumber: %s, BuyAgent: %s, SellAgent: %s, TradeType: %s, VolumeFinancial: %.2f, IsEdit: %s",
                         symbol,
@@ -348,6 +373,7 @@ class ProfitDLL:
                                 "volume_financial": volume_financial,
                                 "is_edit": is_edit,
                                 "trade_id": trade_number,
+                                "exchange_timestamp": exchange_ts,
                             },
                         )
                 else:
@@ -358,7 +384,7 @@ class ProfitDLL:
         self._trade_cb_v2_fn = _trade_cb_v2
 
     def _forward_event(self, symbol: str, action: int, side: int, position: int | None, price: float | None, qty: int | None, count: int | None) -> None:
-        payload = {
+        self._book_forwarder.push(KIND_BOOK_EVENT, {
             "symbol": symbol,
             "timestamp": time.time(),
             "action": action,
@@ -367,83 +393,36 @@ class ProfitDLL:
             "price": price,
             "quantity": qty,
             "offer_count": count,
-        }
-        try:
-            requests.post(
-                "http://127.0.0.1:8002/ingest/order-book-event",
-                json=payload,
-                timeout=2.0,
-            )
-        except Exception as exc:
-            logger.warning("Falha ao enviar evento de book para HF: %s", exc)
+        })
 
     def _forward_snapshot(self, payload: dict) -> None:
         payload = dict(payload)
         payload["timestamp"] = time.time()
-        try:
-            requests.post(
-                "http://127.0.0.1:8002/ingest/order-book-snapshot",
-                json=payload,
-                timeout=4.0,
-            )
-        except Exception as exc:
-            logger.warning("Falha ao enviar snapshot de book para HF: %s", exc)
+        self._book_forwarder.push(KIND_BOOK_SNAPSHOT, payload)
 
     def _forward_offer(self, payload: dict) -> None:
         data = dict(payload)
         data["timestamp"] = time.time()
-        try:
-            requests.post(
-                "http://127.0.0.1:8002/ingest/order-book-offer",
-                json=data,
-                timeout=2.0,
-            )
-        except Exception as exc:
-            logger.warning("Falha ao enviar oferta de book para HF: %s", exc)
-
-    def _build_snapshot_payload(self, symbol: str, p_array_buy: ctypes.c_void_p, p_array_sell: ctypes.c_void_p) -> Optional[dict]:
-        bids = self._decode_price_array(p_array_buy)
-        asks = self._decode_price_array(p_array_sell)
-        if bids is None and asks is None:
-            return None
-        return {
-            "symbol": symbol,
-            "bids": bids or [],
-            "asks": asks or [],
-        }
+        self._book_forwarder.push(KIND_BOOK_OFFER, data)
+
+    def book_stats(self) -> dict:
+        return self._book_forwarder.stats()
+
+    def stop(self) -> None:
+        """Envia o que restou do livro de ofertas e encerra a thread de envio."""
+        self._book_forwarder.stop()
 
-    def _decode_price_array(self, ptr_value: ctypes.c_void_p) -> Optional[list]:
+    def _decode_price_array(self, ptr_value: ctypes.c_void_p) -> list[Level]:
+        """Níveis do array da DLL como tuplas (price, quantity, offer_count), na ordem da DLL"""
         if not ptr_value:
             return []
         try:
-            header = (ctypes.c_ubyte * 8).from_address(ptr_value)
-            count = int.from_bytes(bytes(header[:4]), "little", signed=False)
-            total_size = int.from_bytes(bytes(header[4:8]), "little", signed=False)
-            levels = []
-            offset = 8
-            for _ in range(count):
-                price_bytes = (ctypes.c_ubyte * 8).from_address(ptr_value + offset)
-                price = struct.unpack("<d", bytes(price_bytes))[0]
-                offset += 8
-                qty_bytes = (ctypes.c_ubyte * 8).from_address(ptr_value + offset)
-                quantity = struct.unpack("<q", bytes(qty_bytes))[0]
-                offset += 8
-                count_bytes = (ctypes.c_ubyte * 4).from_address(ptr_value + offset)
-                offer_count = struct.unpack("<i", bytes(count_bytes))[0]
-                offset += 4
-                levels.append(
-                    {
-                        "price": price,
-                        "quantity": quantity,
-                        "offer_count": offer_count,
-                    }
-                )
-            return levels
+            return read_price_array(int(ptr_value))
         except Exception as exc:
             logger.warning("Falha ao decodificar array de book: %s", exc)
             return []
 
-    def _decode_offer_arrays(self, side: int, ptr_sell: ctypes.c_void_p, ptr_buy: ctypes.c_void_p) -> list[dict]:
+    def _decode_offer_arrays(self, side: int, ptr_sell: ctypes.c_void_p, ptr_buy: ctypes.c_void_p) -> list[Offer]:
         bids = self._decode_offer_array(ptr_buy)
         asks = self._decode_offer_array(ptr_sell)
         if side == 0:
@@ -453,94 +432,27 @@ class ProfitDLL:
         # se lado desconhecido, retorna combinação para garantir que não perca dados
         return bids or asks
 
-    def _decode_offer_array(self, ptr_value: ctypes.c_void_p) -> list[dict]:
+    def _decode_offer_array(self, ptr_value: ctypes.c_void_p) -> list[Offer]:
+        """Ofertas como tuplas (price, quantity, agent_id, offer_id); libera o array da DLL"""
         if not ptr_value:
             return []
         if not self._free_pointer:
             logger.debug("FreePointer não disponível para liberar array de ofertas")
             return []
 
-        result: list[dict] = []
         ptr_int = int(ptr_value)
-
+        # Tamanho do cabeçalho para o FreePointer; 0 se nem o cabeçalho puder ser lido
+        total_size = 0
         try:
-            header = (ctypes.c_ubyte * 8).from_address(ptr_int)
-            count = int.from_bytes(bytes(header[:4]), "little", signed=False)
-            total_size = int.from_bytes(bytes(header[4:8]), "little", signed=False)
-
-            offset = 8
-            for _ in range(count):
-                price_bytes = (ctypes.c_ubyte * 8).from_address(ptr_int + offset)
-                price = struct.unpack("<d", bytes(price_bytes))[0]
-                offset += 8
-
-                qty_bytes = (ctypes.c_ubyte * 8).from_address(ptr_int + offset)
-                quantity = struct.unpack("<q", bytes(qty_bytes))[0]
-                offset += 8
-
-                agent_bytes = (ctypes.c_ubyte * 4).from_address(ptr_int + offset)
-                agent_id = struct.unpack("<i", bytes(agent_bytes))[0]
-                offset += 4
-
-                offer_id_bytes = (ctypes.c_ubyte * 8).from_address(ptr_int + offset)
-                offer_id = struct.unpack("<q", bytes(offer_id_bytes))[0]
-                offset += 8
-
-                length_bytes = (ctypes.c_ubyte * 2).from_address(ptr_int + offset)
-                length = struct.unpack("<H", bytes(length_bytes))[0]
-                offset += 2
-
-                if length > 0:
-                    offset += length
-
-                result.append(
-                    {
-                        "price": float(price),
-                        "quantity": int(quantity),
-                        "agent_id": int(agent_id),
-                        "offer_id": int(offer_id),
-                    }
-                )
-
-            # flags finais (ex: OB_LAST_PACKET)
-            offset += 4
-            self._free_pointer(ctypes.c_void_p(ptr_int), total_size)
+            _, total_size = HEADER.unpack(ctypes.string_at(ptr_int, HEADER.size))
+            offers, _ = read_offer_array(ptr_int)
+            return offers
         except Exception as exc:
             logger.warning("Falha ao decodificar array de ofertas: %s", exc)
-        return result
-
-    def _update_side_cache(self, cache: Dict[str, list], side_key: str, action: int, position: int, price: float, qty: int, count: int) -> None:
-        side = cache.get(side_key)
-        if side is None:
-            side = []
-            cache[side_key] = side
-
-        def clamp_index(idx: int) -> int:
-            if idx < 0:
-                return 0
-            if idx > len(side):
-                return len(side)
-            return idx
-
-        if action == 1:  # add
-            idx = clamp_index(len(side) - position)
-            entry = {"price": price, "quantity": qty, "offer_count": count}
-            side.insert(idx, entry)
-        elif action == 2:  # edit
-            idx = len(side) - position - 1
-            if 0 <= idx < len(side):
-                level = side[idx]
-                level["quantity"] = qty
-                level["offer_count"] = count
-                level["price"] = price or level["price"]
-        elif action == 3:  # delete
-            idx = len(side) - position - 1
-            if 0 <= idx < len(side):
-                side.pop(idx)
-        elif action == 5:  # delete_from
-            idx = len(side) - position - 1
-            if 0 <= idx < len(side):
-                del side[idx:]
+            return []
+        finally:
+            # Array inconsistente (BookDecodeError) também é liberado
+            self._free_pointer(ctypes.c_void_p(ptr_int), total_size)
 
     def set_trade_callback(self, callback: Callable[[str, float, int, float], None]) -> None:
         self._on_trade = callback
@@ -548,6 +460,24 @@ class ProfitDLL:
     def set_price_book_callback(self, callback: Callable[[str, dict], None]) -> None:
         self._on_price_book = callback
 
+    def set_history_trade_callback(self, callback: Callable[[str, float, int, float, dict], None]) -> None:
+        """Negócios entregues pelo GetHistoryTrades, com a mesma assinatura do callback de trade."""
+        self._on_history_trade = callback
+
+    def request_history(self, symbol: str, start: float, end: float, exchange: str = "B") -> int:
+        """Pede os negócios de [start, end] (epoch) ao GetHistoryTrades; 0 = aceito.
+
+        A DLL recebe a janela em segundos inteiros, horário de Brasília; os
+        negócios chegam depois, no callback de histórico.
+        """
+        if not self._get_history_trades:
+            return -1
+        start_str = format_exchange_time(math.floor(start))
+        end_str = format_exchange_time(math.ceil(end))
+        ret = self._get_history_trades(symbol, exchange, start_str, end_str)
+        logger.info("GetHistoryTrades(%s,%s,%s,%s) -> %s", symbol, exchange, start_str, end_str, ret)
+        return ret
+
     def _resolve_dll_path(self) -> Path:
         candidates = [
             Path(__file__).resolve().parents[2] / "Dll_Profit" / "bin" / "Win64" / "Example" / "ProfitDLL64.dll",
@@ -727,8 +657,13 @@ class ProfitDLL:
                     set_hist.restype = ctypes.c_int
                     rc = set_hist(self._history_cb_fn)
                     logger.info("SetHistoryTradeCallback -> %s (%s)", rc, _name_of(rc))
+                if hasattr(dll, "GetHistoryTrades"):
+                    self._get_history_trades = dll.GetHistoryTrades
+                    self._get_history_trades.argtypes = [ctypes.c_wchar_p, ctypes.c_wchar_p, ctypes.c_wchar_p, ctypes.c_wchar_p]
+                    self._get_history_trades.restype = ctypes.c_int
             except Exception as exc:
                 logger.warning("SetHistoryTradeCallback registration error: %s", exc)
+            self._book_forwarder.start()
             self._initialized = True
 
     def subscribe(self, symbol: str, exchange: str = "B") -> None:
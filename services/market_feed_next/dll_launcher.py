@@ -11,7 +11,31 @@ if _PROJECT_ROOT_STR not in sys.path:
 import logging
 import time
 import requests
+from services.market_feed_next.backfill import HistoryBackfill
+from services.market_feed_next.buffer import TickBuffer, TickItem
+from services.market_feed_next.config import (
+    HF_INGEST_URL,
+    HF_INGEST_FORMAT,
+    HF_INGEST_COLUMNAR_URL,
+    HF_IPC_ADDRESS,
+    HF_BATCH_MS,
+    HF_BATCH_MAX,
+    HF_BUFFER_MAXLEN,
+    HF_SEND_RETRIES,
+    HF_STATS_INTERVAL_SEC,
+    BACKFILL_ENABLED,
+    GAP_THRESHOLD_SEC,
+    BACKFILL_MINUTES,
+    HF_BACKFILL_URL,
+    BACKFILL_QUEUE_MAX,
+    BACKFILL_CONCURRENCY,
+    BACKFILL_IDLE_SEC,
+    BACKFILL_TIMEOUT_SEC,
+    BACKFILL_MAX_ATTEMPTS,
+)
 from services.market_feed_next.dll import ProfitDLL
+from services.market_feed_next.sender import BatchSender
+from services.shared.ipc_transport import IpcClient
 from services.shared import DEFAULT_MARKET_FEED_SYMBOLS
 
 # Configuração de logging - DEBUG para ver todos os detalhes
@@ -20,48 +44,75 @@ logger = logging.getLogger("dll_launcher")
 
 # Váriavel global para manter a DLL viva
 dll_instance = None
-hf_ingest_url_tick = os.getenv("HF_INGEST_URL", "http://127.0.0.1:8002/ingest/batch").replace("/batch", "/tick")
-hf_subscribe_url = "http://127.0.0.1:8002/subscribe"
+# Backfill de lacunas pelo histórico da DLL (criado junto com a DLL)
+history_backfill = None
+hf_ingest_url_batch = HF_INGEST_URL
+hf_base_url = hf_ingest_url_batch.split("/ingest")[0]
+hf_subscribe_url = f"{hf_base_url}/subscribe"
 http_session = requests.Session()
 
+# Fila limitada entre o callback da DLL e a thread de envio em lote
+tick_buffer = TickBuffer(maxlen=HF_BUFFER_MAXLEN, notify_at=HF_BATCH_MAX)
+batch_sender = BatchSender(
+    hf_ingest_url_batch,
+    max_retries=HF_SEND_RETRIES,
+    columnar_url=HF_INGEST_COLUMNAR_URL if HF_INGEST_FORMAT == "columnar" else None,
+    ipc=IpcClient(HF_IPC_ADDRESS, "market_feed_next.ticks") if HF_IPC_ADDRESS else None,
+)
+
 def on_trade(symbol: str, price: float, qty: int, ts: float, extra_data: dict = None):
     """
-    Callback de trade. Envia o tick para o backend de alta frequência com retentativas.
+    Callback de trade. Apenas enfileira o tick; o envio ao backend de alta
+    frequência é feito em lote pela thread do BatchSender.
     """
-    payload = {
-        "symbol": symbol,
-        "exchange": "B",
-        "price": price,
-        "volume": qty,
-        "timestamp": ts
-    }
-    
-    # Adiciona dados extras se disponíveis
     if extra_data:
-        payload.update({
-            "trade_id": extra_data.get('trade_id'),
-            "buy_agent": extra_data.get('buy_agent'),
-            "sell_agent": extra_data.get('sell_agent'),
-            "trade_type": extra_data.get('trade_type'),
-            "volume_financial": extra_data.get('volume_financial'),
-            "is_edit": extra_data.get('is_edit', False)
-        })
-    
-    # Tenta enviar o tick algumas vezes antes de desistir
-    for attempt in range(5):  # Aumentado para 5 tentativas
-        try:
-            response = http_session.post(hf_ingest_url_tick, json=payload, timeout=5.0)  # Timeout aumentado
-            if response.status_code == 200:
-                return # Sucesso, sai da função
-            else:
-                logger.warning(f"Falha ao enviar tick para HF Backend (tentativa {attempt+1}): {response.status_code} - {response.text}")
-        except requests.RequestException as e:
-            logger.error(f"Erro de conexão ao enviar tick para HF Backend (tentativa {attempt+1}): {e}")
-        
-        # Espera um pouco antes de tentar novamente
-        time.sleep(1.0)  # Aumentado para 1 segundo
-    
-    logger.error(f"Desistindo de enviar o tick para {symbol} após 5 tentativas.")
+        item = TickItem(
+            symbol,
+            "B",
+            price,
+            qty,
+            ts,
+            extra_data.get('trade_id'),
+            buy_agent=extra_data.get('buy_agent'),
+            sell_agent=extra_data.get('sell_agent'),
+            trade_type=extra_data.get('trade_type'),
+            volume_financial=extra_data.get('volume_financial'),
+            is_edit=extra_data.get('is_edit', False),
+            exchange_timestamp=extra_data.get('exchange_timestamp'),
+        )
+    else:
+        item = TickItem(symbol, "B", price, qty, ts, None)
+    tick_buffer.push(item)
+    if history_backfill is not None:
+        history_backfill.observe(symbol, item.trade_id, item.exchange_timestamp or ts, item.is_edit)
+
+
+def log_forwarding_stats():
+    """Loga contadores do buffer e latência dos lotes enviados."""
+    buf = tick_buffer.stats()
+    snd = batch_sender.stats()
+    logger.info(
+        "Ticks: fila=%s/%s pico=%s recebidos=%s overflow=%s | lotes ok=%s falhos=%s ticks_enviados=%s descartados=%s | latência lote ms last=%.1f avg=%.1f max=%.1f",
+        buf["queued"], buf["maxlen"], buf["high_water"], buf["pushed"], buf["overflow"],
+        snd["batches_sent"], snd["batches_failed"], snd["ticks_sent"], snd["ticks_dropped"],
+        snd["last_batch_ms"], snd["avg_batch_ms"], snd["max_batch_ms"],
+    )
+    if dll_instance is not None:
+        book = dll_instance.book_stats()
+        logger.info(
+            "Book: fila=%s/%s recebidos=%s coalescidos=%s enviados=%s descartados=%s (overflow=%s falha=%s) | lotes ok=%s falhos=%s ipc=%s | latência lote ms last=%.1f max=%.1f",
+            book["queued"], book["maxlen"], book["received"], book["coalesced"], book["sent"], book["dropped"],
+            book["dropped_overflow"], book["dropped_failed"], book["batches_sent"], book["batches_failed"],
+            book["ipc_batches"], book["last_batch_ms"], book["max_batch_ms"],
+        )
+    if history_backfill is not None:
+        bf = history_backfill.stats()
+        logger.info(
+            "Backfill: fila=%s/%s ativos=%s/%s lacunas=%s juntadas=%s descartadas=%s abandonadas=%s | pedidos ok=%s falhos=%s sem_resposta=%s | negócios recebidos=%s enviados=%s filtrados=%s falhos=%s",
+            bf["pending"], bf["queue_max"], bf["active"], bf["concurrency"], bf["gaps_detected"], bf["gaps_merged"],
+            bf["gaps_rejected"], bf["gaps_abandoned"], bf["requests_sent"], bf["requests_failed"], bf["requests_timed_out"],
+            bf["history_trades"], bf["ticks_sent"], bf["ticks_filtered"], bf["ticks_failed"],
+        )
 
 
 def wait_for_hf_backend():
@@ -70,7 +121,7 @@ def wait_for_hf_backend():
     
     for attempt in range(30):  # 30 tentativas = 30 segundos
         try:
-            response = http_session.get(hf_ingest_url_tick.replace("/ingest/tick", "/test"), timeout=2.0)
+            response = http_session.get(f"{hf_base_url}/test", timeout=2.0)
             if response.status_code == 200:
                 logger.info("HF Backend está pronto para receber ticks!")
                 return True
@@ -95,12 +146,15 @@ def wait_for_dll_connection(timeout: float = 10.0, poll_interval: float = 0.2) -
     return False
 
 def main():
-    global dll_instance
-    logger.info(f"DLL Launcher iniciado. Enviando ticks para: {hf_ingest_url_tick}")
+    global dll_instance, history_backfill
+    logger.info(f"DLL Launcher iniciado. Enviando ticks em lote para: {hf_ingest_url_batch} (batch_ms={HF_BATCH_MS}, batch_max={HF_BATCH_MAX})")
 
     # Aguarda o HF Backend estar pronto
     wait_for_hf_backend()
 
+    # Thread de envio em lote: o callback da DLL nunca faz I/O
+    batch_sender.start(tick_buffer, HF_BATCH_MS, HF_BATCH_MAX)
+
     try:
         os.environ["PROFIT_INIT_MODE"] = "login"
         
@@ -110,6 +164,22 @@ def main():
         logger.info("Callback de trade configurado com sucesso!")
         logger.info("Configurando callback de book...")
         dll_instance.set_price_book_callback(lambda symbol, payload: None)
+        if BACKFILL_ENABLED:
+            history_backfill = HistoryBackfill(
+                dll_instance.request_history,
+                HF_BACKFILL_URL,
+                gap_threshold_sec=GAP_THRESHOLD_SEC,
+                max_window_sec=BACKFILL_MINUTES * 60,
+                queue_max=BACKFILL_QUEUE_MAX,
+                concurrency=BACKFILL_CONCURRENCY,
+                idle_sec=BACKFILL_IDLE_SEC,
+                timeout_sec=BACKFILL_TIMEOUT_SEC,
+                max_attempts=BACKFILL_MAX_ATTEMPTS,
+            )
+            dll_instance.set_history_trade_callback(history_backfill.on_history_trade)
+            history_backfill.start()
+            logger.info("Backfill de lacunas ativo: %s (limiar=%ss, janela máx=%smin, concorrência=%s)",
+                        HF_BACKFILL_URL, GAP_THRESHOLD_SEC, BACKFILL_MINUTES, BACKFILL_CONCURRENCY)
 
         dll_instance.initialize()
 
@@ -127,10 +197,16 @@ def main():
         
         # Loop infinito para manter o processo vivo
         while True:
-            time.sleep(3600)
+            time.sleep(HF_STATS_INTERVAL_SEC)
+            log_forwarding_stats()
 
     except Exception as e:
         logger.error(f"Erro fatal no DLL Launcher: {e}", exc_info=True)
+        batch_sender.stop(tick_buffer)
+        if history_backfill is not None:
+            history_backfill.stop()
+        if dll_instance is not None:
+            dll_instance.stop()
         exit(1)
 
 if __name__ == "__main__":
@@ -1,18 +1,130 @@
 import json
+import logging
 import threading
 import time
-from typing import List
+from typing import List, Optional
 import requests
 
+from services.market_feed_next.buffer import TickBuffer
+from services.shared.ipc_transport import KIND_TICKS, IpcClient
+from services.shared.tick_codec import CONTENT_TYPE, encode_ticks
+
+logger = logging.getLogger("market_feed_next.sender")
+
 class BatchSender:
-	def __init__(self, ingest_url: str, timeout_sec: float = 5.0):
+	def __init__(self, ingest_url: str, timeout_sec: float = 5.0, max_retries: int = 3, retry_backoff_sec: float = 0.2,
+			columnar_url: Optional[str] = None, ipc: Optional[IpcClient] = None):
 		self._url = ingest_url
+		# Com ipc tenta primeiro o transporte local (espera o ACK); sem conexão cai para o HTTP
+		self._ipc = ipc
+		self.ipc_batches = 0
+		self.http_fallbacks = 0
+		# Com columnar_url envia no formato binário colunar; volta ao JSON se o backend não tiver o endpoint
+		self._columnar_url = columnar_url
 		self._session = requests.Session()
 		self._timeout = timeout_sec
+		self._max_retries = max(1, max_retries)
+		self._retry_backoff = retry_backoff_sec
+		self._thread: Optional[threading.Thread] = None
+		self._stop = threading.Event()
+		self._stats_lock = threading.Lock()
+		self.batches_sent = 0
+		self.ticks_sent = 0
+		self.batches_failed = 0
+		self.ticks_dropped = 0
+		self.last_batch_ms = 0.0
+		self.max_batch_ms = 0.0
+		self._batch_ms_total = 0.0
 
 	def send(self, ticks: List[dict]) -> bool:
+		if self._ipc is not None:
+			if self._ipc.send(KIND_TICKS, encode_ticks(ticks), wait=True):
+				self.ipc_batches += 1
+				return True
+			self.http_fallbacks += 1
 		try:
+			if self._columnar_url:
+				resp = self._session.post(
+					self._columnar_url,
+					data=encode_ticks(ticks),
+					headers={"Content-Type": CONTENT_TYPE},
+					timeout=self._timeout,
+				)
+				if resp.status_code != 404:
+					return 200 <= resp.status_code < 300
+				logger.warning("Backend sem %s; enviando em JSON para %s", self._columnar_url, self._url)
+				self._columnar_url = None
 			resp = self._session.post(self._url, json={"ticks": ticks}, timeout=self._timeout)
 			return 200 <= resp.status_code < 300
 		except Exception:
 			return False
+
+	def start(self, buffer: TickBuffer, batch_ms: int, batch_max: int) -> None:
+		"""Inicia a thread que drena o buffer por tamanho (`batch_max`) ou tempo (`batch_ms`)."""
+		if self._thread and self._thread.is_alive():
+			return
+		self._stop.clear()
+		self._thread = threading.Thread(
+			target=self._run,
+			args=(buffer, batch_ms / 1000.0, batch_max),
+			name="hf-batch-sender",
+			daemon=True,
+		)
+		self._thread.start()
+
+	def stop(self, buffer: Optional[TickBuffer] = None, timeout_sec: float = 5.0) -> None:
+		self._stop.set()
+		if buffer is not None:
+			buffer.wake()
+		if self._thread:
+			self._thread.join(timeout_sec)
+
+	def _run(self, buffer: TickBuffer, batch_sec: float, batch_max: int) -> None:
+		while not self._stop.is_set():
+			batch = buffer.wait_batch(batch_max, batch_sec)
+			if batch:
+				self._deliver([t.to_dict() for t in batch])
+		# Drena o que sobrou antes de sair
+		while True:
+			batch = buffer.drain_batch(batch_max)
+			if not batch:
+				break
+			self._deliver([t.to_dict() for t in batch])
+
+	def _deliver(self, ticks: List[dict]) -> None:
+		for attempt in range(1, self._max_retries + 1):
+			start = time.perf_counter()
+			ok = self.send(ticks)
+			elapsed_ms = (time.perf_counter() - start) * 1000.0
+			if ok:
+				with self._stats_lock:
+					self.batches_sent += 1
+					self.ticks_sent += len(ticks)
+					self.last_batch_ms = elapsed_ms
+					self._batch_ms_total += elapsed_ms
+					if elapsed_ms > self.max_batch_ms:
+						self.max_batch_ms = elapsed_ms
+				return
+			logger.warning("Falha ao enviar lote de %s ticks (tentativa %s/%s, %.1fms)", len(ticks), attempt, self._max_retries, elapsed_ms)
+			if attempt < self._max_retries and not self._stop.is_set():
+				time.sleep(self._retry_backoff * attempt)
+		with self._stats_lock:
+			self.batches_failed += 1
+			self.ticks_dropped += len(ticks)
+		logger.error("Desistindo do lote de %s ticks após %s tentativas", len(ticks), self._max_retries)
+
+	def stats(self) -> dict:
+		with self._stats_lock:
+			return {
+				"batches_sent": self.batches_sent,
+				"ticks_sent": self.ticks_sent,
+				"batches_failed": self.batches_failed,
+				"ticks_dropped": self.ticks_dropped,
+				"last_batch_ms": round(self.last_batch_ms, 2),
+				"avg_batch_ms": round(self._batch_ms_total / self.batches_sent, 2) if self.batches_sent else 0.0,
+				"max_batch_ms": round(self.max_batch_ms, 2),
+				"format": "columnar" if self._columnar_url else "json",
+				"ipc_batches": self.ipc_batches,
+				"http_fallbacks": self.http_fallbacks,
+				"ipc": self._ipc.stats() if self._ipc is not None else None,
+			}
@@ -0,0 +1,276 @@
+"""
+Teste do backfill de lacunas pelo histórico da DLL
+==================================================
+Simula o stream de negócios e a DLL (GetHistoryTrades + callback de
+histórico) com relógio controlado e confere: lacuna por número de negócio
+pula só os números perdidos; silêncio acima do limiar sem número pede a
+janela inteira; edições, repetidos e novo pregão não abrem lacuna; lacunas
+do mesmo símbolo se juntam sem levar os negócios recebidos ao vivo entre
+elas, a fila é limitada e a concorrência respeitada; janelas longas viram
+pedaços; falhas da DLL e do envio são repetidas até desistir, reenviando só
+os lotes recusados; e o envio HTTP em lote num servidor local.
+"""
+
+import json
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from pathlib import Path
+
+# Adiciona o projeto ao path
+_PROJECT_ROOT = Path(__file__).resolve().parents[2]
+if str(_PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(_PROJECT_ROOT))
+
+from services.market_feed_next.backfill import HistoryBackfill
+from services.shared.exchange_time import exchange_epoch, format_exchange_time
+
+T0 = exchange_epoch(2025, 11, 3, 10, 0, 0)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeDll:
+    """Histórico do pregão por símbolo; responde no callback de histórico durante o pedido."""
+
+    def __init__(self, history, answer=True):
+        self.history = history
+        self.answer = answer
+        self.calls = []
+        self.codes = []
+        self.backfill = None
+
+    def request_history(self, symbol, start, end):
+        self.calls.append((symbol, start, end))
+        code = self.codes.pop(0) if self.codes else 0
+        if code == 0 and self.answer:
+            # A DLL trabalha em segundos inteiros: devolve também os vizinhos da janela
+            for trade_id, ts in self.history.get(symbol, []):
+                if int(start) - 1 <= ts <= end + 1:
+                    self.backfill.on_history_trade(symbol, 10.0, 100, ts, {
+                        "trade_id": trade_id, "buy_agent": 3, "sell_agent": 8, "trade_type": 2,
+                        "volume_financial": 1000.0, "exchange_timestamp": ts,
+                    })
+        return code
+
+
+def make_service(dll, clock, **kwargs):
+    service = HistoryBackfill(dll.request_history, "http://127.0.0.1:1/ingest/backfill", clock=clock, **kwargs)
+    service.sent = []
+    service.send = lambda ticks: service.sent.append(ticks) or True
+    dll.backfill = service
+    return service
+
+
+def test_trade_number_gap():
+    history = {"PETR4": [(i, T0 + i * 0.5) for i in range(1, 41)]}
+    clock = FakeClock()
+    dll = FakeDll(history)
+    service = make_service(dll, clock)
+    for trade_id in [1, 2, 3, 4, 5, 5, 12, 13]:
+        service.observe("PETR4", trade_id, T0 + trade_id * 0.5)
+    service.observe("PETR4", 13, T0 + 6.5, is_edit=True)
+    service.poll()
+    assert dll.calls == [("PETR4", T0 + 2.5, T0 + 6.0)]
+    # Todos os números esperados chegaram: conclui sem esperar o silêncio
+    service.poll()
+    assert [t["trade_id"] for t in service.sent[0]] == [6, 7, 8, 9, 10, 11]
+    tick = service.sent[0][0]
+    assert tick["timestamp"] == tick["exchange_timestamp"] == T0 + 3.0 and tick["buy_agent"] == 3
+    stats = service.stats()
+    assert stats["gaps_detected"] == 1 and stats["ticks_sent"] == 6 and stats["pending"] == stats["active"] == 0
+    assert stats["ticks_filtered"] == stats["history_trades"] - 6
+
+
+def test_silence_gap_and_new_session():
+    history = {"WINZ25": [(None, T0 + s) for s in (1, 5, 20, 30, 39, 40, 41)]}
+    clock = FakeClock()
+    dll = FakeDll(history)
+    service = make_service(dll, clock, gap_threshold_sec=12, idle_sec=2)
+    service.observe("WINZ25", None, T0)
+    service.observe("WINZ25", None, T0 + 5)    # silêncio curto: nada
+    service.observe("WINZ25", None, T0 + 40)   # 35s sem negócios
+    service.poll()
+    assert dll.calls == [("WINZ25", T0 + 5, T0 + 40)]
+    service.poll()
+    assert not service.sent  # sem números, espera o silêncio do callback
+    clock.now += 2
+    service.poll()
+    assert [t["exchange_timestamp"] - T0 for t in service.sent[0]] == [20, 30, 39]
+
+    # Novo pregão: a numeração recomeça e não é lacuna
+    service.observe("VALE3", 90_000, T0)
+    service.observe("VALE3", 1, T0 + 86400)
+    service.observe("VALE3", 2, T0 + 86401)
+    assert service.stats()["gaps_detected"] == 1
+
+
+def test_merge_queue_bound_and_concurrency():
+    clock = FakeClock()
+    dll = FakeDll({}, answer=False)
+    service = make_service(dll, clock, queue_max=2, concurrency=2, timeout_sec=10)
+    for symbol in ("PETR4", "VALE3", "ITUB4"):
+        service.observe(symbol, 1, T0)
+    service.observe("PETR4", 5, T0 + 10)
+    service.observe("PETR4", 9, T0 + 20)     # junta com a lacuna anterior, ainda na fila
+    service.observe("VALE3", 3, T0 + 10)
+    service.observe("ITUB4", 3, T0 + 10)     # fila cheia
+    stats = service.stats()
+    assert stats["gaps_merged"] == 1 and stats["gaps_rejected"] == 1 and stats["pending"] == 2
+
+    service.poll()
+    assert dll.calls == [("PETR4", T0, T0 + 20), ("VALE3", T0, T0 + 10)]
+    service.observe("PETR4", 12, T0 + 30)    # mesmo símbolo em andamento: aguarda na fila
+    service.observe("ITUB4", 5, T0 + 30)
+    service.poll()
+    assert len(dll.calls) == 2 and service.stats()["active"] == 2
+
+    # Sem resposta da DLL: os pedidos expiram e liberam as vagas
+    clock.now += 10
+    service.poll()
+    assert dll.calls[2:] == [("PETR4", T0 + 20, T0 + 30), ("ITUB4", T0 + 10, T0 + 30)]
+    assert service.stats()["requests_timed_out"] == 2 and not service.sent
+
+
+def test_merged_gaps_skip_live_trades():
+    history = {
+        "PETR4": [(i, T0 + i) for i in range(1, 20)],
+        "WINZ25": [(None, T0 + s) for s in (2, 5, 9, 11, 15, 20)],
+    }
+    clock = FakeClock()
+    dll = FakeDll(history)
+    service = make_service(dll, clock, gap_threshold_sec=5, idle_sec=1, concurrency=2)
+    # Duas lacunas por número com 5..7 recebidos ao vivo entre elas
+    for trade_id in (1, 5, 6, 7, 10):
+        service.observe("PETR4", trade_id, T0 + trade_id)
+    # Dois silêncios com 10 e 12 recebidos ao vivo entre eles
+    for ts in (0, 10, 12, 22):
+        service.observe("WINZ25", None, T0 + ts)
+    assert service.stats()["gaps_merged"] == 2
+    service.poll()
+    assert dll.calls == [("PETR4", T0 + 1, T0 + 10), ("WINZ25", T0, T0 + 22)]
+    clock.now += 1
+    service.poll()
+    sent = {batch[0]["symbol"]: batch for batch in service.sent}
+    assert [t["trade_id"] for t in sent["PETR4"]] == [2, 3, 4, 8, 9]
+    assert [t["exchange_timestamp"] - T0 for t in sent["WINZ25"]] == [2, 5, 9, 15, 20]
+
+
+def test_retry_resends_only_failed_batches():
+    clock = FakeClock()
+    dll = FakeDll({"PETR4": [(i, T0 + i) for i in range(1, 10)]})
+    service = make_service(dll, clock, batch_max=2, retry_sec=5)
+    answers = [True, False]
+    service.send = lambda ticks: (answers.pop(0) if answers else True) and service.sent.append(ticks) is None
+    service.observe("PETR4", 1, T0 + 1)
+    service.observe("PETR4", 7, T0 + 7)
+    service.poll()
+    service.poll()
+    assert [[t["trade_id"] for t in batch] for batch in service.sent] == [[2, 3]]
+    assert service.stats()["batches_failed"] == 1 and service.stats()["pending"] == 1
+
+    # Repetição: reenvia só o que o backend recusou, sem pedir à DLL de novo
+    clock.now += 5
+    service.poll()
+    assert len(dll.calls) == 1
+    assert [[t["trade_id"] for t in batch] for batch in service.sent] == [[2, 3], [4, 5], [6]]
+    stats = service.stats()
+    assert stats["ticks_sent"] == 5 and stats["pending"] == stats["active"] == 0
+
+
+def test_long_window_is_split():
+    clock = FakeClock()
+    dll = FakeDll({"PETR4": [(i, T0 + i) for i in range(1, 600)]})
+    service = make_service(dll, clock, max_window_sec=180, idle_sec=1)
+    service.observe("PETR4", 1, T0 + 1)
+    service.observe("PETR4", 500, T0 + 500)
+    for _ in range(3):
+        service.poll()
+        clock.now += 1
+        service.poll()
+    assert [(start - T0, end - T0) for _, start, end in dll.calls] == [(1, 181), (181, 361), (361, 500)]
+    sent_ids = sorted(t["trade_id"] for batch in service.sent for t in batch)
+    assert sent_ids[0] == 2 and sent_ids[-1] == 499
+    assert len(set(sent_ids)) == 498
+
+
+def test_failures_are_retried_then_abandoned():
+    clock = FakeClock()
+    dll = FakeDll({"PETR4": [(i, T0 + i) for i in range(1, 10)]})
+    service = make_service(dll, clock, max_attempts=3, retry_sec=5)
+    dll.codes = [-2147483645]
+    service.observe("PETR4", 1, T0 + 1)
+    service.observe("PETR4", 4, T0 + 4)
+    service.poll()
+    assert len(dll.calls) == 1 and service.stats()["requests_failed"] == 1
+    service.poll()
+    assert len(dll.calls) == 1  # espera antes de repetir
+    clock.now += 5
+    service.poll()
+    service.poll()
+    assert [t["trade_id"] for t in service.sent[0]] == [2, 3]
+
+    # Envio ao backend sempre falhando: repete e desiste após max_attempts
+    service.send = lambda ticks: False
+    service.observe("PETR4", 8, T0 + 8)
+    for _ in range(6):
+        service.poll()
+        clock.now += 20
+    stats = service.stats()
+    assert stats["batches_failed"] == 3 and stats["gaps_abandoned"] == 1 and stats["ticks_failed"] == 3
+    assert stats["pending"] == stats["active"] == 0
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.server.requests.append((self.path, json.loads(self.rfile.read(int(self.headers["Content-Length"])))))
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *_args):
+        pass
+
+
+def test_http_send_in_batches():
+    server = HTTPServer(("127.0.0.1", 0), _Handler)
+    server.requests = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    clock = FakeClock()
+    dll = FakeDll({"PETR4": [(i, T0 + i * 0.01) for i in range(1, 3000)]})
+    try:
+        service = HistoryBackfill(dll.request_history, f"http://127.0.0.1:{server.server_port}/ingest/backfill",
+                                  batch_max=1000, clock=clock)
+        dll.backfill = service
+        service.observe("PETR4", 1, T0 + 0.01)
+        service.observe("PETR4", 2500, T0 + 25)
+        service.poll()
+        service.poll()
+        assert [path for path, _ in server.requests] == ["/ingest/backfill"] * 3
+        assert [len(body["ticks"]) for _, body in server.requests] == [1000, 1000, 498]
+        assert service.stats()["ticks_sent"] == 2498
+    finally:
+        server.shutdown()
+
+
+def test_format_exchange_time():
+    assert format_exchange_time(T0 + 61.9) == "03/11/2025 10:01:01"
+
+
+if __name__ == "__main__":
+    test_trade_number_gap()
+    test_silence_gap_and_new_session()
+    test_merge_queue_bound_and_concurrency()
+    test_merged_gaps_skip_live_trades()
+    test_retry_resends_only_failed_batches()
+    test_long_window_is_split()
+    test_failures_are_retried_then_abandoned()
+    test_http_send_in_batches()
+    test_format_exchange_time()
+    print("✅ Lacunas detectadas; fila, concorrência, pedaços, repetição e envio em lote do backfill conferidos")
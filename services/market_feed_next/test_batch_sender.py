@@ -0,0 +1,149 @@
+"""
+Teste do envio em lote dos ticks da DLL
+=======================================
+Confere o caminho do on_trade do dll_launcher sem a DLL: TickBuffer limitado
+(descarta os mais antigos e conta o overflow) e BatchSender num servidor HTTP
+local, com lotes por tamanho (HF_BATCH_MAX) e por tempo (HF_BATCH_MS) em
+/ingest/batch, ordem preservada, push que não espera um backend lento,
+repetição e descarte de lotes recusados e o resto drenado no stop.
+"""
+
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+# Adiciona o projeto ao path
+_PROJECT_ROOT = Path(__file__).resolve().parents[2]
+if str(_PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(_PROJECT_ROOT))
+
+from services.market_feed_next.buffer import TickBuffer, TickItem
+from services.market_feed_next.sender import BatchSender
+
+
+def tick(trade_id: int) -> TickItem:
+    return TickItem("PETR4", "B", 30.0, 100, 1000.0 + trade_id, trade_id, buy_agent=3, sell_agent=8, trade_type=2)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.requests.append((self.path, [t["trade_id"] for t in body["ticks"]]))
+        time.sleep(self.server.delay)
+        self.send_response(self.server.status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *_args):
+        pass
+
+
+class Backend:
+    """Servidor local no lugar do /ingest/batch do backend"""
+
+    def __init__(self, status: int = 200, delay: float = 0.0):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self.server.requests = []
+        self.server.status = status
+        self.server.delay = delay
+        self.url = f"http://127.0.0.1:{self.server.server_port}/ingest/batch"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @property
+    def requests(self):
+        return self.server.requests
+
+    def close(self):
+        self.server.shutdown()
+
+
+def wait_until(predicate, timeout: float = 5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return predicate()
+
+
+def test_buffer_is_bounded():
+    buffer = TickBuffer(maxlen=100, notify_at=10)
+    for trade_id in range(1, 251):
+        buffer.push(tick(trade_id))
+    stats = buffer.stats()
+    assert stats["queued"] == stats["high_water"] == 100
+    assert stats["pushed"] == 250 and stats["overflow"] == 150
+    # Fila cheia descarta os mais antigos
+    assert [t.trade_id for t in buffer.drain_batch(1000)] == list(range(151, 251))
+
+
+def test_batches_by_size_and_time():
+    backend = Backend()
+    buffer = TickBuffer(maxlen=10_000, notify_at=100)
+    sender = BatchSender(backend.url, max_retries=1)
+    try:
+        for trade_id in range(1, 251):
+            buffer.push(tick(trade_id))
+        sender.start(buffer, batch_ms=50, batch_max=100)
+        # Dois lotes cheios na hora; o resto sai quando o tempo do lote vence
+        assert wait_until(lambda: len(backend.requests) == 3)
+        assert [path for path, _ in backend.requests] == ["/ingest/batch"] * 3
+        assert [len(ids) for _, ids in backend.requests] == [100, 100, 50]
+        assert [i for _, ids in backend.requests for i in ids] == list(range(1, 251))
+
+        stats = sender.stats()
+        assert stats["batches_sent"] == 3 and stats["ticks_sent"] == 250
+        assert stats["format"] == "json" and stats["max_batch_ms"] >= stats["avg_batch_ms"] > 0
+    finally:
+        sender.stop(buffer)
+        backend.close()
+
+
+def test_push_does_not_wait_for_backend():
+    backend = Backend(delay=0.2)
+    buffer = TickBuffer(maxlen=10_000, notify_at=200)
+    sender = BatchSender(backend.url, max_retries=1)
+    sender.start(buffer, batch_ms=10, batch_max=200)
+    try:
+        slowest = 0.0
+        for trade_id in range(1, 2001):
+            started = time.perf_counter()
+            buffer.push(tick(trade_id))
+            slowest = max(slowest, time.perf_counter() - started)
+        # O callback da DLL só enfileira: nenhum push espera os 200 ms do backend
+        assert slowest < 0.05, slowest
+        assert buffer.size() > 1000
+    finally:
+        sender.stop(buffer, timeout_sec=30)
+        backend.close()
+    # stop drena o que sobrou antes de encerrar a thread
+    assert buffer.size() == 0
+    assert sender.stats()["ticks_sent"] == 2000
+
+
+def test_failed_batches_are_retried_then_dropped():
+    backend = Backend(status=500)
+    buffer = TickBuffer(maxlen=1000, notify_at=10)
+    sender = BatchSender(backend.url, max_retries=3, retry_backoff_sec=0.01)
+    try:
+        for trade_id in range(1, 11):
+            buffer.push(tick(trade_id))
+        sender.start(buffer, batch_ms=50, batch_max=10)
+        assert wait_until(lambda: sender.stats()["batches_failed"] == 1)
+        assert len(backend.requests) == 3
+        stats = sender.stats()
+        assert stats["ticks_dropped"] == 10 and stats["batches_sent"] == 0
+    finally:
+        sender.stop(buffer)
+        backend.close()
+    print("✅ Envio em lote: fila limitada, lotes por tamanho e tempo, push sem espera e descarte após repetições")
+
+
+if __name__ == "__main__":
+    test_buffer_is_bounded()
+    test_batches_by_size_and_time()
+    test_push_does_not_wait_for_backend()
+    test_failed_batches_are_retried_then_dropped()
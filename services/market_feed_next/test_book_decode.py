@@ -0,0 +1,143 @@
+"""
+Teste da decodificação em bloco dos arrays de livro
+===================================================
+Monta buffers no layout nativo da ProfitDLL (price book e offer book, com
+strings de agente de tamanhos variados) em memória ctypes e confere que
+book_decode lê exatamente o que a leitura campo a campo anterior do dll.py
+lia, tanto nas tuplas quanto nos arrays NumPy, e que buffers truncados são
+rejeitados em vez de lidos além do fim.
+"""
+
+import ctypes
+import random
+import struct
+import sys
+from pathlib import Path
+
+# Adiciona o projeto ao path
+_PROJECT_ROOT = Path(__file__).resolve().parents[2]
+if str(_PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(_PROJECT_ROOT))
+
+from services.market_feed_next.book_decode import (
+    BookDecodeError, decode_offers, decode_price_levels, offers_array, price_levels_array,
+    read_offer_array, read_price_array,
+)
+
+
+def price_buffer(levels) -> bytes:
+    body = b"".join(struct.pack("<dqi", *level) for level in levels)
+    return struct.pack("<II", len(levels), 8 + len(body)) + body
+
+
+def offer_buffer(offers, agents) -> bytes:
+    body = b"".join(
+        struct.pack("<dqiqH", *offer, len(agent)) + agent for offer, agent in zip(offers, agents)
+    )
+    total = 8 + len(body) + 4
+    return struct.pack("<II", len(offers), total) + body + struct.pack("<I", 1)
+
+
+def legacy_price_levels(ptr_value: int):
+    """Leitura campo a campo, como o dll.py fazia antes"""
+    header = (ctypes.c_ubyte * 8).from_address(ptr_value)
+    count = int.from_bytes(bytes(header[:4]), "little", signed=False)
+    levels = []
+    offset = 8
+    for _ in range(count):
+        price = struct.unpack("<d", bytes((ctypes.c_ubyte * 8).from_address(ptr_value + offset)))[0]
+        offset += 8
+        quantity = struct.unpack("<q", bytes((ctypes.c_ubyte * 8).from_address(ptr_value + offset)))[0]
+        offset += 8
+        offer_count = struct.unpack("<i", bytes((ctypes.c_ubyte * 4).from_address(ptr_value + offset)))[0]
+        offset += 4
+        levels.append({"price": price, "quantity": quantity, "offer_count": offer_count})
+    return levels
+
+
+def legacy_offers(ptr_int: int):
+    header = (ctypes.c_ubyte * 8).from_address(ptr_int)
+    count = int.from_bytes(bytes(header[:4]), "little", signed=False)
+    result = []
+    offset = 8
+    for _ in range(count):
+        price = struct.unpack("<d", bytes((ctypes.c_ubyte * 8).from_address(ptr_int + offset)))[0]
+        offset += 8
+        quantity = struct.unpack("<q", bytes((ctypes.c_ubyte * 8).from_address(ptr_int + offset)))[0]
+        offset += 8
+        agent_id = struct.unpack("<i", bytes((ctypes.c_ubyte * 4).from_address(ptr_int + offset)))[0]
+        offset += 4
+        offer_id = struct.unpack("<q", bytes((ctypes.c_ubyte * 8).from_address(ptr_int + offset)))[0]
+        offset += 8
+        length = struct.unpack("<H", bytes((ctypes.c_ubyte * 2).from_address(ptr_int + offset)))[0]
+        offset += 2 + length
+        result.append({"price": price, "quantity": quantity, "agent_id": agent_id, "offer_id": offer_id})
+    return result
+
+
+def make_book(rng: random.Random, count: int, same_length: bool = False):
+    levels = [
+        (round(30 + rng.random() * 2, 2), rng.randint(1, 10 ** 7), rng.randint(1, 500))
+        for _ in range(count)
+    ]
+    offers = [
+        (round(30 + rng.random() * 2, 2), rng.randint(1, 10 ** 6), rng.randint(1, 9999), rng.randint(1, 2 ** 62))
+        for _ in range(count)
+    ]
+    agents = [
+        ("XP" if same_length else rng.choice(("", "XP", "BTG Pactual", "Itaú BBA"))).encode("utf-16-le")
+        for _ in range(count)
+    ]
+    return levels, offers, agents
+
+
+def test_parity():
+    rng = random.Random(7)
+    for count, same_length in ((0, False), (1, False), (5, True), (400, False), (400, True)):
+        levels, offers, agents = make_book(rng, count, same_length)
+
+        price_raw = ctypes.create_string_buffer(price_buffer(levels))
+        address = ctypes.addressof(price_raw)
+        expected = legacy_price_levels(address)
+        assert read_price_array(address) == [(l["price"], l["quantity"], l["offer_count"]) for l in expected]
+        assert decode_price_levels(price_raw.raw) == read_price_array(address)
+        array = price_levels_array(price_raw.raw)
+        assert array["price"].tolist() == [l["price"] for l in expected]
+        assert array["quantity"].tolist() == [l["quantity"] for l in expected]
+        assert array["offer_count"].tolist() == [l["offer_count"] for l in expected]
+
+        offer_raw = ctypes.create_string_buffer(offer_buffer(offers, agents))
+        address = ctypes.addressof(offer_raw)
+        expected = legacy_offers(address)
+        decoded, total_size = read_offer_array(address)
+        assert total_size == len(offer_raw.raw) - 1  # create_string_buffer acrescenta o NUL
+        assert decoded == [(o["price"], o["quantity"], o["agent_id"], o["offer_id"]) for o in expected]
+        array = offers_array(offer_raw.raw)
+        for field in ("price", "quantity", "agent_id", "offer_id"):
+            assert array[field].tolist() == [o[field] for o in expected], field
+        assert array["length"].tolist() == [len(a) for a in agents]
+
+    assert read_price_array(0) == [] and read_offer_array(None) == ([], 0)
+
+
+def test_truncated_buffers_rejected():
+    rng = random.Random(11)
+    levels, offers, agents = make_book(rng, 10)
+    for raw, decoders in (
+        (price_buffer(levels), (decode_price_levels, price_levels_array)),
+        (offer_buffer(offers, agents)[:-20], (decode_offers, offers_array)),
+        (b"\x01\x00", (decode_price_levels, decode_offers)),
+    ):
+        for decode in decoders:
+            data = raw[:-5] if decode in (decode_price_levels, price_levels_array) else raw
+            try:
+                decode(data)
+            except BookDecodeError:
+                continue
+            raise AssertionError(f"{decode.__name__} aceitou buffer truncado")
+
+
+if __name__ == "__main__":
+    test_parity()
+    test_truncated_buffers_rejected()
+    print("✅ Decodificação em bloco idêntica à leitura campo a campo (price book e offer book)")
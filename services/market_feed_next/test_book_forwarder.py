@@ -0,0 +1,161 @@
+"""
+Teste do encaminhamento em lote do livro de ofertas
+===================================================
+Confere que o coalesce do BookForwarder não muda o book: aplicar os eventos
+coalescidos de cada janela dá o mesmo livro que aplicar todos os eventos,
+que só edições repetidas da mesma posição (sem add/delete no meio) e
+snapshots repetidos do mesmo símbolo são descartados, que a fila cheia
+descarta os mais antigos e os contadores, e o envio por HTTP num servidor
+local: um POST por lote em /ingest/order-book-batch e, se o backend não tem
+o endpoint, os POSTs por item.
+"""
+
+import json
+import random
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from pathlib import Path
+
+# Adiciona o projeto ao path
+_PROJECT_ROOT = Path(__file__).resolve().parents[2]
+if str(_PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(_PROJECT_ROOT))
+
+from services.high_frequency.test_order_book import make_events
+from services.market_feed_next.book_forwarder import BookForwarder, coalesce
+from services.shared.ipc_transport import KIND_BOOK_EVENT, KIND_BOOK_OFFER, KIND_BOOK_SNAPSHOT
+from services.shared.order_book import ACTION_ADD, ACTION_EDIT, SIDE_BUY, SIDE_SELL, OrderBook
+
+
+def event_payload(symbol, event):
+    action, side, position, price, qty, count = event
+    return {"symbol": symbol, "timestamp": 0.0, "action": action, "side": side, "position": position,
+            "price": price, "quantity": qty, "offer_count": count}
+
+
+def apply(book, payload):
+    assert book.apply(payload["action"], payload["side"], payload["position"], payload["price"],
+                      payload["quantity"], payload["offer_count"])
+
+
+def test_coalesce_keeps_book():
+    rng = random.Random(11)
+    streams = {symbol: make_events(rng, 5000) for symbol in ("PETR4", "VALE3")}
+    items = []
+    for i in range(5000):
+        for symbol, events in streams.items():
+            items.append((KIND_BOOK_EVENT, event_payload(symbol, events[i])))
+
+    full = {symbol: OrderBook(symbol) for symbol in streams}
+    coalesced_books = {symbol: OrderBook(symbol) for symbol in streams}
+    total_coalesced = 0
+    for start in range(0, len(items), 300):
+        window = items[start:start + 300]
+        for _, payload in window:
+            apply(full[payload["symbol"]], payload)
+        batch, coalesced = coalesce(window)
+        assert len(batch["events"]) + coalesced == len(window)
+        total_coalesced += coalesced
+        for payload in batch["events"]:
+            apply(coalesced_books[payload["symbol"]], payload)
+
+    assert total_coalesced > 0
+    for symbol in streams:
+        assert full[symbol].top(1000) == coalesced_books[symbol].top(1000), symbol
+
+
+def test_coalesce_rules():
+    edit = lambda side, position, qty: (KIND_BOOK_EVENT, event_payload("WINZ25", (ACTION_EDIT, side, position, 0.0, qty, 1)))
+    add = (KIND_BOOK_EVENT, event_payload("WINZ25", (ACTION_ADD, SIDE_BUY, 0, 10.0, 100, 1)))
+    items = [
+        edit(SIDE_BUY, 0, 100),
+        edit(SIDE_SELL, 0, 200),
+        edit(SIDE_BUY, 0, 300),   # substitui a primeira, no mesmo lugar
+        add,                       # desloca as posições do lado comprador
+        edit(SIDE_BUY, 0, 400),   # não junta com as de antes do add
+        edit(SIDE_SELL, 0, 500),  # lado vendedor não foi deslocado: junta
+        (KIND_BOOK_SNAPSHOT, {"symbol": "WINZ25", "sequence": 1}),
+        (KIND_BOOK_SNAPSHOT, {"symbol": "WDOZ25", "sequence": 1}),
+        (KIND_BOOK_SNAPSHOT, {"symbol": "WINZ25", "sequence": 2}),
+        (KIND_BOOK_OFFER, {"symbol": "WINZ25", "offer_id": 1}),
+        (KIND_BOOK_OFFER, {"symbol": "WINZ25", "offer_id": 1}),
+    ]
+    batch, coalesced = coalesce(items)
+    assert coalesced == 3
+    assert [(e["action"], e["side"], e["quantity"]) for e in batch["events"]] == [
+        (ACTION_EDIT, SIDE_BUY, 300), (ACTION_EDIT, SIDE_SELL, 500), (ACTION_ADD, SIDE_BUY, 100), (ACTION_EDIT, SIDE_BUY, 400),
+    ]
+    assert batch["snapshots"] == [{"symbol": "WINZ25", "sequence": 2}, {"symbol": "WDOZ25", "sequence": 1}]
+    assert len(batch["offers"]) == 2
+
+
+def test_overflow_and_batches():
+    sent = []
+    forwarder = BookForwarder("http://127.0.0.1:1/ingest/order-book-batch", batch_max=4, maxlen=10)
+    forwarder.send = lambda batch: sent.append(batch) or True
+    for i in range(15):
+        forwarder.push(KIND_BOOK_OFFER, {"symbol": "PETR4", "offer_id": i})
+    forwarder.flush()
+    offer_ids = [offer["offer_id"] for batch in sent for offer in batch["offers"]]
+    assert offer_ids == list(range(5, 15))
+    assert [len(batch["offers"]) for batch in sent] == [4, 4, 2]
+    stats = forwarder.stats()
+    assert stats["received"] == 15 and stats["dropped_overflow"] == 5 and stats["sent"] == 10
+    assert stats["batches_sent"] == 3 and stats["queued"] == 0
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.requests.append((self.path, body))
+        status = 404 if self.path.endswith("-batch") and not self.server.batch_enabled else 200
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *_args):
+        pass
+
+
+def test_http_batch_and_fallback():
+    server = HTTPServer(("127.0.0.1", 0), _Handler)
+    server.requests = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/ingest/order-book-batch"
+    items = [
+        (KIND_BOOK_EVENT, event_payload("PETR4", (ACTION_ADD, SIDE_BUY, 0, 30.0, 100, 1))),
+        (KIND_BOOK_SNAPSHOT, {"symbol": "PETR4", "bids": [], "asks": [], "sequence": 1}),
+        (KIND_BOOK_OFFER, {"symbol": "PETR4", "offer_id": 7}),
+    ]
+    try:
+        server.batch_enabled = True
+        forwarder = BookForwarder(url, batch_ms=10)
+        forwarder.start()
+        for kind, payload in items:
+            forwarder.push(kind, payload)
+        forwarder.stop()
+        assert [path for path, _ in server.requests] == ["/ingest/order-book-batch"]
+        assert server.requests[0][1]["offers"] == [{"symbol": "PETR4", "offer_id": 7}]
+        assert forwarder.stats()["sent"] == 3 and forwarder.stats()["format"] == "batch"
+
+        server.requests.clear()
+        server.batch_enabled = False
+        forwarder = BookForwarder(url)
+        for kind, payload in items:
+            forwarder.push(kind, payload)
+        forwarder.flush()
+        assert [path for path, _ in server.requests] == [
+            "/ingest/order-book-batch", "/ingest/order-book-event", "/ingest/order-book-snapshot", "/ingest/order-book-offer",
+        ]
+        assert forwarder.stats()["sent"] == 3 and forwarder.stats()["format"] == "single"
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    test_coalesce_keeps_book()
+    test_coalesce_rules()
+    test_overflow_and_batches()
+    test_http_batch_and_fallback()
+    print("✅ Coalesce preserva o book; fila, contadores, lote HTTP e fallback por item conferidos")
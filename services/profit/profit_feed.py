@@ -47,6 +47,9 @@ import firebase_admin
 from firebase_admin import credentials, firestore, storage
 from dotenv import load_dotenv
 from services.profit.db_pg import upsert_candle_1m
+from services.shared.tick_codec import CONTENT_TYPE as TICK_CODEC_CONTENT_TYPE, encode_ticks
+from services.shared.ipc_transport import IpcClient, KIND_TICKS
+from services.shared.exchange_time import parse_exchange_time
 
 # ----------------------------------------------------------------------------
 # Firebase Init
@@ -329,7 +332,7 @@ def _state_cb(state_type: int, result: int):
 @TradeCallbackType
 def _trade_cb(asset: TAssetID, date: str, trade_number: int, price: float, vol: float, qtd: int, *_):
     ticker = asset.ticker if asset and asset.ticker else "UNKNOWN"
-    new_tick(ticker, price, qtd)
+    new_tick(ticker, price, qtd, parse_exchange_time(date))
 
 
 def initialize_market_session():
@@ -448,8 +451,9 @@ async def keepalive_watchdog():
                 except Exception as e:
                     logging.warning("keepalive reSubscribe failed %s: %s", tkr, e)
 
-def new_tick(ticker: str, price: float, volume: int):
-    """Recebido de callback – acumula no buffer e salva tick individual."""
+def new_tick(ticker: str, price: float, volume: int, exchange_ts: float | None = None):
+    """Recebido de callback – acumula no buffer e salva tick individual.
+    `exchange_ts` é o horário do negócio na bolsa (epoch UTC), quando a DLL informa."""
     _telemetry_on_tick(ticker)
     
     # Enfileira tick para ingestão no backend de alta frequência
@@ -462,6 +466,7 @@ def new_tick(ticker: str, price: float, volume: int):
                 "price": float(price),
                 "volume": int(volume or 0),
                 "timestamp": ts,
+                "exchange_timestamp": exchange_ts,
             })
     except Exception as e:
         logging.warning("Failed to enqueue tick for HF ingest: %s", e)
@@ -560,12 +565,38 @@ HF_INGEST_URL = os.getenv("HF_INGEST_URL", "http://127.0.0.1:8002/ingest/batch")
 HF_BATCH_MS = int(os.getenv("HF_BATCH_MS", "50"))
 HF_BATCH_MAX = int(os.getenv("HF_BATCH_MAX", "2000"))
 HF_MAX_RETRIES = int(os.getenv("HF_MAX_RETRIES", "3"))
+# "json" (/ingest/batch) ou "columnar" (/ingest/columnar, formato binário de services/shared/tick_codec)
+HF_INGEST_FORMAT = os.getenv("HF_INGEST_FORMAT", "json").lower()
+HF_INGEST_COLUMNAR_URL = os.getenv("HF_INGEST_COLUMNAR_URL", HF_INGEST_URL.split("/ingest")[0] + "/ingest/columnar")
+# Transporte IPC para o backend (HF_IPC_LISTEN do lado de lá); vazio = só HTTP
+HF_IPC_ADDRESS = os.getenv("HF_IPC_ADDRESS", "")
+hf_ipc = IpcClient(HF_IPC_ADDRESS, "profit_feed.ticks") if HF_IPC_ADDRESS else None
 
 hf_batch: deque[dict] = deque()
 hf_batch_lock = threading.Lock()
 
 def _send_batch_sync(payload: list[dict]) -> bool:
+    global HF_INGEST_FORMAT
+    # Transporte IPC primeiro (espera o ACK); sem conexão segue pelo HTTP
+    if hf_ipc is not None and hf_ipc.send(KIND_TICKS, encode_ticks(payload), wait=True):
+        return True
     try:
+        if HF_INGEST_FORMAT == "columnar":
+            req = _urlreq.Request(
+                HF_INGEST_COLUMNAR_URL,
+                data=encode_ticks(payload),
+                headers={"Content-Type": TICK_CODEC_CONTENT_TYPE},
+                method="POST",
+            )
+            try:
+                with _urlreq.urlopen(req, timeout=5) as resp:
+                    return 200 <= resp.status < 300
+            except _urlerr.HTTPError as e:
+                if e.code != 404:
+                    raise
+                # Backend sem o endpoint colunar: segue em JSON
+                logging.warning("HF ingest sem %s; voltando para JSON", HF_INGEST_COLUMNAR_URL)
+                HF_INGEST_FORMAT = "json"
         data = json.dumps({"ticks": payload}).encode("utf-8")
         req = _urlreq.Request(HF_INGEST_URL, data=data, headers={"Content-Type": "application/json"}, method="POST")
         with _urlreq.urlopen(req, timeout=5) as resp:
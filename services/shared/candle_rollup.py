@@ -0,0 +1,361 @@
+"""
+Rollup de candles em múltiplos timeframes
+=========================================
+Um tick só atualiza a barra aberta do menor timeframe (1s). Os timeframes
+maiores são derivados juntando as barras-filhas já fechadas:
+
+    1s -> 5s -> 15s -> 1m -> 5m -> 15m -> 1h
+
+- A barra de 1s fecha quando chega tick de um segundo posterior ou, pelo
+  relógio, em seal_expired(). Ao fechar (ou ser corrigida por tick atrasado)
+  a barra-mãe de cada nível acima é recalculada a partir das filhas.
+- Um nível pode ser alimentado de fora (`external_levels`): no backend HF o
+  1m vem dos candles fechados pelo CandleAggregator, e 5m/15m/1h derivam dele.
+- Barras fechadas ou recalculadas ficam marcadas como sujas até alguém
+  chamar take_dirty() (gravação incremental por timeframe).
+- Cada série guarda as últimas `retain_bars` barras por timeframe.
+- Depois de um restart, o estado gravado de uma barra derivada (seed_bar)
+  entra como parte anterior às filhas em memória, para a barra recalculada
+  não sobrescrever no banco o que foi gravado antes com só as filhas novas.
+
+Não é thread-safe: quem usa de várias threads protege com o próprio lock.
+"""
+
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+TIMEFRAMES: Tuple[Tuple[str, int], ...] = (
+    ("1s", 1),
+    ("5s", 5),
+    ("15s", 15),
+    ("1m", 60),
+    ("5m", 300),
+    ("15m", 900),
+    ("1h", 3600),
+)
+
+
+class Bar:
+    """Barra OHLCV de um bucket (início em segundos epoch)."""
+
+    __slots__ = ("bucket", "exchange", "open", "high", "low", "close", "volume",
+                 "volume_financial", "tick_count", "first_ts", "last_ts", "fresh")
+
+    def __init__(self, bucket: int, exchange: str, price: float, volume: int, volume_financial: float,
+                 timestamp: float, tick_count: int = 1):
+        self.bucket = bucket
+        self.exchange = exchange
+        self.open = self.high = self.low = self.close = price
+        self.volume = volume
+        self.volume_financial = volume_financial
+        self.tick_count = tick_count
+        self.first_ts = self.last_ts = timestamp
+        # Barra com estado semeado: a parte só das filhas em memória, que é a que sobe para as mães
+        self.fresh: Optional["Bar"] = None
+
+    def add(self, price: float, volume: int, volume_financial: float, timestamp: float) -> None:
+        """Inclui um tick; abertura/fechamento seguem o timestamp (ticks atrasados)."""
+        if price > self.high:
+            self.high = price
+        if price < self.low:
+            self.low = price
+        if timestamp < self.first_ts:
+            self.open = price
+            self.first_ts = timestamp
+        if timestamp >= self.last_ts:
+            self.close = price
+            self.last_ts = timestamp
+        self.volume += volume
+        self.volume_financial += volume_financial
+        self.tick_count += 1
+
+    @classmethod
+    def merge(cls, bucket: int, children: List["Bar"]) -> "Bar":
+        """Barra-mãe a partir das filhas em ordem de bucket."""
+        first, last = children[0], children[-1]
+        bar = cls(bucket, first.exchange, first.open, 0, 0.0, first.first_ts, 0)
+        bar.close = last.close
+        bar.last_ts = last.last_ts
+        bar.high = max(c.high for c in children)
+        bar.low = min(c.low for c in children)
+        bar.volume = sum(c.volume for c in children)
+        bar.volume_financial = sum(c.volume_financial for c in children)
+        bar.tick_count = sum(c.tick_count for c in children)
+        return bar
+
+    @classmethod
+    def combine(cls, seed: "Bar", fresh: "Bar") -> "Bar":
+        """Estado gravado antes do restart (`seed`) somado às filhas em memória (`fresh`)."""
+        bar = cls(fresh.bucket, seed.exchange, seed.open, seed.volume + fresh.volume,
+                  seed.volume_financial + fresh.volume_financial, seed.first_ts, seed.tick_count + fresh.tick_count)
+        bar.high = max(seed.high, fresh.high)
+        bar.low = min(seed.low, fresh.low)
+        if fresh.last_ts >= seed.last_ts:
+            bar.close, bar.last_ts = fresh.close, fresh.last_ts
+        else:
+            bar.close, bar.last_ts = seed.close, seed.last_ts
+        bar.fresh = fresh
+        return bar
+
+    def to_dict(self) -> dict:
+        return {
+            "bucket": self.bucket,
+            "exchange": self.exchange,
+            "open": self.open,
+            "high": self.high,
+            "low": self.low,
+            "close": self.close,
+            "volume": self.volume,
+            "volume_financial": self.volume_financial,
+            "tick_count": self.tick_count,
+        }
+
+
+class RollupEngine:
+    """Barras por símbolo e timeframe derivadas das barras-filhas fechadas."""
+
+    def __init__(self, timeframes: Tuple[Tuple[str, int], ...] = TIMEFRAMES, external_levels: Iterable[str] = (),
+                 retain_bars: int = 2000, seal_grace_sec: float = 0.5, late_window_sec: float = 60.0):
+        self.levels = [name for name, _ in timeframes]
+        self.seconds = [seconds for _, seconds in timeframes]
+        for child, parent in zip(self.seconds, self.seconds[1:]):
+            if parent % child:
+                raise ValueError(f"timeframe de {parent}s não é múltiplo de {child}s")
+        self.external = {self.levels.index(name) for name in external_levels}
+        if 0 in self.external:
+            raise ValueError("o menor timeframe é alimentado pelos ticks")
+        self.retain_bars = retain_bars
+        self.seal_grace_sec = seal_grace_sec
+        self.late_window_sec = late_window_sec
+
+        # símbolo -> uma série (bucket -> barra fechada ou derivada) por nível
+        self._series: Dict[str, List["OrderedDict[int, Bar]"]] = {}
+        # Barra aberta do menor timeframe, fora da série até fechar
+        self._open: Dict[str, Bar] = {}
+        # Bucket do menor timeframe fechado mais recente de cada símbolo
+        self._last_sealed: Dict[str, int] = {}
+        self._dirty: List[Set[Tuple[str, int]]] = [set() for _ in self.levels]
+        # Estado gravado de barras derivadas anteriores ao processo: (símbolo, bucket) -> barra, por nível
+        self._seeds: List[Dict[Tuple[str, int], Bar]] = [{} for _ in self.levels]
+        self.stats = {"ticks": 0, "sealed_by_tick": 0, "sealed_by_clock": 0, "late_ticks": 0,
+                      "late_dropped": 0, "external_bars": 0, "derived_updates": 0}
+
+    def level_of(self, timeframe: str) -> Optional[int]:
+        try:
+            return self.levels.index(timeframe)
+        except ValueError:
+            return None
+
+    # ----------------------------------------------------------------- entrada
+    def record_tick(self, symbol: str, exchange: str, price: float, volume: int, timestamp: float,
+                    volume_financial: Optional[float] = None) -> None:
+        self.stats["ticks"] += 1
+        base = self.seconds[0]
+        bucket = int(timestamp // base) * base
+        financial = volume_financial or price * volume
+        bar = self._open.get(symbol)
+        if bar is not None and bar.bucket == bucket:
+            bar.add(price, volume, financial, timestamp)
+            return
+
+        # Sem barra aberta, é o último bucket fechado que separa tick novo de atrasado
+        newest = self._last_sealed.get(symbol)
+        if bar is None or bucket > bar.bucket:
+            if newest is None or bucket > newest:
+                if bar is not None:
+                    self._seal(symbol, bar)
+                    self.stats["sealed_by_tick"] += 1
+                self._open[symbol] = Bar(bucket, exchange, price, volume, financial, timestamp)
+                return
+
+        # Tick atrasado: bucket de uma barra já fechada (ou que nunca abriu)
+        self.stats["late_ticks"] += 1
+        reference = bar.bucket if bar is not None else newest
+        if reference is not None and bucket < reference - self.late_window_sec:
+            self.stats["late_dropped"] += 1
+            return
+        base_series = self._series_for(symbol)[0]
+        sealed = base_series.get(bucket)
+        if sealed is None:
+            base_series[bucket] = Bar(bucket, exchange, price, volume, financial, timestamp)
+            self._trim(base_series)
+        else:
+            sealed.add(price, volume, financial, timestamp)
+        self._propagate(symbol, 0, bucket)
+
+    def add_bar(self, timeframe: str, symbol: str, exchange: str, bucket: int, open_price: float, high: float,
+                low: float, close: float, volume: int, volume_financial: float, tick_count: int) -> None:
+        """Barra fechada (ou corrigida) de um nível alimentado de fora."""
+        level = self.levels.index(timeframe)
+        if level not in self.external:
+            raise ValueError(f"timeframe {timeframe} é derivado, não alimentado de fora")
+        bar = Bar(bucket, exchange, open_price, volume, volume_financial, float(bucket), tick_count)
+        bar.high, bar.low, bar.close = high, low, close
+        bar.last_ts = float(bucket + self.seconds[level] - 1)
+        series = self._series_for(symbol)[level]
+        series[bucket] = bar
+        self._trim(series)
+        self.stats["external_bars"] += 1
+        self._propagate(symbol, level, bucket)
+
+    def seed_bar(self, timeframe: str, symbol: str, exchange: str, bucket: int, open_price: float, high: float,
+                 low: float, close: float, volume: int, volume_financial: float, tick_count: int,
+                 as_of: float) -> None:
+        """Barra derivada já gravada antes deste processo, com negócios até `as_of`.
+
+        As recalculadas desse bucket passam a somar o estado gravado às
+        filhas em memória em vez de substituí-lo.
+        """
+        level = self.levels.index(timeframe)
+        if level == 0 or level in self.external:
+            raise ValueError(f"timeframe {timeframe} não é derivado")
+        seed = Bar(bucket, exchange, open_price, volume, volume_financial, float(bucket), tick_count)
+        seed.high, seed.low, seed.close = high, low, close
+        seed.last_ts = as_of
+        self._seeds[level][(symbol, bucket)] = seed
+        # Filhas que chegaram antes da semente (ticks aceitos antes do banco ficar pronto)
+        series = self._series.get(symbol)
+        if series is not None and bucket in series[level]:
+            self._rebuild(symbol, level, bucket)
+            self._propagate(symbol, level, bucket)
+
+    def seal_expired(self, now: float) -> int:
+        """Fecha pelo relógio as barras abertas cujo intervalo acabou há mais que a carência."""
+        limit = now - self.seal_grace_sec - self.seconds[0]
+        expired = [(symbol, bar) for symbol, bar in self._open.items() if bar.bucket <= limit]
+        for symbol, bar in expired:
+            del self._open[symbol]
+            self._seal(symbol, bar)
+        self.stats["sealed_by_clock"] += len(expired)
+        return len(expired)
+
+    # ---------------------------------------------------------------- derivação
+    def _series_for(self, symbol: str) -> List["OrderedDict[int, Bar]"]:
+        series = self._series.get(symbol)
+        if series is None:
+            series = self._series[symbol] = [OrderedDict() for _ in self.levels]
+        return series
+
+    def _trim(self, series: "OrderedDict[int, Bar]") -> None:
+        while len(series) > self.retain_bars:
+            series.popitem(last=False)
+
+    def _seal(self, symbol: str, bar: Bar) -> None:
+        if self._open.get(symbol) is bar:
+            del self._open[symbol]
+        base_series = self._series_for(symbol)[0]
+        base_series[bar.bucket] = bar
+        self._trim(base_series)
+        if bar.bucket > self._last_sealed.get(symbol, bar.bucket - 1):
+            self._last_sealed[symbol] = bar.bucket
+        self._propagate(symbol, 0, bar.bucket)
+
+    def _propagate(self, symbol: str, level: int, bucket: int) -> None:
+        """Marca a barra como suja e recalcula as mães até o próximo nível externo."""
+        self._dirty[level].add((symbol, bucket))
+        for parent in range(level + 1, len(self.levels)):
+            if parent in self.external:
+                break
+            bucket = bucket - bucket % self.seconds[parent]
+            if not self._rebuild(symbol, parent, bucket):
+                break
+
+    def _rebuild(self, symbol: str, level: int, bucket: int) -> bool:
+        """Recalcula a barra derivada a partir das filhas (e do estado semeado); False sem filhas."""
+        series = self._series[symbol]
+        size, child_size = self.seconds[level], self.seconds[level - 1]
+        children_series = series[level - 1]
+        children = [children_series[b] for b in range(bucket, bucket + size, child_size) if b in children_series]
+        if not children:
+            return False
+        # Sobe só a parte das filhas em memória: o estado semeado da mãe já inclui o das filhas
+        bar = Bar.merge(bucket, [child.fresh or child for child in children])
+        seed = self._seeds[level].get((symbol, bucket))
+        if seed is not None:
+            bar = Bar.combine(seed, bar)
+        level_series = series[level]
+        level_series[bucket] = bar
+        self._trim(level_series)
+        self._dirty[level].add((symbol, bucket))
+        self.stats["derived_updates"] += 1
+        return True
+
+    # ------------------------------------------------------------------ leitura
+    def get_bars(self, symbol: str, timeframe: str, limit: int) -> List[Bar]:
+        """Barras mais recentes primeiro; no menor timeframe inclui a barra aberta."""
+        level = self.levels.index(timeframe)
+        series = self._series.get(symbol)
+        bars: List[Bar] = []
+        if level == 0 and symbol in self._open:
+            bars.append(self._open[symbol])
+        if series:
+            level_series = series[level]
+            bars.extend(level_series[b] for b in sorted(level_series, reverse=True)[:max(0, limit - len(bars))])
+        return bars[:limit]
+
+    def latest_bar(self, symbol: str, timeframe: str) -> Optional[Bar]:
+        bars = self.get_bars(symbol, timeframe, 1)
+        return bars[0] if bars else None
+
+    def live_bar(self, symbol: str, timeframe: str) -> Optional[Bar]:
+        """Barra corrente do timeframe: a derivada mais recente somada ao que
+        ainda não chegou a ela. Sem nível externo no caminho, é só a barra aberta
+        do menor timeframe; acima de um nível externo, também as barras do menor
+        timeframe fechadas depois da última barra externa (o 1m em andamento)."""
+        level = self.levels.index(timeframe)
+        latest = self.latest_bar(symbol, timeframe)
+        if level == 0:
+            return latest
+        opened = self._open.get(symbol)
+        reference = opened.bucket if opened is not None else self._last_sealed.get(symbol)
+        if reference is None:
+            return latest
+        size = self.seconds[level]
+        bucket = reference - reference % size
+        if latest is not None and latest.bucket > bucket:
+            return latest
+
+        pending: List[Bar] = []
+        external = max((e for e in self.external if e <= level), default=None)
+        if external is not None:
+            series = self._series[symbol]
+            covered = [b for b in series[external] if bucket <= b < bucket + size]
+            start = max(covered) + self.seconds[external] if covered else bucket
+            base_series = series[0]
+            pending.extend(base_series[b] for b in sorted(base_series) if start <= b < bucket + size)
+        if opened is not None:
+            pending.append(opened)
+        if latest is not None and latest.bucket == bucket:
+            pending.insert(0, latest)
+        if not pending:
+            return latest
+        return Bar.merge(bucket, pending)
+
+    def take_dirty(self) -> Dict[str, List[Tuple[str, Bar]]]:
+        """(símbolo, barra) fechadas ou recalculadas desde a última chamada, por timeframe."""
+        result: Dict[str, List[Tuple[str, Bar]]] = {}
+        for level, keys in enumerate(self._dirty):
+            if not keys:
+                continue
+            rows = []
+            for symbol, bucket in keys:
+                bar = self._series.get(symbol, [{}] * len(self.levels))[level].get(bucket)
+                if bar is not None:
+                    rows.append((symbol, bar))
+            self._dirty[level] = set()
+            if rows:
+                result[self.levels[level]] = rows
+        return result
+
+    def mark_dirty(self, timeframe: str, rows: Iterable[Tuple[str, Bar]]) -> None:
+        """Devolve à fila de gravação barras cuja escrita falhou."""
+        dirty = self._dirty[self.levels.index(timeframe)]
+        dirty.update((symbol, bar.bucket) for symbol, bar in rows)
+
+    def get_status(self) -> dict:
+        return {
+            "symbols": len(self._series),
+            "open_bars": len(self._open),
+            "dirty": {name: len(keys) for name, keys in zip(self.levels, self._dirty) if keys},
+            **self.stats,
+        }
@@ -0,0 +1,48 @@
+"""
+Horário da bolsa nos negócios da ProfitDLL
+==========================================
+A DLL entrega o horário do negócio (TConnectorTrade.TradeDate, SYSTEMTIME,
+ou texto "DD/MM/YYYY HH:MM:SS.ZZZ" nas callbacks V1) em horário de Brasília,
+sem fuso. Aqui ele vira epoch em segundos (UTC), o
+mesmo formato do `timestamp` dos ticks. No sentido inverso, as janelas
+pedidas ao GetHistoryTrades voltam a texto em horário de Brasília.
+"""
+
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+try:
+    from zoneinfo import ZoneInfo
+
+    EXCHANGE_TZ = ZoneInfo("America/Sao_Paulo")
+except Exception:
+    # Windows sem o pacote tzdata: Brasília não tem horário de verão desde 2019
+    EXCHANGE_TZ = timezone(timedelta(hours=-3))
+
+
+def exchange_epoch(year: int, month: int, day: int, hour: int, minute: int, second: int,
+                   millisecond: int = 0) -> Optional[float]:
+    """Epoch UTC de um horário de Brasília; None para data vazia ou inválida"""
+    if not year:
+        return None
+    try:
+        return datetime(year, month, day, hour, minute, second, millisecond * 1000, tzinfo=EXCHANGE_TZ).timestamp()
+    except ValueError:
+        return None
+
+
+def format_exchange_time(epoch: float) -> str:
+    """Texto "DD/MM/YYYY HH:MM:SS" em horário de Brasília, formato de data do GetHistoryTrades"""
+    return datetime.fromtimestamp(epoch, EXCHANGE_TZ).strftime("%d/%m/%Y %H:%M:%S")
+
+
+def parse_exchange_time(text: Optional[str]) -> Optional[float]:
+    """Epoch UTC do texto "DD/MM/YYYY HH:MM:SS[.ZZZ]" das callbacks de trade V1"""
+    try:
+        return exchange_epoch(
+            int(text[6:10]), int(text[3:5]), int(text[0:2]),
+            int(text[11:13]), int(text[14:16]), int(text[17:19]),
+            int(text[20:23]) if len(text) >= 23 else 0,
+        )
+    except (TypeError, ValueError):
+        return None
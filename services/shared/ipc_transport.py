@@ -0,0 +1,273 @@
+"""
+Transporte local por socket entre os feeds da DLL e o backend HF
+================================================================
+Alternativa ao HTTP em localhost: uma conexão persistente (TCP em loopback ou
+Unix socket) com frames binários prefixados pelo tamanho.
+
+Frame (little-endian):
+    <IBQ  tamanho do corpo u32, tipo u8, sequência u64, seguido do corpo
+
+- HELLO (cliente -> servidor): corpo <QQ sessão, primeira sequência ainda não
+  confirmada, + nome do stream utf-8. O servidor responde com ACK da última
+  sequência que já recebeu desse stream/sessão, e o cliente reenvia o resto.
+- ACK (servidor -> cliente): sequência = maior sequência contígua já entregue
+  ao backend (enfileirada no buffer). É o ponto de entrega durável.
+- TICKS: corpo no formato colunar de services/shared/tick_codec.
+- BOOK_EVENT / BOOK_SNAPSHOT / BOOK_OFFER: corpo JSON igual ao dos endpoints
+  /ingest/order-book-*.
+- BOOK_BATCH: corpo JSON igual ao de /ingest/order-book-batch (listas
+  events/snapshots/offers).
+
+Sequências puladas são contadas como lacunas pelo servidor; reenvios após
+reconexão chegam com sequência já vista e são descartados (entrega
+at-least-once, com deduplicação por sequência dentro da mesma sessão).
+
+O HTTP continua sendo o caminho padrão: quem usa o IpcClient cai para o HTTP
+quando send() devolve False.
+"""
+
+import logging
+import random
+import socket
+import struct
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+logger = logging.getLogger("shared.ipc_transport")
+
+FRAME_HEADER = struct.Struct("<IBQ")
+HELLO_HEADER = struct.Struct("<QQ")
+MAX_FRAME_BYTES = 64 * 1024 * 1024
+
+KIND_HELLO = 1
+KIND_ACK = 2
+KIND_TICKS = 10
+KIND_BOOK_EVENT = 11
+KIND_BOOK_SNAPSHOT = 12
+KIND_BOOK_OFFER = 13
+KIND_BOOK_BATCH = 14
+
+
+def parse_address(address: str) -> Tuple[str, object]:
+    """"tcp://host:porta" -> ("tcp", (host, porta)); "unix:///caminho" -> ("unix", caminho)"""
+    if address.startswith("unix://"):
+        return "unix", address[len("unix://"):]
+    if address.startswith("tcp://"):
+        address = address[len("tcp://"):]
+    host, _, port = address.rpartition(":")
+    if not host or not port.isdigit():
+        raise ValueError(f"endereço IPC inválido: {address!r}")
+    return "tcp", (host, int(port))
+
+
+def pack_frame(kind: int, seq: int, body: bytes = b"") -> bytes:
+    return FRAME_HEADER.pack(len(body), kind, seq) + body
+
+
+def pack_hello(session: int, base_seq: int, stream: str) -> bytes:
+    return HELLO_HEADER.pack(session, base_seq) + stream.encode("utf-8")
+
+
+def unpack_hello(body: bytes) -> Tuple[int, int, str]:
+    session, base_seq = HELLO_HEADER.unpack_from(body)
+    return session, base_seq, bytes(body[HELLO_HEADER.size:]).decode("utf-8")
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            raise ConnectionError("conexão IPC fechada")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+class IpcClient:
+    """Cliente thread-safe de um stream IPC.
+
+    send() escreve o frame e guarda-o até o ACK; com wait=True espera a
+    confirmação (entrega durável) por até ack_timeout_sec. Frames escritos e não
+    confirmados são reenviados após reconexão, até max_inflight, inclusive os
+    que estouraram o ack_timeout. send() só devolve False quando o frame não foi
+    escrito; aí ele é descartado, pois o chamador o manda pelo HTTP.
+    """
+
+    def __init__(
+        self,
+        address: str,
+        stream: str,
+        connect_timeout_sec: float = 1.0,
+        ack_timeout_sec: float = 2.0,
+        reconnect_backoff_sec: float = 1.0,
+        max_inflight: int = 50_000,
+    ):
+        self._family, self._target = parse_address(address)
+        self.address = address
+        self.stream = stream
+        self._connect_timeout = connect_timeout_sec
+        self._ack_timeout = ack_timeout_sec
+        self._reconnect_backoff = reconnect_backoff_sec
+        self._max_inflight = max_inflight
+        self._session = random.getrandbits(63)
+
+        self._lock = threading.Lock()
+        self._acked = threading.Condition(self._lock)
+        self._sock: Optional[socket.socket] = None
+        self._reader: Optional[threading.Thread] = None
+        self._next_connect_at = 0.0
+        self._seq = 0
+        self._acked_seq = 0
+        self._inflight: "OrderedDict[int, bytes]" = OrderedDict()
+
+        self.frames_sent = 0
+        self.frames_acked = 0
+        self.frames_resent = 0
+        self.frames_dropped = 0
+        self.ack_timeouts = 0
+        self.reconnects = 0
+
+    # ------------------------------------------------------------------ envio
+    def send(self, kind: int, body: bytes, wait: bool = False) -> bool:
+        """Envia um frame; False só se ele não foi escrito (sem conexão ou falha de escrita)."""
+        with self._lock:
+            if self._sock is None and not self._connect_locked():
+                return False
+            self._seq += 1
+            seq = self._seq
+            frame = pack_frame(kind, seq, body)
+            self._inflight[seq] = frame
+            if len(self._inflight) > self._max_inflight:
+                self._inflight.popitem(last=False)
+                self.frames_dropped += 1
+            try:
+                self._sock.sendall(frame)
+            except OSError as exc:
+                logger.warning("Falha ao escrever no IPC %s: %s", self.address, exc)
+                self._disconnect_locked()
+                # O chamador vai reenviar pelo HTTP: não reenvia este frame na reconexão
+                self._inflight.pop(seq, None)
+                return False
+            self.frames_sent += 1
+
+            if not wait:
+                return True
+            deadline = time.monotonic() + self._ack_timeout
+            while self._acked_seq < seq:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._sock is None:
+                    # Já escrito: o backend pode estar ingerindo. Fica na fila de
+                    # reenvio (o servidor descarta a sequência repetida) em vez de
+                    # voltar pelo HTTP e duplicar os ticks
+                    self.ack_timeouts += 1
+                    return True
+                self._acked.wait(remaining)
+            return True
+
+    def close(self) -> None:
+        with self._lock:
+            self._disconnect_locked()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "address": self.address,
+                "stream": self.stream,
+                "connected": self._sock is not None,
+                "seq": self._seq,
+                "acked_seq": self._acked_seq,
+                "inflight": len(self._inflight),
+                "frames_sent": self.frames_sent,
+                "frames_acked": self.frames_acked,
+                "frames_resent": self.frames_resent,
+                "frames_dropped": self.frames_dropped,
+                "ack_timeouts": self.ack_timeouts,
+                "reconnects": self.reconnects,
+            }
+
+    # -------------------------------------------------------------- conexão
+    def _connect_locked(self) -> bool:
+        now = time.monotonic()
+        if now < self._next_connect_at:
+            return False
+        try:
+            if self._family == "unix":
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            else:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.settimeout(self._connect_timeout)
+            sock.connect(self._target)
+
+            base_seq = next(iter(self._inflight), self._seq + 1)
+            sock.sendall(pack_frame(KIND_HELLO, 0, pack_hello(self._session, base_seq, self.stream)))
+            length, kind, resume_seq = FRAME_HEADER.unpack(_recv_exact(sock, FRAME_HEADER.size))
+            if kind != KIND_ACK or length:
+                raise ConnectionError(f"resposta inesperada ao HELLO (tipo {kind})")
+            sock.settimeout(None)
+        except (OSError, ConnectionError) as exc:
+            self._next_connect_at = now + self._reconnect_backoff
+            logger.debug("IPC %s indisponível: %s", self.address, exc)
+            return False
+
+        if self.frames_sent:
+            self.reconnects += 1
+            logger.info("Reconectado ao IPC %s (stream %s, retomando após seq %s)", self.address, self.stream, resume_seq)
+        self._sock = sock
+        self._apply_ack_locked(resume_seq)
+
+        # Reenvia, em ordem, o que ainda não foi confirmado
+        try:
+            for frame in self._inflight.values():
+                sock.sendall(frame)
+                self.frames_resent += 1
+        except OSError as exc:
+            logger.warning("Falha ao reenviar frames para o IPC %s: %s", self.address, exc)
+            self._disconnect_locked()
+            return False
+
+        self._reader = threading.Thread(target=self._read_acks, args=(sock,), name=f"ipc-ack-{self.stream}", daemon=True)
+        self._reader.start()
+        return True
+
+    def _disconnect_locked(self) -> None:
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+            self._sock = None
+            self._next_connect_at = time.monotonic() + self._reconnect_backoff
+        self._acked.notify_all()
+
+    def _apply_ack_locked(self, seq: int) -> None:
+        if seq <= self._acked_seq:
+            return
+        self._acked_seq = seq
+        while self._inflight:
+            first = next(iter(self._inflight))
+            if first > seq:
+                break
+            self._inflight.popitem(last=False)
+            self.frames_acked += 1
+        self._acked.notify_all()
+
+    def _read_acks(self, sock: socket.socket) -> None:
+        try:
+            while True:
+                length, kind, seq = FRAME_HEADER.unpack(_recv_exact(sock, FRAME_HEADER.size))
+                if length:
+                    _recv_exact(sock, length)
+                if kind == KIND_ACK:
+                    with self._lock:
+                        self._apply_ack_locked(seq)
+        except (OSError, ConnectionError, struct.error):
+            pass
+        with self._lock:
+            if self._sock is sock:
+                logger.warning("Conexão IPC %s (stream %s) caiu; %s frames aguardando ACK",
+                               self.address, self.stream, len(self._inflight))
+                self._disconnect_locked()
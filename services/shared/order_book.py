@@ -0,0 +1,239 @@
+"""
+Livro de ofertas L2 (price book) da ProfitDLL
+=============================================
+Motor único usado pelo feed da DLL (market_feed_next/dll.py) e pelo adapter
+do backend HF (high_frequency/profit.py) para manter o price book a partir
+dos eventos do callback V2.
+
+A DLL endereça os níveis por posição contada a partir do fim do array, com o
+melhor preço no fim: posição 0 é o topo do book. Cada lado guarda preço,
+quantidade e número de ofertas em array.array na mesma ordem, então add,
+edit e delete perto do topo (a imensa maioria) movem só os `posição` níveis
+acima do índice alterado, e o top-N é lido do fim em O(N).
+
+Ações (nAction): 0 add, 1 edit, 2 delete, 3 delete from (do topo até a
+posição, inclusive), 4 book completo (arrays do callback).
+
+Consistência: um evento com posição fora do book (ou sequência externa fora
+de ordem) é uma lacuna; o livro segue aplicando o que consegue, mas fica
+marcado fora de sincronia até o próximo book completo.
+"""
+
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+ACTION_ADD = 0
+ACTION_EDIT = 1
+ACTION_DELETE = 2
+ACTION_DELETE_FROM = 3
+ACTION_FULL_BOOK = 4
+
+SIDE_BUY = 0
+SIDE_SELL = 1
+
+# (price, quantity, offer_count)
+Level = Tuple[float, int, int]
+
+
+class BookSide:
+    """Um lado do book, na ordem da DLL (melhor preço no fim)."""
+
+    __slots__ = ("prices", "quantities", "counts")
+
+    def __init__(self):
+        self.prices = array("d")
+        self.quantities = array("q")
+        self.counts = array("i")
+
+    def __len__(self) -> int:
+        return len(self.prices)
+
+    def load(self, levels: Iterable[Level]) -> None:
+        """Substitui o lado pelos níveis do array da DLL (mesma ordem)"""
+        prices, quantities, counts = array("d"), array("q"), array("i")
+        for price, quantity, count in levels:
+            prices.append(price)
+            quantities.append(quantity)
+            counts.append(count)
+        self.prices, self.quantities, self.counts = prices, quantities, counts
+
+    def add(self, position: int, price: float, quantity: int, count: int) -> bool:
+        size = len(self.prices)
+        index = size - position
+        consistent = 0 <= index <= size
+        index = min(max(index, 0), size)
+        self.prices.insert(index, price)
+        self.quantities.insert(index, quantity)
+        self.counts.insert(index, count)
+        return consistent
+
+    def edit(self, position: int, price: float, quantity: int, count: int) -> bool:
+        index = len(self.prices) - position - 1
+        if not 0 <= index < len(self.prices):
+            return False
+        self.quantities[index] = quantity
+        self.counts[index] = count
+        if price:
+            self.prices[index] = price
+        return True
+
+    def delete(self, position: int) -> bool:
+        index = len(self.prices) - position - 1
+        if not 0 <= index < len(self.prices):
+            return False
+        del self.prices[index]
+        del self.quantities[index]
+        del self.counts[index]
+        return True
+
+    def delete_from(self, position: int) -> bool:
+        index = len(self.prices) - position - 1
+        if not 0 <= index < len(self.prices):
+            return False
+        del self.prices[index:]
+        del self.quantities[index:]
+        del self.counts[index:]
+        return True
+
+    def top(self, n: int) -> List[Level]:
+        """Os n melhores níveis, do melhor para o pior"""
+        if n <= 0:
+            return []
+        end = -n - 1
+        return list(zip(self.prices[:end:-1], self.quantities[:end:-1], self.counts[:end:-1]))
+
+    def best(self) -> Optional[Tuple[float, int]]:
+        if not self.prices:
+            return None
+        return self.prices[-1], self.quantities[-1]
+
+    def depth(self, n: int) -> int:
+        """Quantidade somada dos n melhores níveis"""
+        return sum(self.quantities[-n:]) if n > 0 else 0
+
+
+class OrderBook:
+    """Price book de um símbolo, com sequência, lacunas, métricas e snapshots periódicos."""
+
+    def __init__(self, symbol: str, top_levels: int = 10, snapshot_interval_ms: float = 5000):
+        self.symbol = symbol
+        self.top_levels = top_levels
+        self.snapshot_interval_sec = snapshot_interval_ms / 1000.0
+        self.bids = BookSide()
+        self.asks = BookSide()
+        # Eventos aplicados (sequência local, vai nos snapshots/eventos emitidos)
+        self.sequence = 0
+        # Última sequência externa vista (replay de order_book_events, IPC etc.)
+        self.last_external_sequence: Optional[int] = None
+        self.gaps = 0
+        self.in_sync = False
+        self.last_snapshot_at: Optional[float] = None
+
+    def side(self, side: int) -> BookSide:
+        return self.asks if side == SIDE_SELL else self.bids
+
+    def load(self, bids: Iterable[Level], asks: Iterable[Level], sequence: Optional[int] = None) -> None:
+        """Book completo (ação 4): volta a ficar em sincronia"""
+        self.bids.load(bids)
+        self.asks.load(asks)
+        self.sequence += 1
+        if sequence is not None:
+            self.last_external_sequence = sequence
+        self.in_sync = True
+
+    def apply(
+        self,
+        action: int,
+        side: int,
+        position: Optional[int],
+        price: Optional[float] = None,
+        quantity: Optional[int] = None,
+        count: Optional[int] = None,
+        sequence: Optional[int] = None,
+    ) -> bool:
+        """Aplica um evento incremental; False se ele não casa com o book (lacuna)"""
+        if sequence is not None:
+            last = self.last_external_sequence
+            if last is not None and sequence != last + 1:
+                self._gap()
+            self.last_external_sequence = sequence
+
+        book_side = self.asks if side == SIDE_SELL else self.bids
+        position = position if position is not None else -1
+        if action == ACTION_ADD:
+            ok = book_side.add(position, price or 0.0, quantity or 0, count or 0)
+        elif action == ACTION_EDIT:
+            ok = book_side.edit(position, price or 0.0, quantity or 0, count or 0)
+        elif action == ACTION_DELETE:
+            ok = book_side.delete(position)
+        elif action == ACTION_DELETE_FROM:
+            ok = book_side.delete_from(position)
+        else:
+            return False
+
+        self.sequence += 1
+        if not ok:
+            self._gap()
+        return ok
+
+    def _gap(self) -> None:
+        self.gaps += 1
+        self.in_sync = False
+
+    # Consultas ---------------------------------------------------------
+
+    def top(self, n: Optional[int] = None) -> Tuple[List[Level], List[Level]]:
+        n = self.top_levels if n is None else n
+        return self.bids.top(n), self.asks.top(n)
+
+    def metrics(self, depth_levels: Optional[int] = None) -> Dict[str, Optional[float]]:
+        """Spread, preço médio, microprice e desequilíbrio de profundidade nos
+        `depth_levels` melhores níveis (padrão: top_levels)"""
+        n = self.top_levels if depth_levels is None else depth_levels
+        bid, ask = self.bids.best(), self.asks.best()
+        bid_depth, ask_depth = self.bids.depth(n), self.asks.depth(n)
+        total_depth = bid_depth + ask_depth
+        metrics: Dict[str, Optional[float]] = {
+            "best_bid": bid[0] if bid else None,
+            "best_ask": ask[0] if ask else None,
+            "spread": None,
+            "mid": None,
+            "microprice": None,
+            "imbalance": (bid_depth - ask_depth) / total_depth if total_depth else None,
+        }
+        if bid and ask:
+            (bid_price, bid_qty), (ask_price, ask_qty) = bid, ask
+            metrics["spread"] = ask_price - bid_price
+            metrics["mid"] = (ask_price + bid_price) / 2
+            top_qty = bid_qty + ask_qty
+            # Microprice: o preço pende para o lado com menos quantidade no topo
+            metrics["microprice"] = (
+                (bid_price * ask_qty + ask_price * bid_qty) / top_qty if top_qty else metrics["mid"]
+            )
+        return metrics
+
+    # Snapshots periódicos ---------------------------------------------
+
+    def snapshot_due(self, now: float) -> bool:
+        return self.last_snapshot_at is None or now - self.last_snapshot_at >= self.snapshot_interval_sec
+
+    def snapshot(self, now: float) -> Dict:
+        """Top-N dos dois lados (melhor primeiro) no formato de /ingest/order-book-snapshot;
+        marca o horário para snapshot_due"""
+        self.last_snapshot_at = now
+        bids, asks = self.top()
+        return {
+            "symbol": self.symbol,
+            "bids": [{"price": p, "quantity": q, "offer_count": c} for p, q, c in bids],
+            "asks": [{"price": p, "quantity": q, "offer_count": c} for p, q, c in asks],
+            "sequence": self.sequence,
+        }
+
+    def status(self) -> Dict:
+        return {
+            "bid_levels": len(self.bids),
+            "ask_levels": len(self.asks),
+            "sequence": self.sequence,
+            "gaps": self.gaps,
+            "in_sync": self.in_sync,
+        }
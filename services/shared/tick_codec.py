@@ -0,0 +1,239 @@
+"""
+Formato colunar binário dos lotes de ticks
+==========================================
+Alternativa compacta ao JSON {"ticks": [...]} do /ingest/batch, usada pelo
+/ingest/columnar do backend de alta frequência e pelos enviadores dos feeds.
+
+Layout (little-endian):
+    cabeçalho  <4sBBIH   magic b"UPTK", versão, reservado, n ticks, n símbolos
+    símbolos   n símbolos × (u8 len + symbol utf-8, u8 len + exchange utf-8)
+    colunas    n itens cada, nesta ordem:
+               symbol_index u16, flags u8, timestamp f64, price f64, volume i64,
+               trade_id i64, buy_agent i32, sell_agent i32, trade_type i8,
+               volume_financial f64, exchange_timestamp f64
+
+`flags` indica quais campos opcionais estão presentes (o resto da coluna é 0)
+e carrega is_edit. `timestamp` é o recebimento no feed; `exchange_timestamp`
+(versão 2) é o horário do negócio na bolsa. Lotes da versão 1, sem essa
+coluna, continuam sendo lidos (journal em disco, feeds ainda não atualizados).
+
+Só depende da biblioteca padrão (struct/array), para rodar igual nas máquinas
+Windows dos feeds.
+"""
+
+import math
+import struct
+import sys
+from array import array
+from typing import Iterable, Iterator, List, Tuple
+
+CONTENT_TYPE = "application/x-up-ticks"
+MAGIC = b"UPTK"
+VERSION = 2
+
+_HEADER = struct.Struct("<4sBBIH")
+
+HAS_TIMESTAMP = 1
+HAS_TRADE_ID = 2
+HAS_BUY_AGENT = 4
+HAS_SELL_AGENT = 8
+HAS_TRADE_TYPE = 16
+HAS_VOLUME_FINANCIAL = 32
+IS_EDIT = 64
+HAS_EXCHANGE_TIMESTAMP = 128
+
+# (nome, typecode do array) na ordem do payload
+_COLUMNS = (
+    ("symbol_index", "H"),
+    ("flags", "B"),
+    ("timestamp", "d"),
+    ("price", "d"),
+    ("volume", "q"),
+    ("trade_id", "q"),
+    ("buy_agent", "i"),
+    ("sell_agent", "i"),
+    ("trade_type", "b"),
+    ("volume_financial", "d"),
+    ("exchange_timestamp", "d"),
+)
+# Colunas presentes em cada versão do formato
+_VERSION_COLUMNS = {1: _COLUMNS[:-1], 2: _COLUMNS}
+
+_BIG_ENDIAN = sys.byteorder == "big"
+
+
+class TickCodecError(ValueError):
+    """Payload colunar malformado ou com valores inválidos"""
+
+
+def _optional(value, flag: int, default=0) -> Tuple[object, int]:
+    return (default, 0) if value is None else (value, flag)
+
+
+def encode_ticks(ticks: Iterable[dict]) -> bytes:
+    """Codifica ticks no formato dos dicts do /ingest/batch"""
+    symbols: dict = {}
+    columns = {name: array(code) for name, code in _COLUMNS}
+    symbol_index = columns["symbol_index"].append
+    flags_col = columns["flags"].append
+    timestamp_col = columns["timestamp"].append
+    price_col = columns["price"].append
+    volume_col = columns["volume"].append
+    trade_id_col = columns["trade_id"].append
+    buy_col = columns["buy_agent"].append
+    sell_col = columns["sell_agent"].append
+    trade_type_col = columns["trade_type"].append
+    financial_col = columns["volume_financial"].append
+    exchange_ts_col = columns["exchange_timestamp"].append
+
+    for tick in ticks:
+        key = (tick["symbol"], tick.get("exchange") or "B")
+        index = symbols.get(key)
+        if index is None:
+            index = symbols[key] = len(symbols)
+        symbol_index(index)
+
+        timestamp, f_ts = _optional(tick.get("timestamp"), HAS_TIMESTAMP, 0.0)
+        trade_id, f_id = _optional(tick.get("trade_id"), HAS_TRADE_ID)
+        buy_agent, f_buy = _optional(tick.get("buy_agent"), HAS_BUY_AGENT)
+        sell_agent, f_sell = _optional(tick.get("sell_agent"), HAS_SELL_AGENT)
+        trade_type, f_type = _optional(tick.get("trade_type"), HAS_TRADE_TYPE)
+        financial, f_fin = _optional(tick.get("volume_financial"), HAS_VOLUME_FINANCIAL, 0.0)
+        exchange_ts, f_exch = _optional(tick.get("exchange_timestamp"), HAS_EXCHANGE_TIMESTAMP, 0.0)
+        flags_col(f_ts | f_id | f_buy | f_sell | f_type | f_fin | f_exch | (IS_EDIT if tick.get("is_edit") else 0))
+
+        timestamp_col(float(timestamp))
+        price_col(float(tick["price"]))
+        volume_col(int(tick["volume"]))
+        trade_id_col(int(trade_id))
+        buy_col(int(buy_agent))
+        sell_col(int(sell_agent))
+        trade_type_col(int(trade_type))
+        financial_col(float(financial))
+        exchange_ts_col(float(exchange_ts))
+
+    if len(symbols) > 0xFFFF:
+        raise TickCodecError("mais de 65535 símbolos em um lote")
+
+    parts = [_HEADER.pack(MAGIC, VERSION, 0, len(columns["flags"]), len(symbols))]
+    for symbol, exchange in symbols:
+        for text in (symbol, exchange):
+            raw = text.encode("utf-8")
+            parts.append(bytes((len(raw),)) + raw)
+    for name, _ in _COLUMNS:
+        column = columns[name]
+        if _BIG_ENDIAN:
+            column.byteswap()
+        parts.append(column.tobytes())
+    return b"".join(parts)
+
+
+class TickColumns:
+    """Lote decodificado: tabela de símbolos e uma coluna array por campo"""
+
+    __slots__ = ("symbols",) + tuple(name for name, _ in _COLUMNS)
+
+    def __init__(self, symbols: List[Tuple[str, str]], columns: dict):
+        self.symbols = symbols
+        for name, _ in _COLUMNS:
+            setattr(self, name, columns[name])
+
+    def __len__(self) -> int:
+        return len(self.flags)
+
+    def rows(self, default_timestamp: float) -> Iterator[tuple]:
+        """(symbol, exchange, price, volume, timestamp, trade_id, buy_agent,
+        sell_agent, trade_type, volume_financial, is_edit, exchange_timestamp),
+        com None nos opcionais ausentes e default_timestamp quando não veio
+        timestamp"""
+        symbols = self.symbols
+        for sym, flags, ts, price, volume, trade_id, buy, sell, trade_type, financial, exchange_ts in zip(
+            self.symbol_index, self.flags, self.timestamp, self.price, self.volume,
+            self.trade_id, self.buy_agent, self.sell_agent, self.trade_type, self.volume_financial,
+            self.exchange_timestamp,
+        ):
+            symbol, exchange = symbols[sym]
+            yield (
+                symbol,
+                exchange,
+                price,
+                volume,
+                ts if flags & HAS_TIMESTAMP else default_timestamp,
+                trade_id if flags & HAS_TRADE_ID else None,
+                buy if flags & HAS_BUY_AGENT else None,
+                sell if flags & HAS_SELL_AGENT else None,
+                trade_type if flags & HAS_TRADE_TYPE else None,
+                financial if flags & HAS_VOLUME_FINANCIAL else None,
+                bool(flags & IS_EDIT),
+                exchange_ts if flags & HAS_EXCHANGE_TIMESTAMP else None,
+            )
+
+
+def decode_ticks(payload: bytes, normalize=str.upper, validate: bool = True) -> TickColumns:
+    """Decodifica e valida o lote inteiro de uma vez.
+
+    `normalize` é aplicado uma vez por símbolo/exchange da tabela (o
+    /ingest/batch faz .upper() em cada tick). Com validate=False só a
+    estrutura é conferida, para reler lotes já aceitos (journal em disco).
+    """
+    view = memoryview(payload)
+    if len(view) < _HEADER.size:
+        raise TickCodecError("payload menor que o cabeçalho")
+    magic, version, _, count, symbol_count = _HEADER.unpack_from(view)
+    if magic != MAGIC:
+        raise TickCodecError("magic inválido")
+    layout = _VERSION_COLUMNS.get(version)
+    if layout is None:
+        raise TickCodecError(f"versão {version} não suportada")
+
+    offset = _HEADER.size
+    symbols: List[Tuple[str, str]] = []
+    try:
+        for _ in range(symbol_count):
+            pair = []
+            for _ in range(2):
+                size = view[offset]
+                if offset + 1 + size > len(view):
+                    raise IndexError("texto truncado")
+                pair.append(normalize(bytes(view[offset + 1:offset + 1 + size]).decode("utf-8")))
+                offset += 1 + size
+            symbols.append((pair[0], pair[1]))
+    except (IndexError, UnicodeDecodeError) as exc:
+        raise TickCodecError(f"tabela de símbolos inválida: {exc}") from exc
+
+    columns = {}
+    for name, code in layout:
+        column = array(code)
+        size = count * column.itemsize
+        if offset + size > len(view):
+            raise TickCodecError(f"coluna {name} truncada")
+        column.frombytes(view[offset:offset + size])
+        if _BIG_ENDIAN:
+            column.byteswap()
+        columns[name] = column
+        offset += size
+    if offset != len(view):
+        raise TickCodecError(f"{len(view) - offset} bytes sobrando após as colunas")
+    for name, code in _COLUMNS[len(layout):]:
+        # Colunas que a versão do lote não tem: zeradas, com o flag ausente
+        columns[name] = array(code, bytes(count * array(code).itemsize))
+
+    if count and not symbols:
+        raise TickCodecError("índice de símbolo fora da tabela")
+    if count and validate:
+        if not symbols or max(columns["symbol_index"]) >= len(symbols):
+            raise TickCodecError("índice de símbolo fora da tabela")
+        if any(not symbol for symbol, _ in symbols):
+            raise TickCodecError("símbolo vazio")
+        prices = columns["price"]
+        if not all(map(math.isfinite, prices)) or min(prices) <= 0:
+            raise TickCodecError("preço inválido")
+        if min(columns["volume"]) < 0:
+            raise TickCodecError("volume negativo")
+        if not all(map(math.isfinite, columns["timestamp"])) or not all(map(math.isfinite, columns["volume_financial"])):
+            raise TickCodecError("timestamp ou volume financeiro inválido")
+        if not all(map(math.isfinite, columns["exchange_timestamp"])):
+            raise TickCodecError("horário da bolsa inválido")
+
+    return TickColumns(symbols, columns)
+